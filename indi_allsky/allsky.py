@@ -25,6 +25,8 @@ from .version import __version__
 from .version import __config_level__
 
 from .config import IndiAllSkyConfig
+from .videoLanes import IndiAllSkyVideoLanes
+from .uploadScheduler import IndiAllSkyUploadScheduler
 
 from . import constants
 
@@ -77,7 +79,7 @@ class IndiAllSky(object):
 
         with app.app_context():
             try:
-                self._config_obj = IndiAllSkyConfig()
+                self._config_obj = IndiAllSkyConfig(cached=True)
                 #logger.info('Loaded config id: %d', self._config_obj.config_id)
             except NoResultFound:
                 logger.error('No config file found, please import a config')
@@ -218,17 +220,29 @@ class IndiAllSky(object):
         self.image_worker = None
         self.image_worker_idx = 0
 
-        self.video_q = Queue()
-        self.video_error_q = Queue()
-        self.video_worker = None
+        self.frame_ring = None
+        self._setupFrameRing()
+
+        self.video_q = Queue()  # all video tasks go through the dispatcher
+        self.video_dispatch_error_q = Queue()
+        self.video_dispatch_worker = None
+        self.video_dispatch_worker_idx = 0
+
+        self.video_worker_list = []
         self.video_worker_idx = 0
+        self._setupVideoLanes()
 
         self.sensor_q = Queue()
         self.sensor_error_q = Queue()
         self.sensor_worker = None
         self.sensor_worker_idx = 0
 
-        self.upload_q = Queue()
+        self.upload_q = Queue()  # all upload tasks go through the dispatcher
+        self.upload_scheduler = IndiAllSkyUploadScheduler(self.config)
+        self.upload_dispatch_error_q = Queue()
+        self.upload_dispatch_worker = None
+        self.upload_dispatch_worker_idx = 0
+
         self.upload_worker_list = []
         self.upload_worker_idx = 0
 
@@ -275,6 +289,35 @@ class IndiAllSky(object):
         self._pid_file = Path(new_pid_file)
 
 
+    def _setupFrameRing(self):
+        # shared memory must be allocated before the capture and image workers are started
+        from .frameRing import IndiAllSkyFrameRing
+
+        frame_shm_config = self.config.get('FRAME_SHARED_MEMORY', {})
+
+        if not frame_shm_config.get('ENABLE'):
+            if self.frame_ring:
+                self.frame_ring.close(unlink=True)
+                self.frame_ring = None
+
+            return
+
+
+        slot_count = int(frame_shm_config.get('SLOTS', 3))
+        slot_bytes = int(frame_shm_config.get('SLOT_MB', 64)) * 1024 * 1024
+
+        if self.frame_ring:
+            if self.frame_ring.slot_count == slot_count and self.frame_ring.slot_bytes == slot_bytes:
+                # workers are stopped, any slots still in use are abandoned
+                self.frame_ring.resetAll()
+                return
+
+            self.frame_ring.close(unlink=True)
+
+
+        self.frame_ring = IndiAllSkyFrameRing(slot_count, slot_bytes)
+
+
     def sighup_handler_main(self, signum, frame):
         logger.warning('Caught HUP signal')
 
@@ -427,6 +470,10 @@ class IndiAllSky(object):
 
         self.capture_worker_idx += 1
 
+        if self.frame_ring:
+            # a previous capture worker may have exited while writing a frame
+            self.frame_ring.resetWriting()
+
         logger.info('Starting Capture-%d worker', self.capture_worker_idx)
         self.capture_worker = CaptureWorker(
             self.capture_worker_idx,
@@ -444,6 +491,7 @@ class IndiAllSky(object):
             self.sensors_user_av,
             self.night_av,
             self.astro_av,
+            frame_ring=self.frame_ring,
         )
         self.capture_worker.start()
 
@@ -497,6 +545,7 @@ class IndiAllSky(object):
             self.sensors_user_av,
             self.night_av,
             self.astro_av,
+            frame_ring=self.frame_ring,
         )
         self.image_worker.start()
 
@@ -529,16 +578,82 @@ class IndiAllSky(object):
         self.image_worker.join()
 
 
-    def _startVideoWorker(self):
+    def _setupVideoLanes(self):
+        # workers must be stopped
+        self.video_worker_list = list()
+
+        for lane in IndiAllSkyVideoLanes.lane_list:
+            for x in range(IndiAllSkyVideoLanes.workerCount(self.config, lane)):
+                self.video_worker_list.append({
+                    'worker'  : None,
+                    'error_q' : Queue(),
+                    'task_q'  : Queue(),
+                    'slot'    : '{0:s}-{1:d}'.format(lane, x),
+                    'lane'    : lane,
+                })
+
+
+        logger.info('Video worker lanes: %s', ', '.join(v['slot'] for v in self.video_worker_list))
+
+
+    def _startVideoWorkers(self):
+        self._videoDispatchWorkerStart()
+
+        for video_worker_dict in self.video_worker_list:
+            self._videoWorkerStart(video_worker_dict)
+
+
+    def _videoDispatchWorkerStart(self):
+        from .videoDispatch import VideoDispatcher
+
+        if self.video_dispatch_worker:
+            if self.video_dispatch_worker.is_alive():
+                return
+
+
+            try:
+                dispatch_error, dispatch_traceback = self.video_dispatch_error_q.get_nowait()
+                for line in dispatch_traceback.split('\n'):
+                    logger.error('Video dispatch worker exception: %s', line)
+            except queue.Empty:
+                pass
+
+
+        self.video_dispatch_worker_idx += 1
+
+        logger.info('Starting VideoDispatch-%d worker', self.video_dispatch_worker_idx)
+        self.video_dispatch_worker = VideoDispatcher(
+            self.video_dispatch_worker_idx,
+            self.config,
+            self.video_dispatch_error_q,
+            self.video_q,
+            {v['slot'] : v['task_q'] for v in self.video_worker_list},
+            {v['slot'] : v['lane'] for v in self.video_worker_list},
+        )
+        self.video_dispatch_worker.start()
+
+
+        if self.video_dispatch_worker_idx % 10 == 0:
+            # notify if worker is restarted more than 10 times
+            with app.app_context():
+                self._miscDb.addNotification(
+                    NotificationCategory.WORKER,
+                    'VideoDispatcher',
+                    'WARNING: VideoDispatcher was restarted more than 10 times',
+                    expire=timedelta(hours=2),
+                )
+
+
+    def _videoWorkerStart(self, vw_dict):
         from .video import VideoWorker
 
-        if self.video_worker:
-            if self.video_worker.is_alive():
+        if vw_dict['worker']:
+            if vw_dict['worker'].is_alive():
                 return
 
 
             try:
-                video_error, video_traceback = self.video_error_q.get_nowait()
+                video_error, video_traceback = vw_dict['error_q'].get_nowait()
                 for line in video_traceback.split('\n'):
                     logger.error('Video worker exception: %s', line)
             except queue.Empty:
@@ -547,17 +662,25 @@ class IndiAllSky(object):
 
         self.video_worker_idx += 1
 
-        logger.info('Starting Video-%d worker', self.video_worker_idx)
-        self.video_worker = VideoWorker(
+        logger.info('Starting Video-%d worker (%s)', self.video_worker_idx, vw_dict['slot'])
+        vw_dict['worker'] = VideoWorker(
             self.video_worker_idx,
             self.config,
-            self.video_error_q,
-            self.video_q,
+            vw_dict['error_q'],
+            vw_dict['task_q'],
             self.upload_q,
             self.night_av,
             self.binning_av,
+            slot=vw_dict['slot'],
+            dispatch_q=self.video_q,
         )
-        self.video_worker.start()
+        vw_dict['worker'].start()
+
+        # the dispatcher sends tasks to the new worker
+        self.video_q.put({
+            'worker_start' : vw_dict['slot'],
+            'worker_idx'   : self.video_worker_idx,
+        })
 
 
         if self.video_worker_idx % 10 == 0:
@@ -571,21 +694,49 @@ class IndiAllSky(object):
                 )
 
 
-    def _stopVideoWorker(self):
-        if not self.video_worker:
+    def _stopVideoWorkers(self):
+        # stop dispatching first, tasks that are not started are picked up by the next dispatcher
+        self._videoDispatchWorkerStop()
+
+
+        active_worker_list = list()
+        for video_worker_dict in self.video_worker_list:
+            if not video_worker_dict['worker']:
+                continue
+
+            if not video_worker_dict['worker'].is_alive():
+                continue
+
+            if self._terminate:
+                logger.info('Terminating Video worker')
+                video_worker_dict['worker'].terminate()
+
+            active_worker_list.append(video_worker_dict)
+
+            # need to put the stops in the queues before waiting on workers to join
+            video_worker_dict['task_q'].put({'stop' : True})
+
+
+        for video_worker_dict in active_worker_list:
+            logger.info('Stopping Video worker (%s)', video_worker_dict['slot'])
+            video_worker_dict['worker'].join()
+
+
+    def _videoDispatchWorkerStop(self):
+        if not self.video_dispatch_worker:
             return
 
-        if not self.video_worker.is_alive():
+        if not self.video_dispatch_worker.is_alive():
             return
 
         if self._terminate:
-            logger.info('Terminating Video worker')
-            self.video_worker.terminate()
+            logger.info('Terminating VideoDispatch worker')
+            self.video_dispatch_worker.terminate()
 
-        logger.info('Stopping Video worker')
+        logger.info('Stopping VideoDispatch worker')
 
         self.video_q.put({'stop' : True})
-        self.video_worker.join()
+        self.video_dispatch_worker.join()
 
 
     def _startSensorWorker(self):
@@ -645,10 +796,52 @@ class IndiAllSky(object):
 
 
     def _startFileUploadWorkers(self):
+        self._uploadDispatchWorkerStart()
+
         for upload_worker_dict in self.upload_worker_list:
             self._fileUploadWorkerStart(upload_worker_dict)
 
 
+    def _uploadDispatchWorkerStart(self):
+        from .uploader import UploadDispatcher
+
+        if self.upload_dispatch_worker:
+            if self.upload_dispatch_worker.is_alive():
+                return
+
+
+            try:
+                dispatch_error, dispatch_traceback = self.upload_dispatch_error_q.get_nowait()
+                for line in dispatch_traceback.split('\n'):
+                    logger.error('Upload dispatch worker exception: %s', line)
+            except queue.Empty:
+                pass
+
+
+        self.upload_dispatch_worker_idx += 1
+
+        logger.info('Starting UploadDispatch-%d worker', self.upload_dispatch_worker_idx)
+        self.upload_dispatch_worker = UploadDispatcher(
+            self.upload_dispatch_worker_idx,
+            self.config,
+            self.upload_dispatch_error_q,
+            self.upload_q,
+            self.upload_scheduler,
+        )
+        self.upload_dispatch_worker.start()
+
+
+        if self.upload_dispatch_worker_idx % 10 == 0:
+            # notify if worker is restarted more than 10 times
+            with app.app_context():
+                self._miscDb.addNotification(
+                    NotificationCategory.WORKER,
+                    'UploadDispatcher',
+                    'WARNING: UploadDispatcher was restarted more than 10 times',
+                    expire=timedelta(hours=2),
+                )
+
+
     def _fileUploadWorkerStart(self, uw_dict):
         from .uploader import FileUploader
 
@@ -673,6 +866,7 @@ class IndiAllSky(object):
             self.config,
             uw_dict['error_q'],
             self.upload_q,
+            scheduler=self.upload_scheduler,
         )
 
         uw_dict['worker'].start()
@@ -690,6 +884,10 @@ class IndiAllSky(object):
 
 
     def _stopFileUploadWorkers(self):
+        # tasks that are not started stay in the scheduler for the next workers
+        self._uploadDispatchWorkerStop()
+
+
         active_worker_list = list()
         for upload_worker_dict in self.upload_worker_list:
             if not upload_worker_dict['worker']:
@@ -719,6 +917,19 @@ class IndiAllSky(object):
         uw_dict['worker'].join()
 
 
+    def _uploadDispatchWorkerStop(self):
+        if not self.upload_dispatch_worker:
+            return
+
+        if not self.upload_dispatch_worker.is_alive():
+            return
+
+        logger.info('Stopping UploadDispatch worker')
+
+        self.upload_dispatch_worker.stop()
+        self.upload_dispatch_worker.join()
+
+
     def run(self):
         with app.app_context():
             self.write_pid()
@@ -737,10 +948,13 @@ class IndiAllSky(object):
                 logger.warning('Shutting down')
                 self._stopCaptureWorker()  # stop this first so image queue is cleared out
                 self._stopImageWorker()
-                self._stopVideoWorker()
+                self._stopVideoWorkers()
                 self._stopSensorWorker()
                 self._stopFileUploadWorkers()
 
+                if self.frame_ring:
+                    self.frame_ring.close(unlink=True)
+
 
                 with app.app_context():
                     self._miscDb.setState('STATUS', constants.STATUS_STOPPED)
@@ -757,7 +971,7 @@ class IndiAllSky(object):
                 self._reload = False
                 self._stopCaptureWorker()  # stop this first so image queue is cleared out
                 self._stopImageWorker()
-                self._stopVideoWorker()
+                self._stopVideoWorkers()
                 self._stopSensorWorker()
                 self._stopFileUploadWorkers()
                 # processes will start at the next loop
@@ -772,7 +986,7 @@ class IndiAllSky(object):
             # restart worker if it has failed
             self._startCaptureWorker()
             self._startImageWorker()
-            self._startVideoWorker()
+            self._startVideoWorkers()
             self._startSensorWorker()
             self._startFileUploadWorkers()
 
@@ -789,7 +1003,8 @@ class IndiAllSky(object):
     def reload_handler(self):
         logger.warning('Reconfiguring...')
 
-        self._config_obj = IndiAllSkyConfig()
+        # only parsed if the config changed since it was last loaded
+        self._config_obj = IndiAllSkyConfig(cached=True)
 
         # overwrite config
         self.config = self._config_obj.config
@@ -812,6 +1027,12 @@ class IndiAllSky(object):
         self._miscDb.setState('CONFIG_ID', self._config_obj.config_id)
 
 
+        # workers are stopped at this point
+        self._setupFrameRing()
+        self._setupVideoLanes()
+        self.upload_scheduler.updateConfig(self.config)
+
+
     def _systemHealthCheck(self, task_state=TaskQueueState.QUEUED):
         # This will delete old images from the filesystem and DB
         jobdata = {
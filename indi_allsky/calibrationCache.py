@@ -0,0 +1,119 @@
+from collections import OrderedDict
+import logging
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyCalibrationCache(object):
+    """LRU cache of merged master dark frames, bounded by total bytes"""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self._max_bytes = int(max_bytes)
+
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+
+        self._generation = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, new_max_bytes):
+        self._max_bytes = int(new_max_bytes)
+        self._evict()
+
+
+    @property
+    def cache_bytes(self):
+        return self._cache_bytes
+
+
+    @property
+    def generation(self):
+        return self._generation
+
+    @generation.setter
+    def generation(self, new_generation):
+        # a new generation means calibration frames were added or removed
+        if new_generation == self._generation:
+            return
+
+        if not isinstance(self._generation, type(None)):
+            logger.info('Calibration frames updated, clearing calibration cache')
+            self.clear()
+
+        self._generation = new_generation
+
+
+    @staticmethod
+    def buildKey(camera_id, binning, dark_entry, p_dark, bpm_entry=None, p_bpm=None):
+        # modification times catch files that are replaced in place
+        dark_key = (dark_entry.id, p_dark.stat().st_mtime_ns)
+
+        if bpm_entry and p_bpm:
+            bpm_key = (bpm_entry.id, p_bpm.stat().st_mtime_ns)
+        else:
+            bpm_key = (None, None)
+
+        return (int(camera_id), int(binning)) + dark_key + bpm_key
+
+
+    def get(self, key):
+        try:
+            master_dark = self._cache[key]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self._cache.move_to_end(key)
+        self.hits += 1
+
+        return master_dark
+
+
+    def put(self, key, master_dark):
+        if master_dark.nbytes > self._max_bytes:
+            logger.warning('Master dark (%0.1f MB) exceeds calibration cache size', master_dark.nbytes / 1024 / 1024)
+            return
+
+        # cached data is shared between frames, it must never be modified
+        master_dark.flags.writeable = False
+
+        old_master_dark = self._cache.pop(key, None)
+        if not isinstance(old_master_dark, type(None)):
+            self._cache_bytes -= old_master_dark.nbytes
+
+        self._cache[key] = master_dark
+        self._cache_bytes += master_dark.nbytes
+
+        self._evict()
+
+
+    def clear(self):
+        self._cache.clear()
+        self._cache_bytes = 0
+
+
+    def logStats(self):
+        logger.info(
+            'Calibration cache - hits: %d, misses: %d, evictions: %d, entries: %d, size: %0.1f MB',
+            self.hits,
+            self.misses,
+            self.evictions,
+            len(self._cache),
+            self._cache_bytes / 1024 / 1024,
+        )
+
+
+    def _evict(self):
+        while self._cache_bytes > self._max_bytes and self._cache:
+            _, old_master_dark = self._cache.popitem(last=False)
+            self._cache_bytes -= old_master_dark.nbytes
+            self.evictions += 1
@@ -128,6 +128,8 @@ class IndiClient(PyIndi.BaseClient):
 
         self._filename_t = 'ccd{0:d}_{1:s}.{2:s}'
 
+        self.frame_ring = None  # shared memory frame transport
+
         self._timeout = 10.0
 
         self._exposure = 0.0
@@ -384,13 +386,19 @@ class IndiClient(PyIndi.BaseClient):
         blobfile = io.BytesIO(imgdata)
         hdulist = fits.open(blobfile)
 
-        try:
-            with tempfile.NamedTemporaryFile(mode='w+b', delete=False, suffix='.fit') as f_tmpfile:
-                hdulist.writeto(f_tmpfile)
-                f_tmpfile_p = Path(f_tmpfile.name)
-        except OSError as e:
-            logger.error('OSError: %s', str(e))
-            return
+
+        frame_dict = self._putSharedFrame(hdulist)
+
+        if frame_dict:
+            f_tmpfile_p = None
+        else:
+            try:
+                with tempfile.NamedTemporaryFile(mode='w+b', delete=False, suffix='.fit') as f_tmpfile:
+                    hdulist.writeto(f_tmpfile)
+                    f_tmpfile_p = Path(f_tmpfile.name)
+            except OSError as e:
+                logger.error('OSError: %s', str(e))
+                return
 
 
         #elapsed_s = time.time() - start
@@ -400,7 +408,8 @@ class IndiClient(PyIndi.BaseClient):
 
         ### process data in worker
         jobdata = {
-            'filename'    : str(f_tmpfile_p),
+            'filename'    : str(f_tmpfile_p) if f_tmpfile_p else None,
+            'frame'       : frame_dict,
             'exposure'    : self.exposure,
             'gain'        : self.gain,
             'binning'     : self.binning,
@@ -433,6 +442,23 @@ class IndiClient(PyIndi.BaseClient):
         self.image_q.put(jobdata)
 
 
+    def _putSharedFrame(self, hdulist):
+        # Returns the shared memory slot metadata, None if the frame must be written to a file
+        if not self.frame_ring:
+            return None
+
+        if self.sqm_exposure:
+            # SQM exposures are processed from files
+            return None
+
+        repair_config = self.config.get('IMAGE_ASI676MC_REPAIR', {})
+        if repair_config.get('ENABLE') and repair_config.get('SAVE_DIAGNOSTIC_FITS'):
+            # diagnostic FITS are copied from the original file
+            return None
+
+        return self.frame_ring.putFrame(hdulist[0].data, hdulist[0].header)
+
+
     def newMessage(self, d, m):
         logger.info("new Message %s", d.messageQueue(m))
 
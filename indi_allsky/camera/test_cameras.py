@@ -200,11 +200,22 @@ class IndiClientTestCameraBase(IndiClient):
 
         exp_date = datetime.now()
 
-        self.write_fit(exp_date)
+        hdulist = self.build_hdulist(exp_date)
+
+        frame_dict = self._putSharedFrame(hdulist)
+
+        if frame_dict:
+            filename = None
+            self.current_exposure_file_p.unlink()
+        else:
+            self.write_fit(hdulist)
+            filename = str(self.current_exposure_file_p)
+
 
         ### process data in worker
         jobdata = {
-            'filename'    : str(self.current_exposure_file_p),
+            'filename'    : filename,
+            'frame'       : frame_dict,
             'exposure'    : self.exposure,
             'gain'        : self.gain,
             'binning'     : self.binning,
@@ -368,7 +379,7 @@ class IndiClientTestCameraBase(IndiClient):
         pass
 
 
-    def write_fit(self, exp_date):
+    def build_hdulist(self, exp_date):
         import numpy
         from astropy.io import fits
 
@@ -403,7 +414,10 @@ class IndiClientTestCameraBase(IndiClient):
         hdulist[0].header['DATE-OBS'] = exp_date.isoformat()
         #hdulist[0].header['BITPIX'] = 8
 
+        return hdulist
+
 
+    def write_fit(self, hdulist):
         with io.open(str(self.current_exposure_file_p), 'wb') as f_image:
             hdulist.writeto(f_image)
 
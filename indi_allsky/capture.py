@@ -219,6 +219,7 @@ class CaptureWorker(Process):
         sensors_user_av,
         night_av,
         astro_av,
+        frame_ring=None,
     ):
 
         super(CaptureWorker, self).__init__()
@@ -242,6 +243,8 @@ class CaptureWorker(Process):
         self.night_av = night_av
         self.astro_av = astro_av
 
+        self.frame_ring = frame_ring
+
         self._miscDb = miscDb(self.config)
         self._expUtils = IndiAllSkyExposureUtils(self.config, self.exposure_av, self.gain_av, self.binning_av)
         self._dateCalcs = IndiAllSkyDateCalcs(self.config, self.position_av)
@@ -446,8 +449,7 @@ class CaptureWorker(Process):
                         ### Generate timelapse at end of night
                         yesterday_ref = dayDate - timedelta(days=1)
                         timespec = yesterday_ref.strftime('%Y%m%d')
-                        self._generateNightKeogram(timespec, self.camera_id)  # keogram/st first
-                        self._generateNightTimelapse(timespec, self.camera_id)
+                        self._generateNightProducts(timespec, self.camera_id)
                         self._uploadAllskyEndOfNight(self.camera_id)
 
                         # prevent duplicate generation until reconfigureCcd() is called
@@ -511,8 +513,7 @@ class CaptureWorker(Process):
                         ### Generate timelapse at end of night
                         yesterday_ref = dayDate - timedelta(days=1)
                         timespec = yesterday_ref.strftime('%Y%m%d')
-                        self._generateNightKeogram(timespec, self.camera_id)  # keogram/st first
-                        self._generateNightTimelapse(timespec, self.camera_id)
+                        self._generateNightProducts(timespec, self.camera_id)
                         self._uploadAllskyEndOfNight(self.camera_id)
 
                         # prevent duplicate generation until reconfigureCcd() is called
@@ -841,6 +842,10 @@ class CaptureWorker(Process):
         )
 
 
+        if self.config.get('FRAME_SHARED_MEMORY', {}).get('ENABLE'):
+            self.indiclient.frame_ring = self.frame_ring
+
+
         # set indi server localhost and port
         self.indiclient.setServer(self.config['INDI_SERVER'], self.config['INDI_PORT'])
 
@@ -2178,25 +2183,75 @@ class CaptureWorker(Process):
         self.video_q.put({'task_id' : video_task.id})
 
 
-        if self.config.get('FISH2PANO', {}).get('ENABLE'):
-            panorama_video_jobdata = {
-                'action'      : 'generatePanoramaVideo',
-                'kwargs' : {
-                    'timespec'    : timespec,
-                    'night'       : True,
-                    'camera_id'   : camera.id,
-                },
-            }
+        self._generateNightPanoramaTimelapse(timespec, camera.id, task_state=task_state)
 
-            panorama_video_task = IndiAllSkyDbTaskQueueTable(
-                queue=TaskQueueQueue.VIDEO,
-                state=task_state,
-                data=panorama_video_jobdata,
-            )
-            db.session.add(panorama_video_task)
-            db.session.commit()
 
-            self.video_q.put({'task_id' : panorama_video_task.id})
+    def _generateNightPanoramaTimelapse(self, timespec, camera_id, task_state=TaskQueueState.QUEUED):
+        if not self.config.get('FISH2PANO', {}).get('ENABLE'):
+            return
+
+
+        panorama_video_jobdata = {
+            'action'      : 'generatePanoramaVideo',
+            'kwargs' : {
+                'timespec'    : timespec,
+                'night'       : True,
+                'camera_id'   : camera_id,
+            },
+        }
+
+        panorama_video_task = IndiAllSkyDbTaskQueueTable(
+            queue=TaskQueueQueue.VIDEO,
+            state=task_state,
+            data=panorama_video_jobdata,
+        )
+        db.session.add(panorama_video_task)
+        db.session.commit()
+
+        self.video_q.put({'task_id' : panorama_video_task.id})
+
+
+    def _generateNightProducts(self, timespec, camera_id, task_state=TaskQueueState.QUEUED):
+        if not self.config.get('TIMELAPSE', {}).get('SINGLE_PASS', True):
+            self._generateNightKeogram(timespec, camera_id, task_state=task_state)  # keogram/st first
+            self._generateNightTimelapse(timespec, camera_id, task_state=task_state)
+            return
+
+
+        if not self.config.get('TIMELAPSE_ENABLE', True):
+            logger.warning('Timelapse creation disabled')
+            return
+
+
+        camera = IndiAllSkyDbCameraTable.query\
+            .filter(IndiAllSkyDbCameraTable.id == camera_id)\
+            .one()
+
+
+        logger.warning('Generating night time keogram, star trails and timelapse for %s camera %d', timespec, camera.id)
+
+        jobdata = {
+            'action'      : 'generateNightProducts',
+            'kwargs' : {
+                'timespec'    : timespec,
+                'night'       : True,
+                'camera_id'   : camera.id,
+            },
+        }
+
+        task = IndiAllSkyDbTaskQueueTable(
+            queue=TaskQueueQueue.VIDEO,
+            state=task_state,
+            data=jobdata,
+        )
+        db.session.add(task)
+        db.session.commit()
+
+        self.video_q.put({'task_id' : task.id})
+
+
+        # panorama images are a separate set of files
+        self._generateNightPanoramaTimelapse(timespec, camera.id, task_state=task_state)
 
 
     def _generateNightKeogram(self, timespec, camera_id, task_state=TaskQueueState.QUEUED):
@@ -0,0 +1,108 @@
+import math
+import logging
+
+import numpy
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyChartDownsample(object):
+    """Reduce chart series to a requested number of points
+
+    All series share one timestamp array, both methods return the row indices
+    to keep so every series is reduced the same way.
+    """
+
+    methods = ('minmax', 'lttb')
+
+
+    @classmethod
+    def minmax(cls, ts_array, column_list, points):
+        # each bucket is reduced to the first and last timestamp of the bucket,
+        # every series keeps its minimum and maximum in time order
+        ts_array = numpy.asarray(ts_array)
+        row_count = ts_array.shape[0]
+
+        bucket_size = math.ceil(row_count / max(int(points / 2), 1))
+        bucket_count = math.ceil(row_count / bucket_size)
+
+        if bucket_size < 2:
+            return ts_array, list(column_list)
+
+
+        pad = (bucket_count * bucket_size) - row_count
+
+        bucket_first = numpy.arange(bucket_count) * bucket_size
+        bucket_last = numpy.minimum(bucket_first + bucket_size, row_count) - 1
+
+        new_ts_array = numpy.empty(bucket_count * 2, dtype=ts_array.dtype)
+        new_ts_array[0::2] = ts_array[bucket_first]
+        new_ts_array[1::2] = ts_array[bucket_last]
+
+
+        new_column_list = list()
+        for column in column_list:
+            column = numpy.asarray(column, dtype=numpy.float64)
+
+            # nan values (missing data) are never selected unless the whole bucket is missing
+            low_values = numpy.pad(numpy.where(numpy.isnan(column), numpy.inf, column), (0, pad), constant_values=numpy.inf).reshape((bucket_count, bucket_size))
+            high_values = numpy.pad(numpy.where(numpy.isnan(column), -numpy.inf, column), (0, pad), constant_values=-numpy.inf).reshape((bucket_count, bucket_size))
+
+            min_index = bucket_first + numpy.argmin(low_values, axis=1)
+            max_index = bucket_first + numpy.argmax(high_values, axis=1)
+
+            new_column = numpy.empty(bucket_count * 2, dtype=numpy.float64)
+            new_column[0::2] = column[numpy.minimum(min_index, max_index)]
+            new_column[1::2] = column[numpy.maximum(min_index, max_index)]
+
+            new_column_list.append(new_column)
+
+
+        return new_ts_array, new_column_list
+
+
+    @classmethod
+    def lttbIndices(cls, ts_array, y_array, points):
+        # Largest-Triangle-Three-Buckets, returns the indices of the selected rows
+        row_count = len(ts_array)
+
+        if points >= row_count or points < 3:
+            return numpy.arange(row_count)
+
+
+        x = numpy.asarray(ts_array, dtype=numpy.float64)
+        y = numpy.nan_to_num(numpy.asarray(y_array, dtype=numpy.float64))
+
+        # first and last rows are always kept
+        bucket_edges = numpy.linspace(1, row_count - 1, points - 1).astype(numpy.int64)
+
+        index_list = numpy.empty(points, dtype=numpy.int64)
+        index_list[0] = 0
+        index_list[-1] = row_count - 1
+
+        a = 0
+        for i in range(points - 2):
+            bucket_start = bucket_edges[i]
+            bucket_end = max(bucket_edges[i + 1], bucket_start + 1)
+
+            # average of the next bucket is the third point of the triangle
+            if i == points - 3:
+                next_x = x[-1]
+                next_y = y[-1]
+            else:
+                next_start = bucket_end
+                next_end = max(bucket_edges[i + 2], next_start + 1)
+                next_x = x[next_start:next_end].mean()
+                next_y = y[next_start:next_end].mean()
+
+
+            area = numpy.abs(
+                ((x[a] - next_x) * (y[bucket_start:bucket_end] - y[a]))
+                - ((x[a] - x[bucket_start:bucket_end]) * (next_y - y[a]))
+            )
+
+            a = bucket_start + int(numpy.argmax(area))
+            index_list[i + 1] = a
+
+
+        return index_list
@@ -6,6 +6,7 @@ from datetime import datetime
 from datetime import timezone
 import io
 import json
+import threading
 import tempfile
 import random
 from pathlib import Path
@@ -185,6 +186,8 @@ class IndiAllSkyConfigBase(object):
             "PRE_SCALE"      : 50,
             "FFMPEG_REPORT"  : False,
             "USE_NIGHT_CONFIG" : True,
+            "PIPE"           : True,
+            "SINGLE_PASS"    : True,
         },
         "DAYTIME_CAPTURE"          : True,
         "DAYTIME_CAPTURE_SAVE"     : True,
@@ -240,12 +243,25 @@ class IndiAllSkyConfigBase(object):
             "SAVE_INTERVAL" : 25,
             "LABEL"         : False,
         },
+        "IMAGE_PREFETCH" : {
+            "THREADS"       : 3,
+            "QUEUE_DEPTH"   : 8,
+        },
+        "ASSET_EXPIRE" : {
+            "CHUNK_SIZE"     : 500,
+            "UNLINK_THREADS" : 4,
+        },
+        "NIGHT_ACCUMULATOR" : {
+            "ENABLE"              : True,
+            "CHECKPOINT_INTERVAL" : 25,
+        },
         "STARTRAILS_MAX_ADU"    : 65,
         "STARTRAILS_MASK_THOLD" : 255,
         "STARTRAILS_PIXEL_THOLD": 1.0,
         "STARTRAILS_MIN_STARS"  : 0,
         "STARTRAILS_TIMELAPSE"  : True,
         "STARTRAILS_TIMELAPSE_MINFRAMES" : 250,
+        "STARTRAILS_TIMELAPSE_PIPE"      : True,
         "STARTRAILS_SUN_ALT_THOLD"       : -15.0,
         "STARTRAILS_MOONMODE_THOLD"      : True,
         "STARTRAILS_MOON_ALT_THOLD"      : 91.0,
@@ -290,6 +306,7 @@ class IndiAllSkyConfigBase(object):
         "IMAGE_CALIBRATE_FIX_HOLES"     : False,
         "IMAGE_CALIBRATE_HOLE_THOLD"    : 30,
         "IMAGE_CALIBRATE_MANUAL_OFFSET" : 0,
+        "IMAGE_CALIBRATE_CACHE_MB"      : 256,
         "PRIVACY_MODE"                  : False,
         "IMAGE_EXIF_PRIVACY"    : False,
         "IMAGE_FILE_TYPE" : "jpg",  # jpg, png, or tif
@@ -393,6 +410,7 @@ class IndiAllSkyConfigBase(object):
         "IMAGE_STACK_METHOD"        : "maximum",  # maximum, average, or minimum
         "IMAGE_STACK_COUNT"         : 1,
         "IMAGE_STACK_ALIGN"         : False,
+        "IMAGE_STACK_INCREMENTAL"   : False,
         "IMAGE_ALIGN_DETECTSIGMA"   : 5,
         "IMAGE_ALIGN_POINTS"        : 50,
         "IMAGE_ALIGN_SOURCEMINAREA" : 10,
@@ -416,6 +434,11 @@ class IndiAllSkyConfigBase(object):
         "CAPTURE_HOOK_PRE"      : "",
         "CAPTURE_HOOK_TIMEOUT"  : 5,
         "IMAGE_QUEUE_BACKOFF"   : 0.5,
+        "FRAME_SHARED_MEMORY"   : {
+            "ENABLE"  : False,
+            "SLOTS"   : 3,
+            "SLOT_MB" : 64,
+        },
         "FFMPEG_FRAMERATE"      : 25,
         "FFMPEG_FRAMERATE_DAY"  : 25,
         "FFMPEG_BITRATE"        : "5000k",
@@ -484,7 +507,19 @@ class IndiAllSkyConfigBase(object):
             "BOTTOM"    : 0,
             "COLOR"     : [0, 0, 0],
         },
+        "VIDEO_WORKERS" : {
+            "HEAVY" : 0,  # timelapse/keogram generation, 0 selects based on the CPU count
+            "LIGHT" : 1,  # network updates and maintenance
+        },
         "UPLOAD_WORKERS" : 2,
+        "UPLOAD_CONNECTION_IDLE_TIMEOUT" : 120,  # seconds, 0 disables connection reuse
+        "UPLOAD_DESTINATION_WORKERS" : {  # concurrent uploads per destination
+            "FILETRANSFER" : 1,
+            "S3"           : 1,
+            "MQTT"         : 1,
+            "SYNCAPI"      : 1,
+            "YOUTUBE"      : 1,
+        },
         "FILETRANSFER" : {
             "CLASSNAME"              : "pycurl_sftp",  # pycurl_sftp, pycurl_ftps, pycurl_ftpes, paramiko_sftp, python_ftp, python_ftpes
             "HOST"                   : "",
@@ -571,6 +606,9 @@ class IndiAllSkyConfigBase(object):
             "CERT_BYPASS"            : False,
             "UPLOAD_FITS"            : False,
             "UPLOAD_RAW"             : False,
+            "MULTIPART_THRESHOLD_MB" : 64,  # larger files are uploaded in resumable parts
+            "MULTIPART_PART_SIZE_MB" : 16,
+            "MULTIPART_CONCURRENCY"  : 4,
         },
         "MQTTPUBLISH" : {
             "ENABLE"                 : False,
@@ -610,6 +648,7 @@ class IndiAllSkyConfigBase(object):
             "UPLOAD_IMAGE"           : 1,
             "UPLOAD_PANORAMA"        : 1,
             #"UPLOAD_VIDEO"           : True,  # this cannot be changed
+            "BATCH_SIZE"             : 1,  # entries per request, batches require a server with the batch endpoint
             "CONNECT_TIMEOUT"        : 10.0,
             "TIMEOUT"                : 60.0,
         },
@@ -935,7 +974,21 @@ class IndiAllSkyConfigBase(object):
 
 class IndiAllSkyConfig(IndiAllSkyConfigBase):
 
-    def __init__(self):
+    # process wide cache of the latest config, parsed and decrypted
+    _cache_lock = threading.Lock()
+    _cache = None
+
+
+    def __init__(self, cached=False):
+        if cached:
+            self._loadCachedConfig()
+        else:
+            self._loadConfig()
+
+        self._image_folder = Path('/var/www/html/allsky/images')
+
+
+    def _loadConfig(self):
         self._config = self.base_config.copy()  # populate initial values
 
         # fetch latest config
@@ -948,7 +1001,50 @@ class IndiAllSkyConfig(IndiAllSkyConfigBase):
         self._config.update(config_entry.data)
 
         self._config = self._decrypt_passwords()
-        self._image_folder = Path('/var/www/html/allsky/images')
+
+
+    def _loadCachedConfig(self):
+        # a new or deleted config changes the newest row, this is a primary key lookup
+        newest_entry = db.session.query(
+            IndiAllSkyDbConfigTable.id,
+            IndiAllSkyDbConfigTable.createDate,
+        )\
+            .order_by(IndiAllSkyDbConfigTable.id.desc())\
+            .first()
+
+        if not newest_entry:
+            raise NoResultFound('No configuration found')
+
+        cache_key = (newest_entry.id, newest_entry.createDate)
+
+
+        with self._cache_lock:
+            cache = IndiAllSkyConfig._cache
+
+
+        if isinstance(cache, type(None)) or cache['key'] != cache_key:
+            self._loadConfig()
+
+            cache = {
+                'key'          : cache_key,
+                'config_id'    : self._config_id,
+                'config_level' : self._config_level,
+                'createDate'   : self._createDate,
+                'config_json'  : json.dumps(self._config),
+            }
+
+            with self._cache_lock:
+                IndiAllSkyConfig._cache = cache
+
+            return
+
+
+        self._config_id = cache['config_id']
+        self._config_level = cache['config_level']
+        self._createDate = cache['createDate']
+
+        # callers are free to modify their copy, json is faster than deepcopy
+        self._config = OrderedDict(json.loads(cache['config_json']))
 
 
     @property
@@ -34,6 +34,8 @@ ENDPOINT_V1 = {
     THUMBNAIL       : 'sync/v1/thumbnail',
 }
 
+ENDPOINT_V1_BATCH = 'sync/v1/batch'
+
 
 # File transfers
 TRANSFER_UPLOAD  = 501
@@ -1510,6 +1510,8 @@ class IndiAllSkyDarks(object):
 
         db.session.commit()
 
+        self._miscDb.updateCalibrationGeneration()
+
 
     def getCcdTemperature(self):
         temp_val = self.indiclient.getCcdTemperature()
@@ -3,6 +3,8 @@ from .generic import GenericFileTransfer
 from .exceptions import ConnectionFailure
 from .exceptions import CertificateValidationFailure
 from .exceptions import TransferFailure
+from .multipart import MultipartState
+from .multipart import Boto3MultipartUpload
 
 from pathlib import Path
 #from datetime import datetime
@@ -97,6 +99,7 @@ class boto3_minio(GenericFileTransfer):
 
         import botocore.exceptions
         import boto3.exceptions
+        from boto3.s3.transfer import TransferConfig
 
 
         local_file = kwargs['local_file']
@@ -139,15 +142,37 @@ class boto3_minio(GenericFileTransfer):
             extra_args['StorageClass'] = storage_class
 
 
+        multipart_settings = MultipartState.settings(self.config)
+        local_file_size = local_file_p.stat().st_size
+
+
         start = time.time()
 
         try:
-            self.client.upload_file(
-                str(local_file_p),
-                bucket,
-                str(key),
-                ExtraArgs=extra_args,
-            )
+            if local_file_size >= multipart_settings['threshold']:
+                # large files are resumed from the last confirmed part
+                multipart_state = MultipartState(
+                    multipart_settings['state_dir'],
+                    local_file_p,
+                    bucket,
+                    key,
+                    multipart_settings['part_size'],
+                )
+
+                multipart_upload = Boto3MultipartUpload(
+                    self.client,
+                    multipart_state,
+                    concurrency=multipart_settings['concurrency'],
+                )
+                multipart_upload.upload(bucket, str(key), extra_args)
+            else:
+                self.client.upload_file(
+                    str(local_file_p),
+                    bucket,
+                    str(key),
+                    ExtraArgs=extra_args,
+                    Config=TransferConfig(multipart_threshold=multipart_settings['threshold']),
+                )
         except socket.gaierror as e:
             raise ConnectionFailure(str(e)) from e
         except socket.timeout as e:
@@ -176,10 +201,11 @@ class boto3_minio(GenericFileTransfer):
             raise TransferFailure(str(e)) from e
         except botocore.exceptions.SSLError as e:
             raise CertificateValidationFailure(str(e)) from e
+        except botocore.exceptions.ClientError as e:
+            raise TransferFailure(str(e)) from e
 
 
         upload_elapsed_s = time.time() - start
-        local_file_size = local_file_p.stat().st_size
         logger.info('File transferred in %0.4f s (%0.2f kB/s)', upload_elapsed_s, local_file_size / upload_elapsed_s / 1024)
 
 
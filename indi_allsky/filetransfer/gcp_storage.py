@@ -2,6 +2,7 @@ from .generic import GenericFileTransfer
 #from .exceptions import AuthenticationFailure
 from .exceptions import ConnectionFailure
 #from .exceptions import TransferFailure
+from .multipart import MultipartState
 
 import os
 from pathlib import Path
@@ -63,6 +64,8 @@ class gcp_storage(GenericFileTransfer):
     def put(self, *args, **kwargs):
         super(gcp_storage, self).put(*args, **kwargs)
 
+        from google.cloud.storage import transfer_manager
+
 
         local_file = kwargs['local_file']
         bucket = kwargs['bucket']
@@ -110,13 +113,30 @@ class gcp_storage(GenericFileTransfer):
             upload_kwargs['predefined_acl'] = acl  # all assets are normally publicly readable
 
 
+        multipart_settings = MultipartState.settings(self.config)
+        local_file_size = local_file_p.stat().st_size
+
+
         start = time.time()
 
         try:
-            blob.upload_from_filename(
-                str(local_file_p),
-                **upload_kwargs,
-            )
+            if local_file_size >= multipart_settings['threshold'] and not acl:
+                # parts are uploaded in parallel and retried individually
+                # upload_chunks_concurrently() does not accept a predefined ACL
+                transfer_manager.upload_chunks_concurrently(
+                    str(local_file_p),
+                    blob,
+                    content_type=content_type,
+                    chunk_size=max(multipart_settings['part_size'], MultipartState.min_part_size),
+                    worker_type=transfer_manager.THREAD,
+                    max_workers=multipart_settings['concurrency'],
+                    timeout=self.timeout,
+                )
+            else:
+                blob.upload_from_filename(
+                    str(local_file_p),
+                    **upload_kwargs,
+                )
         except socket.gaierror as e:
             raise ConnectionFailure(str(e)) from e
         except socket.timeout as e:
@@ -131,7 +151,6 @@ class gcp_storage(GenericFileTransfer):
             raise ConnectionFailure(str(e)) from e
 
         upload_elapsed_s = time.time() - start
-        local_file_size = local_file_p.stat().st_size
         logger.info('File transferred in %0.4f s (%0.2f kB/s)', upload_elapsed_s, local_file_size / upload_elapsed_s / 1024)
 
 
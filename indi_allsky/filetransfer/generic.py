@@ -7,6 +7,10 @@ logger = logging.getLogger('indi_allsky')
 
 
 class GenericFileTransfer(object):
+
+    reusable = True  # connection may be kept open between transfers
+
+
     def __init__(self, *args, **kwargs):
         self.config = args[0]
         self.delete = kwargs.get('delete', False)
@@ -70,6 +74,12 @@ class GenericFileTransfer(object):
         pass
 
 
+    def isConnected(self):
+        # health check before a kept alive connection is reused
+        # clients with internal connection pools reconnect on demand
+        return True
+
+
     def put(self, *args, **kwargs):
         if self.delete:
             # perform delete instead of upload
@@ -0,0 +1,377 @@
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+import io
+import json
+import time
+import hashlib
+import threading
+import logging
+
+logger = logging.getLogger('indi_allsky')
+
+
+class MultipartState(object):
+    """Completed parts of a multipart upload
+
+    The state is stored locally after every part, an interrupted upload
+    resumes with the parts that were not confirmed.  The state is tied to
+    the size and modification time of the local file, uploads which can no
+    longer be resumed are aborted so the parts are not retained.
+    """
+
+    min_part_size = 5 * 1024 * 1024  # S3 minimum, except for the last part
+    max_parts = 10000
+
+    state_expire_days = 7  # incomplete uploads are normally cleaned up by bucket lifecycle rules
+
+
+    def __init__(self, state_dir, local_file, bucket, key, part_size):
+        self.state_dir = Path(state_dir)
+        self.local_file_p = Path(local_file)
+
+        local_file_stat = self.local_file_p.stat()
+        self.size = local_file_stat.st_size
+
+
+        # parts must cover the file within the part limit
+        self.part_size = max(int(part_size), self.min_part_size, -(-self.size // self.max_parts))
+
+
+        upload_ident = json.dumps([
+            str(self.local_file_p.absolute()),
+            self.size,
+            int(local_file_stat.st_mtime),
+            str(bucket),
+            str(key),
+            self.part_size,
+        ])
+
+        self.bucket = str(bucket)
+        self.key = str(key)
+
+        self.state_file = self.state_dir.joinpath('multipart_{0:s}.json'.format(hashlib.sha1(upload_ident.encode()).hexdigest()))
+
+
+        self.upload_id = None
+        self.parts = dict()  # part number: etag
+
+        self._lock = threading.Lock()
+
+
+    @classmethod
+    def settings(cls, config, section='S3UPLOAD'):
+        section_config = config.get(section, {})
+
+        varlib_folder = config.get('VARLIB_FOLDER', '/var/lib/indi-allsky')
+
+        return {
+            'threshold'   : int(float(section_config.get('MULTIPART_THRESHOLD_MB', 64)) * 1024 * 1024),
+            'part_size'   : int(float(section_config.get('MULTIPART_PART_SIZE_MB', 16)) * 1024 * 1024),
+            'concurrency' : max(int(section_config.get('MULTIPART_CONCURRENCY', 4)), 1),
+            'state_dir'   : Path(varlib_folder).joinpath('multipart'),
+        }
+
+
+    @classmethod
+    def expireStateFiles(cls, state_dir, abort_upload=None):
+        # abort_upload(bucket, key, upload_id) is called for the upload of each expired state
+        state_dir_p = Path(state_dir)
+        if not state_dir_p.is_dir():
+            return
+
+
+        cutoff = time.time() - (cls.state_expire_days * 86400)
+
+        for state_file_p in state_dir_p.glob('multipart_*.json'):
+            try:
+                if state_file_p.stat().st_mtime >= cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+
+
+            state = cls._readStateFile(state_file_p)
+
+            if abort_upload and state.get('upload_id') and state.get('bucket'):
+                try:
+                    abort_upload(state['bucket'], state['key'], state['upload_id'])
+                except Exception as e:
+                    logger.error('Unable to abort expired multipart upload %s: %s', state['upload_id'], str(e))
+
+
+            try:
+                logger.warning('Removing expired multipart state: %s', state_file_p.name)
+                state_file_p.unlink()
+            except OSError as e:
+                logger.error('Cannot remove multipart state: %s', str(e))
+
+
+    @staticmethod
+    def _readStateFile(state_file_p):
+        try:
+            with io.open(str(state_file_p), 'r') as f_state:
+                return json.load(f_state)
+        except (OSError, ValueError):
+            return dict()
+
+
+    def staleStates(self):
+        # Other uploads of the same local file or to the same key.  A modified
+        # file, a new key, or new settings start a new upload and the old upload
+        # must be aborted.  Returns [(state_file_p, state)]
+        if not self.state_dir.is_dir():
+            return []
+
+
+        local_file = str(self.local_file_p.absolute())
+
+        stale_list = list()
+        for state_file_p in self.state_dir.glob('multipart_*.json'):
+            if state_file_p == self.state_file:
+                continue
+
+            state = self._readStateFile(state_file_p)
+            if not state.get('upload_id') or not state.get('bucket'):
+                # state from an older version, removed when expired
+                continue
+
+            if state.get('local_file') == local_file or (state['bucket'] == self.bucket and state.get('key') == self.key):
+                stale_list.append((state_file_p, state))
+
+
+        return stale_list
+
+
+    def load(self):
+        try:
+            with io.open(str(self.state_file), 'r') as f_state:
+                state = json.load(f_state)
+        except FileNotFoundError:
+            return False
+        except ValueError as e:
+            logger.error('Invalid multipart state %s: %s', self.state_file.name, str(e))
+            return False
+
+
+        self.upload_id = state['upload_id']
+        self.parts = {int(k): v for k, v in state['parts'].items()}
+
+        return True
+
+
+    def start(self, upload_id):
+        with self._lock:
+            self.upload_id = upload_id
+            self.parts = dict()
+            self._save()
+
+
+    def reset(self):
+        with self._lock:
+            self.upload_id = None
+            self.parts = dict()
+
+
+    def addPart(self, part_number, etag):
+        with self._lock:
+            self.parts[int(part_number)] = etag
+            self._save()
+
+
+    def _save(self):
+        if not self.state_dir.is_dir():
+            self.state_dir.mkdir(mode=0o755, parents=True)
+
+
+        state = {
+            'upload_id'  : self.upload_id,
+            'local_file' : str(self.local_file_p.absolute()),
+            'bucket'     : self.bucket,
+            'key'        : self.key,
+            'size'       : self.size,
+            'part_size'  : self.part_size,
+            'parts'      : self.parts,
+        }
+
+        # atomic replace
+        tmp_state_file = self.state_file.with_suffix('.tmp')
+        with io.open(str(tmp_state_file), 'w') as f_state:
+            json.dump(state, f_state)
+
+        tmp_state_file.replace(self.state_file)
+
+
+    def remove(self):
+        try:
+            self.state_file.unlink()
+        except FileNotFoundError:
+            pass
+
+
+    def partList(self):
+        # returns [(part_number, offset, length)]
+        part_list = list()
+
+        offset = 0
+        part_number = 1
+        while offset < self.size:
+            length = min(self.part_size, self.size - offset)
+            part_list.append((part_number, offset, length))
+
+            offset += length
+            part_number += 1
+
+
+        return part_list
+
+
+    def pendingParts(self):
+        return [p for p in self.partList() if p[0] not in self.parts]
+
+
+    def completedParts(self):
+        return [{'PartNumber' : n, 'ETag' : self.parts[n]} for n in sorted(self.parts.keys())]
+
+
+    def readPart(self, offset, length):
+        with io.open(str(self.local_file_p), 'rb') as f_localfile:
+            f_localfile.seek(offset)
+            return f_localfile.read(length)
+
+
+
+class Boto3MultipartUpload(object):
+    """Parallel, resumable multipart upload with a boto3 S3 client"""
+
+    def __init__(self, client, state, concurrency=4):
+        self.client = client
+        self.state = state
+        self.concurrency = concurrency
+
+
+    def upload(self, bucket, key, extra_args):
+        import botocore.exceptions
+
+        # uploads which cannot be resumed still hold the uploaded parts
+        MultipartState.expireStateFiles(self.state.state_dir, abort_upload=self.abort)
+        self.abortStale()
+
+
+        if self.state.load():
+            try:
+                self._verifyParts(bucket, key)
+                logger.info('Resuming multipart upload with %d of %d parts completed', len(self.state.parts), len(self.state.partList()))
+            except botocore.exceptions.ClientError as e:
+                if e.response.get('Error', {}).get('Code') != 'NoSuchUpload':
+                    raise
+
+                logger.warning('Multipart upload %s no longer exists, restarting', self.state.upload_id)
+                self.state.reset()
+
+
+        if not self.state.upload_id:
+            r = self.client.create_multipart_upload(
+                Bucket=bucket,
+                Key=key,
+                **extra_args,
+            )
+
+            self.state.start(r['UploadId'])
+
+
+        pending_parts = self.state.pendingParts()
+        logger.info('Uploading %d parts of %d bytes (%d threads)', len(pending_parts), self.state.part_size, self.concurrency)
+
+
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+        try:
+            future_list = list()
+            for part_number, offset, length in pending_parts:
+                future_list.append(executor.submit(self._uploadPart, bucket, key, part_number, offset, length))
+
+            for future in as_completed(future_list):
+                future.result()  # raises the first failure
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+        self.client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=self.state.upload_id,
+            MultipartUpload={'Parts' : self.state.completedParts()},
+        )
+
+        self.state.remove()
+
+
+    def abort(self, bucket, key, upload_id):
+        import botocore.exceptions
+
+        logger.warning('Aborting multipart upload %s', upload_id)
+
+        try:
+            self.client.abort_multipart_upload(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+            )
+        except botocore.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'NoSuchUpload':
+                raise
+
+
+    def abortStale(self):
+        import botocore.exceptions
+
+        for state_file_p, state in self.state.staleStates():
+            try:
+                self.abort(state['bucket'], state['key'], state['upload_id'])
+            except botocore.exceptions.ClientError as e:
+                # retried with the next upload, the state is removed when expired
+                logger.error('Unable to abort multipart upload %s: %s', state['upload_id'], str(e))
+                continue
+
+            state_file_p.unlink(missing_ok=True)
+
+
+    def _uploadPart(self, bucket, key, part_number, offset, length):
+        r = self.client.upload_part(
+            Bucket=bucket,
+            Key=key,
+            UploadId=self.state.upload_id,
+            PartNumber=part_number,
+            Body=self.state.readPart(offset, length),
+        )
+
+        self.state.addPart(part_number, r['ETag'])
+
+
+    def _verifyParts(self, bucket, key):
+        # the server is authoritative, a part may have completed after the last save
+        part_length_dict = {p[0]: p[2] for p in self.state.partList()}
+
+        server_parts = dict()
+
+        list_kwargs = {
+            'Bucket'   : bucket,
+            'Key'      : key,
+            'UploadId' : self.state.upload_id,
+        }
+
+        while True:
+            r = self.client.list_parts(**list_kwargs)
+
+            for part in r.get('Parts', []):
+                if part_length_dict.get(part['PartNumber']) == part['Size']:
+                    server_parts[part['PartNumber']] = part['ETag']
+
+            if not r.get('IsTruncated'):
+                break
+
+            list_kwargs['PartNumberMarker'] = r['NextPartNumberMarker']
+
+
+        self.state.parts = server_parts
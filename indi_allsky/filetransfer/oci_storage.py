@@ -1,7 +1,8 @@
 from .generic import GenericFileTransfer
 #from .exceptions import AuthenticationFailure
 from .exceptions import ConnectionFailure
-#from .exceptions import TransferFailure
+from .exceptions import TransferFailure
+from .multipart import MultipartState
 
 #import os
 import io
@@ -58,6 +59,8 @@ class oci_storage(GenericFileTransfer):
     def put(self, *args, **kwargs):
         super(oci_storage, self).put(*args, **kwargs)
 
+        import oci
+
         local_file = kwargs['local_file']
         bucket = kwargs['bucket']
         key = kwargs['key']
@@ -98,17 +101,24 @@ class oci_storage(GenericFileTransfer):
         #    upload_kwargs['predefined_acl'] = acl  # all assets are normally publicly readable
 
 
+        multipart_settings = MultipartState.settings(self.config)
+        local_file_size = local_file_p.stat().st_size
+
+
         start = time.time()
 
         try:
-            with io.open(str(local_file_p), 'rb') as f_localfile:
-                self.client.put_object(
-                    namespace,
-                    bucket,
-                    str(key),
-                    f_localfile,
-                    **upload_kwargs,
-                )
+            if local_file_size >= multipart_settings['threshold']:
+                self._multipart_upload(local_file_p, namespace, bucket, str(key), multipart_settings, upload_kwargs)
+            else:
+                with io.open(str(local_file_p), 'rb') as f_localfile:
+                    self.client.put_object(
+                        namespace,
+                        bucket,
+                        str(key),
+                        f_localfile,
+                        **upload_kwargs,
+                    )
         except socket.gaierror as e:
             raise ConnectionFailure(str(e)) from e
         except socket.timeout as e:
@@ -121,12 +131,90 @@ class oci_storage(GenericFileTransfer):
             raise ConnectionFailure(str(e)) from e
         except requests.exceptions.ReadTimeout as e:
             raise ConnectionFailure(str(e)) from e
+        except oci.exceptions.ServiceError as e:
+            raise TransferFailure(str(e)) from e
 
         upload_elapsed_s = time.time() - start
-        local_file_size = local_file_p.stat().st_size
         logger.info('File transferred in %0.4f s (%0.2f kB/s)', upload_elapsed_s, local_file_size / upload_elapsed_s / 1024)
 
 
+    def _multipart_upload(self, local_file_p, namespace, bucket, key, multipart_settings, upload_kwargs):
+        import oci
+        from oci.object_storage import MultipartObjectAssembler
+
+
+        def abort_upload(abort_bucket, abort_key, upload_id):
+            logger.warning('Aborting multipart upload %s', upload_id)
+
+            try:
+                self.client.abort_multipart_upload(namespace, abort_bucket, abort_key, upload_id)
+            except oci.exceptions.ServiceError as e:
+                if e.status != 404:
+                    raise
+
+
+        # only the upload id is stored, completed parts are listed from the server on resume
+        MultipartState.expireStateFiles(multipart_settings['state_dir'], abort_upload=abort_upload)
+
+        multipart_state = MultipartState(
+            multipart_settings['state_dir'],
+            local_file_p,
+            bucket,
+            key,
+            multipart_settings['part_size'],
+        )
+
+
+        # uploads which cannot be resumed still hold the uploaded parts
+        for state_file_p, state in multipart_state.staleStates():
+            try:
+                abort_upload(state['bucket'], state['key'], state['upload_id'])
+            except oci.exceptions.ServiceError as e:
+                logger.error('Unable to abort multipart upload %s: %s', state['upload_id'], str(e))
+                continue
+
+            state_file_p.unlink(missing_ok=True)
+
+
+        assembler = MultipartObjectAssembler(
+            self.client,
+            namespace,
+            bucket,
+            key,
+            part_size=multipart_state.part_size,
+            allow_parallel_uploads=True,
+            parallel_process_count=multipart_settings['concurrency'],
+            **upload_kwargs,
+        )
+        assembler.add_parts_from_file(str(local_file_p))
+
+
+        resumed = False
+        if multipart_state.load():
+            try:
+                logger.info('Resuming multipart upload %s', multipart_state.upload_id)
+                assembler.resume(upload_id=multipart_state.upload_id)
+                resumed = True
+            except oci.exceptions.ServiceError as e:
+                if e.status != 404:
+                    raise
+
+                logger.warning('Multipart upload %s no longer exists, restarting', multipart_state.upload_id)
+                assembler.manifest['uploadId'] = None
+
+
+        if not resumed:
+            assembler.new_upload()
+            multipart_state.start(assembler.manifest['uploadId'])
+
+            assembler.upload()
+
+
+        assembler.commit()
+
+        multipart_state.remove()
+
+
     def delete(self, *args, **kwargs):
         super(oci_storage, self).delete(*args, **kwargs)
 
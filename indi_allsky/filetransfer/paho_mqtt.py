@@ -8,6 +8,7 @@ import ssl
 import io
 import socket
 import time
+import threading
 import logging
 
 logger = logging.getLogger('indi_allsky')
@@ -17,17 +18,19 @@ class paho_mqtt(GenericFileTransfer):
     def __init__(self, *args, **kwargs):
         super(paho_mqtt, self).__init__(*args, **kwargs)
 
+        self.client = None
         self._port = 1883
 
-        self.mq_transport = None
-        self.mq_hostname = None
-        self.mq_auth = None
-        self.mq_tls = None
+        self._connect_event = threading.Event()
+        self._connect_reason = None
 
 
     def connect(self, *args, **kwargs):
         super(paho_mqtt, self).connect(*args, **kwargs)
 
+        import paho.mqtt.client as mqtt
+        import paho.mqtt.enums
+
         transport = kwargs['transport']
         protocol = kwargs['protocol']
         hostname = kwargs['hostname']
@@ -37,42 +40,79 @@ class paho_mqtt(GenericFileTransfer):
         cert_bypass = kwargs.get('cert_bypass')
 
 
-        self.mq_transport = transport
-        self.mq_protocol = protocol
-        self.mq_hostname = hostname
+        # the client stays connected between transfers
+        self.client = mqtt.Client(
+            callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+            client_id='',
+            transport=transport,
+            protocol=getattr(paho.mqtt.enums.MQTTProtocolVersion, protocol),
+        )
 
+        self.client.connect_timeout = self.connect_timeout
+        self.client.on_connect = self._on_connect
 
-        if tls:
-            self.mq_tls = {
-                'ca_certs'    : '/etc/ssl/certs/ca-certificates.crt',
-                'cert_reqs'   : ssl.CERT_REQUIRED,
-                'insecure'    : False,
-            }
 
+        if tls:
             if cert_bypass:
-                self.mq_tls['cert_reqs'] = ssl.CERT_NONE
-                self.mq_tls['insecure'] = True
-
+                self.client.tls_set(ca_certs='/etc/ssl/certs/ca-certificates.crt', cert_reqs=ssl.CERT_NONE)
+                self.client.tls_insecure_set(True)
+            else:
+                self.client.tls_set(ca_certs='/etc/ssl/certs/ca-certificates.crt', cert_reqs=ssl.CERT_REQUIRED)
 
 
         if username:
-            self.mq_auth = {
-                'username' : username,
-                'password' : password,
-            }
+            self.client.username_pw_set(username, password=password)
+
+
+        self._connect_event.clear()
+        self._connect_reason = None
+
+        try:
+            self.client.connect(hostname, port=self._port, keepalive=60)
+        except socket.gaierror as e:
+            raise ConnectionFailure(str(e)) from e
+        except socket.timeout as e:
+            raise ConnectionFailure(str(e)) from e
+        except ssl.SSLCertVerificationError as e:
+            raise ConnectionFailure(str(e)) from e
+        except ConnectionRefusedError as e:
+            raise ConnectionFailure(str(e)) from e
+        except OSError as e:
+            raise ConnectionFailure(str(e)) from e
+
+
+        self.client.loop_start()
+
+
+        if not self._connect_event.wait(timeout=self.connect_timeout):
+            raise ConnectionFailure('MQTT connection timed out')
+
+        if self._connect_reason.is_failure:
+            raise AuthenticationFailure(str(self._connect_reason))
+
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        self._connect_reason = reason_code
+        self._connect_event.set()
 
 
     def close(self):
         super(paho_mqtt, self).close()
 
+        if self.client:
+            self.client.disconnect()
+            self.client.loop_stop()
 
-    def put(self, *args, **kwargs):
-        super(paho_mqtt, self).put(*args, **kwargs)
 
-        import paho.mqtt.publish as publish
-        import paho.mqtt.enums
-        from paho.mqtt import MQTTException
+    def isConnected(self):
+        if not self.client:
+            return False
 
+        return self.client.is_connected()
+
+
+    def put(self, *args, **kwargs):
+        super(paho_mqtt, self).put(*args, **kwargs)
 
         local_file = kwargs['local_file']
         base_topic = kwargs['base_topic']
@@ -114,29 +154,18 @@ class paho_mqtt(GenericFileTransfer):
         start = time.time()
 
         try:
-            publish.multiple(
-                message_list,
-                transport=self.mq_transport,
-                hostname=self.mq_hostname,
-                port=self._port,
-                client_id='',
-                keepalive=60,
-                auth=self.mq_auth,
-                tls=self.mq_tls,
-                protocol=getattr(paho.mqtt.enums.MQTTProtocolVersion, self.mq_protocol),
-            )
-        except socket.gaierror as e:
-            raise ConnectionFailure(str(e)) from e
-        except socket.timeout as e:
-            raise ConnectionFailure(str(e)) from e
-        except ssl.SSLCertVerificationError as e:
-            raise ConnectionFailure(str(e)) from e
-        except ConnectionRefusedError as e:
-            raise ConnectionFailure(str(e)) from e
-        except OSError as e:
+            message_info_list = list()
+            for message in message_list:
+                message_info_list.append(self.client.publish(**message))
+
+            for message_info in message_info_list:
+                message_info.wait_for_publish(timeout=self.timeout)
+
+                if not message_info.is_published():
+                    raise ConnectionFailure('MQTT publish timed out')
+        except RuntimeError as e:
+            # not connected
             raise ConnectionFailure(str(e)) from e
-        except MQTTException as e:
-            raise AuthenticationFailure(str(e)) from e
         except ValueError as e:
             raise TransferFailure(str(e)) from e
 
@@ -144,4 +173,3 @@ class paho_mqtt(GenericFileTransfer):
         local_file_size = local_file_p.stat().st_size
         logger.info('File transferred in %0.4f s (%0.2f kB/s)', upload_elapsed_s, local_file_size / upload_elapsed_s / 1024)
 
-
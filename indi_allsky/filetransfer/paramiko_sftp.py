@@ -82,9 +82,22 @@ class paramiko_sftp(GenericFileTransfer):
             self.client.close()
 
 
+    def isConnected(self):
+        if not self.client or not self.sftp:
+            return False
+
+        transport = self.client.get_transport()
+        if not transport:
+            return False
+
+        return transport.is_active()
+
+
     def put(self, *args, **kwargs):
         super(paramiko_sftp, self).put(*args, **kwargs)
 
+        import paramiko
+
         local_file = kwargs['local_file']
         remote_file = kwargs['remote_file']
 
@@ -119,6 +132,12 @@ class paramiko_sftp(GenericFileTransfer):
         except FileNotFoundError as e:
             logger.error('Upload failed.  Paramiko does not support ~ in remote paths')
             raise TransferFailure(str(e)) from e
+        except paramiko.ssh_exception.SSHException as e:
+            raise ConnectionFailure(str(e)) from e
+        except EOFError as e:
+            raise ConnectionFailure(str(e)) from e
+        except socket.timeout as e:
+            raise ConnectionFailure(str(e)) from e
 
         upload_elapsed_s = time.time() - start
         local_file_size = local_file_p.stat().st_size
@@ -57,6 +57,18 @@ class python_ftp(GenericFileTransfer):
             self.client.quit()
 
 
+    def isConnected(self):
+        if not self.client:
+            return False
+
+        try:
+            self.client.voidcmd('NOOP')
+        except ftplib.all_errors:
+            return False
+
+        return True
+
+
     def put(self, *args, **kwargs):
         super(python_ftp, self).put(*args, **kwargs)
 
@@ -94,6 +106,15 @@ class python_ftp(GenericFileTransfer):
                 self.client.storbinary('STOR {0}'.format(str(remote_file_p)), f_localfile, blocksize=262144)
         except ftplib.error_perm as e:
             raise TransferFailure(str(e)) from e
+        except ftplib.error_temp as e:
+            # 421 idle timeout
+            raise ConnectionFailure(str(e)) from e
+        except EOFError as e:
+            raise ConnectionFailure(str(e)) from e
+        except ConnectionError as e:
+            raise ConnectionFailure(str(e)) from e
+        except socket.timeout as e:
+            raise ConnectionFailure(str(e)) from e
 
 
         upload_elapsed_s = time.time() - start
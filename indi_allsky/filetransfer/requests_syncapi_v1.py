@@ -59,7 +59,9 @@ class requests_syncapi_v1(GenericFileTransfer):
         self.url = endpoint_url
 
 
-        self.client = requests
+        # session keeps the connection alive between transfers
+        self.client = requests.Session()
+        self.client.verify = self.verify
 
 
         if cert_bypass:
@@ -70,8 +72,15 @@ class requests_syncapi_v1(GenericFileTransfer):
     def close(self):
         super(requests_syncapi_v1, self).close()
 
+        if self.client:
+            self.client.close()
+
 
     def put(self, *args, **kwargs):
+        if kwargs.get('batch'):
+            return self._putBatch(kwargs['batch'], kwargs['empty_file'])
+
+
         super(requests_syncapi_v1, self).put(*args, **kwargs)
 
         metadata = kwargs['metadata']
@@ -119,6 +128,98 @@ class requests_syncapi_v1(GenericFileTransfer):
         }
 
 
+        start = time.time()
+
+        try:
+            r = self._send(json_metadata, fields)
+        finally:
+            f_metadata.close()
+            f_media.close()
+
+
+        upload_elapsed_s = time.time() - start
+        logger.info('File transferred in %0.4f s (%0.2f kB/s)', upload_elapsed_s, local_file_size / upload_elapsed_s / 1024)
+
+
+        return json.loads(r.text)
+
+
+    def _putBatch(self, batch, empty_file):
+        # batch is a dict with camera_uuid, utc_offset, and a list of (metadata, local_file) items
+        logger.info('Uploading batch of %d files', len(batch['items']))
+
+        f_list = list()
+        media_fields = dict()
+
+        item_metadata_list = list()
+        batch_size = 0
+
+        for i, (metadata, local_file) in enumerate(batch['items']):
+            local_file_p = Path(local_file)
+
+            if not empty_file:
+                local_file_size = local_file_p.stat().st_size
+                f_media = io.open(str(local_file_p), 'rb')
+            else:
+                local_file_size = 0
+                f_media = io.BytesIO(b'')  # no data
+
+            f_list.append(f_media)
+
+
+            item_metadata = dict(metadata)
+            item_metadata['file_size'] = local_file_size  # needed to validate
+            item_metadata['media'] = 'media_{0:d}'.format(i)
+            item_metadata_list.append(item_metadata)
+
+            batch_size += local_file_size
+
+
+            media_fields[item_metadata['media']] = (
+                local_file_p.name,  # need file extension from original file
+                f_media,
+                'application/octet-stream',
+            )
+
+
+        batch_metadata = {
+            'camera_uuid' : batch['camera_uuid'],
+            'utc_offset'  : batch['utc_offset'],
+            'items'       : item_metadata_list,
+        }
+
+        json_metadata = json.dumps(batch_metadata)
+        f_metadata = io.StringIO(json_metadata)
+
+        fields = {
+            'metadata' : (
+                'metadata.json',
+                f_metadata,
+                'application/json',
+            ),
+        }
+        fields.update(media_fields)
+
+
+        start = time.time()
+
+        try:
+            r = self._send(json_metadata, fields)
+        finally:
+            f_metadata.close()
+
+            for f in f_list:
+                f.close()
+
+
+        upload_elapsed_s = time.time() - start
+        logger.info('Batch of %d files transferred in %0.4f s (%0.2f kB/s)', len(item_metadata_list), upload_elapsed_s, batch_size / upload_elapsed_s / 1024)
+
+
+        return json.loads(r.text)
+
+
+    def _send(self, json_metadata, fields):
         mp_enc = MultipartEncoder(fields=fields)
 
 
@@ -136,13 +237,10 @@ class requests_syncapi_v1(GenericFileTransfer):
 
         headers = {
             'Authorization' : 'Bearer {0:s}:{1:s}'.format(self.username, message_hmac),
-            'Connection'    : 'close',  # no need for keep alives
             'Content-Type'  : mp_enc.content_type,
         }
 
 
-        start = time.time()
-
         try:
             # put allows overwrites
             r = self.client.put(
@@ -166,18 +264,11 @@ class requests_syncapi_v1(GenericFileTransfer):
             raise CertificateValidationFailure(str(e)) from e
         except requests.exceptions.SSLError as e:
             raise CertificateValidationFailure(str(e)) from e
-        finally:
-            f_metadata.close()
-            f_media.close()
 
 
         if r.status_code >= 400:
             raise TransferFailure('Sync error: {0:d}'.format(r.status_code))
 
 
-        upload_elapsed_s = time.time() - start
-        logger.info('File transferred in %0.4f s (%0.2f kB/s)', upload_elapsed_s, local_file_size / upload_elapsed_s / 1024)
-
-
-        return json.loads(r.text)
+        return r
 
@@ -25,6 +25,10 @@ MAX_RETRIES = 3
 
 
 class youtube_oauth2(GenericFileTransfer):
+
+    reusable = False  # credentials are loaded for every upload
+
+
     def __init__(self, *args, **kwargs):
         super(youtube_oauth2, self).__init__(*args, **kwargs)
 
@@ -0,0 +1,214 @@
+import os
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+from flask import current_app as app  # prevent circular import
+from . import db
+
+from .models import IndiAllSkyDbThumbnailTable
+
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyAssetExpire(object):
+    """Bulk deletion of asset files and database entries
+
+    Entries are selected in chunks of (id, filename, thumbnail_uuid) tuples,
+    the files are unlinked in a thread pool, then the entries and their
+    thumbnails are removed with a single DELETE per table and chunk.
+    """
+
+    def __init__(self, chunk_size=500, unlink_threads=4):
+        self._chunk_size = int(chunk_size)
+        self._unlink_threads = max(int(unlink_threads), 1)
+
+        self._image_folder_p = None
+
+        self._shutdown = False
+
+
+    @property
+    def chunk_size(self):
+        return self._chunk_size
+
+    @property
+    def unlink_threads(self):
+        return self._unlink_threads
+
+
+    def shutdown(self):
+        # stop after the current chunk is finished
+        self._shutdown = True
+
+
+    def deleteQuery(self, table, query):
+        # query is any query against table, the ordering is replaced with the primary key
+        delete_count = 0
+        last_id = 0
+
+        with ThreadPoolExecutor(max_workers=self._unlink_threads, thread_name_prefix='asset_expire') as executor:
+            while not self._shutdown:
+                chunk = query\
+                    .with_entities(table.id, table.filename, table.thumbnail_uuid)\
+                    .filter(table.id > last_id)\
+                    .order_by(None)\
+                    .order_by(table.id.asc())\
+                    .limit(self._chunk_size)\
+                    .all()
+
+                if not chunk:
+                    break
+
+                last_id = chunk[-1].id
+
+                delete_count += self._deleteChunk(executor, table, chunk)
+
+
+        return delete_count
+
+
+    def deleteAssets(self, table, entry_id_list):
+        entry_id_list = list(entry_id_list)
+
+        delete_count = 0
+
+        with ThreadPoolExecutor(max_workers=self._unlink_threads, thread_name_prefix='asset_expire') as executor:
+            for i in range(0, len(entry_id_list), self._chunk_size):
+                if self._shutdown:
+                    break
+
+                chunk = table.query\
+                    .with_entities(table.id, table.filename, table.thumbnail_uuid)\
+                    .filter(table.id.in_(entry_id_list[i:i + self._chunk_size]))\
+                    .all()
+
+                delete_count += self._deleteChunk(executor, table, chunk)
+
+
+        return delete_count
+
+
+    def removeEmptyFolders(self, folder):
+        # single bottom-up walk, folders that only contain empty folders are also removed
+        remove_count, _ = self._sweepFolder(folder)
+        return remove_count
+
+
+    def _deleteChunk(self, executor, table, chunk):
+        thumbnail_uuid_list = [row.thumbnail_uuid for row in chunk if row.thumbnail_uuid]
+
+        if thumbnail_uuid_list:
+            thumbnail_rows = IndiAllSkyDbThumbnailTable.query\
+                .with_entities(IndiAllSkyDbThumbnailTable.id, IndiAllSkyDbThumbnailTable.uuid, IndiAllSkyDbThumbnailTable.filename)\
+                .filter(IndiAllSkyDbThumbnailTable.uuid.in_(thumbnail_uuid_list))\
+                .all()
+        else:
+            thumbnail_rows = list()
+
+
+        thumbnail_map = {row.uuid: row for row in thumbnail_rows}
+
+
+        path_list = [self._filesystemPath(row.filename) for row in chunk]
+        path_list.extend([self._filesystemPath(row.filename) for row in thumbnail_rows])
+
+        failed_set = set(p for p, ok in zip(path_list, executor.map(self._unlink, path_list)) if not ok)
+
+
+        entry_id_list = list()
+        thumbnail_id_list = list()
+        for row in chunk:
+            if self._filesystemPath(row.filename) in failed_set:
+                continue
+
+            thumbnail_row = thumbnail_map.get(row.thumbnail_uuid)
+            if thumbnail_row:
+                if self._filesystemPath(thumbnail_row.filename) in failed_set:
+                    continue
+
+                thumbnail_id_list.append(thumbnail_row.id)
+
+            entry_id_list.append(row.id)
+
+
+        if thumbnail_id_list:
+            IndiAllSkyDbThumbnailTable.query\
+                .filter(IndiAllSkyDbThumbnailTable.id.in_(thumbnail_id_list))\
+                .delete(synchronize_session=False)
+
+        if entry_id_list:
+            table.query\
+                .filter(table.id.in_(entry_id_list))\
+                .delete(synchronize_session=False)
+
+        db.session.commit()
+
+
+        logger.info('Removed %d %s entries (%d thumbnails)', len(entry_id_list), table.__name__, len(thumbnail_id_list))
+
+        return len(entry_id_list)
+
+
+    def _filesystemPath(self, filename):
+        if filename.startswith('/'):
+            # filename is already fully qualified
+            return Path(filename)
+
+        if isinstance(self._image_folder_p, type(None)):
+            self._image_folder_p = Path(app.config['INDI_ALLSKY_IMAGE_FOLDER'])
+
+        return self._image_folder_p.joinpath(filename)
+
+
+    def _unlink(self, filename_p):
+        try:
+            filename_p.unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error('Cannot remove file: %s', str(e))
+            return False
+
+        return True
+
+
+    def _sweepFolder(self, folder):
+        # returns the number of folders removed and whether the folder is now empty
+        remove_count = 0
+        empty = True
+
+        try:
+            with os.scandir(folder) as it:
+                entries = list(it)
+        except OSError as e:
+            logger.error('Cannot read folder: %s', str(e))
+            return remove_count, False
+
+
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False):
+                empty = False
+                continue
+
+
+            sub_remove_count, sub_empty = self._sweepFolder(entry.path)
+            remove_count += sub_remove_count
+
+            if not sub_empty:
+                empty = False
+                continue
+
+
+            logger.info('Removing empty directory: %s', entry.path)
+
+            try:
+                os.rmdir(entry.path)
+                remove_count += 1
+            except OSError as e:
+                logger.error('Cannot remove folder: %s', str(e))
+                empty = False
+
+
+        return remove_count, empty
@@ -57,7 +57,7 @@ class BaseView(View):
         from ..config import IndiAllSkyConfig  # prevent circular import
 
         # not catching exception
-        self._indi_allsky_config_obj = IndiAllSkyConfig()
+        self._indi_allsky_config_obj = IndiAllSkyConfig(cached=True)
 
         self.indi_allsky_config = self._indi_allsky_config_obj.config
         self.indi_allsky_config_id = self._indi_allsky_config_obj.config_id
@@ -3,6 +3,8 @@ from datetime import timedelta
 from pathlib import Path
 import uuid
 import io
+import json
+import time
 import logging
 #from pprint import pformat
 
@@ -27,7 +29,6 @@ from .models import IndiAllSkyDbRawImageTable
 from .models import IndiAllSkyDbPanoramaImageTable
 from .models import IndiAllSkyDbPanoramaVideoTable
 from .models import IndiAllSkyDbThumbnailTable
-from .models import IndiAllSkyDbLongTermKeogramTable
 from .models import IndiAllSkyDbNotificationTable
 from .models import IndiAllSkyDbStateTable
 
@@ -35,17 +36,28 @@ from .models import IndiAllSkyDbStateTable
 
 from sqlalchemy import or_
 from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.sql.expression import false as sa_false
 
 from .. import constants
+from ..rollingWindow import IndiAllSkyImageStats
+from ..longTermKeogramStore import LongTermKeogramStore
 #from ..exceptions import BadImage
 
 logger = logging.getLogger('indi_allsky')
 
 
 class miscDb(object):
+
+    image_stats_window_minutes = 30
+    image_stats_state_tmpl = 'IMAGE_STATS_CCD{0:d}'
+
+
     def __init__(self, config):
         self.config = config
 
+        self._image_stats = dict()  # camera_id: IndiAllSkyImageStats
+        self._longterm_keogram_store = None
+
 
         if self.config.get('IMAGE_FOLDER'):
             self.image_dir = Path(self.config['IMAGE_FOLDER']).absolute()
@@ -205,7 +217,7 @@ class miscDb(object):
         return camera
 
 
-    def addImage(self, filename, camera_id, metadata):
+    def addImage(self, filename, camera_id, metadata, commit=True):
 
         ### expected metadata
         #{
@@ -298,8 +310,33 @@ class miscDb(object):
         )
 
         db.session.add(image)
+
+        if not commit:
+            # the caller commits the transaction and calls imageAdded()
+            db.session.flush()
+            return image
+
+
+        if not image.exclude:
+            # the statistics are stored in the same transaction as the image
+            self._updateImageStats(image, commit=False)
+
         db.session.commit()
 
+        self._imageEvents(image)
+
+        return image
+
+
+    def imageAdded(self, image, commit=True):
+        # statistics and events for a committed image
+        if not image.exclude:
+            self._updateImageStats(image, commit=commit)
+
+        self._imageEvents(image)
+
+
+    def _imageEvents(self, image):
         try:
             from ..events import event_manager
             from ..sensors_mapping import get_latest_sensors_payload
@@ -322,7 +359,59 @@ class miscDb(object):
         except Exception as ev_err:
             logger.error('Error broadcasting exposure events: %s', ev_err)
 
-        return image
+
+    def getImageStats(self, camera_id):
+        # the rolling statistics are warmed from the database on first use
+        image_stats = self._image_stats.get(camera_id)
+        if image_stats:
+            return image_stats
+
+
+        image_stats = IndiAllSkyImageStats(self.image_stats_window_minutes * 60)
+
+        now_minus_minutes = datetime.now() - timedelta(minutes=self.image_stats_window_minutes)
+
+        image_rows = IndiAllSkyDbImageTable.query\
+            .with_entities(
+                IndiAllSkyDbImageTable.createDate,
+                IndiAllSkyDbImageTable.sqm,
+                IndiAllSkyDbImageTable.stars,
+                IndiAllSkyDbImageTable.data,
+            )\
+            .filter(IndiAllSkyDbImageTable.camera_id == camera_id)\
+            .filter(IndiAllSkyDbImageTable.exclude == sa_false())\
+            .filter(IndiAllSkyDbImageTable.createDate > now_minus_minutes)\
+            .order_by(IndiAllSkyDbImageTable.createDate.asc())
+
+
+        for row in image_rows:
+            image_stats.add(row.createDate.timestamp(), row.sqm, row.stars, row.data)
+
+
+        self._image_stats[camera_id] = image_stats
+
+        return image_stats
+
+
+    def _updateImageStats(self, image, commit=True):
+        if image.camera_id in self._image_stats:
+            self._image_stats[image.camera_id].add(image.createDate.timestamp(), image.sqm, image.stars, image.data)
+            image_stats = self._image_stats[image.camera_id]
+        else:
+            # new entry is included in the warm up query
+            image_stats = self.getImageStats(image.camera_id)
+
+
+        # shared with the web interface
+        summary = image_stats.summary(time.time())
+
+        try:
+            self.setState(self.image_stats_state_tmpl.format(image.camera_id), json.dumps(summary), commit=commit)
+        except Exception as e:
+            logger.error('Unable to store image statistics: %s', str(e))
+
+            if commit:
+                db.session.rollback()
 
 
     def addDarkFrame(self, filename, camera_id, metadata):
@@ -388,6 +477,8 @@ class miscDb(object):
         db.session.add(dark)
         db.session.commit()
 
+        self.updateCalibrationGeneration()
+
         return dark
 
 
@@ -454,10 +545,12 @@ class miscDb(object):
         db.session.add(bpm)
         db.session.commit()
 
+        self.updateCalibrationGeneration()
+
         return bpm
 
 
-    def addVideo(self, filename, camera_id, metadata):
+    def addVideo(self, filename, camera_id, metadata, commit=True):
 
         ### expected metadata
         #{
@@ -512,12 +605,17 @@ class miscDb(object):
         )
 
         db.session.add(video)
-        db.session.commit()
+
+        if commit:
+            db.session.commit()
+        else:
+            # the caller commits the transaction
+            db.session.flush()
 
         return video
 
 
-    def addMiniVideo(self, filename, camera_id, metadata):
+    def addMiniVideo(self, filename, camera_id, metadata, commit=True):
 
         ### expected metadata
         #{
@@ -597,12 +695,17 @@ class miscDb(object):
         )
 
         db.session.add(mini_video)
-        db.session.commit()
+
+        if commit:
+            db.session.commit()
+        else:
+            # the caller commits the transaction
+            db.session.flush()
 
         return mini_video
 
 
-    def addPanoramaVideo(self, filename, camera_id, metadata):
+    def addPanoramaVideo(self, filename, camera_id, metadata, commit=True):
 
         ### expected metadata
         #{
@@ -654,12 +757,17 @@ class miscDb(object):
         )
 
         db.session.add(panorama_video)
-        db.session.commit()
+
+        if commit:
+            db.session.commit()
+        else:
+            # the caller commits the transaction
+            db.session.flush()
 
         return panorama_video
 
 
-    def addKeogram(self, filename, camera_id, metadata):
+    def addKeogram(self, filename, camera_id, metadata, commit=True):
 
         ### expected metadata
         #{
@@ -710,7 +818,12 @@ class miscDb(object):
         )
 
         db.session.add(keogram)
-        db.session.commit()
+
+        if commit:
+            db.session.commit()
+        else:
+            # the caller commits the transaction
+            db.session.flush()
 
         try:
             from ..events import event_manager
@@ -729,7 +842,7 @@ class miscDb(object):
         return keogram
 
 
-    def addStarTrail(self, filename, camera_id, metadata):
+    def addStarTrail(self, filename, camera_id, metadata, commit=True):
 
         ### expected metadata
         #{
@@ -781,7 +894,12 @@ class miscDb(object):
         )
 
         db.session.add(startrail)
-        db.session.commit()
+
+        if commit:
+            db.session.commit()
+        else:
+            # the caller commits the transaction
+            db.session.flush()
 
         try:
             from ..events import event_manager
@@ -800,7 +918,7 @@ class miscDb(object):
         return startrail
 
 
-    def addStarTrailVideo(self, filename, camera_id, metadata):
+    def addStarTrailVideo(self, filename, camera_id, metadata, commit=True):
 
         ### expected metadata
         #{
@@ -852,12 +970,17 @@ class miscDb(object):
         )
 
         db.session.add(startrail_video)
-        db.session.commit()
+
+        if commit:
+            db.session.commit()
+        else:
+            # the caller commits the transaction
+            db.session.flush()
 
         return startrail_video
 
 
-    def addFitsImage(self, filename, camera_id, metadata):
+    def addFitsImage(self, filename, camera_id, metadata, commit=True):
 
         ### expected metadata
         #{
@@ -916,12 +1039,17 @@ class miscDb(object):
         )
 
         db.session.add(fits_image)
-        db.session.commit()
+
+        if commit:
+            db.session.commit()
+        else:
+            # the caller commits the transaction
+            db.session.flush()
 
         return fits_image
 
 
-    def addRawImage(self, filename, camera_id, metadata):
+    def addRawImage(self, filename, camera_id, metadata, commit=True):
 
         ### expected metadata
         #{
@@ -980,12 +1108,17 @@ class miscDb(object):
         )
 
         db.session.add(raw_image)
-        db.session.commit()
+
+        if commit:
+            db.session.commit()
+        else:
+            # the caller commits the transaction
+            db.session.flush()
 
         return raw_image
 
 
-    def addPanoramaImage(self, filename, camera_id, metadata):
+    def addPanoramaImage(self, filename, camera_id, metadata, commit=True):
 
         ### expected metadata
         #{
@@ -1045,7 +1178,12 @@ class miscDb(object):
         )
 
         db.session.add(panorama_image)
-        db.session.commit()
+
+        if commit:
+            db.session.commit()
+        else:
+            # the caller commits the transaction
+            db.session.flush()
 
         return panorama_image
 
@@ -1098,7 +1236,7 @@ class miscDb(object):
         return new_notice
 
 
-    def setState(self, key, value, encrypted=False):
+    def setState(self, key, value, encrypted=False, commit=True):
         now = datetime.now()
 
         # all keys must be upper-case
@@ -1132,7 +1270,13 @@ class miscDb(object):
             db.session.add(state)
 
 
-        db.session.commit()
+        if commit:
+            db.session.commit()
+
+
+    def updateCalibrationGeneration(self):
+        # signals image processors to drop cached master darks
+        self.setState('CALIBRATION_GENERATION', uuid.uuid4())
 
 
     def setEncryptedState(self, key, value):
@@ -1396,7 +1540,7 @@ class miscDb(object):
     #    return self.addThumbnail(*args, **kwargs)
 
 
-    def addThumbnail_remote(self, filename, camera_id, thumbnail_metadata):
+    def addThumbnail_remote(self, filename, camera_id, thumbnail_metadata, commit=True):
 
         ### expected metadata
         #{
@@ -1438,7 +1582,12 @@ class miscDb(object):
         )
 
         db.session.add(thumbnail_entry)
-        db.session.commit()
+
+        if commit:
+            db.session.commit()
+        else:
+            # the caller commits the transaction
+            db.session.flush()
 
         return thumbnail_entry
 
@@ -1453,37 +1602,14 @@ class miscDb(object):
             ts = exp_date.timestamp()
 
 
-        # data is probably numpy types
-        r1, g1, b1 = rgb_pixel_list[0]
-        r2, g2, b2 = rgb_pixel_list[1]
-        r3, g3, b3 = rgb_pixel_list[2]
-        r4, g4, b4 = rgb_pixel_list[3]
-        r5, g5, b5 = rgb_pixel_list[4]
+        if isinstance(self._longterm_keogram_store, type(None)):
+            self._longterm_keogram_store = LongTermKeogramStore(self.config)
 
-        #logger.info('r1: %s, g1: %s, b1: %s', type(r1), type(g1), type(b1))
-        #logger.info('r1: %d, g1: %d, b1: %d', r1, g1, b1)
 
-        keogram_entry = IndiAllSkyDbLongTermKeogramTable(
-            ts=int(ts),
-            camera_id=camera_id,
-            r1=int(r1),  # 1
-            g1=int(g1),
-            b1=int(b1),
-            r2=int(r2),  # 2
-            g2=int(g2),
-            b2=int(b2),
-            r3=int(r3),  # 3
-            g3=int(g3),
-            b3=int(b3),
-            r4=int(r4),  # 4
-            g4=int(g4),
-            b4=int(b4),
-            r5=int(r5),  # 5
-            g5=int(g5),
-            b5=int(b5),
-        )
-        db.session.add(keogram_entry)
-        db.session.commit()
+        # data is probably numpy types
+        bgr_pixel_list = [[int(b), int(g), int(r)] for r, g, b in rgb_pixel_list[:LongTermKeogramStore.pixels]]
+
+        self._longterm_keogram_store.add(camera_id, int(ts), bgr_pixel_list)
 
-        return keogram_entry
+        return bgr_pixel_list
 
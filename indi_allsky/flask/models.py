@@ -314,6 +314,15 @@ class IndiAllSkyDbImageTable(IndiAllSkyDbFileBase):
         s3_key,
     )
 
+    db.Index(
+        'idx_image_cdnec_ix',
+        camera_id,
+        dayDate,
+        night,
+        exclude,
+        createDate,
+    )
+
     def __repr__(self):
         return '<Image {0:s}>'.format(self.filename)
 
@@ -462,6 +471,14 @@ class IndiAllSkyDbVideoTable(IndiAllSkyDbFileBase):
     )
 
 
+    db.Index(
+        'idx_video_cdnc_ix',
+        camera_id,
+        dayDate,
+        night,
+        createDate,
+    )
+
     def __repr__(self):
         return '<Video {0:s}>'.format(self.filename)
 
@@ -506,6 +523,14 @@ class IndiAllSkyDbMiniVideoTable(IndiAllSkyDbFileBase):
     )
 
 
+    db.Index(
+        'idx_minivideo_cdnc_ix',
+        camera_id,
+        dayDate,
+        night,
+        createDate,
+    )
+
     def __repr__(self):
         return '<Mini Video {0:s}>'.format(self.filename)
 
@@ -532,6 +557,14 @@ class IndiAllSkyDbKeogramTable(IndiAllSkyDbFileBase):
     camera_id = db.Column(db.Integer, db.ForeignKey('camera.id'), nullable=False)
     camera = db.relationship('IndiAllSkyDbCameraTable', back_populates='keograms')
 
+    db.Index(
+        'idx_keogram_cdnc_ix',
+        camera_id,
+        dayDate,
+        night,
+        createDate,
+    )
+
     def __repr__(self):
         return '<Keogram {0:s}>'.format(self.filename)
 
@@ -568,6 +601,14 @@ class IndiAllSkyDbStarTrailsTable(IndiAllSkyDbFileBase):
     camera_id = db.Column(db.Integer, db.ForeignKey('camera.id'), nullable=False)
     camera = db.relationship('IndiAllSkyDbCameraTable', back_populates='startrails')
 
+    db.Index(
+        'idx_startrails_cdnc_ix',
+        camera_id,
+        dayDate,
+        night,
+        createDate,
+    )
+
     def __repr__(self):
         return '<StarTrails {0:s}>'.format(self.filename)
 
@@ -605,6 +646,14 @@ class IndiAllSkyDbStarTrailsVideoTable(IndiAllSkyDbFileBase):
     camera_id = db.Column(db.Integer, db.ForeignKey('camera.id'), nullable=False)
     camera = db.relationship('IndiAllSkyDbCameraTable', back_populates='startrailvideos')
 
+    db.Index(
+        'idx_startrailsvideo_cdnc_ix',
+        camera_id,
+        dayDate,
+        night,
+        createDate,
+    )
+
     def __repr__(self):
         return '<StarTrailVideo {0:s}>'.format(self.filename)
 
@@ -646,6 +695,14 @@ class IndiAllSkyDbFitsImageTable(IndiAllSkyDbFileBase):
     camera_id = db.Column(db.Integer, db.ForeignKey('camera.id'), nullable=False)
     camera = db.relationship('IndiAllSkyDbCameraTable', back_populates='fitsimages')
 
+    db.Index(
+        'idx_fitsimage_cdnc_ix',
+        camera_id,
+        dayDate,
+        night,
+        createDate,
+    )
+
     def __repr__(self):
         return '<FitsImage {0:s}>'.format(self.filename)
 
@@ -689,6 +746,14 @@ class IndiAllSkyDbRawImageTable(IndiAllSkyDbFileBase):
     camera_id = db.Column(db.Integer, db.ForeignKey('camera.id'), nullable=False)
     camera = db.relationship('IndiAllSkyDbCameraTable', back_populates='rawimages')
 
+    db.Index(
+        'idx_rawimage_cdnc_ix',
+        camera_id,
+        dayDate,
+        night,
+        createDate,
+    )
+
     def __repr__(self):
         return '<RawImage {0:s}>'.format(self.filename)
 
@@ -733,6 +798,15 @@ class IndiAllSkyDbPanoramaImageTable(IndiAllSkyDbFileBase):
     camera_id = db.Column(db.Integer, db.ForeignKey('camera.id'), nullable=False)
     camera = db.relationship('IndiAllSkyDbCameraTable', back_populates='panoramaimages')
 
+    db.Index(
+        'idx_panoramaimage_cdnec_ix',
+        camera_id,
+        dayDate,
+        night,
+        exclude,
+        createDate,
+    )
+
     def __repr__(self):
         return '<PanoramaImage {0:s}>'.format(self.filename)
 
@@ -782,6 +856,14 @@ class IndiAllSkyDbPanoramaVideoTable(IndiAllSkyDbFileBase):
     camera_id = db.Column(db.Integer, db.ForeignKey('camera.id'), nullable=False)
     camera = db.relationship('IndiAllSkyDbCameraTable', back_populates='panoramavideos')
 
+    db.Index(
+        'idx_panoramavideo_cdnc_ix',
+        camera_id,
+        dayDate,
+        night,
+        createDate,
+    )
+
     def __repr__(self):
         return '<PanoramaVideo {0:s}>'.format(self.filename)
 
@@ -69,6 +69,14 @@ class SyncApiBaseView(BaseView):
             self.image_dir = Path(__file__).parent.parent.parent.joinpath('html', 'images').absolute()
 
 
+        # temporary files are on the same filesystem as the images, the files are renamed into place
+        self.tmp_dir = self.image_dir.joinpath('.syncapi_tmp')
+
+
+        # file changes of batch transactions are run by the caller after the commit
+        self.file_operation_list = list()
+
+
     def dispatch_request(self):
         try:
             #time.sleep(10)  # testing
@@ -175,7 +183,7 @@ class SyncApiBaseView(BaseView):
         })
 
 
-    def processPost(self, camera, metadata, tmp_file_p, overwrite=False):
+    def processPost(self, camera, metadata, tmp_file_p, overwrite=False, commit=True):
         # offset createDate to account for difference between local and remote sites
         metadata['createDate'] += (metadata['utc_offset'] - datetime.now().astimezone().utcoffset().total_seconds())
 
@@ -211,10 +219,7 @@ class SyncApiBaseView(BaseView):
                 raise EntryExists('Entry Exists: {0:s}'.format(old_entry.filename))
 
 
-            old_entry.deleteAsset()
-
-            db.session.delete(old_entry)
-            db.session.commit()
+            self._deleteEntry(old_entry, commit)
         except MultipleResultsFound as e:
             # this should never happen
             raise EntryError('Multiple entries for the same dayDate and night') from e
@@ -234,7 +239,7 @@ class SyncApiBaseView(BaseView):
 
         if filename_p.exists():
             app.logger.warning('Removing orphaned file: %s', filename_p)
-            filename_p.unlink()
+            self._fileOperation(commit, self._unlinkFile, filename_p)
 
 
         # do not sync these metadata keys for now
@@ -251,18 +256,11 @@ class SyncApiBaseView(BaseView):
             filename_p,
             camera.id,
             metadata,
+            commit=commit,
         )
 
 
-        tmp_file_size = tmp_file_p.stat().st_size
-        if tmp_file_size != 0:
-            # only copy file if it is not empty
-            # if the empty file option is selected, this can be expected
-            shutil.copy2(str(tmp_file_p), str(filename_p))
-            filename_p.chmod(0o644)
-
-
-        tmp_file_p.unlink()
+        self._fileOperation(commit, self.moveMedia, tmp_file_p, filename_p)
 
         app.logger.info('Uploaded file: %s', filename_p)
 
@@ -318,7 +316,10 @@ class SyncApiBaseView(BaseView):
         media_file_p = Path(media_file.filename)  # need this for the extension
         #app.logger.info('File: %s', media_file_p)
 
-        f_tmp_media = tempfile.NamedTemporaryFile(mode='wb', delete=False, suffix=media_file_p.suffix)
+        if not self.tmp_dir.exists():
+            self.tmp_dir.mkdir(mode=0o755, parents=True)
+
+        f_tmp_media = tempfile.NamedTemporaryFile(mode='wb', delete=False, suffix=media_file_p.suffix, dir=str(self.tmp_dir))
         f_tmp_media.close()
 
         tmp_media_p = Path(f_tmp_media.name)
@@ -328,6 +329,80 @@ class SyncApiBaseView(BaseView):
         return tmp_media_p
 
 
+    def moveMedia(self, tmp_file_p, file_p):
+        tmp_file_size = tmp_file_p.stat().st_size
+        if tmp_file_size == 0:
+            # only move file if it is not empty
+            # if the empty file option is selected, this can be expected
+            tmp_file_p.unlink()
+            return
+
+
+        # rename if the temp file is on the same filesystem
+        shutil.move(str(tmp_file_p), str(file_p))
+        file_p.chmod(0o644)
+
+
+    def _commit(self, commit):
+        if commit:
+            db.session.commit()
+        else:
+            # batch transactions are committed by the caller
+            db.session.flush()
+
+
+    def _fileOperation(self, commit, func, *args):
+        if commit:
+            func(*args)
+        else:
+            # files cannot be rolled back, they are changed after the batch is committed
+            self.file_operation_list.append((func, args))
+
+
+    def runFileOperations(self):
+        for func, args in self.file_operation_list:
+            try:
+                func(*args)
+            except OSError as e:
+                app.logger.error('File operation failed: %s', str(e))
+
+        self.file_operation_list.clear()
+
+
+    def _unlinkFile(self, file_p):
+        try:
+            file_p.unlink()
+        except FileNotFoundError:
+            pass
+
+
+    def _deleteEntry(self, entry, commit):
+        if commit:
+            entry.deleteAsset()
+
+            db.session.delete(entry)
+            db.session.commit()
+            return
+
+
+        # same as deleteAsset() without the commit, the files are removed after the batch is committed
+        if getattr(entry, 'thumbnail_uuid', None):
+            try:
+                thumbnail_entry = IndiAllSkyDbThumbnailTable.query\
+                    .filter(IndiAllSkyDbThumbnailTable.uuid == entry.thumbnail_uuid)\
+                    .one()
+
+                self._fileOperation(commit, self._unlinkFile, thumbnail_entry.getFilesystemPath())
+                db.session.delete(thumbnail_entry)
+            except NoResultFound:
+                pass
+
+
+        self._fileOperation(commit, self._unlinkFile, entry.getFilesystemPath())
+        db.session.delete(entry)
+        db.session.flush()
+
+
     #def put(self):
     #    #media_file = request.files.get('media')
     #    pass
@@ -459,7 +534,7 @@ class SyncApiCameraView(SyncApiBaseView):
         return entry
 
 
-    def processPost(self, camera_notUsed, metadata, file_notUsed, overwrite=True):
+    def processPost(self, camera_notUsed, metadata, file_notUsed, overwrite=True, commit=True):
         addFunction_method = getattr(self._miscDb, self.add_function)
         entry = addFunction_method(
             metadata,
@@ -481,7 +556,7 @@ class SyncApiBaseImageView(SyncApiBaseView):
     type_folder = None
 
 
-    def processPost(self, camera, image_metadata, tmp_file_p, overwrite=False):
+    def processPost(self, camera, image_metadata, tmp_file_p, overwrite=False, commit=True):
         # offset createDate to account for difference between local and remote sites
         image_metadata['createDate'] += (image_metadata['utc_offset'] - datetime.now().astimezone().utcoffset().total_seconds())
 
@@ -516,17 +591,14 @@ class SyncApiBaseImageView(SyncApiBaseView):
 
 
             app.logger.warning('Removing orphaned image entry')
-            old_entry.deleteAsset()
-
-            db.session.delete(old_entry)
-            db.session.commit()
+            self._deleteEntry(old_entry, commit)
         except NoResultFound:
             pass
 
 
 
         if image_file_p.exists():
-            image_file_p.unlink()
+            self._fileOperation(commit, self._unlinkFile, image_file_p)
 
 
         addFunction_method = getattr(self._miscDb, self.add_function)
@@ -534,18 +606,11 @@ class SyncApiBaseImageView(SyncApiBaseView):
             image_file_p,
             camera.id,
             image_metadata,
+            commit=commit,
         )
 
 
-        tmp_file_size = tmp_file_p.stat().st_size
-        if tmp_file_size != 0:
-            # only copy file if it is not empty
-            # if the empty file option is selected, this can be expected
-            shutil.copy2(str(tmp_file_p), str(image_file_p))
-            image_file_p.chmod(0o644)
-
-
-        tmp_file_p.unlink()
+        self._fileOperation(commit, self.moveMedia, tmp_file_p, image_file_p)
 
         app.logger.info('Uploaded image: %s', image_file_p)
 
@@ -592,7 +657,7 @@ class SyncApiImageView(SyncApiBaseImageView):
     type_folder = 'exposures'
 
 
-    def processPost(self, camera, image_metadata, tmp_file_p, overwrite=False):
+    def processPost(self, camera, image_metadata, tmp_file_p, overwrite=False, commit=True):
         if image_metadata.get('keogram_pixels'):
             # do not offset timestamp
             self._miscDb.add_long_term_keogram_data(
@@ -601,7 +666,7 @@ class SyncApiImageView(SyncApiBaseImageView):
                 image_metadata['keogram_pixels'],
             )
 
-        return super(SyncApiImageView, self).processPost(camera, image_metadata, tmp_file_p, overwrite=False)
+        return super(SyncApiImageView, self).processPost(camera, image_metadata, tmp_file_p, overwrite=False, commit=commit)
 
 
 class SyncApiVideoView(SyncApiBaseView):
@@ -688,7 +753,7 @@ class SyncApiThumbnailView(SyncApiBaseView):
     add_function = 'addThumbnail_remote'
 
 
-    def processPost(self, camera, thumbnail_metadata, tmp_file_p, overwrite=False):
+    def processPost(self, camera, thumbnail_metadata, tmp_file_p, overwrite=False, commit=True):
         # offset createDate to account for difference between local and remote sites
         thumbnail_metadata['createDate'] += (thumbnail_metadata['utc_offset'] - datetime.now().astimezone().utcoffset().total_seconds())
 
@@ -745,17 +810,17 @@ class SyncApiThumbnailView(SyncApiBaseView):
 
                 app.logger.warning('Removing orphaned thumbnail entry')
                 db.session.delete(old_thumbnail_entry)
-                db.session.commit()
+                self._commit(commit)
             except NoResultFound:
                 pass
 
 
         else:
             if not overwrite:
-                raise EntryExists('Entry Exists: {0:s}'.format(old_thumbnail_entry.filename))
+                raise EntryExists('Entry Exists: {0:s}'.format(str(thumbnail_file_p)))
 
             app.logger.warning('Replacing image')
-            thumbnail_file_p.unlink()
+            self._fileOperation(commit, self._unlinkFile, thumbnail_file_p)
 
             try:
                 old_image_entry = self.model.query\
@@ -764,7 +829,7 @@ class SyncApiThumbnailView(SyncApiBaseView):
 
                 app.logger.warning('Removing old image entry')
                 db.session.delete(old_image_entry)
-                db.session.commit()
+                self._commit(commit)
             except NoResultFound:
                 pass
 
@@ -774,27 +839,157 @@ class SyncApiThumbnailView(SyncApiBaseView):
             thumbnail_file_p,
             camera.id,
             thumbnail_metadata,
+            commit=commit,
         )
 
 
-        tmp_file_size = tmp_file_p.stat().st_size
-        if tmp_file_size != 0:
-            # only copy file if it is not empty
-            # if the empty file option is selected, this can be expected
+        thumbnail_dir_p = thumbnail_file_p.parent
+        if not thumbnail_dir_p.exists():
+            thumbnail_dir_p.mkdir(mode=0o755, parents=True)
 
-            thumbnail_dir_p = thumbnail_file_p.parent
-            if not thumbnail_dir_p.exists():
-                thumbnail_dir_p.mkdir(mode=0o755, parents=True)
+        self._fileOperation(commit, self.moveMedia, tmp_file_p, thumbnail_file_p)
 
-            shutil.copy2(str(tmp_file_p), str(thumbnail_file_p))
-            thumbnail_file_p.chmod(0o644)
+        app.logger.info('Uploaded thumbnail: %s', thumbnail_file_p)
 
+        return new_entry
 
-        tmp_file_p.unlink()
 
-        app.logger.info('Uploaded thumbnail: %s', thumbnail_file_p)
+class SyncApiBatchView(SyncApiBaseView):
+    """Many entries in a single request
 
-        return new_entry
+    The metadata contains the camera and a list of items, each item names the
+    form field of its media file.  All entries are added in one transaction.
+    """
+
+    decorators = []
+
+    item_views = {
+        constants.IMAGE           : SyncApiImageView,
+        constants.VIDEO           : SyncApiVideoView,
+        constants.MINI_VIDEO      : SyncApiMiniVideoView,
+        constants.KEOGRAM         : SyncApiKeogramView,
+        constants.STARTRAIL       : SyncApiStartrailView,
+        constants.STARTRAIL_VIDEO : SyncApiStartrailVideoView,
+        constants.RAW_IMAGE       : SyncApiRawImageView,
+        constants.FITS_IMAGE      : SyncApiFitsImageView,
+        constants.PANORAMA_IMAGE  : SyncApiPanoramaImageView,
+        constants.PANORAMA_VIDEO  : SyncApiPanoramaVideoView,
+        constants.THUMBNAIL       : SyncApiThumbnailView,
+    }
+
+
+    def post(self, overwrite=False):
+        batch_metadata = self.saveMetadata(request.files['metadata'])
+
+        try:
+            camera = self.getCamera(batch_metadata)
+        except NoResultFound:
+            app.logger.error('Camera not found: %s', batch_metadata['camera_uuid'])
+            return jsonify({'error' : 'camera not found'}), 400
+
+
+        tmp_media_file_list = list()
+        try:
+            for item_metadata in batch_metadata['items']:
+                tmp_media_file_p = self.saveMedia(request.files[item_metadata['media']])
+                tmp_media_file_list.append(tmp_media_file_p)
+
+                if tmp_media_file_p.stat().st_size != item_metadata.get('file_size', -1):
+                    raise AuthenticationFailure('Media file size does not match')
+        except (AuthenticationFailure, KeyError):
+            for tmp_media_file_p in tmp_media_file_list:
+                tmp_media_file_p.unlink()
+
+            raise
+
+
+        view_dict = dict()
+        item_result_list = list()
+        new_file_list = list()
+        new_image_list = list()
+
+        try:
+            for item_metadata, tmp_media_file_p in zip(batch_metadata['items'], tmp_media_file_list):
+                item_view_class = self.item_views.get(item_metadata['type'])
+                if not item_view_class:
+                    app.logger.error('Invalid batch item type: %s', str(item_metadata['type']))
+                    tmp_media_file_p.unlink()
+                    item_result_list.append({'error' : 'invalid_type'})
+                    continue
+
+
+                if item_view_class not in view_dict:
+                    view_dict[item_view_class] = item_view_class()
+                    view_dict[item_view_class].file_operation_list = self.file_operation_list  # run in item order
+
+
+                try:
+                    file_entry = view_dict[item_view_class].processPost(camera, item_metadata, tmp_media_file_p, overwrite=overwrite, commit=False)
+                except EntryExists as e:
+                    app.logger.error('Transfer skipped: %s', str(e))
+                    tmp_media_file_p.unlink()
+                    item_result_list.append({'error' : 'file_exists'})
+                    continue
+
+
+                new_file_list.append(Path(file_entry.getFilesystemPath()))
+
+                if item_view_class.model == IndiAllSkyDbImageTable:
+                    new_image_list.append(file_entry)
+
+                item_result_list.append({
+                    'id'   : file_entry.id,
+                    'url'  : str(file_entry.getUrl(local=True)),
+                })
+
+
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+
+            # existing files are untouched until the commit, only the temp files are removed
+            self.file_operation_list.clear()
+
+            for tmp_media_file_p in tmp_media_file_list:
+                try:
+                    tmp_media_file_p.unlink()
+                except FileNotFoundError:
+                    pass
+
+            raise
+
+
+        # old files are deleted and the new files are moved into place
+        self.runFileOperations()
+
+
+        for image_entry in new_image_list:
+            self._miscDb.imageAdded(image_entry, commit=False)
+
+        if new_image_list:
+            # image statistics are stored once per batch
+            db.session.commit()
+
+
+        app.logger.info('Batch uploaded %d files', len(new_file_list))
+
+        return jsonify({
+            'items' : item_result_list,
+        })
+
+
+    def put(self, overwrite=True):
+        return self.post(overwrite=overwrite)
+
+
+    def delete(self):
+        app.logger.error('delete not implemented')
+        return jsonify({'error' : 'not_implemented'}), 400
+
+
+    def get(self):
+        app.logger.error('get not implemented')
+        return jsonify({'error' : 'not_implemented'}), 400
 
 
 class EntryExists(Exception):
@@ -825,4 +1020,5 @@ bp_syncapi_allsky.add_url_rule('/sync/v1/fitsimage', view_func=SyncApiFitsImageV
 bp_syncapi_allsky.add_url_rule('/sync/v1/panoramaimage', view_func=SyncApiPanoramaImageView.as_view('syncapi_v1_panoramaimage_view'), methods=['GET', 'POST', 'PUT', 'DELETE'])
 bp_syncapi_allsky.add_url_rule('/sync/v1/panoramavideo', view_func=SyncApiPanoramaVideoView.as_view('syncapi_v1_panorama_video_view'), methods=['GET', 'POST', 'PUT', 'DELETE'])
 bp_syncapi_allsky.add_url_rule('/sync/v1/thumbnail', view_func=SyncApiThumbnailView.as_view('syncapi_v1_thumbnail_view'), methods=['GET', 'POST', 'PUT', 'DELETE'])
+bp_syncapi_allsky.add_url_rule('/sync/v1/batch', view_func=SyncApiBatchView.as_view('syncapi_v1_batch_view'), methods=['POST', 'PUT'])
 
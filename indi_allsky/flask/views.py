@@ -5,6 +5,7 @@ from datetime import timezone
 import io
 import tempfile
 import json
+import hashlib
 from collections import OrderedDict
 from functools import wraps
 import time
@@ -27,6 +28,10 @@ from .. import constants
 from .. import asi676mc
 from .. import asi676mc_calibration
 from ..processing import ImageProcessor
+from ..imageHistogram import IndiAllSkyImageHistogram
+from ..chartDownsample import IndiAllSkyChartDownsample
+from ..videoLanes import IndiAllSkyVideoLanes
+from ..uploadScheduler import IndiAllSkyUploadScheduler
 from ..lens_solver import IndiAllSkyLensSolver
 from ..lens_solver import parseSolverRequestValues
 from ..lens_solver import applySolvedValuesToConfig
@@ -129,6 +134,8 @@ from .base_views import TemplateView
 from .base_views import FormView
 from .base_views import JsonView
 
+from .assetExpire import IndiAllSkyAssetExpire
+
 from .youtube_views import YoutubeAuthorizeView
 from .youtube_views import YoutubeCallbackView
 from .youtube_views import YoutubeRefreshAuthView
@@ -178,7 +185,7 @@ def _asi676mc_feature_enabled():
     """Read the current persisted master switch before opening the tool."""
     from ..config import IndiAllSkyConfig
 
-    return asi676mc.feature_enabled(IndiAllSkyConfig().config)
+    return asi676mc.feature_enabled(IndiAllSkyConfig(cached=True).config)
 
 
 def _calibration_owner():
@@ -1180,6 +1187,7 @@ class JsonImageLoopView(JsonView):
         self.history_seconds = 900
         self.sqm_history_minutes = 30
         self.stars_history_minutes = 30
+        self.image_stats_max_periods = 3  # fall back to the database when the image worker misses exposures
         self._limit = 1000  # sanity check
 
 
@@ -1192,6 +1200,8 @@ class JsonImageLoopView(JsonView):
         self.cameraSetup(camera_id=camera_id)
 
 
+        live = not timestamp
+
         if not timestamp:
             timestamp = int(datetime.timestamp(self.camera_now))
 
@@ -1202,13 +1212,24 @@ class JsonImageLoopView(JsonView):
             history_seconds = 14400
 
 
-        jsqm_data, camera_sqm_mag_data, camera_sqm_adu_data, device_sqm_mag_data = self.getSqmData(camera_id, ts_dt)
+        image_stats = None
+        if live:
+            # live view, use the statistics published by the image worker
+            image_stats = self.getImageStatsSummary(camera_id)
+
+
+        if image_stats:
+            jsqm_data, camera_sqm_mag_data, camera_sqm_adu_data, device_sqm_mag_data, stars_data = image_stats
+        else:
+            jsqm_data, camera_sqm_mag_data, camera_sqm_adu_data, device_sqm_mag_data = self.getSqmData(camera_id, ts_dt)
+            stars_data = self.getStarsData(camera_id, ts_dt)
+
 
         data = {
             'message'    : '',
             'image_list' : self.getLoopImages(camera_id, ts_dt, history_seconds),
             'jsqm_data'  : jsqm_data,
-            'stars_data' : self.getStarsData(camera_id, ts_dt),
+            'stars_data' : stars_data,
             'camera_sqm_mag_data' : camera_sqm_mag_data,
             'camera_sqm_adu_data' : camera_sqm_adu_data,
             'device_sqm_mag_data' : device_sqm_mag_data,
@@ -1291,6 +1312,60 @@ class JsonImageLoopView(JsonView):
         return image_list
 
 
+    def getImageStatsSummary(self, camera_id):
+        # returns None if the summary is missing or stale
+        try:
+            image_stats = json.loads(self._miscDb.getState(self._miscDb.image_stats_state_tmpl.format(camera_id)))
+        except NoResultFound:
+            return None
+        except ValueError as e:
+            app.logger.error('Invalid image statistics: %s', str(e))
+            return None
+
+
+        # the summary is updated with every image
+        exposure_period = max(
+            float(self.indi_allsky_config.get('EXPOSURE_PERIOD', 15.0)),
+            float(self.indi_allsky_config.get('EXPOSURE_PERIOD_DAY', 15.0)),
+            float(self.indi_allsky_config.get('CCD_EXPOSURE_MAX', 15.0)),
+        )
+
+        if time.time() - image_stats.get('ts', 0) > exposure_period * self.image_stats_max_periods:
+            return None
+
+        if image_stats.get('window_s') != self.sqm_history_minutes * 60:
+            return None
+
+        if image_stats.get('window_s') != self.stars_history_minutes * 60:
+            return None
+
+
+        sqm_data_list = list()
+        for metric in ('sqm', 'camera_sqm_mag', 'camera_sqm_adu', 'device_sqm_mag'):
+            metric_data = image_stats[metric]
+
+            if isinstance(metric_data['max'], type(None)):
+                # no images in the window
+                metric_data = {
+                    'max' : 0.0,
+                    'min' : 0.0,
+                    'avg' : 0.0,
+                    'last' : 0.0,
+                }
+
+            sqm_data_list.append(metric_data)
+
+
+        stars_data = {
+            'max' : image_stats['stars']['max'],
+            'min' : image_stats['stars']['min'],
+            'avg' : image_stats['stars']['avg'],
+        }
+
+
+        return (*sqm_data_list, stars_data)
+
+
     def getSqmData(self, camera_id, ts_dt):
         ts_minus_minutes = ts_dt - timedelta(minutes=self.sqm_history_minutes)
 
@@ -1459,6 +1534,11 @@ class JsonPanoramaLoopView(JsonImageLoopView):
     model = IndiAllSkyDbPanoramaImageTable
 
 
+    def getImageStatsSummary(self, *args):
+        # statistics are only tracked for images
+        return None
+
+
     def getSqmData(self, *args):
         sqm_data = {
             'max'  : 0,
@@ -1572,35 +1652,133 @@ class ChartView(TemplateView):
 
 
 class JsonChartView(JsonView):
+    series_keys = (
+        'jsqm',
+        'stars',
+        'temp',
+        'gain',
+        'exp',
+        'detection',
+        'custom_1',
+        'custom_2',
+        'custom_3',
+        'custom_4',
+        'custom_5',
+        'custom_6',
+        'custom_7',
+        'custom_8',
+        'custom_9',
+    )
+
+
     def __init__(self, **kwargs):
         super(JsonChartView, self).__init__(**kwargs)
 
         self.chart_history_seconds = 900
+        self.stars_rolling_rows = 6
+        self.max_points = 10000
+        self.lttb_series = 'jsqm'  # series selecting the rows for LTTB
 
 
-    def get_objects(self):
-        camera_id = int(request.args['camera_id'])
-        history_seconds = int(request.args.get('limit_s', self.chart_history_seconds))
-        timestamp = int(request.args.get('timestamp', 0))
+    def dispatch_request(self):
+        # responses only change when a new image is added
+        self.camera_id = int(request.args['camera_id'])
+        self.history_seconds = int(request.args.get('limit_s', self.chart_history_seconds))
+        self.timestamp = int(request.args.get('timestamp', 0))
+        self.since = float(request.args.get('since', 0))
+        self.columnar = request.args.get('format') == 'columnar'
+        self.points = min(int(request.args.get('points', 0)), self.max_points)
+        self.downsample = request.args.get('downsample', 'minmax')
 
-        self.cameraSetup(camera_id=camera_id)
+        if self.downsample not in IndiAllSkyChartDownsample.methods:
+            return jsonify({'error' : 'Invalid downsample method'}), 400
 
-        if not timestamp:
-            timestamp = int(datetime.timestamp(self.camera_now))
 
-        ts_dt = datetime.fromtimestamp(timestamp + 3)  # allow some jitter
+        self.cameraSetup(camera_id=self.camera_id)
+
+        if not self.timestamp:
+            self.timestamp = int(datetime.timestamp(self.camera_now))
+
+        self.ts_dt = datetime.fromtimestamp(self.timestamp + 3)  # allow some jitter
 
         # safety, limit history to 1 day
-        if history_seconds > 86400:
-            history_seconds = 86400
+        if self.history_seconds > 86400:
+            self.history_seconds = 86400
+
+
+        self.latest_image = IndiAllSkyDbImageTable.query\
+            .filter(IndiAllSkyDbImageTable.camera_id == self.camera_id)\
+            .filter(IndiAllSkyDbImageTable.createDate < self.ts_dt)\
+            .order_by(IndiAllSkyDbImageTable.createDate.desc())\
+            .first()
+
+
+        # the window moves with the current time, older rows drop out of the response
+        window_start_dt = self.ts_dt - timedelta(seconds=self.history_seconds)
+
+        self.oldest_image = IndiAllSkyDbImageTable.query\
+            .filter(IndiAllSkyDbImageTable.camera_id == self.camera_id)\
+            .filter(IndiAllSkyDbImageTable.createDate > window_start_dt)\
+            .filter(IndiAllSkyDbImageTable.createDate < self.ts_dt)\
+            .order_by(IndiAllSkyDbImageTable.createDate.asc())\
+            .first()
+
+
+        etag = self.getETag()
+
+        if request.if_none_match.contains(etag):
+            r = Response(status=304)
+            r.set_etag(etag)
+            return r
+
+
+        r = jsonify(self.get_objects())
+        r.set_etag(etag)
+        r.headers['Cache-Control'] = 'no-cache'
+
+        return r
+
+
+    def getETag(self):
+        if self.latest_image:
+            latest_image_id = self.latest_image.id
+        else:
+            latest_image_id = None
+
+        if self.oldest_image:
+            # first row of the window
+            oldest_image_id = self.oldest_image.id
+        else:
+            oldest_image_id = None
+
+        etag_data = [
+            latest_image_id,
+            oldest_image_id,
+            sorted(request.args.items(multi=True)),
+            self.indi_allsky_config_id,
+            self.indi_allsky_config.get('TEMP_DISPLAY'),
+            [self.camera_data.get('custom_chart_{0:d}_key'.format(x)) for x in range(1, 10)],
+        ]
+
+        return hashlib.sha1(json.dumps(etag_data).encode()).hexdigest()
+
+
+    def get_objects(self):
+        if self.columnar:
+            chart_data = self.getColumnarChartData(self.camera_id, self.ts_dt, self.history_seconds)
+            row_count = len(chart_data['ts'])
+        else:
+            chart_data = self.getChartData(self.camera_id, self.ts_dt, self.history_seconds)
+            row_count = len(chart_data['jsqm'])
+
 
         data = {
-            'chart_data' : self.getChartData(camera_id, ts_dt, history_seconds),
+            'chart_data' : chart_data,
             'message' : '',
         }
 
 
-        if len(data['chart_data']['jsqm']) == 0:
+        if row_count == 0 and not self.since:
             data['message'] = 'No chart data in history range'
 
 
@@ -1608,34 +1786,7 @@ class JsonChartView(JsonView):
 
 
     def getChartData(self, camera_id, ts_dt, history_seconds):
-        import numpy
-
-        ts_minus_seconds = ts_dt - timedelta(seconds=history_seconds)
-
-        chart_query = IndiAllSkyDbImageTable.query\
-            .add_columns(
-                IndiAllSkyDbImageTable.createDate,
-                IndiAllSkyDbImageTable.sqm.label('jsqm'),
-                func.avg(IndiAllSkyDbImageTable.stars).over(order_by=IndiAllSkyDbImageTable.createDate, rows=(-5, 0)).label('stars_rolling'),
-                IndiAllSkyDbImageTable.temp,
-                IndiAllSkyDbImageTable.gain,
-                IndiAllSkyDbImageTable.exposure,
-                IndiAllSkyDbImageTable.detections,
-                #(IndiAllSkyDbImageTable.sqm - func.lag(IndiAllSkyDbImageTable.sqm).over(order_by=IndiAllSkyDbImageTable.createDate)).label('jsqm_diff'),
-                IndiAllSkyDbImageTable.data,
-            )\
-            .join(IndiAllSkyDbCameraTable)\
-            .filter(
-                and_(
-                    IndiAllSkyDbCameraTable.id == camera_id,
-                    IndiAllSkyDbImageTable.createDate > ts_minus_seconds,
-                    IndiAllSkyDbImageTable.createDate < ts_dt,
-                )
-            )\
-            .order_by(IndiAllSkyDbImageTable.createDate.asc())
-
-
-        #app.logger.info('Chart SQL: %s', str(chart_query))
+        ts_list, x_list, series = self.getChartSeries(camera_id, ts_dt, history_seconds)
 
         chart_data = {
             'jsqm'   : [],
@@ -1663,224 +1814,255 @@ class JsonChartView(JsonView):
         }
 
 
-        if self.camera.data:
-            camera_data = dict(self.camera.data)
-        else:
-            camera_data = dict()
+        for key in self.series_keys:
+            chart_data[key] = [{'x' : x, 'y' : y} for x, y in zip(x_list, series[key])]
 
 
-        custom_chart_1_key = camera_data.get('custom_chart_1_key', 'sensor_user_10')
-        custom_chart_2_key = camera_data.get('custom_chart_2_key', 'sensor_user_11')
-        custom_chart_3_key = camera_data.get('custom_chart_3_key', 'sensor_user_12')
-        custom_chart_4_key = camera_data.get('custom_chart_4_key', 'sensor_user_13')
-        custom_chart_5_key = camera_data.get('custom_chart_5_key', 'sensor_user_14')
-        custom_chart_6_key = camera_data.get('custom_chart_6_key', 'sensor_user_15')
-        custom_chart_7_key = camera_data.get('custom_chart_7_key', 'sensor_user_16')
-        custom_chart_8_key = camera_data.get('custom_chart_8_key', 'sensor_user_17')
-        custom_chart_9_key = camera_data.get('custom_chart_9_key', 'sensor_user_18')
+        # build last image histogram
+        histogram_data = self.getLatestHistogram(ts_dt, history_seconds)
+        for col, hist in histogram_data.items():
+            for x, val in enumerate(hist):
+                h_data = {
+                    'x' : str(x),
+                    'y' : val,
+                }
+                chart_data['histogram'][col].append(h_data)
 
 
-        for i in chart_query:
-            x = i.createDate.strftime('%H:%M:%S')
+        return chart_data
 
-            jsqm_data = {
-                'x' : x,
-                'y' : i.jsqm,
-            }
-            chart_data['jsqm'].append(jsqm_data)
 
-            star_data = {
-                'x' : x,
-                'y' : int(i.stars_rolling),
-            }
-            chart_data['stars'].append(star_data)
+    def getColumnarChartData(self, camera_id, ts_dt, history_seconds):
+        # one shared timestamp array and one array per series
+        ts_list, x_list, series = self.getChartSeries(camera_id, ts_dt, history_seconds)
+
+        chart_data = {
+            'ts'     : ts_list,
+            'x'      : x_list,
+            'series' : series,
+            'histogram' : {
+                'red'   : [],
+                'green' : [],
+                'blue'  : [],
+                'gray'  : [],
+            },
+        }
 
 
-            if self.indi_allsky_config.get('TEMP_DISPLAY') == 'f':
-                sensortemp = ((i.temp * 9.0) / 5.0) + 32
-            elif self.indi_allsky_config.get('TEMP_DISPLAY') == 'k':
-                sensortemp = i.temp + 273.15
-            else:
-                sensortemp = i.temp
+        chart_data['histogram'].update(self.getLatestHistogram(ts_dt, history_seconds))
 
-            temp_data = {
-                'x' : x,
-                'y' : sensortemp,
-            }
-            chart_data['temp'].append(temp_data)
 
-            exp_data = {
-                'x' : x,
-                'y' : i.exposure,
-            }
-            chart_data['exp'].append(exp_data)
+        return chart_data
 
-            gain_data = {
-                'x' : x,
-                'y' : i.gain,
-            }
-            chart_data['gain'].append(gain_data)
 
-            #jsqm_d_data = {
-            #    'x' : x,
-            #    'y' : i.jsqm_diff,
-            #}
-            #chart_data['jsqm_d'].append(jsqm_d_data)
+    def getChartSeries(self, camera_id, ts_dt, history_seconds):
+        import numpy
 
+        ts_minus_seconds = ts_dt - timedelta(seconds=history_seconds)
 
-            if i.detections > 0:
-                detection = 1
+        start_filter = IndiAllSkyDbImageTable.createDate > ts_minus_seconds
+        since_dt = None
+
+        if self.since:
+            # timestamps are whole seconds, return rows after the since second
+            since_dt = datetime.fromtimestamp(int(self.since) + 1)
+
+            if since_dt > ts_minus_seconds:
+                start_filter = IndiAllSkyDbImageTable.createDate >= since_dt
             else:
-                detection = 0
+                since_dt = None
 
-            detection_data = {
-                'x' : x,
-                'y' : detection,
-            }
-            chart_data['detection'].append(detection_data)
 
+        custom_chart_columns = list()
+        for x in range(1, 10):
+            custom_chart_key = self.camera_data.get('custom_chart_{0:d}_key'.format(x), 'sensor_user_{0:d}'.format(x + 9))
 
-            # custom chart 1
-            try:
-                custom_1_y = i.data[custom_chart_1_key]
-            except KeyError:
-                custom_1_y = 0
+            # only the selected values are extracted from the json data
+            custom_chart_columns.append(IndiAllSkyDbImageTable.data[custom_chart_key].as_float())
 
-            custom_1_data = {
-                'x' : x,
-                'y' : custom_1_y,
-            }
-            chart_data['custom_1'].append(custom_1_data)
 
+        chart_rows = db.session.query(
+            IndiAllSkyDbImageTable.createDate,
+            IndiAllSkyDbImageTable.sqm,
+            IndiAllSkyDbImageTable.stars,
+            IndiAllSkyDbImageTable.temp,
+            IndiAllSkyDbImageTable.gain,
+            IndiAllSkyDbImageTable.exposure,
+            IndiAllSkyDbImageTable.detections,
+            *custom_chart_columns,
+        )\
+            .filter(
+                and_(
+                    IndiAllSkyDbImageTable.camera_id == camera_id,
+                    start_filter,
+                    IndiAllSkyDbImageTable.createDate < ts_dt,
+                )
+            )\
+            .order_by(IndiAllSkyDbImageTable.createDate.asc())\
+            .all()
 
-            # custom chart 2
-            try:
-                custom_2_y = i.data[custom_chart_2_key]
-            except KeyError:
-                custom_2_y = 0
 
-            custom_2_data = {
-                'x' : x,
-                'y' : custom_2_y,
-            }
-            chart_data['custom_2'].append(custom_2_data)
+        if not chart_rows:
+            return [], [], {key: [] for key in self.series_keys}
 
 
-            # custom chart 3
-            try:
-                custom_3_y = i.data[custom_chart_3_key]
-            except KeyError:
-                custom_3_y = 0
+        row_columns = list(zip(*chart_rows))
 
-            custom_3_data = {
-                'x' : x,
-                'y' : custom_3_y,
-            }
-            chart_data['custom_3'].append(custom_3_data)
+        create_date_list = row_columns[0]
 
 
-            # custom chart 4
-            try:
-                custom_4_y = i.data[custom_chart_4_key]
-            except KeyError:
-                custom_4_y = 0
+        # rolling average of stars over the previous rows in the history range
+        stars_prefix = list()
+        if since_dt:
+            stars_prefix_rows = db.session.query(IndiAllSkyDbImageTable.stars)\
+                .filter(
+                    and_(
+                        IndiAllSkyDbImageTable.camera_id == camera_id,
+                        IndiAllSkyDbImageTable.createDate > ts_minus_seconds,
+                        IndiAllSkyDbImageTable.createDate < since_dt,
+                    )
+                )\
+                .order_by(IndiAllSkyDbImageTable.createDate.desc())\
+                .limit(self.stars_rolling_rows - 1)\
+                .all()
 
-            custom_4_data = {
-                'x' : x,
-                'y' : custom_4_y,
-            }
-            chart_data['custom_4'].append(custom_4_data)
+            stars_prefix = [s for s, in reversed(stars_prefix_rows)]
 
 
-            # custom chart 5
-            try:
-                custom_5_y = i.data[custom_chart_5_key]
-            except KeyError:
-                custom_5_y = 0
+        stars_array = numpy.array(stars_prefix + list(row_columns[2]), dtype=numpy.float64)
+        stars_valid = ~numpy.isnan(stars_array)
+        stars_sum = numpy.concatenate(([0.0], numpy.cumsum(numpy.where(stars_valid, stars_array, 0.0))))
+        stars_count = numpy.concatenate(([0], numpy.cumsum(stars_valid)))
 
-            custom_5_data = {
-                'x' : x,
-                'y' : custom_5_y,
-            }
-            chart_data['custom_5'].append(custom_5_data)
+        window_end = numpy.arange(1, stars_array.shape[0] + 1)
+        window_start = numpy.maximum(window_end - self.stars_rolling_rows, 0)
+        stars_rolling = (stars_sum[window_end] - stars_sum[window_start]) / numpy.maximum(stars_count[window_end] - stars_count[window_start], 1)
+        stars_rolling = stars_rolling[len(stars_prefix):].astype(numpy.int64)
 
 
-            # custom chart 6
-            try:
-                custom_6_y = i.data[custom_chart_6_key]
-            except KeyError:
-                custom_6_y = 0
+        temp_list = row_columns[3]
+        if self.indi_allsky_config.get('TEMP_DISPLAY') in ('f', 'k'):
+            temp_array = numpy.array(temp_list, dtype=numpy.float64)
 
-            custom_6_data = {
-                'x' : x,
-                'y' : custom_6_y,
-            }
-            chart_data['custom_6'].append(custom_6_data)
+            if self.indi_allsky_config.get('TEMP_DISPLAY') == 'f':
+                temp_array = ((temp_array * 9.0) / 5.0) + 32
+            else:
+                temp_array = temp_array + 273.15
 
+            temp_list = self._seriesList(temp_array)
 
-            # custom chart 7
-            try:
-                custom_7_y = i.data[custom_chart_7_key]
-            except KeyError:
-                custom_7_y = 0
 
-            custom_7_data = {
-                'x' : x,
-                'y' : custom_7_y,
-            }
-            chart_data['custom_7'].append(custom_7_data)
+        series = {
+            'jsqm'      : list(row_columns[1]),
+            'stars'     : stars_rolling.tolist(),
+            'temp'      : list(temp_list),
+            'gain'      : list(row_columns[4]),
+            'exp'       : list(row_columns[5]),
+            'detection' : [1 if d > 0 else 0 for d in row_columns[6]],
+        }
 
+        for x in range(1, 10):
+            # missing values are charted as 0
+            series['custom_{0:d}'.format(x)] = [0 if v is None else v for v in row_columns[6 + x]]
 
-            # custom chart 8
-            try:
-                custom_8_y = i.data[custom_chart_8_key]
-            except KeyError:
-                custom_8_y = 0
 
-            custom_8_data = {
-                'x' : x,
-                'y' : custom_8_y,
-            }
-            chart_data['custom_8'].append(custom_8_data)
+        ts_list = [int(d.timestamp()) for d in create_date_list]
 
 
-            # custom chart 9
-            try:
-                custom_9_y = i.data[custom_chart_9_key]
-            except KeyError:
-                custom_9_y = 0
+        if self.points and len(ts_list) > self.points:
+            ts_list, series = self.downsampleSeries(ts_list, series)
+            x_list = [datetime.fromtimestamp(ts).strftime('%H:%M:%S') for ts in ts_list]
+        else:
+            x_list = [d.strftime('%H:%M:%S') for d in create_date_list]
 
-            custom_9_data = {
-                'x' : x,
-                'y' : custom_9_y,
-            }
-            chart_data['custom_9'].append(custom_9_data)
 
+        return ts_list, x_list, series
 
-        # build last image histogram
-        now_minus_seconds = ts_dt - timedelta(seconds=history_seconds)
 
-        latest_image = IndiAllSkyDbImageTable.query\
-            .join(IndiAllSkyDbImageTable.camera)\
-            .filter(
-                and_(
-                    IndiAllSkyDbCameraTable.id == camera_id,
-                    IndiAllSkyDbImageTable.createDate > now_minus_seconds,
-                    IndiAllSkyDbImageTable.createDate < ts_dt,
-                )
-            )\
-            .order_by(IndiAllSkyDbImageTable.createDate.desc())\
-            .first()
+    def downsampleSeries(self, ts_list, series):
+        import numpy
+
+        ts_array = numpy.array(ts_list, dtype=numpy.int64)
+        column_list = [numpy.array(series[key], dtype=numpy.float64) for key in self.series_keys]
+
+        if self.downsample == 'lttb':
+            index_list = IndiAllSkyChartDownsample.lttbIndices(ts_array, column_list[self.series_keys.index(self.lttb_series)], self.points)
+
+            ts_array = ts_array[index_list]
+            column_list = [column[index_list] for column in column_list]
+        else:
+            ts_array, column_list = IndiAllSkyChartDownsample.minmax(ts_array, column_list, self.points)
+
+
+        new_series = dict()
+        for key, column in zip(self.series_keys, column_list):
+            new_series[key] = self._seriesList(column)
+
+        new_series['stars'] = [int(v) for v in new_series['stars']]
+        new_series['detection'] = [int(v) for v in new_series['detection']]
+
+
+        return ts_array.tolist(), new_series
+
+
+    def _seriesList(self, column):
+        import numpy
+
+        column = numpy.round(column, 3)
 
+        if not numpy.isnan(column).any():
+            return column.tolist()
+
+        return [None if numpy.isnan(v) else v for v in column.tolist()]
+
+
+    def getLatestHistogram(self, ts_dt, history_seconds):
+        # histogram of the latest image in the history range
+        now_minus_seconds = ts_dt - timedelta(seconds=history_seconds)
+
+        latest_image = self.latest_image
 
         if not latest_image:
-            return chart_data
+            return {}
+
+        if latest_image.createDate <= now_minus_seconds:
+            return {}
+
+
+        stored_histogram = self.getStoredHistogram(latest_image.camera_id, latest_image.id)
+        if stored_histogram:
+            return stored_histogram
+
+
+        # older images, calculate from the image file
+        return self.getFileHistogram(latest_image)
+
+
+    def getStoredHistogram(self, camera_id, image_id):
+        # histogram stored when the image was processed, None if it belongs to another image
+        try:
+            histogram_state = json.loads(self._miscDb.getState(IndiAllSkyImageHistogram.state_key_tmpl.format(camera_id)))
+        except NoResultFound:
+            return None
+        except ValueError as e:
+            app.logger.error('Invalid stored histogram: %s', str(e))
+            return None
+
+
+        if histogram_state.get('image_id') != image_id:
+            return None
+
+
+        return histogram_state.get('histogram')
 
 
+    def getFileHistogram(self, latest_image):
+        import numpy
+
         latest_image_p = latest_image.getFilesystemPath()
         if not latest_image_p.exists():
             app.logger.error('Image does not exist: %s', latest_image_p)
-            return chart_data
+            return {}
 
 
         #image_start = time.time()
@@ -1894,7 +2076,7 @@ class JsonChartView(JsonView):
                     image_data = simplejpeg.decode_jpeg(f_img.read(), colorspace='BGR')
             except ValueError:
                 app.logger.error('Unable to read %s', latest_image_p)
-                return chart_data
+                return {}
 
         elif latest_image_p.suffix in ('.png', ):
             import cv2
@@ -1903,7 +2085,7 @@ class JsonChartView(JsonView):
 
             if isinstance(image_data, type(None)):
                 app.logger.error('Unable to read %s', latest_image_p)
-                return chart_data
+                return {}
 
         else:
             # pillow supports remaining types
@@ -1916,11 +2098,11 @@ class JsonChartView(JsonView):
                     image_data = cv2.cvtColor(numpy.array(img_pil), cv2.COLOR_RGB2BGR)
             except PIL.UnidentifiedImageError:
                 app.logger.error('Unable to read %s', latest_image_p)
-                return chart_data
+                return {}
 
 
             app.logger.warning('Unsupported image format')
-            return chart_data
+            return {}
 
 
         #image_elapsed_s = time.time() - image_start
@@ -1961,20 +2143,15 @@ class JsonChartView(JsonView):
             numpy_mask = _sqm_mask == 0
 
 
+        histogram_data = dict()
+
         if len(image_data.shape) == 2:
             # mono
             #h_numpy = cv2.calcHist([image_data], [0], mask, [256], [0, 256])
             gray_ma = numpy.ma.masked_array(image_data, mask=numpy_mask)
             h_numpy = numpy.histogram(gray_ma.compressed(), bins=256, range=(0, 256))
 
-            #for x, val in enumerate(h_numpy.tolist()):
-            for x, val in enumerate(h_numpy[0].tolist()):
-                h_data = {
-                    'x' : str(x),
-                    #'y' : val[0]
-                    'y' : val,
-                }
-                chart_data['histogram']['gray'].append(h_data)
+            histogram_data['gray'] = h_numpy[0].tolist()
 
         else:
             # color
@@ -1984,17 +2161,10 @@ class JsonChartView(JsonView):
                 col_ma = numpy.ma.masked_array(image_data[:, :, i], mask=numpy_mask)
                 h_numpy = numpy.histogram(col_ma.compressed(), bins=256, range=(0, 256))
 
-                #for x, val in enumerate(h_numpy.tolist()):
-                for x, val in enumerate(h_numpy[0].tolist()):
-                    h_data = {
-                        'x' : str(x),
-                        #'y' : val[0]
-                        'y' : val,
-                    }
-                    chart_data['histogram'][col].append(h_data)
+                histogram_data[col] = h_numpy[0].tolist()
 
 
-        return chart_data
+        return histogram_data
 
 
 class JsonSensorPanelView(JsonView):
@@ -5861,10 +6031,16 @@ class TaskQueueView(TemplateView):
             else:
                 task_data = {}
 
+            if task.queue == TaskQueueQueue.VIDEO:
+                lane = IndiAllSkyVideoLanes.laneForAction(task_data.get('action'))
+            else:
+                lane = ''
+
             t = {
                 'id'         : task.id,
                 'createDate' : task.createDate,
                 'queue'      : task.queue.name,
+                'lane'       : lane,
                 'state'      : task.state.name,
                 'action'     : task_data.get('action', 'MISSING'),
                 'result'     : task.result,
@@ -5873,10 +6049,66 @@ class TaskQueueView(TemplateView):
             task_list.append(t)
 
         context['task_list'] = task_list
+        context['lane_list'] = self.getVideoLaneStatus()
+        context['upload_destination_list'] = self.getUploadDestinationStatus()
 
         return context
 
 
+    def getVideoLaneStatus(self):
+        # published by the video dispatcher
+        try:
+            lane_state = json.loads(self._miscDb.getState(IndiAllSkyVideoLanes.state_key))
+        except NoResultFound:
+            return []
+        except ValueError as e:
+            app.logger.error('Invalid video lane state: %s', str(e))
+            return []
+
+
+        lane_list = list()
+        for lane in IndiAllSkyVideoLanes.lane_list:
+            lane_status = lane_state['lanes'].get(lane, {})
+
+            lane_list.append({
+                'name'    : lane,
+                'workers' : lane_status.get('workers', 0),
+                'running' : lane_status.get('running', []),
+                'pending' : lane_status.get('pending', 0),
+                'updated' : datetime.fromtimestamp(lane_state.get('ts', 0)),
+            })
+
+
+        return lane_list
+
+
+    def getUploadDestinationStatus(self):
+        # published by the upload dispatcher
+        try:
+            destination_state = json.loads(self._miscDb.getState(IndiAllSkyUploadScheduler.state_key))
+        except NoResultFound:
+            return []
+        except ValueError as e:
+            app.logger.error('Invalid upload destination state: %s', str(e))
+            return []
+
+
+        destination_list = list()
+        for dest in IndiAllSkyUploadScheduler.destination_list:
+            dest_status = destination_state['destinations'].get(dest, {})
+
+            destination_list.append({
+                'name'      : dest,
+                'limit'     : dest_status.get('limit', 0),
+                'in_flight' : dest_status.get('in_flight', 0),
+                'queued'    : dest_status.get('queued', 0),
+                'updated'   : datetime.fromtimestamp(destination_state.get('ts', 0)),
+            })
+
+
+        return destination_list
+
+
 class AjaxSystemInfoView(BaseView):
     methods = ['POST']
     decorators = [login_required]
@@ -6205,11 +6437,6 @@ class AjaxSystemInfoView(BaseView):
             .order_by(IndiAllSkyDbPanoramaImageTable.createDate.asc())
 
 
-        ### Getting IDs first then deleting each file is faster than deleting all files with
-        ### thumbnails with a single query.  Deleting associated thumbnails causes sqlalchemy
-        ### to recache after every delete which cause a 1-5 second lag for each delete
-
-
         asset_lists = [
             (image_query, IndiAllSkyDbImageTable),
             (fits_image_query, IndiAllSkyDbFitsImageTable),
@@ -6218,18 +6445,7 @@ class AjaxSystemInfoView(BaseView):
         ]
 
 
-        delete_count = 0
-        for asset_list, asset_table in asset_lists:
-            while True:
-                id_list = [entry.id for entry in asset_list.limit(500)]
-
-                if not id_list:
-                    break
-
-                delete_count += self._deleteAssets(asset_table, id_list)
-
-
-        return delete_count
+        return self._deleteAssetQueries(asset_lists)
 
 
     def flush16MinutesImages(self, camera_id):
@@ -6244,28 +6460,12 @@ class AjaxSystemInfoView(BaseView):
             .order_by(IndiAllSkyDbImageTable.createDate.asc())
 
 
-        ### Getting IDs first then deleting each file is faster than deleting all files with
-        ### thumbnails with a single query.  Deleting associated thumbnails causes sqlalchemy
-        ### to recache after every delete which cause a 1-5 second lag for each delete
-
-
         asset_lists = [
             (image_query_16, IndiAllSkyDbImageTable),
         ]
 
 
-        delete_count = 0
-        for asset_list, asset_table in asset_lists:
-            while True:
-                id_list = [entry.id for entry in asset_list.limit(500)]
-
-                if not id_list:
-                    break
-
-                delete_count += self._deleteAssets(asset_table, id_list)
-
-
-        return delete_count
+        return self._deleteAssetQueries(asset_lists)
 
 
     def flushTimelapses(self, camera_id):
@@ -6300,11 +6500,6 @@ class AjaxSystemInfoView(BaseView):
             .order_by(IndiAllSkyDbPanoramaVideoTable.createDate.asc())
 
 
-        ### Getting IDs first then deleting each file is faster than deleting all files with
-        ### thumbnails with a single query.  Deleting associated thumbnails causes sqlalchemy
-        ### to recache after every delete which cause a 1-5 second lag for each delete
-
-
         asset_lists = [
             (video_query, IndiAllSkyDbVideoTable),
             (mini_video_query, IndiAllSkyDbMiniVideoTable),
@@ -6315,18 +6510,7 @@ class AjaxSystemInfoView(BaseView):
         ]
 
 
-        delete_count = 0
-        for asset_list, asset_table in asset_lists:
-            while True:
-                id_list = [entry.id for entry in asset_list.limit(500)]
-
-                if not id_list:
-                    break
-
-                delete_count += self._deleteAssets(asset_table, id_list)
-
-
-        return delete_count
+        return self._deleteAssetQueries(asset_lists)
 
 
     def flushDaytime(self, camera_id):
@@ -6390,11 +6574,6 @@ class AjaxSystemInfoView(BaseView):
         ## no startrail videos
 
 
-        ### Getting IDs first then deleting each file is faster than deleting all files with
-        ### thumbnails with a single query.  Deleting associated thumbnails causes sqlalchemy
-        ### to recache after every delete which cause a 1-5 second lag for each delete
-
-
         asset_lists = [
             (image_query, IndiAllSkyDbImageTable),
             (fits_image_query, IndiAllSkyDbFitsImageTable),
@@ -6406,39 +6585,18 @@ class AjaxSystemInfoView(BaseView):
         ]
 
 
-        delete_count = 0
-        for asset_list, asset_table in asset_lists:
-            while True:
-                id_list = [entry.id for entry in asset_list.limit(500)]
+        return self._deleteAssetQueries(asset_lists)
 
-                if not id_list:
-                    break
-
-                delete_count += self._deleteAssets(asset_table, id_list)
-
-
-        return delete_count
 
+    def _deleteAssetQueries(self, asset_lists):
+        asset_expire = IndiAllSkyAssetExpire(
+            chunk_size=self.indi_allsky_config.get('ASSET_EXPIRE', {}).get('CHUNK_SIZE', 500),
+            unlink_threads=self.indi_allsky_config.get('ASSET_EXPIRE', {}).get('UNLINK_THREADS', 4),
+        )
 
-    def _deleteAssets(self, table, entry_id_list):
         delete_count = 0
-        for entry_id in entry_id_list:
-            entry = table.query\
-                .filter(table.id == entry_id)\
-                .one()
-
-            app.logger.info('Removing %s entry: %s', entry.__class__.__name__, entry.filename)
-
-            try:
-                entry.deleteAsset()
-            except OSError as e:
-                app.logger.error('Cannot remove file: %s', str(e))
-                continue
-
-            db.session.delete(entry)
-            db.session.commit()
-
-            delete_count += 1
+        for asset_list, asset_table in asset_lists:
+            delete_count += asset_expire.deleteQuery(asset_table, asset_list)
 
         return delete_count
 
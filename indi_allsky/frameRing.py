@@ -0,0 +1,140 @@
+from multiprocessing import Array
+from multiprocessing import shared_memory
+import logging
+
+import numpy
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyFrameRing(object):
+    """Preallocated shared memory slots to pass frames from the capture process to the image worker"""
+
+    SLOT_FREE    = 0
+    SLOT_WRITING = 1
+    SLOT_READY   = 2
+
+
+    def __init__(self, slot_count, slot_bytes):
+        # This must be created in the main process before the workers are started
+        self._slot_count = int(slot_count)
+        self._slot_bytes = int(slot_bytes)
+
+        self._slot_state_av = Array('i', [self.SLOT_FREE for x in range(self._slot_count)])
+
+        self._shm_list = list()
+        for x in range(self._slot_count):
+            shm = shared_memory.SharedMemory(create=True, size=self._slot_bytes)
+            self._shm_list.append(shm)
+
+
+        logger.info('Allocated %d shared memory frame slots (%0.1f MB each)', self._slot_count, self._slot_bytes / 1024 / 1024)
+
+
+    @property
+    def slot_count(self):
+        return self._slot_count
+
+    @property
+    def slot_bytes(self):
+        return self._slot_bytes
+
+
+    def acquire(self):
+        with self._slot_state_av.get_lock():
+            for idx in range(self._slot_count):
+                if self._slot_state_av[idx] == self.SLOT_FREE:
+                    self._slot_state_av[idx] = self.SLOT_WRITING
+                    return idx
+
+        return None
+
+
+    def release(self, idx):
+        with self._slot_state_av.get_lock():
+            self._slot_state_av[idx] = self.SLOT_FREE
+
+
+    def resetWriting(self):
+        # slots left behind by a capture process that exited during a write
+        with self._slot_state_av.get_lock():
+            for idx in range(self._slot_count):
+                if self._slot_state_av[idx] == self.SLOT_WRITING:
+                    self._slot_state_av[idx] = self.SLOT_FREE
+
+
+    def resetAll(self):
+        with self._slot_state_av.get_lock():
+            for idx in range(self._slot_count):
+                self._slot_state_av[idx] = self.SLOT_FREE
+
+
+    def putFrame(self, data, header):
+        # Returns slot metadata for the image queue, None if the frame cannot be stored
+        if data.nbytes > self._slot_bytes:
+            logger.warning('Frame (%0.1f MB) exceeds shared memory slot size', data.nbytes / 1024 / 1024)
+            return None
+
+
+        idx = self.acquire()
+        if isinstance(idx, type(None)):
+            logger.warning('No free shared memory frame slots')
+            return None
+
+
+        slot_data = self._slotArray(idx, data.shape, data.dtype)
+        slot_data[:] = data
+
+
+        header = header.copy()
+
+        # slot data is already scaled
+        for key in ('BZERO', 'BSCALE'):
+            if key in header:
+                del header[key]
+
+
+        with self._slot_state_av.get_lock():
+            self._slot_state_av[idx] = self.SLOT_READY
+
+
+        frame_dict = {
+            'slot'   : idx,
+            'shape'  : list(data.shape),
+            'dtype'  : data.dtype.str,
+            'header' : header.tostring(),
+        }
+
+        return frame_dict
+
+
+    def getFrameData(self, frame_dict):
+        # numpy array backed by the shared memory slot, no data is copied
+        return self._slotArray(frame_dict['slot'], frame_dict['shape'], numpy.dtype(frame_dict['dtype']))
+
+
+    def getHdulist(self, frame_dict):
+        from astropy.io import fits
+
+        data = self.getFrameData(frame_dict)
+        header = fits.Header.fromstring(frame_dict['header'])
+
+        hdu = fits.PrimaryHDU(data=data, header=header)
+        hdu.update_header()  # populates BITPIX, NAXIS, etc
+
+        return fits.HDUList([hdu])
+
+
+    def close(self, unlink=False):
+        for shm in self._shm_list:
+            shm.close()
+
+            if unlink:
+                try:
+                    shm.unlink()
+                except FileNotFoundError:
+                    pass
+
+
+    def _slotArray(self, idx, shape, dtype):
+        return numpy.ndarray(shape, dtype=dtype, buffer=self._shm_list[idx].buf)
@@ -4,7 +4,6 @@ import json
 import re
 from pathlib import Path
 from datetime import datetime
-from datetime import timedelta
 from datetime import timezone
 import time
 import tempfile
@@ -33,6 +32,8 @@ from . import constants
 from . import asi676mc
 
 from .processing import ImageProcessor
+from .nightAccumulator import IndiAllSkyNightAccumulator
+from .imageHistogram import IndiAllSkyImageHistogram
 from .miscUpload import miscUpload
 from .adsb import AdsbAircraftHttpWorker
 
@@ -49,7 +50,6 @@ from .flask.models import IndiAllSkyDbFitsImageTable
 from .flask.models import IndiAllSkyDbImageTable
 from .flask.models import IndiAllSkyDbTaskQueueTable
 
-from sqlalchemy import func
 #from sqlalchemy.orm.exc import NoResultFound
 
 from .exceptions import TimeOutException
@@ -65,10 +65,6 @@ logger = logging.getLogger('indi_allsky')
 
 class ImageWorker(Process):
 
-    sqm_history_minutes = 30
-    stars_history_minutes = 30
-
-
     def __init__(
         self,
         idx,
@@ -84,6 +80,7 @@ class ImageWorker(Process):
         sensors_user_av,
         night_av,
         astro_av,
+        frame_ring=None,
     ):
         super(ImageWorker, self).__init__()
 
@@ -105,6 +102,8 @@ class ImageWorker(Process):
         self.night_av = night_av
         self.astro_av = astro_av
 
+        self.frame_ring = frame_ring
+
         self.filename_t = 'ccd{0:d}_{1:s}.{2:s}'
 
         self.adsb_worker = None
@@ -169,6 +168,11 @@ class ImageWorker(Process):
         self.pre_hook_datajson_name_p = None
 
 
+        self._night_accumulator = None
+
+        self._image_histogram = IndiAllSkyImageHistogram(self.config)
+
+
         self.next_save_fits_offset = self.config.get('IMAGE_SAVE_FITS_PERIOD', 7200)
         self.next_save_fits_time = time.time() + self.next_save_fits_offset
 
@@ -247,6 +251,8 @@ class ImageWorker(Process):
             try:
                 i_dict = self.image_q.get(timeout=23)  # prime number
             except queue.Empty:
+                # idle time is used to store the accumulated keogram/star trail
+                self._checkpointNightAccumulator()
                 continue
 
 
@@ -256,6 +262,7 @@ class ImageWorker(Process):
 
             if self._shutdown:
                 self.image_processor.realtimeKeogramDataSave()
+                self._checkpointNightAccumulator()
 
                 logger.warning('Goodbye')
 
@@ -263,8 +270,12 @@ class ImageWorker(Process):
 
 
             # new context for every task, reduces the effects of caching
-            with app.app_context():
-                self.processImage(i_dict)
+            try:
+                with app.app_context():
+                    self.processImage(i_dict)
+            finally:
+                if i_dict.get('frame'):
+                    self.releaseSharedFrame(i_dict['frame'])
 
 
     def processImage(self, i_dict):
@@ -297,7 +308,15 @@ class ImageWorker(Process):
         #filename_t = task.data.get('filename_t')
         ###
 
-        filename_p = Path(i_dict['filename'])
+        frame_dict = i_dict.get('frame')
+        if frame_dict:
+            # frame data is in a shared memory slot
+            filename_p = None
+            frame_hdulist = self.frame_ring.getHdulist(frame_dict)
+        else:
+            filename_p = Path(i_dict['filename'])
+            frame_hdulist = None
+
         exposure = i_dict['exposure']
         gain = i_dict['gain']
         binning = i_dict['binning']
@@ -315,7 +334,7 @@ class ImageWorker(Process):
         libcamera_ccm = i_dict.get('libcamera_ccm')
 
 
-        if self.config['CAMERA_INTERFACE'].startswith('libcamera_') or self.config['CAMERA_INTERFACE'].startswith('mqtt_'):
+        if filename_p and (self.config['CAMERA_INTERFACE'].startswith('libcamera_') or self.config['CAMERA_INTERFACE'].startswith('mqtt_')):
             if filename_p.suffix == '.dng':
                 self.libcamera_raw = True
                 self.image_processor.libcamera_raw = True
@@ -328,17 +347,18 @@ class ImageWorker(Process):
             self.filename_t = filename_t
 
 
-        if not filename_p.exists():
-            logger.error('Frame not found: %s', filename_p)
-            #task.setFailed('Frame not found: {0:s}'.format(str(filename_p)))
-            return
+        if filename_p:
+            if not filename_p.exists():
+                logger.error('Frame not found: %s', filename_p)
+                #task.setFailed('Frame not found: {0:s}'.format(str(filename_p)))
+                return
 
 
-        image_size = filename_p.stat().st_size
-        if image_size == 0:
-            logger.error('Frame is empty: %s', filename_p)
-            filename_p.unlink()
-            return
+            image_size = filename_p.stat().st_size
+            if image_size == 0:
+                logger.error('Frame is empty: %s', filename_p)
+                filename_p.unlink()
+                return
 
         #logger.info('Image size: %0.2fMB', image_size / 1024 / 1024)
 
@@ -398,10 +418,12 @@ class ImageWorker(Process):
                 exp_elapsed,
                 camera,
                 detected_camera_name=detected_camera_name,
+                hdulist=frame_hdulist,
             )
         except BadImage as e:
             logger.error('Bad Image: %s', str(e))
-            filename_p.unlink()
+            if filename_p:
+                filename_p.unlink()
             #task.setFailed('Bad Image: {0:s}'.format(str(filename_p)))
             return
 
@@ -411,15 +433,17 @@ class ImageWorker(Process):
         # therefore contain the restored mosaic; diagnostic FITS below retain
         # the untouched camera input when calibration evidence is requested.
         self.image_processor.correct_asi676mc_frame(i_ref)
-        try:
-            self.capture_asi676mc_diagnostic_fits(filename_p, i_ref, camera)
-        except Exception:
-            logger.exception(
-                'Unexpected error while capturing ASI676MC diagnostic FITS'
-            )
+        if filename_p:
+            # shared memory frames are not used when diagnostic FITS are enabled
+            try:
+                self.capture_asi676mc_diagnostic_fits(filename_p, i_ref, camera)
+            except Exception:
+                logger.exception(
+                    'Unexpected error while capturing ASI676MC diagnostic FITS'
+                )
 
 
-        filename_p.unlink()  # original file is no longer needed
+            filename_p.unlink()  # original file is no longer needed
 
 
         self.image_count += 1
@@ -853,6 +877,12 @@ class ImageWorker(Process):
                 'camera_sqm_raw_mag' : self.image_processor.camera_sqm_raw_mag,
             }
 
+
+            image_histogram = self.calculateHistogram(self.image_processor.image, i_ref.binning)
+            if image_histogram:
+                image_add_data['image_stats'] = image_histogram[1]
+
+
             asi676mc_repair_result = i_ref.asi676mc_repair_result
             if (
                 asi676mc_repair_result
@@ -928,6 +958,14 @@ class ImageWorker(Process):
             self._set_asi676mc_cached_image_id(i_ref, image_entry.id)
 
 
+            if image_histogram:
+                self.storeHistogram(image_entry, image_histogram[0])
+
+
+            if not image_metadata.get('exclude'):
+                self._accumulateNight(self.image_processor.image, i_ref, camera, new_filename, image_metadata)
+
+
             image_thumbnail_metadata = {
                 'type'       : constants.THUMBNAIL,
                 'origin'     : constants.IMAGE,
@@ -1276,6 +1314,7 @@ class ImageWorker(Process):
             'local_file'   : str(tmp_metadata_name_p),
             'remote_file'  : str(remote_file_p),
             'remove_local' : True,
+            'coalesce'     : True,  # only the newest pending upload is sent
         }
 
         upload_task = IndiAllSkyDbTaskQueueTable(
@@ -1289,49 +1328,67 @@ class ImageWorker(Process):
         self.upload_q.put({'task_id' : upload_task.id})
 
 
-    def getSqmData(self, camera_id):
-        now_minus_minutes = datetime.now() - timedelta(minutes=self.sqm_history_minutes)
-
-        sqm_images = IndiAllSkyDbImageTable.query\
-            .add_columns(
-                func.max(IndiAllSkyDbImageTable.sqm).label('image_max_sqm'),
-                func.min(IndiAllSkyDbImageTable.sqm).label('image_min_sqm'),
-                func.avg(IndiAllSkyDbImageTable.sqm).label('image_avg_sqm'),
-            )\
-            .join(IndiAllSkyDbCameraTable)\
-            .filter(IndiAllSkyDbCameraTable.id == camera_id)\
-            .filter(IndiAllSkyDbImageTable.createDate > now_minus_minutes)\
-            .first()
+    def releaseSharedFrame(self, frame_dict):
+        slot_data = self.frame_ring.getFrameData(frame_dict)
+
+        # images retained for stacking must not reference the slot after it is reused
+        for i_ref in self.image_processor.image_list:
+            if isinstance(i_ref, type(None)):
+                continue
+
+            if numpy.may_share_memory(i_ref.hdulist[0].data, slot_data):
+                i_ref.hdulist[0].data = numpy.array(i_ref.hdulist[0].data)
+
+            if not isinstance(i_ref.opencv_data, type(None)):
+                if numpy.may_share_memory(i_ref.opencv_data, slot_data):
+                    i_ref.opencv_data = numpy.array(i_ref.opencv_data)
+
+
+        self.frame_ring.release(frame_dict['slot'])
+
 
+    def calculateHistogram(self, image, binning):
+        try:
+            return self._image_histogram.calculate(image, binning)
+        except Exception:
+            logger.exception('Error calculating histogram')
+            return None
+
+
+    def storeHistogram(self, image_entry, histogram_data):
+        # the chart view serves the latest histogram without reading the image
+        histogram_state = {
+            'image_id'  : image_entry.id,
+            'histogram' : histogram_data,
+        }
+
+        try:
+            self._miscDb.setState(IndiAllSkyImageHistogram.state_key_tmpl.format(image_entry.camera_id), json.dumps(histogram_state))
+        except Exception:
+            logger.exception('Error storing histogram')
+
+
+    def getSqmData(self, camera_id):
+        # rolling window maintained by addImage
+        sqm_summary = self._miscDb.getImageStats(camera_id).summary(time.time())['sqm']
 
         sqm_data = {
-            'max' : sqm_images.image_max_sqm,
-            'min' : sqm_images.image_min_sqm,
-            'avg' : sqm_images.image_avg_sqm,
+            'max' : sqm_summary['max'],
+            'min' : sqm_summary['min'],
+            'avg' : sqm_summary['avg'],
         }
 
         return sqm_data
 
 
     def getStarsData(self, camera_id):
-        now_minus_minutes = datetime.now() - timedelta(minutes=self.stars_history_minutes)
-
-        stars_images = IndiAllSkyDbImageTable.query\
-            .add_columns(
-                func.max(IndiAllSkyDbImageTable.stars).label('image_max_stars'),
-                func.min(IndiAllSkyDbImageTable.stars).label('image_min_stars'),
-                func.avg(IndiAllSkyDbImageTable.stars).label('image_avg_stars'),
-            )\
-            .join(IndiAllSkyDbCameraTable)\
-            .filter(IndiAllSkyDbCameraTable.id == camera_id)\
-            .filter(IndiAllSkyDbImageTable.createDate > now_minus_minutes)\
-            .first()
-
+        # rolling window maintained by addImage
+        stars_summary = self._miscDb.getImageStats(camera_id).summary(time.time())['stars']
 
         stars_data = {
-            'max' : stars_images.image_max_stars,
-            'min' : stars_images.image_min_stars,
-            'avg' : stars_images.image_avg_stars,
+            'max' : stars_summary['max'],
+            'min' : stars_summary['min'],
+            'avg' : stars_summary['avg'],
         }
 
         return stars_data
@@ -2603,6 +2660,72 @@ class ImageWorker(Process):
         tmpfile_name.unlink()
 
 
+    def _accumulateNight(self, image, i_ref, camera, image_file_p, image_metadata):
+        # The keogram and star trail for the night are built as images arrive,
+        # the end of night task only processes images after the last checkpoint
+        if not self.config.get('NIGHT_ACCUMULATOR', {}).get('ENABLE', True):
+            return
+
+
+        night = bool(image_metadata['night'])
+
+        if self._night_accumulator and not self._night_accumulator.matches(camera.id, i_ref.day_date, night):
+            # store the final state for the end of night processing
+            self._night_accumulator.checkpoint()
+            self._night_accumulator = None
+
+
+        try:
+            if not self._night_accumulator:
+                detection_mask_dict = self.image_processor.detection_mask
+
+                self._night_accumulator = IndiAllSkyNightAccumulator.load(
+                    self.config,
+                    camera,
+                    i_ref.day_date,
+                    night,
+                    mask=detection_mask_dict,
+                )
+
+                if not self._night_accumulator:
+                    # images captured before a restart without a checkpoint will cause a full rescan
+                    self._night_accumulator = IndiAllSkyNightAccumulator(
+                        self.config,
+                        camera,
+                        i_ref.day_date,
+                        night,
+                        mask=detection_mask_dict,
+                    )
+
+                IndiAllSkyNightAccumulator.expireCheckpoints(self.config, camera.id)
+
+
+            self._night_accumulator.add(
+                image,
+                image_file_p,
+                image_metadata['binmode'],
+                image_metadata['createDate'],
+                adu=image_metadata['adu'],
+                star_count=image_metadata['stars'],
+            )
+        except Exception:
+            logger.exception('Night accumulator failed, end of night processing will use a full rescan')
+            self._night_accumulator = None
+            return
+
+
+        checkpoint_interval = self.config.get('NIGHT_ACCUMULATOR', {}).get('CHECKPOINT_INTERVAL', 25)
+        if self._night_accumulator.frame_count % checkpoint_interval == 0:
+            self._night_accumulator.checkpoint()
+
+
+    def _checkpointNightAccumulator(self):
+        if not self._night_accumulator:
+            return
+
+        self._night_accumulator.checkpoint()
+
+
     def write_realtime_keogram(self, data, camera):
         if isinstance(data, type(None)):
             logger.warning('Realtime keogram data empty')
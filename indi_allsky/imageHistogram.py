@@ -0,0 +1,168 @@
+from pathlib import Path
+import logging
+
+import numpy
+import cv2
+
+from .maskProcessing import MaskProcessor
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyImageHistogram(object):
+    """Histograms and basic statistics of the processed image
+
+    The detection mask (or the SQM RoI) is transformed to match the processed
+    image, the same area used by the chart histograms.
+    """
+
+    state_key_tmpl = 'IMAGE_HISTOGRAM_CCD{0:d}'
+
+    percentiles = (5, 25, 50, 75, 95)
+
+
+    def __init__(self, config):
+        self.config = config
+
+        self._mask_cache = dict()  # (binning, height, width): mask
+
+
+    def calculate(self, image, binning):
+        # returns histograms (lists of 256 counts) and statistics per channel
+        image_height, image_width = image.shape[:2]
+
+        mask = self.getMask(binning, image_height, image_width)
+
+
+        if len(image.shape) == 2:
+            channels = (('gray', 0),)
+        else:
+            channels = (('blue', 0), ('green', 1), ('red', 2))
+
+
+        histogram_data = dict()
+        stats_data = dict()
+        for name, channel in channels:
+            hist = cv2.calcHist([image], [channel], mask, [256], [0, 256]).reshape(-1).astype(numpy.int64)
+
+            histogram_data[name] = hist.tolist()
+            stats_data[name] = self.histogramStats(hist)
+
+
+        return histogram_data, stats_data
+
+
+    @classmethod
+    def histogramStats(cls, hist):
+        pixels = int(hist.sum())
+
+        if not pixels:
+            return {}
+
+
+        stats = {
+            'mean' : round(float(numpy.dot(hist, numpy.arange(hist.size))) / pixels, 2),
+        }
+
+        cumulative = numpy.cumsum(hist)
+        for p in cls.percentiles:
+            stats['p{0:d}'.format(p)] = int(numpy.searchsorted(cumulative, pixels * p / 100))
+
+        stats['median'] = stats['p50']
+
+        return stats
+
+
+    def getMask(self, binning, image_height, image_width):
+        mask_key = (int(binning), image_height, image_width)
+
+        if mask_key not in self._mask_cache:
+            self._mask_cache[mask_key] = self._buildMask(*mask_key)
+
+        return self._mask_cache[mask_key]
+
+
+    def _buildMask(self, binning, image_height, image_width):
+        detection_mask = self._loadDetectionMask(binning)
+
+        if not isinstance(detection_mask, type(None)):
+            if detection_mask.shape[:2] == (image_height, image_width):
+                return detection_mask
+
+            logger.error('Detection mask does not match image dimensions, using SQM RoI for histogram')
+
+
+        mask = numpy.zeros((image_height, image_width), dtype=numpy.uint8)
+
+        sqm_roi = self.config.get('SQM_ROI', [])
+
+        try:
+            x1 = int(sqm_roi[0] / binning)
+            y1 = int(sqm_roi[1] / binning)
+            x2 = int(sqm_roi[2] / binning)
+            y2 = int(sqm_roi[3] / binning)
+        except IndexError:
+            sqm_fov_div = self.config.get('SQM_FOV_DIV', 4)
+            x1 = int((image_width / 2) - (image_width / sqm_fov_div))
+            y1 = int((image_height / 2) - (image_height / sqm_fov_div))
+            x2 = int((image_width / 2) + (image_width / sqm_fov_div))
+            y2 = int((image_height / 2) + (image_height / sqm_fov_div))
+
+
+        mask[y1:y2, x1:x2] = 255
+
+        return mask
+
+
+    def _loadDetectionMask(self, binning):
+        detect_mask = self.config.get('DETECT_MASK', '')
+
+        if not detect_mask:
+            return None
+
+
+        detect_mask_p = Path(detect_mask)
+
+        try:
+            if not detect_mask_p.is_file():
+                logger.error('%s is not a file', detect_mask_p)
+                return None
+        except PermissionError as e:
+            logger.error(str(e))
+            return None
+
+
+        mask_data = cv2.imread(str(detect_mask_p), cv2.IMREAD_GRAYSCALE)  # mono
+        if isinstance(mask_data, type(None)):
+            logger.error('%s is not a valid image', detect_mask_p)
+            return None
+
+
+        if binning > 1:
+            mask_height, mask_width = mask_data.shape[:2]
+            mask_data = cv2.resize(mask_data, (int(mask_width / binning), int(mask_height / binning)), interpolation=cv2.INTER_AREA)
+
+
+        ### any intermediate values will be set to 255
+        mask_data[mask_data > 0] = 255
+
+
+        mask_processor = MaskProcessor(
+            self.config,
+        )
+
+        mask_processor.binning = binning
+
+        # masks need to be rotated, flipped, cropped for post-processed images
+        mask_processor.image = mask_data
+
+        mask_processor.rotate_90()
+        mask_processor.rotate_angle()
+        mask_processor.flip_v()
+        mask_processor.flip_h()
+        mask_processor.crop_image()
+        mask_processor.scale_image()
+        mask_processor.add_border()
+
+
+        return mask_processor.image
@@ -0,0 +1,146 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import io
+import time
+import logging
+
+import cv2
+import numpy
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyImagePrefetch(object):
+    """Decode upcoming image files in a thread pool while they are consumed in order"""
+
+    def __init__(self, threads=3, queue_depth=8):
+        self._threads = max(int(threads), 1)
+        self._queue_depth = max(int(queue_depth), 1)
+
+        self.decode_elapsed_s = 0.0  # summed across all threads
+        self.wait_elapsed_s = 0.0  # time the consumer was blocked on decoding
+        self.decode_count = 0
+
+
+    @property
+    def threads(self):
+        return self._threads
+
+    @property
+    def queue_depth(self):
+        return self._queue_depth
+
+
+    def iterate(self, items):
+        # items are (key, image_file_p) tuples
+        # yields (key, image_file_p, image_data, image_mtime) in the same order, unreadable files are skipped
+        pending = deque()
+
+        executor = ThreadPoolExecutor(max_workers=self._threads, thread_name_prefix='image_prefetch')
+
+        try:
+            for key, image_file_p in items:
+                pending.append((key, image_file_p, executor.submit(self._decode, image_file_p)))
+
+                if len(pending) < self._queue_depth:
+                    continue
+
+                result = self._result(pending.popleft())
+                if result:
+                    yield result
+
+
+            while pending:
+                result = self._result(pending.popleft())
+                if result:
+                    yield result
+        finally:
+            # consumer stopped early
+            for _, _, future in pending:
+                future.cancel()
+
+            executor.shutdown(wait=True)
+
+
+    def logStats(self, label):
+        logger.info(
+            '%s - decoded %d images in %0.1f s (%d threads, depth %d), waited %0.1f s for decoding',
+            label,
+            self.decode_count,
+            self.decode_elapsed_s,
+            self._threads,
+            self._queue_depth,
+            self.wait_elapsed_s,
+        )
+
+
+    def _result(self, pending_item):
+        key, image_file_p, future = pending_item
+
+        wait_start = time.time()
+        image_data, image_mtime, decode_elapsed_s = future.result()
+        self.wait_elapsed_s += time.time() - wait_start
+
+        self.decode_elapsed_s += decode_elapsed_s
+
+        if isinstance(image_data, type(None)):
+            return None
+
+        self.decode_count += 1
+
+        return key, image_file_p, image_data, image_mtime
+
+
+    def _decode(self, image_file_p):
+        decode_start = time.time()
+
+        image_data, image_mtime = self.decodeImage(image_file_p)
+
+        return image_data, image_mtime, time.time() - decode_start
+
+
+    @staticmethod
+    def decodeImage(image_file_p):
+        # returns (None, None) if the file cannot be read
+        try:
+            image_stat = image_file_p.stat()
+        except FileNotFoundError:
+            logger.error('File not found: %s', image_file_p)
+            return None, None
+
+        if image_stat.st_size == 0:
+            return None, None
+
+
+        #logger.info('Reading file: %s', image_file_p)
+        if image_file_p.suffix in ('.jpg', '.jpeg'):
+            # simplejpeg releases the GIL while decoding
+            import simplejpeg
+
+            try:
+                with io.open(str(image_file_p), 'rb') as f_img:
+                    image_data = simplejpeg.decode_jpeg(f_img.read(), colorspace='BGR')
+            except ValueError as e:
+                logger.error('Unable to read image - %s: %s', str(e), image_file_p)
+                return None, None
+        elif image_file_p.suffix in ('.png',):
+            # opencv is faster than Pillow with PNG
+            image_data = cv2.imread(str(image_file_p), cv2.IMREAD_COLOR)
+
+            if isinstance(image_data, type(None)):
+                logger.error('Unable to read %s', image_file_p)
+                return None, None
+        else:
+            # Pillow supports remaining image types
+            import PIL
+            from PIL import Image
+
+            try:
+                with Image.open(str(image_file_p)) as img_pil:
+                    image_data = cv2.cvtColor(numpy.array(img_pil), cv2.COLOR_RGB2BGR)
+            except PIL.UnidentifiedImageError:
+                logger.error('Unable to read image: %s', image_file_p)
+                return None, None
+
+
+        return image_data, image_stat.st_mtime
@@ -7,6 +7,7 @@ from PIL import ImageDraw
 import math
 import time
 #import copy
+from collections import deque
 from datetime import datetime
 from datetime import timezone
 from pathlib import Path
@@ -19,6 +20,123 @@ from .exceptions import KeogramMismatchException
 logger = logging.getLogger('indi_allsky')
 
 
+class KeogramColumnBuffer(object):
+    """Preallocated column storage for keogram data
+
+    With a capacity the buffer is a ring and the oldest column is overwritten,
+    otherwise the storage doubles in size when full.
+    """
+
+    def __init__(self, height, channels, dtype, capacity=None, initial_columns=512):
+        self._height = int(height)
+        self._channels = int(channels)
+        self._dtype = numpy.dtype(dtype)
+
+        if capacity:
+            self._capacity = int(capacity)
+            self._fixed = True
+        else:
+            self._capacity = int(initial_columns)
+            self._fixed = False
+
+
+        self._data = numpy.zeros([self._height, self._capacity, self._channels], dtype=self._dtype)
+
+        self._start = 0
+        self._count = 0
+
+        self._ordered = None  # cached copy of wrapped data
+
+
+    def __len__(self):
+        return self._count
+
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def shape(self):
+        return (self._height, self._count, self._channels)
+
+
+    @property
+    def data(self):
+        # columns in order, oldest first
+        if self._start + self._count <= self._capacity:
+            # contiguous, no copy required
+            return self._data[:, self._start:self._start + self._count]
+
+
+        if isinstance(self._ordered, type(None)):
+            self._ordered = numpy.concatenate(self.segments(), axis=1)
+
+        return self._ordered
+
+
+    def segments(self):
+        # in order views of the stored columns without copying
+        end = self._start + self._count
+
+        if end <= self._capacity:
+            return [self._data[:, self._start:end]]
+
+        return [
+            self._data[:, self._start:],
+            self._data[:, :end - self._capacity],
+        ]
+
+
+    def append(self, column):
+        # accepts (height, 1, channels) or (height, channels)
+        if column.shape[0] != self._height or column.size != self._height * self._channels:
+            raise ValueError('Column shape {0} does not match keogram height {1:d}'.format(column.shape, self._height))
+
+
+        if self._count == self._capacity:
+            if self._fixed:
+                # overwrite the oldest column
+                self._data[:, self._start] = column.reshape(self._height, self._channels)
+                self._start = (self._start + 1) % self._capacity
+                self._ordered = None
+                return
+
+            self._grow()
+
+
+        idx = (self._start + self._count) % self._capacity
+        self._data[:, idx] = column.reshape(self._height, self._channels)
+        self._count += 1
+        self._ordered = None
+
+
+    def extend(self, data):
+        if data.shape[0] != self._height or data.shape[2] != self._channels:
+            raise ValueError('Data shape {0} does not match keogram height {1:d}'.format(data.shape, self._height))
+
+        if self._fixed:
+            # only the newest columns will be retained
+            data = data[:, -self._capacity:]
+
+        for x in range(data.shape[1]):
+            self.append(data[:, x])
+
+
+    def _grow(self):
+        new_data = numpy.zeros([self._height, self._capacity * 2, self._channels], dtype=self._dtype)
+        new_data[:, :self._count] = self.data
+
+        self._data = new_data
+        self._capacity *= 2
+        self._start = 0
+        self._ordered = None
+
+
 class KeogramGenerator(object):
 
     # label settings
@@ -26,10 +144,13 @@ class KeogramGenerator(object):
     line_length = 35
 
 
-    def __init__(self, config, skip_frames=0):
+    def __init__(self, config, skip_frames=0, max_entries=None):
         self.config = config
         self.skip_frames = skip_frames
 
+        # oldest entries are discarded when max_entries is reached
+        self._max_entries = max_entries
+
         self.process_count = 0
 
         self._angle = self.config['KEOGRAM_ANGLE']
@@ -58,10 +179,15 @@ class KeogramGenerator(object):
         self.rotated_width = None
         self.rotated_height = None
 
-        self._keogram_data = None
+        # source coordinates of the rotated center line
+        self._sampling_geometry = None
+        self._sampling_map_x = None
+        self._sampling_map_y = None
+
+        self._keogram_buffer = None
         self._keogram_final = None  # will contain final resized keogram
 
-        self._timestamps = list()
+        self._timestamps = deque(maxlen=self._max_entries)
         self.image_processing_elapsed_s = 0
 
         base_path  = Path(__file__).parent
@@ -136,16 +262,34 @@ class KeogramGenerator(object):
 
     @timestamps.setter
     def timestamps(self, new_timestamps):
-        self._timestamps = list(new_timestamps)
+        self._timestamps = deque(new_timestamps, maxlen=self._max_entries)
+
+
+    @property
+    def keogram_buffer(self):
+        return self._keogram_buffer
 
 
     @property
     def keogram_data(self):
-        return self._keogram_data
+        if isinstance(self._keogram_buffer, type(None)):
+            return None
+
+        return self._keogram_buffer.data
 
     @keogram_data.setter
     def keogram_data(self, new_data):
-        self._keogram_data = new_data
+        if isinstance(new_data, type(None)):
+            self._keogram_buffer = None
+            return
+
+        self._keogram_buffer = KeogramColumnBuffer(
+            new_data.shape[0],
+            new_data.shape[2],
+            new_data.dtype,
+            capacity=self._max_entries,
+        )
+        self._keogram_buffer.extend(new_data)
 
 
     @property
@@ -171,6 +315,34 @@ class KeogramGenerator(object):
         return self.keogram_final.shape
 
 
+    def getState(self):
+        # accumulated data for checkpointing
+        return {
+            'process_count'   : self.process_count,
+            'timestamps'      : list(self.timestamps),
+            'original_width'  : self.original_width,
+            'original_height' : self.original_height,
+            'rotated_width'   : self.rotated_width,
+            'rotated_height'  : self.rotated_height,
+            'keogram_data'    : self.keogram_data,
+        }
+
+
+    def setState(self, state):
+        self.process_count = int(state['process_count'])
+        self.timestamps = state['timestamps']
+
+        self.original_width = state['original_width']
+        self.original_height = state['original_height']
+        self.rotated_width = state['rotated_width']
+        self.rotated_height = state['rotated_height']
+
+        # the sampling map is rebuilt with the next image
+        self._sampling_geometry = None
+
+        self.keogram_data = state.get('keogram_data')
+
+
     def processImage(self, image, timestamp):
         self.process_count += 1
 
@@ -185,36 +357,24 @@ class KeogramGenerator(object):
         #logger.info('Original: %d x %d', image_width, image_height)
 
 
-        recenter_width = image_width + (abs(self.x_offset) * 2)
-        recenter_height = image_height + (abs(self.y_offset) * 2)
-        #logger.info('New: %d x %d', recenter_width, recenter_height)
-
-
-        recenter_image = numpy.zeros([recenter_height, recenter_width, 3], dtype=numpy.uint8)
-        recenter_image[
-            int((recenter_height / 2) - (image_height / 2) + self.y_offset):int((recenter_height / 2) + (image_height / 2) + self.y_offset),
-            int((recenter_width / 2) - (image_width / 2) - self.x_offset):int((recenter_width / 2) + (image_width / 2) - self.x_offset),
-        ] = image  # recenter the image circle in the new image
-
-
-        ### Draw a crosshair for reference
-        #cv2.line(f_image, (int(final_width / 2), 0), (int(final_width / 2), final_height), (0, 0, 128), 3)
-        #cv2.line(f_image, (0, int(final_height / 2)), (final_width, int(final_height / 2)), (0, 0, 128), 3)
-        #cv2.imwrite('/tmp/keogram_test.jpg', f_image, [cv2.IMWRITE_JPEG_QUALITY, 90])
-        #raise Exception()
-
+        geometry = (image_height, image_width, self.angle, self.x_offset, self.y_offset)
+        if geometry != self._sampling_geometry:
+            self._buildSamplingMap(image_height, image_width)
+            self._sampling_geometry = geometry
 
-        rotated_image = self.rotate(recenter_image)
 
+        # only the pixels along the center line are sampled
+        rotated_center_line = cv2.remap(
+            image,
+            self._sampling_map_x,
+            self._sampling_map_y,
+            cv2.INTER_LINEAR,
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=0,
+        ).reshape(self.rotated_height, 1, -1)
 
-        rot_height, rot_width = rotated_image.shape[:2]
-        self.rotated_height = rot_height
-        self.rotated_width = rot_width
 
-        rotated_center_line = rotated_image[:, [int(rot_width / 2)]]
-
-
-        if isinstance(self.keogram_data, type(None)):
+        if isinstance(self._keogram_buffer, type(None)):
             # this only happens on the first image
 
             new_shape = rotated_center_line.shape
@@ -223,7 +383,12 @@ class KeogramGenerator(object):
             new_dtype = rotated_center_line.dtype
             logger.info('New dtype: %s', new_dtype)
 
-            self.keogram_data = numpy.empty(new_shape, dtype=new_dtype)
+            self._keogram_buffer = KeogramColumnBuffer(
+                new_shape[0],
+                new_shape[2],
+                new_dtype,
+                capacity=self._max_entries,
+            )
 
 
         #if recenter_height != self.original_height or recenter_width != self.original_width:
@@ -233,17 +398,50 @@ class KeogramGenerator(object):
 
         # will raise ValueError if dimensions do not match
         try:
-            self.keogram_data = numpy.append(self.keogram_data, rotated_center_line, 1)
+            self._keogram_buffer.append(rotated_center_line)
         except ValueError as e:
             raise KeogramMismatchException from e
 
 
-        # set every image for reasons
+        self.image_processing_elapsed_s += time.time() - image_processing_start
+
+
+    def _buildSamplingMap(self, image_height, image_width):
+        # The keogram line is the center column of the recentered and rotated image.
+        # Rather than transforming every image, map the center column back to
+        # source image coordinates once per geometry.
+        recenter_width = image_width + (abs(self.x_offset) * 2)
+        recenter_height = image_height + (abs(self.y_offset) * 2)
+        #logger.info('New: %d x %d', recenter_width, recenter_height)
+
+        # position of the image within the recentered image
+        recenter_x1 = int((recenter_width / 2) - (image_width / 2) - self.x_offset)
+        recenter_y1 = int((recenter_height / 2) - (image_height / 2) + self.y_offset)
+
+
+        rot, bound_w, bound_h = self._rotationMatrix(recenter_width, recenter_height)
+
+        # warpAffine samples the source with the inverse transform
+        rot_inv = cv2.invertAffineTransform(rot)
+
+
+        center_x = int(bound_w / 2)
+        line_y = numpy.arange(bound_h, dtype=numpy.float64)
+
+        map_x = (rot_inv[0, 0] * center_x) + (rot_inv[0, 1] * line_y) + rot_inv[0, 2] - recenter_x1
+        map_y = (rot_inv[1, 0] * center_x) + (rot_inv[1, 1] * line_y) + rot_inv[1, 2] - recenter_y1
+
+        self._sampling_map_x = map_x.astype(numpy.float32).reshape(bound_h, 1)
+        self._sampling_map_y = map_y.astype(numpy.float32).reshape(bound_h, 1)
+
+
         self.original_height = recenter_height
         self.original_width = recenter_width
 
+        self.rotated_height = bound_h
+        self.rotated_width = bound_w
 
-        self.image_processing_elapsed_s += time.time() - image_processing_start
+        logger.info('Keogram sampling map: %d x %d image, %d px line', image_width, image_height, bound_h)
 
 
     def finalize(self, outfile, camera):
@@ -390,6 +588,15 @@ class KeogramGenerator(object):
 
     def rotate(self, image):
         height, width = image.shape[:2]
+
+        rot, bound_w, bound_h = self._rotationMatrix(width, height)
+
+        rotated = cv2.warpAffine(image, rot, (bound_w, bound_h))
+
+        return rotated
+
+
+    def _rotationMatrix(self, width, height):
         center_x = int(width / 2)
         center_y = int(height / 2)
 
@@ -404,9 +611,7 @@ class KeogramGenerator(object):
         rot[0, 2] += bound_w / 2 - center_x
         rot[1, 2] += bound_h / 2 - center_y
 
-        rotated = cv2.warpAffine(image, rot, (bound_w, bound_h))
-
-        return rotated
+        return rot, bound_w, bound_h
 
 
     def trimEdges(self, keogram):
@@ -1,5 +1,6 @@
 
 import math
+import itertools
 from pathlib import Path
 from datetime import datetime
 from datetime import timedelta
@@ -17,6 +18,8 @@ from .flask import create_app
 from .flask.models import IndiAllSkyDbCameraTable
 from .flask.models import IndiAllSkyDbLongTermKeogramTable
 
+from .longTermKeogramStore import LongTermKeogramStore
+
 
 app = create_app()
 
@@ -28,6 +31,9 @@ class LongTermKeogramGenerator(object):
     # label settings
     line_thickness = 2
 
+    chunk_days = 30  # limit memory while assembling the keogram
+    yield_rows = 50000  # rows per partition when streaming from the database
+
 
     def __init__(self, config):
         self.config = config
@@ -41,6 +47,8 @@ class LongTermKeogramGenerator(object):
         self._reverse = False
         self._label = True
 
+        self._store = LongTermKeogramStore(self.config)
+
 
         base_path  = Path(__file__).parent
         self.font_path  = base_path.joinpath('fonts')
@@ -116,17 +124,11 @@ class LongTermKeogramGenerator(object):
 
         if self.days == 42:
             # special condition to show all available data
-            first_entry = db.session.query(
-                IndiAllSkyDbLongTermKeogramTable.ts,
-            )\
-                .join(IndiAllSkyDbCameraTable)\
-                .filter(IndiAllSkyDbCameraTable.id == self.camera_id)\
-                .order_by(IndiAllSkyDbLongTermKeogramTable.ts.asc())\
-                .first()
-
+            first_ts = self.firstTimestamp()
 
-            first_date = datetime.fromtimestamp(first_entry.ts)
-            query_start_date = datetime.strptime(first_date.strftime('%Y%m%d_120000'), '%Y%m%d_%H%M%S')
+            if not isinstance(first_ts, type(None)):
+                first_date = datetime.fromtimestamp(first_ts)
+                query_start_date = datetime.strptime(first_date.strftime('%Y%m%d_120000'), '%Y%m%d_%H%M%S')
 
 
         query_start_ts = query_start_date.timestamp() - self.offset_seconds  # subtract offset
@@ -134,52 +136,21 @@ class LongTermKeogramGenerator(object):
 
 
         total_days = math.ceil((query_end_ts - query_start_ts) / 86400)
+        total_periods = periods_per_day * total_days
 
         query_start_offset = int(query_start_ts / self.alignment_seconds)
 
 
-        ltk_interval = cast(IndiAllSkyDbLongTermKeogramTable.ts / self.alignment_seconds, Integer).label('interval')  # cast is slightly faster than func.floor
-
-        q = db.session.query(
-            ltk_interval,
-            func.avg(IndiAllSkyDbLongTermKeogramTable.r1).label('r1_avg'),
-            func.avg(IndiAllSkyDbLongTermKeogramTable.b1).label('b1_avg'),
-            func.avg(IndiAllSkyDbLongTermKeogramTable.g1).label('g1_avg'),
-            func.avg(IndiAllSkyDbLongTermKeogramTable.r2).label('r2_avg'),
-            func.avg(IndiAllSkyDbLongTermKeogramTable.b2).label('b2_avg'),
-            func.avg(IndiAllSkyDbLongTermKeogramTable.g2).label('g2_avg'),
-            func.avg(IndiAllSkyDbLongTermKeogramTable.r3).label('r3_avg'),
-            func.avg(IndiAllSkyDbLongTermKeogramTable.b3).label('b3_avg'),
-            func.avg(IndiAllSkyDbLongTermKeogramTable.g3).label('g3_avg'),
-            func.avg(IndiAllSkyDbLongTermKeogramTable.r4).label('r4_avg'),
-            func.avg(IndiAllSkyDbLongTermKeogramTable.b4).label('b4_avg'),
-            func.avg(IndiAllSkyDbLongTermKeogramTable.g4).label('g4_avg'),
-            func.avg(IndiAllSkyDbLongTermKeogramTable.r5).label('r5_avg'),
-            func.avg(IndiAllSkyDbLongTermKeogramTable.b5).label('b5_avg'),
-            func.avg(IndiAllSkyDbLongTermKeogramTable.g5).label('g5_avg'),
-        )\
-            .join(IndiAllSkyDbCameraTable)\
-            .filter(IndiAllSkyDbCameraTable.id == self.camera_id)\
-            .filter(IndiAllSkyDbLongTermKeogramTable.ts >= query_start_ts)\
-            .filter(IndiAllSkyDbLongTermKeogramTable.ts < query_end_ts)\
-            .group_by(ltk_interval)
-
-
-        ### order is proably unnecessary
-        #    .order_by(ltk_interval.asc())
+        period_data, period_counts = self.getStoreData(query_start_offset, total_periods)
 
-        #logger.info('Rows: %d', q.count())
 
+        legacy_data = self.getLegacyData(query_start_ts, query_end_ts, query_start_offset, total_periods)
+        if not isinstance(legacy_data, type(None)):
+            # rows that have not been compacted into the store
+            legacy_period_data, legacy_mask = legacy_data
 
-        # modifying a native array is faster than a numpy array
-        data = [[0, 0, 0]] * ((periods_per_day * total_days) * self.period_pixels)
-
-
-        if db.engine.dialect.name == 'mysql':
-            query_limit = 300000  # limit memory impact on database
-        else:
-            # assume sqlite
-            query_limit = 300000
+            fill_mask = legacy_mask & (period_counts == 0)
+            period_data[fill_mask] = legacy_period_data[fill_mask]
 
 
         # generate a list of days
@@ -193,68 +164,184 @@ class LongTermKeogramGenerator(object):
             })
 
 
-        i = 0
-        while i % query_limit == 0:
-            q_offset = q.limit(query_limit).offset(i)
+        # each day is period_pixels rows high
+        keogram_data = numpy.reshape(period_data, (total_days, periods_per_day, LongTermKeogramStore.pixels, 3))[:, :, :self.period_pixels]
+        keogram_data = numpy.ascontiguousarray(numpy.transpose(keogram_data, (0, 2, 1, 3)))
+        keogram_data = numpy.reshape(keogram_data, ((total_days * self.period_pixels), periods_per_day, 3))
+        #logger.info(keogram_data.shape)
+
 
-            for row in q_offset:
-                second_offset = row.interval - query_start_offset
-                day = int(second_offset / periods_per_day)
-                index = second_offset + (day * (periods_per_day * (self.period_pixels - 1)))
+        if not self.reverse:
+            # newer data at top
+            keogram_data = numpy.ascontiguousarray(numpy.flip(keogram_data, axis=0))
+            day_list.reverse()
 
 
-                if self.period_pixels == 5:
-                    data[index + (periods_per_day * 4)] = row.b5_avg, row.g5_avg, row.r5_avg
-                    data[index + (periods_per_day * 3)] = row.b4_avg, row.g4_avg, row.r4_avg
-                    data[index + (periods_per_day * 2)] = row.b3_avg, row.g3_avg, row.r3_avg
-                    data[index + (periods_per_day * 1)] = row.b2_avg, row.g2_avg, row.r2_avg
+        #app.logger.info('Days: %s', str(day_list))
+
+        # apply time labels
+        keogram_data = self.applyLabels(keogram_data, day_list)
 
-                elif self.period_pixels == 4:
-                    data[index + (periods_per_day * 3)] = row.b4_avg, row.g4_avg, row.r4_avg
-                    data[index + (periods_per_day * 2)] = row.b3_avg, row.g3_avg, row.r3_avg
-                    data[index + (periods_per_day * 1)] = row.b2_avg, row.g2_avg, row.r2_avg
 
-                elif self.period_pixels == 3:
-                    data[index + (periods_per_day * 2)] = row.b3_avg, row.g3_avg, row.r3_avg
-                    data[index + (periods_per_day * 1)] = row.b2_avg, row.g2_avg, row.r2_avg
+        return keogram_data
 
-                elif self.period_pixels == 2:
-                    data[index + (periods_per_day * 1)] = row.b2_avg, row.g2_avg, row.r2_avg
 
+    def firstTimestamp(self):
+        first_ts_list = list()
 
-                # always add 1 row
-                data[index] = row.b1_avg, row.g1_avg, row.r1_avg
+        store_first_ts = self._store.firstTimestamp(self.camera_id)
+        if not isinstance(store_first_ts, type(None)):
+            first_ts_list.append(store_first_ts)
 
-                i += 1
 
+        first_entry = db.session.query(
+            IndiAllSkyDbLongTermKeogramTable.ts,
+        )\
+            .join(IndiAllSkyDbCameraTable)\
+            .filter(IndiAllSkyDbCameraTable.id == self.camera_id)\
+            .order_by(IndiAllSkyDbLongTermKeogramTable.ts.asc())\
+            .first()
 
-        # convert to numpy array
-        numpy_data = numpy.array(data, dtype=numpy.uint8)
+        if first_entry:
+            first_ts_list.append(first_entry.ts)
 
 
-        keogram_data = numpy.reshape(numpy_data, ((total_days * self.period_pixels), periods_per_day, 3))
-        #logger.info(keogram_data.shape)
+        if not first_ts_list:
+            return None
 
+        return min(first_ts_list)
 
-        if not self.reverse:
-            # newer data at top
-            keogram_data = numpy.flip(keogram_data, axis=0)
-            day_list.reverse()
 
+    def getStoreData(self, start_period, total_periods):
+        # returns (total_periods, 5, 3) BGR averages and the image count per period
+        grid_seconds = self._store.grid_seconds
 
-        # sanity check
-        keogram_data = numpy.clip(keogram_data, 0, 255)
-        #keogram_data[keogram_data < 0] = 0
-        #keogram_data[keogram_data > 255] = 255
+        period_data = numpy.zeros((total_periods, LongTermKeogramStore.pixels * 3), dtype=numpy.uint8)
+        period_counts = numpy.zeros(total_periods, dtype=numpy.uint32)
 
+        chunk_periods = int(86400 / self.alignment_seconds) * self.chunk_days
 
-        #app.logger.info('Days: %s', str(day_list))
+        for chunk_start in range(0, total_periods, chunk_periods):
+            chunk_end = min(chunk_start + chunk_periods, total_periods)
 
-        # apply time labels
-        keogram_data = self.applyLabels(keogram_data, day_list)
+            # slots are assigned to the period containing the start of the slot
+            p0 = start_period + chunk_start
+            p1 = start_period + chunk_end
+            s0 = -((-p0 * self.alignment_seconds) // grid_seconds)  # ceil
+            s1 = -((-p1 * self.alignment_seconds) // grid_seconds)
 
+            grid_data = self._store.read(self.camera_id, s0, s1 - s0)
 
-        return keogram_data
+            grid_counts = grid_data[:, -1].astype(numpy.uint32)
+            if not grid_counts.any():
+                continue
+
+
+            # weighted average of the slots in each period
+            grid_sums = grid_data[:, :-1].astype(numpy.uint32) * grid_counts[:, None]
+
+            if self.alignment_seconds % grid_seconds == 0:
+                # every period has the same number of slots
+                slots_per_period = self.alignment_seconds // grid_seconds
+
+                sums = grid_sums.reshape((-1, slots_per_period, grid_sums.shape[1])).sum(axis=1)
+                counts = grid_counts.reshape((-1, slots_per_period)).sum(axis=1)
+            else:
+                slot_period = ((numpy.arange(s0, s1, dtype=numpy.int64) * grid_seconds) // self.alignment_seconds) - p0
+                period_index = numpy.searchsorted(slot_period, numpy.arange(chunk_end - chunk_start))
+
+                sums = numpy.add.reduceat(grid_sums, period_index, axis=0)
+                counts = numpy.add.reduceat(grid_counts, period_index)
+
+            used = counts > 0
+            period_data[chunk_start:chunk_end][used] = sums[used] // counts[used, None]
+            period_counts[chunk_start:chunk_end] = counts
+
+
+        return numpy.reshape(period_data, (total_periods, LongTermKeogramStore.pixels, 3)), period_counts
+
+
+    def getLegacyData(self, query_start_ts, query_end_ts, query_start_offset, total_periods):
+        # returns None if there are no database entries in the range
+        legacy_entry = db.session.query(
+            IndiAllSkyDbLongTermKeogramTable.id,
+        )\
+            .filter(IndiAllSkyDbLongTermKeogramTable.camera_id == self.camera_id)\
+            .filter(IndiAllSkyDbLongTermKeogramTable.ts >= query_start_ts)\
+            .filter(IndiAllSkyDbLongTermKeogramTable.ts < query_end_ts)\
+            .first()
+
+        if not legacy_entry:
+            return None
+
+
+        logger.warning('Long term keogram data found in database, run misc/longterm_keogram_compact.py to migrate')
+
+
+        ltk_interval = cast(IndiAllSkyDbLongTermKeogramTable.ts / self.alignment_seconds, Integer).label('interval')  # cast is slightly faster than func.floor
+
+        q = db.session.query(
+            ltk_interval,
+            func.avg(IndiAllSkyDbLongTermKeogramTable.b1).label('b1_avg'),
+            func.avg(IndiAllSkyDbLongTermKeogramTable.g1).label('g1_avg'),
+            func.avg(IndiAllSkyDbLongTermKeogramTable.r1).label('r1_avg'),
+            func.avg(IndiAllSkyDbLongTermKeogramTable.b2).label('b2_avg'),
+            func.avg(IndiAllSkyDbLongTermKeogramTable.g2).label('g2_avg'),
+            func.avg(IndiAllSkyDbLongTermKeogramTable.r2).label('r2_avg'),
+            func.avg(IndiAllSkyDbLongTermKeogramTable.b3).label('b3_avg'),
+            func.avg(IndiAllSkyDbLongTermKeogramTable.g3).label('g3_avg'),
+            func.avg(IndiAllSkyDbLongTermKeogramTable.r3).label('r3_avg'),
+            func.avg(IndiAllSkyDbLongTermKeogramTable.b4).label('b4_avg'),
+            func.avg(IndiAllSkyDbLongTermKeogramTable.g4).label('g4_avg'),
+            func.avg(IndiAllSkyDbLongTermKeogramTable.r4).label('r4_avg'),
+            func.avg(IndiAllSkyDbLongTermKeogramTable.b5).label('b5_avg'),
+            func.avg(IndiAllSkyDbLongTermKeogramTable.g5).label('g5_avg'),
+            func.avg(IndiAllSkyDbLongTermKeogramTable.r5).label('r5_avg'),
+        )\
+            .filter(IndiAllSkyDbLongTermKeogramTable.camera_id == self.camera_id)\
+            .group_by(ltk_interval)
+
+
+        legacy_period_data = numpy.zeros((total_periods, LongTermKeogramStore.pixels * 3), dtype=numpy.uint8)
+        legacy_mask = numpy.zeros(total_periods, dtype=bool)
+
+
+        row_width = 1 + (LongTermKeogramStore.pixels * 3)  # interval + BGR averages
+
+
+        # keyset pagination on ts, pages end on a period boundary so a group is never split
+        page_periods = int(86400 / self.alignment_seconds) * self.chunk_days
+
+        for page_start in range(0, total_periods, page_periods):
+            page_start_ts = max((query_start_offset + page_start) * self.alignment_seconds, query_start_ts)
+            page_end_ts = min((query_start_offset + page_start + page_periods) * self.alignment_seconds, query_end_ts)
+
+            q_page = q\
+                .filter(IndiAllSkyDbLongTermKeogramTable.ts >= page_start_ts)\
+                .filter(IndiAllSkyDbLongTermKeogramTable.ts < page_end_ts)
+
+            # rows are streamed from the database in partitions
+            result = db.session.connection().execute(q_page.statement.execution_options(yield_per=self.yield_rows))
+
+            for partition in result.partitions():
+                # flatten the rows directly into numpy, avoids a python object per value
+                row_data = numpy.fromiter(
+                    itertools.chain.from_iterable(partition),
+                    dtype=numpy.float64,
+                    count=len(partition) * row_width,
+                ).reshape((len(partition), row_width))
+
+                index = row_data[:, 0].astype(numpy.int64) - query_start_offset
+
+                in_range = (index >= 0) & (index < total_periods)
+                index = index[in_range]
+
+                # truncate the averages like the original integer conversion
+                legacy_period_data[index] = numpy.clip(row_data[in_range, 1:], 0, 255).astype(numpy.uint8)
+                legacy_mask[index] = True
+
+
+        return numpy.reshape(legacy_period_data, (total_periods, LongTermKeogramStore.pixels, 3)), legacy_mask
 
 
     def applyLabels(self, keogram_data, day_list):
@@ -0,0 +1,275 @@
+import os
+import tempfile
+from pathlib import Path
+import logging
+
+import numpy
+from numpy.lib.format import open_memmap
+
+logger = logging.getLogger('indi_allsky')
+
+
+class LongTermKeogramStore(object):
+    """Columnar storage for the long term keogram
+
+    Each camera has one file per UTC day holding a fixed grid of slots.  Every
+    slot is 16 bytes, 5 pixels of BGR data followed by the number of images
+    averaged into the slot.  The grid resolution divides every alignment
+    offered in the web interface so any alignment can be assembled by
+    reshaping the grid.
+    """
+
+    grid_seconds = 5
+    slots_per_day = int(86400 / grid_seconds)
+
+    pixels = 5
+    row_width = (pixels * 3) + 1  # last byte is the image count
+    max_count = 255
+
+    day_file_tmpl = 'ltk_{0:d}.npy'  # days since epoch
+
+
+    def __init__(self, config):
+        self.config = config
+
+        varlib_folder = self.config.get('VARLIB_FOLDER', '/var/lib/indi-allsky')
+        self._store_folder_p = Path(varlib_folder).joinpath('longterm_keogram')
+
+        # the current day is kept mapped while images are added
+        self._day_mmap = None
+        self._day_mmap_p = None
+
+
+    @property
+    def store_folder(self):
+        return self._store_folder_p
+
+
+    def cameraFolder(self, camera_id):
+        return self._store_folder_p.joinpath('ccd{0:d}'.format(int(camera_id)))
+
+
+    def dayFile(self, camera_id, day):
+        return self.cameraFolder(camera_id).joinpath(self.day_file_tmpl.format(int(day)))
+
+
+    def add(self, camera_id, ts, bgr_pixel_list):
+        slot = int(ts) // self.grid_seconds
+        day, day_slot = divmod(slot, self.slots_per_day)
+
+        day_data = self._mapDay(camera_id, day)
+
+        row = day_data[day_slot]
+
+        count = min(int(row[-1]), self.max_count - 1)
+
+        # running average
+        new_pixels = numpy.asarray(bgr_pixel_list, dtype=numpy.uint32).reshape(-1)[:self.pixels * 3]
+        old_pixels = row[:-1].astype(numpy.uint32)
+
+        row[:-1] = ((old_pixels * count) + new_pixels + ((count + 1) // 2)) // (count + 1)
+        row[-1] = count + 1
+
+        day_data.flush()
+
+
+    def addMany(self, camera_id, ts_array, bgr_pixel_array):
+        # bulk import, bgr_pixel_array shape is (n, 5, 3)
+        slot_array = numpy.asarray(ts_array, dtype=numpy.int64) // self.grid_seconds
+        bgr_pixel_array = numpy.asarray(bgr_pixel_array, dtype=numpy.uint32).reshape((-1, self.pixels * 3))
+
+        day_array = slot_array // self.slots_per_day
+
+        for day in numpy.unique(day_array):
+            day_mask = day_array == day
+            day_slots = slot_array[day_mask] - (day * self.slots_per_day)
+
+            day_data = self._mapDay(camera_id, int(day))
+
+            counts = day_data[:, -1].astype(numpy.uint32)
+            sums = day_data[:, :-1].astype(numpy.uint32) * counts[:, None]
+
+            numpy.add.at(sums, day_slots, bgr_pixel_array[day_mask])
+            numpy.add.at(counts, day_slots, 1)
+
+            updated = counts > 0
+            day_data[updated, :-1] = sums[updated] // counts[updated, None]
+            day_data[updated, -1] = numpy.minimum(counts[updated], self.max_count)
+
+            day_data.flush()
+
+
+    def read(self, camera_id, start_slot, slot_count):
+        # returns a (slot_count, row_width) array starting at the grid slot since epoch
+        data = numpy.zeros((slot_count, self.row_width), dtype=numpy.uint8)
+
+        end_slot = start_slot + slot_count
+
+        first_day = start_slot // self.slots_per_day
+        last_day = (end_slot - 1) // self.slots_per_day
+
+        for day in range(first_day, last_day + 1):
+            day_file_p = self.dayFile(camera_id, day)
+
+            if not day_file_p.exists():
+                continue
+
+
+            day_start_slot = day * self.slots_per_day
+
+            src_start = max(start_slot, day_start_slot) - day_start_slot
+            src_end = min(end_slot, day_start_slot + self.slots_per_day) - day_start_slot
+
+            try:
+                day_data = numpy.load(str(day_file_p), mmap_mode='r')
+            except (OSError, ValueError) as e:
+                logger.error('Unable to read long term keogram data %s: %s', day_file_p, str(e))
+                continue
+
+
+            dst_start = day_start_slot + src_start - start_slot
+            data[dst_start:dst_start + (src_end - src_start)] = day_data[src_start:src_end]
+
+            del day_data
+
+
+        return data
+
+
+    def firstTimestamp(self, camera_id):
+        # returns None when there is no data
+        camera_folder_p = self.cameraFolder(camera_id)
+
+        if not camera_folder_p.exists():
+            return None
+
+
+        day_list = list()
+        for day_file_p in camera_folder_p.glob('ltk_*.npy'):
+            try:
+                day_list.append(int(day_file_p.stem[4:]))
+            except ValueError:
+                continue
+
+
+        for day in sorted(day_list):
+            day_data = numpy.load(str(self.dayFile(camera_id, day)), mmap_mode='r')
+
+            slot_list = numpy.flatnonzero(day_data[:, -1])
+            if slot_list.size:
+                return ((day * self.slots_per_day) + int(slot_list[0])) * self.grid_seconds
+
+
+        return None
+
+
+    def mergeCamera(self, src_camera_id, dst_camera_id):
+        # moves the data of one camera to another, slots with data from both cameras are averaged
+        src_folder_p = self.cameraFolder(src_camera_id)
+
+        if not src_folder_p.exists():
+            return 0
+
+
+        self.close()
+
+        day_count = 0
+        for src_day_file_p in sorted(src_folder_p.glob('ltk_*.npy')):
+            try:
+                day = int(src_day_file_p.stem[4:])
+            except ValueError:
+                continue
+
+
+            dst_day_file_p = self.dayFile(dst_camera_id, day)
+
+            if not dst_day_file_p.exists():
+                dst_day_file_p.parent.mkdir(mode=0o755, parents=True, exist_ok=True)
+
+                try:
+                    # do not replace a file created by another process
+                    os.link(str(src_day_file_p), str(dst_day_file_p))
+                except FileExistsError:
+                    pass
+                else:
+                    src_day_file_p.unlink()
+                    day_count += 1
+                    continue
+
+
+            src_data = numpy.load(str(src_day_file_p))
+            dst_data = self._mapDay(dst_camera_id, day)
+
+            src_counts = src_data[:, -1].astype(numpy.uint32)
+            dst_counts = dst_data[:, -1].astype(numpy.uint32)
+            counts = src_counts + dst_counts
+
+            sums = (src_data[:, :-1].astype(numpy.uint32) * src_counts[:, None]) + (dst_data[:, :-1].astype(numpy.uint32) * dst_counts[:, None])
+
+            updated = src_counts > 0
+            dst_data[updated, :-1] = sums[updated] // counts[updated, None]
+            dst_data[updated, -1] = numpy.minimum(counts[updated], self.max_count)
+
+            dst_data.flush()
+
+            src_day_file_p.unlink()
+            day_count += 1
+
+
+        self.close()
+
+        try:
+            src_folder_p.rmdir()
+        except OSError:
+            pass
+
+
+        return day_count
+
+
+    def close(self):
+        if not isinstance(self._day_mmap, type(None)):
+            self._day_mmap.flush()
+
+        self._day_mmap = None
+        self._day_mmap_p = None
+
+
+    def _mapDay(self, camera_id, day):
+        day_file_p = self.dayFile(camera_id, day)
+
+        if day_file_p == self._day_mmap_p:
+            return self._day_mmap
+
+
+        self.close()
+
+
+        if not day_file_p.exists():
+            self._createDay(day_file_p)
+
+
+        self._day_mmap = open_memmap(str(day_file_p), mode='r+')
+        self._day_mmap_p = day_file_p
+
+        return self._day_mmap
+
+
+    def _createDay(self, day_file_p):
+        day_file_p.parent.mkdir(mode=0o755, parents=True, exist_ok=True)
+
+        # create under a temp name so readers never see a partial file
+        f_tmp_day = tempfile.NamedTemporaryFile(dir=day_file_p.parent, suffix='.npy', delete=False)
+        f_tmp_day.close()
+
+        tmp_day_data = open_memmap(f_tmp_day.name, mode='w+', dtype=numpy.uint8, shape=(self.slots_per_day, self.row_width))
+        tmp_day_data.flush()
+        del tmp_day_data
+
+        try:
+            # do not replace a file created by another process
+            os.link(f_tmp_day.name, str(day_file_p))
+        except FileExistsError:
+            pass
+        finally:
+            Path(f_tmp_day.name).unlink()
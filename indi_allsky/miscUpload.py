@@ -128,6 +128,7 @@ class miscUpload(object):
                 'model'       : image_entry.__class__.__name__,
                 'id'          : image_entry.id,
                 'remote_file' : str(latest_remote_file_p),
+                'coalesce'    : True,  # only the newest pending upload is sent
             }
 
             latest_upload_task = IndiAllSkyDbTaskQueueTable(
@@ -206,6 +207,7 @@ class miscUpload(object):
                 'model'       : video_entry.__class__.__name__,
                 'id'          : video_entry.id,
                 'remote_file' : str(latest_remote_file_p),
+                'coalesce'    : True,  # only the newest pending upload is sent
             }
 
             latest_upload_task = IndiAllSkyDbTaskQueueTable(
@@ -337,6 +339,7 @@ class miscUpload(object):
                 'model'       : video_entry.__class__.__name__,
                 'id'          : video_entry.id,
                 'remote_file' : str(latest_remote_file_p),
+                'coalesce'    : True,  # only the newest pending upload is sent
             }
 
             latest_upload_task = IndiAllSkyDbTaskQueueTable(
@@ -415,6 +418,7 @@ class miscUpload(object):
                 'model'       : keogram_entry.__class__.__name__,
                 'id'          : keogram_entry.id,
                 'remote_file' : str(latest_remote_file_p),
+                'coalesce'    : True,  # only the newest pending upload is sent
             }
 
             latest_upload_task = IndiAllSkyDbTaskQueueTable(
@@ -493,6 +497,7 @@ class miscUpload(object):
                 'model'       : startrail_entry.__class__.__name__,
                 'id'          : startrail_entry.id,
                 'remote_file' : str(latest_remote_file_p),
+                'coalesce'    : True,  # only the newest pending upload is sent
             }
 
             latest_upload_task = IndiAllSkyDbTaskQueueTable(
@@ -571,6 +576,7 @@ class miscUpload(object):
                 'model'       : startrail_video_entry.__class__.__name__,
                 'id'          : startrail_video_entry.id,
                 'remote_file' : str(latest_remote_file_p),
+                'coalesce'    : True,  # only the newest pending upload is sent
             }
 
             latest_upload_task = IndiAllSkyDbTaskQueueTable(
@@ -663,6 +669,7 @@ class miscUpload(object):
                 'model'       : panorama_entry.__class__.__name__,
                 'id'          : panorama_entry.id,
                 'remote_file' : str(latest_remote_file_p),
+                'coalesce'    : True,  # only the newest pending upload is sent
             }
 
             latest_upload_task = IndiAllSkyDbTaskQueueTable(
@@ -727,6 +734,7 @@ class miscUpload(object):
             'action'         : constants.TRANSFER_UPLOAD,
             'local_file'     : str(keogram_file_p),
             'remote_file'    : str(remote_file_p),
+            'coalesce'       : True,  # only the newest pending upload is sent
         }
 
         upload_task = IndiAllSkyDbTaskQueueTable(
@@ -805,6 +813,7 @@ class miscUpload(object):
                 'model'       : raw_image_entry.__class__.__name__,
                 'id'          : raw_image_entry.id,
                 'remote_file' : str(latest_remote_file_p),
+                'coalesce'    : True,  # only the newest pending upload is sent
             }
 
             latest_upload_task = IndiAllSkyDbTaskQueueTable(
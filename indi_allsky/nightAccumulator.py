@@ -0,0 +1,404 @@
+import os
+import io
+import shutil
+import json
+import hashlib
+import tempfile
+import time
+from pathlib import Path
+import logging
+
+import numpy
+
+from .keogram import KeogramGenerator
+from .starTrails import StarTrailGenerator
+from .exceptions import KeogramMismatchException
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyNightAccumulator(object):
+    """Build the keogram and star trail for the current day/night while images are captured
+
+    The accumulated state is periodically checkpointed to disk so the end of
+    night task only needs to process the images captured after the last
+    checkpoint.  Star trail timelapse frames are written to a folder which is
+    kept with the checkpoint.
+    """
+
+    checkpoint_version = 2
+    checkpoint_tmpl = 'night_accumulator_ccd{0:d}_{1:s}_{2:s}.npz'
+    frame_folder_tmpl = 'night_accumulator_ccd{0:d}_{1:s}_{2:s}_frames'
+
+
+    def __init__(self, config, camera, day_date, night, mask=None):
+        self.config = config
+
+        self._camera_id = int(camera.id)
+
+        self._day_date = day_date
+        self._night = bool(night)
+
+        self._fingerprint = self.configFingerprint(self.config, camera)
+
+        self._frame_count = 0
+        self._last_create_ts = None
+        self._dirty = False
+
+
+        self._keogram_gen = self.keogramGenerator(self.config)
+
+        if self._night:
+            self._startrail_gen = self.startrailGenerator(self.config, camera, mask)
+
+            if self._startrail_gen.timelapse_enable:
+                # frames must survive restarts until the end of night processing
+                self._startrail_gen.timelapse_frame_folder = self.frameFolder(
+                    self.config,
+                    self._camera_id,
+                    self._day_date,
+                    self.timeofday,
+                )
+        else:
+            # star trails are only generated at night
+            self._startrail_gen = None
+
+
+        varlib_folder = self.config.get('VARLIB_FOLDER', '/var/lib/indi-allsky')
+        self._checkpoint_p = Path(varlib_folder).joinpath(
+            self.checkpoint_tmpl.format(
+                self._camera_id,
+                self._day_date.strftime('%Y%m%d'),
+                self.timeofday,
+            )
+        )
+
+
+    @property
+    def camera_id(self):
+        return self._camera_id
+
+    @property
+    def day_date(self):
+        return self._day_date
+
+    @property
+    def night(self):
+        return self._night
+
+    @property
+    def timeofday(self):
+        if self._night:
+            return 'night'
+
+        return 'day'
+
+    @property
+    def fingerprint(self):
+        return self._fingerprint
+
+    @property
+    def frame_count(self):
+        return self._frame_count
+
+    @property
+    def last_create_ts(self):
+        return self._last_create_ts
+
+    @property
+    def checkpoint_file(self):
+        return self._checkpoint_p
+
+    @property
+    def keogram_generator(self):
+        return self._keogram_gen
+
+    @property
+    def startrail_generator(self):
+        return self._startrail_gen
+
+
+    def matches(self, camera_id, day_date, night):
+        return self._camera_id == camera_id and self._day_date == day_date and self._night == bool(night)
+
+
+    def add(self, image, image_file_p, binning, create_ts, adu=None, star_count=None):
+        # images must be added in capture order
+        image_mtime = image_file_p.stat().st_mtime
+
+        try:
+            self._keogram_gen.processImage(image, image_mtime)
+        except KeogramMismatchException as e:
+            logger.error('Error processing keogram image: %s', str(e))
+
+
+        if self._startrail_gen:
+            if not self.config.get('STARTRAILS_USE_DB_DATA', True):
+                adu, star_count = None, None
+
+            self._startrail_gen.processImage(image_file_p, image, binning, adu=adu, star_count=star_count)
+
+
+        self._frame_count += 1
+        self._last_create_ts = int(create_ts)
+        self._dirty = True
+
+
+    def checkpoint(self):
+        if not self._dirty:
+            return
+
+
+        metadata = {
+            'version'        : self.checkpoint_version,
+            'camera_id'      : self._camera_id,
+            'dayDate'        : self._day_date.strftime('%Y%m%d'),
+            'night'          : self._night,
+            'fingerprint'    : self._fingerprint,
+            'frame_count'    : self._frame_count,
+            'last_createDate': self._last_create_ts,
+        }
+
+        arrays = dict()
+
+        metadata['keogram'] = self._splitState(self._keogram_gen.getState(), 'keogram_', arrays)
+
+        if self._startrail_gen:
+            metadata['startrail'] = self._splitState(self._startrail_gen.getState(), 'startrail_', arrays)
+
+
+        arrays['metadata'] = numpy.array(json.dumps(metadata))
+
+
+        # write to a temp file and rename so a reader never sees a partial checkpoint
+        f_tmp_checkpoint = tempfile.NamedTemporaryFile(dir=self._checkpoint_p.parent, suffix='.npz', delete=False)
+
+        try:
+            with io.open(f_tmp_checkpoint.name, 'w+b') as f_numpy:
+                numpy.savez_compressed(f_numpy, **arrays)
+
+            f_tmp_checkpoint.close()
+
+            os.replace(f_tmp_checkpoint.name, str(self._checkpoint_p))
+        except OSError as e:
+            logger.error('Unable to write night accumulator checkpoint: %s', str(e))
+            Path(f_tmp_checkpoint.name).unlink(missing_ok=True)
+            return
+
+
+        self._dirty = False
+
+        logger.info('Stored night accumulator checkpoint: %d images', self._frame_count)
+
+
+    @classmethod
+    def load(cls, config, camera, day_date, night, mask=None):
+        # returns None if there is no usable checkpoint
+        accumulator = cls(config, camera, day_date, night, mask=mask)
+
+        if not accumulator.checkpoint_file.exists():
+            logger.warning('Night accumulator checkpoint not found: %s', accumulator.checkpoint_file)
+            return None
+
+
+        try:
+            with numpy.load(str(accumulator.checkpoint_file), allow_pickle=False) as npz:
+                arrays = {k: npz[k] for k in npz.files}
+        except (OSError, ValueError) as e:
+            logger.error('Unable to read night accumulator checkpoint: %s', str(e))
+            return None
+
+
+        try:
+            metadata = json.loads(str(arrays.pop('metadata')))
+        except (KeyError, ValueError) as e:
+            logger.error('Invalid night accumulator checkpoint: %s', str(e))
+            return None
+
+
+        if metadata.get('version') != cls.checkpoint_version:
+            logger.warning('Night accumulator checkpoint version mismatch')
+            return None
+
+        if metadata.get('fingerprint') != accumulator.fingerprint:
+            logger.warning('Night accumulator checkpoint configuration changed')
+            return None
+
+        if not accumulator.matches(metadata.get('camera_id'), day_date, metadata.get('night')) or metadata.get('dayDate') != day_date.strftime('%Y%m%d'):
+            logger.warning('Night accumulator checkpoint is for a different camera or night')
+            return None
+
+
+        accumulator._keogram_gen.setState(cls._mergeState(metadata['keogram'], 'keogram_', arrays))
+
+        if accumulator._startrail_gen:
+            if not metadata.get('startrail'):
+                logger.warning('Night accumulator checkpoint does not include star trails')
+                return None
+
+            accumulator._startrail_gen.setState(cls._mergeState(metadata['startrail'], 'startrail_', arrays))
+
+            for frame_p in accumulator._startrail_gen.timelapse_frame_list:
+                if not frame_p.exists():
+                    logger.warning('Night accumulator star trail timelapse frame missing: %s', frame_p)
+                    return None
+
+
+        accumulator._frame_count = int(metadata['frame_count'])
+        accumulator._last_create_ts = metadata['last_createDate']
+
+        logger.info('Loaded night accumulator checkpoint: %d images', accumulator.frame_count)
+
+        return accumulator
+
+
+    @classmethod
+    def expireCheckpoints(cls, config, camera_id, max_age_s=172800):
+        # the previous night is kept until the end of night processing is finished
+        varlib_folder_p = Path(config.get('VARLIB_FOLDER', '/var/lib/indi-allsky'))
+
+        cutoff = time.time() - max_age_s
+
+        for checkpoint_p in varlib_folder_p.glob('night_accumulator_ccd{0:d}_*.npz'.format(camera_id)):
+            try:
+                if checkpoint_p.stat().st_mtime > cutoff:
+                    continue
+
+                logger.info('Removing old night accumulator checkpoint: %s', checkpoint_p)
+                checkpoint_p.unlink()
+            except FileNotFoundError:
+                pass
+
+
+        for frame_folder_p in cls.scratchFolder(config).glob('night_accumulator_ccd{0:d}_*_frames'.format(camera_id)):
+            try:
+                if frame_folder_p.stat().st_mtime > cutoff:
+                    continue
+
+                logger.info('Removing old night accumulator frames: %s', frame_folder_p)
+                shutil.rmtree(frame_folder_p)
+            except FileNotFoundError:
+                pass
+
+
+    @staticmethod
+    def scratchFolder(config):
+        if config.get('IMAGE_FOLDER'):
+            image_dir = Path(config['IMAGE_FOLDER']).absolute()
+        else:
+            image_dir = Path(__file__).parent.parent.joinpath('html', 'images').absolute()
+
+        return image_dir.joinpath('scratch')
+
+
+    @classmethod
+    def frameFolder(cls, config, camera_id, day_date, timeofday):
+        return cls.scratchFolder(config).joinpath(
+            cls.frame_folder_tmpl.format(
+                camera_id,
+                day_date.strftime('%Y%m%d'),
+                timeofday,
+            )
+        )
+
+
+    @staticmethod
+    def keogramGenerator(config):
+        kg = KeogramGenerator(
+            config,
+            skip_frames=config.get('TIMELAPSE_SKIP_FRAMES', 4),
+        )
+        kg.angle = config.get('KEOGRAM_ANGLE', 0.0)
+        kg.h_scale_factor = config.get('KEOGRAM_H_SCALE', 100)
+        kg.v_scale_factor = config.get('KEOGRAM_V_SCALE', 33)
+        kg.crop_top = config.get('KEOGRAM_CROP_TOP', 0)
+        kg.crop_bottom = config.get('KEOGRAM_CROP_BOTTOM', 0)
+        kg.label = config.get('KEOGRAM_LABEL', True)
+
+        return kg
+
+
+    @staticmethod
+    def startrailGenerator(config, camera, mask):
+        stg = StarTrailGenerator(
+            config,
+            skip_frames=config.get('TIMELAPSE_SKIP_FRAMES', 4),
+            mask=mask,
+        )
+        stg.max_adu = config['STARTRAILS_MAX_ADU']
+        stg.mask_threshold = config['STARTRAILS_MASK_THOLD']
+        stg.pixel_cutoff_threshold = config['STARTRAILS_PIXEL_THOLD']
+        stg.min_stars = config.get('STARTRAILS_MIN_STARS', 0)
+        stg.latitude = camera.latitude
+        stg.longitude = camera.longitude
+        stg.sun_alt_threshold = config['STARTRAILS_SUN_ALT_THOLD']
+
+        if config['STARTRAILS_MOONMODE_THOLD']:
+            stg.moonmode_alt = config['NIGHT_MOONMODE_ALT_DEG']
+            stg.moonmode_phase = config['NIGHT_MOONMODE_PHASE']
+        else:
+            stg.moon_alt_threshold = config['STARTRAILS_MOON_ALT_THOLD']
+            stg.moon_phase_threshold = config['STARTRAILS_MOON_PHASE_THOLD']
+
+        return stg
+
+
+    @staticmethod
+    def configFingerprint(config, camera):
+        # any change to these settings invalidates the accumulated data
+        settings = {
+            'latitude'     : round(float(camera.latitude), 4),
+            'longitude'    : round(float(camera.longitude), 4),
+            'DETECT_MASK'  : config.get('DETECT_MASK', ''),
+            'STARTRAILS'   : config.get('STARTRAILS', {}),
+            'IMAGE_BORDER' : config.get('IMAGE_BORDER', {}),
+        }
+
+        for key in (
+            'TIMELAPSE_SKIP_FRAMES',
+            'KEOGRAM_ANGLE',
+            'LENS_OFFSET_X',
+            'LENS_OFFSET_Y',
+            'STARTRAILS_MAX_ADU',
+            'STARTRAILS_MASK_THOLD',
+            'STARTRAILS_PIXEL_THOLD',
+            'STARTRAILS_MIN_STARS',
+            'STARTRAILS_SUN_ALT_THOLD',
+            'STARTRAILS_MOONMODE_THOLD',
+            'STARTRAILS_MOON_ALT_THOLD',
+            'STARTRAILS_MOON_PHASE_THOLD',
+            'STARTRAILS_USE_DB_DATA',
+            'STARTRAILS_TIMELAPSE',
+            'IMAGE_FILE_TYPE',
+            'NIGHT_MOONMODE_ALT_DEG',
+            'NIGHT_MOONMODE_PHASE',
+        ):
+            settings[key] = config.get(key)
+
+
+        settings_json = json.dumps(settings, sort_keys=True, default=str)
+
+        return hashlib.sha1(settings_json.encode()).hexdigest()
+
+
+    def _splitState(self, state, prefix, arrays):
+        # numpy arrays are stored natively, everything else is stored as json
+        scalars = dict()
+        for k, v in state.items():
+            if isinstance(v, numpy.ndarray):
+                arrays[prefix + k] = v
+            else:
+                scalars[k] = v
+
+        return scalars
+
+
+    @staticmethod
+    def _mergeState(scalars, prefix, arrays):
+        state = dict(scalars)
+
+        for k, v in arrays.items():
+            if k.startswith(prefix):
+                state[k[len(prefix):]] = v
+
+        return state
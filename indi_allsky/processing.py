@@ -38,6 +38,7 @@ from .utils import IndiAllSkyDateCalcs
 from .overlay.moonOverlay import IndiAllSkyMoonOverlay
 from .overlay.lightgraphOverlay import IndiAllSkyLightgraphOverlay
 from .overlay.imageOverlay import IndiAllSkyImageOverlay
+from .calibrationCache import IndiAllSkyCalibrationCache
 
 from .flask.miscDb import miscDb
 from .flask.models import IndiAllSkyDbBadPixelMapTable
@@ -46,6 +47,7 @@ from .flask.models import IndiAllSkyDbTleDataTable
 from .flask.models import NotificationCategory
 
 from sqlalchemy.sql.expression import true as sa_true
+from sqlalchemy.orm.exc import NoResultFound
 
 from .exceptions import TimeOutException
 from .exceptions import CalibrationNotFound
@@ -141,10 +143,15 @@ class ImageProcessor(object):
 
         self._gamma_lut = None
 
+        self._calibration_cache = IndiAllSkyCalibrationCache(
+            max_bytes=int(self.config.get('IMAGE_CALIBRATE_CACHE_MB', 256)) * 1024 * 1024,
+        )
+
         self.focus_mode = self.config.get('FOCUS_MODE', False)
 
         self.stack_method = self.config.get('IMAGE_STACK_METHOD', 'maximum')
         self.stack_count = self.config.get('IMAGE_STACK_COUNT', 1)
+        self.stack_incremental = self.config.get('IMAGE_STACK_INCREMENTAL', False)
 
         self._text_color_rgb = [0, 0, 0]
         self._text_xy = [0, 0]
@@ -199,6 +206,7 @@ class ImageProcessor(object):
         # Realtime keogram
         self._keogram_gen = KeogramGenerator(
             self.config,
+            max_entries=self.config.get('REALTIME_KEOGRAM', {}).get('MAX_ENTRIES', 1000),
         )
         self._keogram_gen.angle = self.config.get('KEOGRAM_ANGLE', 0.0)
         self._keogram_gen.h_scale_factor = self.config.get('KEOGRAM_H_SCALE', 100)
@@ -378,6 +386,15 @@ class ImageProcessor(object):
         return self._camera_sqm_raw_mag
 
 
+    @property
+    def detection_mask(self):
+        if isinstance(self._detection_mask_dict, type(None)):
+            return self._load_detection_mask()
+
+        # consumers populate missing binning entries, do not share the dict
+        return dict(self._detection_mask_dict)
+
+
     def post_init(self):
         # binning_av needs to be populated before running this
 
@@ -432,6 +449,7 @@ class ImageProcessor(object):
         exp_elapsed,
         camera,
         detected_camera_name=None,
+        hdulist=None,
     ):
         """Ingest one capture and retain its authoritative device identity."""
         if isinstance(self._detection_mask_dict, type(None)):
@@ -468,6 +486,7 @@ class ImageProcessor(object):
             exp_elapsed,
             camera,
             detected_camera_name=detected_camera_name,
+            hdulist=hdulist,
         )
 
         self.image_list.insert(0, i_ref)  # new image is first in list
@@ -485,18 +504,26 @@ class ImageProcessor(object):
         exp_elapsed,
         camera,
         detected_camera_name=None,
+        hdulist=None,
     ):
-        """Decode one capture into ImageData without updating the stack."""
-        from astropy.io import fits
+        """Decode one capture into ImageData without updating the stack.
 
-        filename_p = Path(filename)
+        A FITS ``hdulist`` may be passed instead of a filename when the frame
+        was received through shared memory.
+        """
+        from astropy.io import fits
 
 
         # clear old data as soon as possible
         self.image = None
 
 
-        image_size = filename_p.stat().st_size
+        if not isinstance(hdulist, type(None)):
+            filename_p = None
+            image_size = hdulist[0].data.nbytes
+        else:
+            filename_p = Path(filename)
+            image_size = filename_p.stat().st_size
 
 
         # update keogram store path
@@ -506,7 +533,9 @@ class ImageProcessor(object):
 
 
         filename_str = str(filename_p)
-        if filename_str.endswith(('.fit', '.fits', '.fit.gz', 'fits.gz')):
+        if not isinstance(hdulist, type(None)):
+            image_type = 'FITS'
+        elif filename_str.endswith(('.fit', '.fits', '.fit.gz', 'fits.gz')):
             image_type = 'FITS'
         elif filename_str.endswith('.dng'):
             image_type = 'DNG'
@@ -520,10 +549,11 @@ class ImageProcessor(object):
 
         ### Open file
         if image_type == 'FITS':
-            try:
-                hdulist = fits.open(filename_p)
-            except OSError as e:
-                raise BadImage(str(e)) from e
+            if isinstance(hdulist, type(None)):
+                try:
+                    hdulist = fits.open(filename_p)
+                except OSError as e:
+                    raise BadImage(str(e)) from e
 
             #logger.info('Initial HDU Header = %s', pformat(hdulist[0].header))
             image_bitpix = int(hdulist[0].header['BITPIX'])
@@ -1413,13 +1443,11 @@ class ImageProcessor(object):
             p_bpm = Path(bpm_entry.getFilesystemPath())
             if p_bpm.exists():
                 logger.info('Matched bad pixel map: %s', p_bpm)
-                with fits.open(p_bpm) as bpm_f:
-                    bpm = bpm_f[0].data
             else:
                 logger.error('Bad Pixel Map missing: %s', bpm_entry.filename)
-                bpm = None
+                p_bpm = None
         else:
-            bpm = None
+            p_bpm = None
 
 
         p_dark_frame = Path(dark_frame_entry.getFilesystemPath())
@@ -1430,15 +1458,40 @@ class ImageProcessor(object):
 
         logger.info('Matched dark: %s', p_dark_frame)
 
-        with fits.open(p_dark_frame) as dark_f:
-            dark = dark_f[0].data
 
+        self._calibration_cache.generation = self._getCalibrationGeneration()
 
-        if not isinstance(bpm, type(None)):
-            # merge bad pixel map and dark
-            master_dark = numpy.maximum(bpm, dark)
-        else:
-            master_dark = dark
+        cache_key = self._calibration_cache.buildKey(
+            i_ref.camera_id,
+            i_ref.binning,
+            dark_frame_entry,
+            p_dark_frame,
+            bpm_entry=bpm_entry,
+            p_bpm=p_bpm,
+        )
+
+        master_dark = self._calibration_cache.get(cache_key)
+
+        if isinstance(master_dark, type(None)):
+            with fits.open(p_dark_frame) as dark_f:
+                dark = dark_f[0].data
+
+
+            if not isinstance(p_bpm, type(None)):
+                with fits.open(p_bpm) as bpm_f:
+                    bpm = bpm_f[0].data
+
+                # merge bad pixel map and dark
+                master_dark = numpy.maximum(bpm, dark)
+            else:
+                # copy to keep the data resident after the file is closed
+                master_dark = numpy.array(dark)
+
+
+            self._calibration_cache.put(cache_key, master_dark)
+
+
+        self._calibration_cache.logStats()
 
 
         master_dark_height, master_dark_width = master_dark.shape[:2]
@@ -1526,6 +1579,14 @@ class ImageProcessor(object):
         return data_calibrated
 
 
+    def _getCalibrationGeneration(self):
+        # updated when dark frames and bad pixel maps are added or removed
+        try:
+            return self._miscDb.getState('CALIBRATION_GENERATION')
+        except NoResultFound:
+            return None
+
+
     def fix_holes_early(self):
         if self.focus_mode:
             # disable processing in focus mode
@@ -1714,6 +1775,7 @@ class ImageProcessor(object):
 
         if stack_list_len == 1:
             # no reason to stack a single image
+            self._stacker.running_reset()  # release references to old frames
             self.image = i_ref.opencv_data
             return
 
@@ -1729,6 +1791,8 @@ class ImageProcessor(object):
             raise Exception('Unknown bits per pixel')
 
 
+        stack_aligned = False
+
         if self.config.get('IMAGE_STACK_ALIGN'):
             if i_ref.exposure > self.registration_exposure_thresh:
                 # only perform registration once the exposure exceeds 5 seconds
@@ -1741,7 +1805,12 @@ class ImageProcessor(object):
                 signal.alarm(int(self.config['EXPOSURE_PERIOD'] - 3))
 
                 try:
-                    stack_data_list = self._stacker.register(stack_i_ref_list, i_ref.binning, self.max_bit_depth)
+                    if self.stack_incremental:
+                        stack_data_list = self._stacker.register_incremental(stack_i_ref_list, i_ref.binning)
+                    else:
+                        stack_data_list = self._stacker.register(stack_i_ref_list, i_ref.binning, self.max_bit_depth)
+
+                    stack_aligned = True
                 except TimeOutException:
                     # stack unaligned images
                     logger.error('Registration exceeded the exposure period, cancel alignment')
@@ -1760,13 +1829,17 @@ class ImageProcessor(object):
         stack_start = time.time()
 
 
-        try:
-            stacker_method = getattr(self._stacker, self.stack_method)
-            self.image = stacker_method(stack_data_list, numpy_type)
-        except AttributeError:
-            logger.error('Unknown stacking method: %s', self.stack_method)
-            self.image = i_ref.opencv_data
-            return
+        if self.stack_incremental and not stack_aligned and self.stack_method in ('average', 'mean'):
+            # unaligned frames can be maintained in a running sum
+            self.image = self._stacker.average_running(stack_i_ref_list, numpy_type)
+        else:
+            try:
+                stacker_method = getattr(self._stacker, self.stack_method)
+                self.image = stacker_method(stack_data_list, numpy_type)
+            except AttributeError:
+                logger.error('Unknown stacking method: %s', self.stack_method)
+                self.image = i_ref.opencv_data
+                return
 
 
         if self.config.get('IMAGE_STACK_SPLIT'):
@@ -4294,19 +4367,11 @@ class ImageProcessor(object):
             return
 
 
-        max_entries = self.config.get('REALTIME_KEOGRAM', {}).get('MAX_ENTRIES', 1000)
-        while self.realtime_keogram_data.shape[1] > max_entries:
-            self.realtime_keogram_data = numpy.delete(self.realtime_keogram_data, 0, 1)
-
-        # timestamps might not be populated if numpy data loaded from file
-        while len(self.realtime_keogram_timestamps) > max_entries:
-            self.realtime_keogram_timestamps.pop(0)
-
-
     def realtimeKeogramDataLoad(self):
         logger.info('Loading stored realtime keogram data')
-        with io.open(str(self._keogram_store_p), 'r+b') as f_numpy:
-            keogram_data = numpy.load(f_numpy)
+
+        # data is copied into the keogram ring buffer
+        keogram_data = numpy.load(str(self._keogram_store_p), mmap_mode='r')
 
 
         with io.open(str(self._keogram_store_metadata_p), 'r+b') as f_numpy:
@@ -4321,14 +4386,30 @@ class ImageProcessor(object):
 
 
     def realtimeKeogramDataSave(self):
-        if isinstance(self.realtime_keogram_data, type(None)):
+        keogram_buffer = self._keogram_gen.keogram_buffer
+
+        if isinstance(keogram_buffer, type(None)):
             logger.warning('Realtime keogram data is empty')
             return
 
 
         logger.info('Storing realtime keogram data')
-        with io.open(str(self._keogram_store_p), 'w+b') as f_numpy:
-            numpy.save(f_numpy, self.realtime_keogram_data)
+
+        # write the ring buffer segments in order without building a temporary array
+        keogram_mmap = numpy.lib.format.open_memmap(
+            str(self._keogram_store_p),
+            mode='w+',
+            dtype=keogram_buffer.dtype,
+            shape=keogram_buffer.shape,
+        )
+
+        x = 0
+        for segment in keogram_buffer.segments():
+            keogram_mmap[:, x:x + segment.shape[1]] = segment
+            x += segment.shape[1]
+
+        keogram_mmap.flush()
+        del keogram_mmap
 
 
         # Allow multiple datapoints
@@ -4608,6 +4689,10 @@ class ImageData(object):
         self._asi676mc_repair_result = None
         self._opencv_data = None
 
+        # transform from the previous stacked frame to this frame
+        self._registration_transform = None
+        self._registration_reference_date = None
+
         self._kpindex = 0.0
         self._ovation_max = 0
         self._aurora_mag_bt = 0.0
@@ -4755,6 +4840,23 @@ class ImageData(object):
         self._opencv_data = new_opencv_data
 
 
+    @property
+    def registration_transform(self):
+        return self._registration_transform
+
+    @registration_transform.setter
+    def registration_transform(self, new_registration_transform):
+        self._registration_transform = new_registration_transform
+
+    @property
+    def registration_reference_date(self):
+        return self._registration_reference_date
+
+    @registration_reference_date.setter
+    def registration_reference_date(self, new_registration_reference_date):
+        self._registration_reference_date = new_registration_reference_date
+
+
     @property
     def uptime(self):
         return self._uptime
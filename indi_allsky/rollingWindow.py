@@ -0,0 +1,156 @@
+from collections import deque
+import logging
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyRollingWindow(object):
+    """Minimum, maximum and average of the values added in the last window_s seconds
+
+    Monotonic deques track the min and max, a running sum tracks the average.
+    Values must be added in timestamp order, all operations are amortized O(1).
+    """
+
+    def __init__(self, window_s):
+        self._window_s = float(window_s)
+
+        self._values = deque()  # (seq, ts, value)
+        self._min_q = deque()  # (seq, value) increasing
+        self._max_q = deque()  # (seq, value) decreasing
+
+        self._sum = 0.0
+        self._seq = 0
+
+
+    @property
+    def window_s(self):
+        return self._window_s
+
+    @property
+    def count(self):
+        return len(self._values)
+
+
+    def add(self, ts, value):
+        if isinstance(value, type(None)):
+            return
+
+        self._seq += 1
+
+        self._values.append((self._seq, ts, value))
+        self._sum += value
+
+
+        while self._min_q and self._min_q[-1][1] > value:
+            self._min_q.pop()
+
+        self._min_q.append((self._seq, value))
+
+
+        while self._max_q and self._max_q[-1][1] < value:
+            self._max_q.pop()
+
+        self._max_q.append((self._seq, value))
+
+
+        self.expire(ts)
+
+
+    def expire(self, now):
+        # entries must be newer than the cutoff, same as createDate > now - window
+        cutoff = now - self._window_s
+
+        while self._values and self._values[0][1] <= cutoff:
+            seq, _, value = self._values.popleft()
+            self._sum -= value
+
+            if self._min_q[0][0] == seq:
+                self._min_q.popleft()
+
+            if self._max_q[0][0] == seq:
+                self._max_q.popleft()
+
+
+        if not self._values:
+            # prevent float drift from accumulating
+            self._sum = 0.0
+
+
+    def clear(self):
+        self._values.clear()
+        self._min_q.clear()
+        self._max_q.clear()
+        self._sum = 0.0
+
+
+    def summary(self, now=None):
+        if not isinstance(now, type(None)):
+            self.expire(now)
+
+
+        if not self._values:
+            return {
+                'max'  : None,
+                'min'  : None,
+                'avg'  : None,
+                'last' : None,
+            }
+
+
+        return {
+            'max'  : self._max_q[0][1],
+            'min'  : self._min_q[0][1],
+            'avg'  : self._sum / len(self._values),
+            'last' : self._values[-1][2],
+        }
+
+
+class IndiAllSkyImageStats(object):
+    """Rolling SQM and star statistics of the images of a single camera"""
+
+    # metric name, sensor slot in the image data
+    sensor_metrics = (
+        ('camera_sqm_mag', 'sensor_user_8'),
+        ('camera_sqm_adu', 'sensor_user_9'),
+        ('device_sqm_mag', 'sensor_user_7'),
+    )
+
+
+    def __init__(self, window_s):
+        self._window_s = float(window_s)
+
+        self._windows = {
+            'sqm'   : IndiAllSkyRollingWindow(self._window_s),
+            'stars' : IndiAllSkyRollingWindow(self._window_s),
+        }
+
+        for metric, _ in self.sensor_metrics:
+            self._windows[metric] = IndiAllSkyRollingWindow(self._window_s)
+
+
+    @property
+    def window_s(self):
+        return self._window_s
+
+
+    def add(self, ts, sqm, stars, data=None):
+        if not data:
+            data = {}
+
+        self._windows['sqm'].add(ts, sqm)
+        self._windows['stars'].add(ts, stars)
+
+        for metric, sensor_key in self.sensor_metrics:
+            self._windows[metric].add(ts, data.get(sensor_key, 0.0))
+
+
+    def summary(self, now):
+        data = {
+            'ts'       : now,
+            'window_s' : self._window_s,
+        }
+
+        for metric, window in self._windows.items():
+            data[metric] = window.summary(now)
+
+        return data
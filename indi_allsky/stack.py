@@ -28,6 +28,10 @@ class IndiAllskyStacker(object):
         self._scale_limit = 0.97  # scale may not exceed this value (+/-)
         self._history_min_vals = 15
 
+        # running sum for incremental averaging
+        self._running_sum = None
+        self._running_i_ref_list = list()
+
 
     @property
     def detection_sigma(self):
@@ -97,6 +101,39 @@ class IndiAllskyStacker(object):
         return mean_image.astype(numpy_type)  # no floats
 
 
+    def average_running(self, stack_i_ref_list, numpy_type):
+        # Only frames entering or leaving the stack are added to or removed from the sum
+        reference_data = stack_i_ref_list[0].opencv_data
+
+        if isinstance(self._running_sum, type(None)) or self._running_sum.shape != reference_data.shape:
+            self.running_reset()
+            self._running_sum = numpy.zeros(reference_data.shape, dtype=numpy.uint32)
+
+
+        stack_id_set = set(id(x) for x in stack_i_ref_list)
+        for i_ref in [x for x in self._running_i_ref_list if id(x) not in stack_id_set]:
+            numpy.subtract(self._running_sum, i_ref.opencv_data, out=self._running_sum, casting='unsafe')
+            self._running_i_ref_list.remove(i_ref)
+
+
+        running_id_set = set(id(x) for x in self._running_i_ref_list)
+        for i_ref in stack_i_ref_list:
+            if id(i_ref) in running_id_set:
+                continue
+
+            numpy.add(self._running_sum, i_ref.opencv_data, out=self._running_sum, casting='unsafe')
+            self._running_i_ref_list.append(i_ref)
+
+
+        mean_image = numpy.floor_divide(self._running_sum, len(self._running_i_ref_list))
+        return mean_image.astype(numpy_type)  # no floats
+
+
+    def running_reset(self):
+        self._running_sum = None
+        self._running_i_ref_list.clear()
+
+
     def maximum(self, stack_data_list, numpy_type):
         image_max = stack_data_list[0]  # start with first image
 
@@ -251,6 +288,142 @@ class IndiAllskyStacker(object):
         return reg_data_list
 
 
+    def register_incremental(self, stack_i_ref_list, binning):
+        # Each frame is registered once against the frame before it.  The cached
+        # transforms are chained to warp older frames onto the newest frame.
+        logger.info('Starting incremental image registration')
+
+
+        # first image is the reference
+        reference_i_ref = stack_i_ref_list[0]
+
+
+        if isinstance(self._stack_mask_dict[binning], type(None)):
+            # This only needs to be done once if a mask is not provided
+            self._generateStackMask(reference_i_ref.opencv_data, binning)
+
+
+        reg_start = time.time()
+
+        self._registerPrevious(reference_i_ref, stack_i_ref_list[1], binning)
+
+        reg_elapsed_s = time.time() - reg_start
+        logger.info('Registered newest image in %0.4f s', reg_elapsed_s)
+
+
+        warp_start = time.time()
+
+        image_height, image_width = reference_i_ref.opencv_data.shape[:2]
+
+        reg_data_list = [reference_i_ref.opencv_data]  # add target to final list
+
+        # transform from the current frame to the reference frame
+        transform_matrix = numpy.identity(3)
+
+        for newer_i_ref, i_ref in zip(stack_i_ref_list[:-1], stack_i_ref_list[1:]):
+            if isinstance(newer_i_ref.registration_transform, type(None)):
+                logger.warning('Registration chain broken, aligned %d+1 images', len(reg_data_list) - 1)
+                break
+
+            if newer_i_ref.registration_reference_date != i_ref.exp_date:
+                logger.warning('Registration chain broken, aligned %d+1 images', len(reg_data_list) - 1)
+                break
+
+
+            transform_matrix = numpy.dot(transform_matrix, newer_i_ref.registration_transform)
+
+            reg_data = cv2.warpAffine(
+                i_ref.opencv_data,
+                transform_matrix[:2],
+                (image_width, image_height),
+                flags=cv2.INTER_LINEAR,
+                borderMode=cv2.BORDER_CONSTANT,
+                borderValue=0,
+            )
+
+            reg_data_list.append(reg_data)
+
+
+        warp_elapsed_s = time.time() - warp_start
+        logger.info('Warped %d images in %0.4f s', len(reg_data_list) - 1, warp_elapsed_s)
+
+        return reg_data_list
+
+
+    def _registerPrevious(self, i_ref, previous_i_ref, binning):
+        if not isinstance(i_ref.registration_transform, type(None)):
+            if i_ref.registration_reference_date == previous_i_ref.exp_date:
+                # already registered
+                return
+
+
+        i_ref.registration_transform = None
+        i_ref.registration_reference_date = None
+
+
+        i_masked = cv2.bitwise_and(i_ref.opencv_data, i_ref.opencv_data, mask=self._stack_mask_dict[binning])
+        previous_masked = cv2.bitwise_and(previous_i_ref.opencv_data, previous_i_ref.opencv_data, mask=self._stack_mask_dict[binning])
+
+
+        try:
+            # transform maps the previous frame onto the newest frame
+            transform, (source_list, target_list) = astroalign.find_transform(
+                previous_masked,
+                i_masked,
+                detection_sigma=self.detection_sigma,
+                max_control_points=self.max_control_points,
+                min_area=self.min_area,
+            )
+        except astroalign.MaxIterError as e:
+            logger.error('Image registration failure: %s', str(e))
+            return
+        except ValueError as e:
+            logger.error('Image registration failure: %s', str(e))
+            return
+        except TypeError as e:
+            logger.error('Image registration failure: %s', str(e))
+            return
+
+
+        logger.info(
+            'Registration Matches: %d, Rotation: %0.6f, Translation: (%0.6f, %0.6f), Scale: %0.6f',
+            len(target_list),
+            transform.rotation,
+            transform.translation[0], transform.translation[1],
+            transform.scale,
+        )
+
+
+        # rotation between consecutive frames should be consistent
+        if len(self.hist_rotation) >= self._history_min_vals:
+            rotation_mean = numpy.mean(self.hist_rotation)
+            rotation_std = numpy.std(self.hist_rotation)
+
+            rotation_stddev_limit = rotation_std * self._rotation_dev
+
+            if transform.rotation > (rotation_mean + rotation_stddev_limit)\
+                    or transform.rotation < (rotation_mean - rotation_stddev_limit):
+
+                logger.error('Rotation %0.8f exceeded limit of +/- %0.8f', transform.rotation, rotation_stddev_limit)
+                return
+
+
+        self.hist_rotation.append(transform.rotation)  # only add known good rotation values
+
+        # do not let the history grow forever
+        while len(self.hist_rotation) > 100:
+            self.hist_rotation.pop(0)
+
+
+        if abs(transform.scale) < self._scale_limit:
+            logger.error('Scale %0.6f exceeded limit of +/- %0.2f', transform.scale, self._scale_limit)
+            return
+
+
+        i_ref.registration_transform = transform.params
+        i_ref.registration_reference_date = previous_i_ref.exp_date
+
+
     def _crop(self, image):
         image_height, image_width = image.shape[:2]
 
@@ -14,6 +14,7 @@ import ephem
 import logging
 
 from .stars import IndiAllSkyStars
+from .exceptions import TimelapseException
 
 
 logger = logging.getLogger('indi_allsky')
@@ -79,8 +80,15 @@ class StarTrailGenerator(object):
         self.placeholder_adu = 255
 
         self._trail_count = 0
+        self._timelapse_enable = self.config.get('STARTRAILS_TIMELAPSE', True)
         self._timelapse_frame_count = 0
         self._timelapse_frame_list = list()
+        self._timelapse_frame_folder_p = None
+
+        # when set, timelapse frames are streamed to ffmpeg
+        self._timelapse_generator = None
+        self._timelapse_stream_file_p = None
+        self._timelapse_stream_failed = False
 
         self._image_circle_alpha_mask = None
 
@@ -100,6 +108,7 @@ class StarTrailGenerator(object):
         # this needs to be a class variable
         self.timelapse_tmpdir = tempfile.TemporaryDirectory(dir=scratch_base_dir, suffix='_startrail_timelapse')    # context manager automatically deletes files when finished
         self.timelapse_tmpdir_p = Path(self.timelapse_tmpdir.name)
+        self._timelapse_frame_folder_p = self.timelapse_tmpdir_p
 
 
 
@@ -143,6 +152,15 @@ class StarTrailGenerator(object):
     def trail_count(self, new_trail_count):
         return  # read only
 
+    @property
+    def timelapse_enable(self):
+        return self._timelapse_enable
+
+    @timelapse_enable.setter
+    def timelapse_enable(self, new_timelapse_enable):
+        self._timelapse_enable = bool(new_timelapse_enable)
+
+
     @property
     def timelapse_frame_count(self):
         return self._timelapse_frame_count
@@ -159,6 +177,22 @@ class StarTrailGenerator(object):
     def timelapse_frame_list(self, new_frame_list):
         return  # read only
 
+    @property
+    def timelapse_frame_folder(self):
+        return self._timelapse_frame_folder_p
+
+    @timelapse_frame_folder.setter
+    def timelapse_frame_folder(self, new_frame_folder):
+        # frames written outside of the temporary directory are not removed automatically
+        self._timelapse_frame_folder_p = Path(new_frame_folder)
+
+        if not self._timelapse_frame_folder_p.exists():
+            self._timelapse_frame_folder_p.mkdir(mode=0o755, parents=True)
+
+    @property
+    def timelapse_stream_file(self):
+        return self._timelapse_stream_file_p
+
     @property
     def latitude(self):
         return self._latitude
@@ -226,6 +260,41 @@ class StarTrailGenerator(object):
         pass  # read only
 
 
+    def getState(self):
+        # accumulated data for checkpointing
+        return {
+            'process_count'         : self.process_count,
+            'trail_count'           : self._trail_count,
+            'excluded_images'       : dict(self.excluded_images),
+            'original_width'        : self.original_width,
+            'original_height'       : self.original_height,
+            'pixels_cutoff'         : self.pixels_cutoff,
+            'placeholder_adu'       : float(self.placeholder_adu),
+            'trail_image'           : self.trail_image,
+            'placeholder_image'     : self.placeholder_image,
+            'timelapse_frame_count' : self._timelapse_frame_count,
+            'timelapse_frame_list'  : [str(p) for p in self._timelapse_frame_list],
+        }
+
+
+    def setState(self, state):
+        self.process_count = int(state['process_count'])
+        self._trail_count = int(state['trail_count'])
+        self.excluded_images.update(state['excluded_images'])
+
+        self.original_width = state['original_width']
+        self.original_height = state['original_height']
+        self.pixels_cutoff = state['pixels_cutoff']
+
+        self.placeholder_adu = state['placeholder_adu']
+        self.placeholder_image = state.get('placeholder_image')
+
+        self.trail_image = state.get('trail_image')
+
+        self._timelapse_frame_count = int(state.get('timelapse_frame_count', 0))
+        self._timelapse_frame_list = [Path(p) for p in state.get('timelapse_frame_list', [])]
+
+
     def processImage(self, file_p, image, binning, adu=None, star_count=None):
         self.process_count += 1
 
@@ -353,10 +422,12 @@ class StarTrailGenerator(object):
 
 
         # Star trail timelapse processing
-        if self.config.get('STARTRAILS_TIMELAPSE', True):
+        if self.timelapse_enable and self._timelapse_generator:
+            self._streamTimelapseFrame()
+        elif self.timelapse_enable:
             image_mtime = file_p.stat().st_mtime
 
-            f_tmp_frame = tempfile.NamedTemporaryFile(dir=self.timelapse_tmpdir_p, suffix='.{0:s}'.format(self.config['IMAGE_FILE_TYPE']), delete=False)
+            f_tmp_frame = tempfile.NamedTemporaryFile(dir=self._timelapse_frame_folder_p, suffix='.{0:s}'.format(self.config['IMAGE_FILE_TYPE']), delete=False)
             f_tmp_frame.close()
 
             f_tmp_frame_p = Path(f_tmp_frame.name)
@@ -392,6 +463,44 @@ class StarTrailGenerator(object):
         self.image_processing_elapsed_s += time.time() - image_processing_start
 
 
+    def enableTimelapseStream(self, timelapse_generator, video_file_name):
+        # The cumulative frames are piped to ffmpeg as raw pixels instead of temporary image files.
+        # The video is written to the scratch folder, the caller closes the stream.
+        self._timelapse_generator = timelapse_generator
+        self._timelapse_stream_file_p = self.timelapse_tmpdir_p.joinpath(video_file_name)
+
+
+    def _streamTimelapseFrame(self):
+        if self._timelapse_stream_failed:
+            return
+
+        try:
+            if not self._timelapse_generator.streaming:
+                if len(self.trail_image.shape) == 2:
+                    channels = 1
+                else:
+                    channels = 3
+
+                self._timelapse_generator.openStream(
+                    self._timelapse_stream_file_p,
+                    self.original_width,
+                    self.original_height,
+                    channels=channels,
+                )
+
+            self._timelapse_generator.writeFrame(self.trail_image)
+        except TimelapseException as e:
+            logger.error('Star trail timelapse stream failed: %s', str(e))
+            self._timelapse_generator.abortStream()
+
+            # no timelapse will be generated
+            self._timelapse_stream_failed = True
+            self._timelapse_frame_count = 0
+            return
+
+        self._timelapse_frame_count += 1
+
+
     def finalize(self, outfile, camera):
         import piexif
 
@@ -2,8 +2,11 @@ import os
 import time
 from pathlib import Path
 import subprocess
+import tempfile
 import logging
 
+import numpy
+
 from . import timelapse_preprocessor
 from .exceptions import TimelapseException
 
@@ -36,11 +39,24 @@ class TimelapseGenerator(object):
         self._vf_scale = ''
         self._ffmpeg_extra_options = ''
 
+        # stream frames from the pre-processor to ffmpeg instead of an image sequence
+        self._pipe = self.config.get('TIMELAPSE', {}).get('PIPE', True)
+
 
         pp_class = getattr(timelapse_preprocessor, pre_processor_class)
         self._pre_processor = pp_class(self.config)
 
 
+        # rawvideo stream
+        self._stream_subproc = None
+        self._stream_output_f = None
+        self._stream_video_file_p = None
+        self._stream_start = None
+        self._stream_frame_count = 0
+        self._stream_frame_shape = None
+        self._stream_skipped = 0
+
+
     @property
     def codec(self):
         return self._codec
@@ -82,19 +98,41 @@ class TimelapseGenerator(object):
         self._ffmpeg_extra_options = str(new_ffmpeg_extra_options)
 
 
+    @property
+    def pipe(self):
+        return self._pipe
+
+    @pipe.setter
+    def pipe(self, new_pipe):
+        self._pipe = bool(new_pipe)
+
+
     @property
     def pre_processor(self):
         return self._pre_processor
 
 
-    def generate(self, video_file, file_list):
+    @property
+    def streaming(self):
+        return not isinstance(self._stream_subproc, type(None))
+
+    @property
+    def stream_frame_count(self):
+        return self._stream_frame_count
+
+
+    def generate(self, video_file, file_list, sort=True):
         video_file_p = Path(video_file)
 
         # Exclude empty files
         file_list_nonzero = filter(lambda p: p.stat().st_size != 0, file_list)
 
-        # Sort by timestamp
-        file_list_ordered = sorted(file_list_nonzero, key=lambda p: p.stat().st_mtime)
+        if sort:
+            # Sort by timestamp
+            file_list_ordered = sorted(file_list_nonzero, key=lambda p: p.stat().st_mtime)
+        else:
+            # caller supplies the frames in order
+            file_list_ordered = list(file_list_nonzero)
 
 
         if self.skip_frames:
@@ -102,6 +140,11 @@ class TimelapseGenerator(object):
             file_list_ordered = file_list_ordered[self.skip_frames:]
 
 
+        if self.pipe:
+            self._generatePipe(video_file_p, file_list_ordered)
+            return
+
+
         # process images
         self.pre_processor.main(file_list_ordered)
         seqfolder = self.pre_processor.seqfolder
@@ -109,6 +152,237 @@ class TimelapseGenerator(object):
 
         start = time.time()
 
+        input_options = [
+            '-r', '{0:0.2f}'.format(self.framerate),
+            '-f', 'image2',
+            #'-start_number', '0',
+            #'-pattern_type', 'glob',
+            '-i', '{0:s}/%05d.{1:s}'.format(str(seqfolder), self.config['IMAGE_FILE_TYPE']),
+        ]
+
+        cmd = self._buildCommand(input_options, video_file_p)
+        logger.info('FFmpeg command: %s', ' '.join(cmd))
+
+        ffmpeg_env = self._ffmpegEnv()
+
+
+        try:
+            ffmpeg_subproc = subprocess.run(
+                cmd,
+                env=ffmpeg_env,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                preexec_fn=lambda: os.nice(19),
+                check=True
+            )
+            elapsed_s = time.time() - start
+            logger.info('Timelapse generated in %0.4f s', elapsed_s)
+
+            for line in ffmpeg_subproc.stdout.decode().split('\n'):
+                logger.info('ffmpeg: %s', line)
+        except subprocess.CalledProcessError as e:
+            elapsed_s = time.time() - start
+
+            logger.info('FFMPEG ran for %0.4f s', elapsed_s)
+            logger.error('FFMPEG failed to generate timelapse, return code: %d', e.returncode)
+
+            for line in e.stdout.decode().split('\n'):
+                logger.error('ffmpeg: %s', line)
+
+            ### Check if video file was created
+            if video_file_p.is_file():
+                logger.error('FFMPEG created broken video file, cleaning up')
+                video_file_p.unlink()
+
+            raise TimelapseException('FFMPEG return code %d', e.returncode)
+
+
+        # set default permissions
+        video_file_p.chmod(0o644)
+
+
+    def _generatePipe(self, video_file_p, file_list):
+        # pre-processing runs while ffmpeg encodes the previous frames
+        try:
+            for frame in self.pre_processor.frames(file_list):
+                self._pipeFrame(video_file_p, frame)
+        except Exception:
+            self.abortStream()
+            raise
+
+
+        if not self.streaming:
+            raise TimelapseException('No frames available for timelapse')
+
+
+        self.closeStream()
+
+
+    def streamFrame(self, video_file, frame):
+        # Frames supplied one at a time by the caller, the stream is opened with the first frame.
+        # The caller is responsible for closeStream()
+        if self._stream_skipped < self.skip_frames:
+            self._stream_skipped += 1
+            return
+
+        self._pipeFrame(Path(video_file), frame)
+
+
+    def _pipeFrame(self, video_file_p, frame):
+        if not self.streaming:
+            frame_height, frame_width = frame.shape[:2]
+
+            if len(frame.shape) == 2:
+                channels = 1
+            else:
+                channels = 3
+
+            self.openStream(video_file_p, frame_width, frame_height, channels=channels)
+            self._stream_frame_shape = frame.shape
+
+
+        if frame.shape != self._stream_frame_shape:
+            # raw frames must all have the same dimensions
+            logger.error('Skipping timelapse frame with dimension mismatch: %s', str(frame.shape))
+            return
+
+
+        self.writeFrame(frame)
+
+
+    def openStream(self, video_file, width, height, channels=3):
+        # Frames are written to ffmpeg stdin as raw pixels, no intermediate image files
+        video_file_p = Path(video_file)
+
+        if channels == 1:
+            pix_fmt = 'gray'
+        else:
+            pix_fmt = 'bgr24'
+
+
+        input_options = [
+            '-f', 'rawvideo',
+            '-pix_fmt', pix_fmt,
+            '-s', '{0:d}x{1:d}'.format(int(width), int(height)),
+            '-r', '{0:0.2f}'.format(self.framerate),
+            '-i', 'pipe:0',
+        ]
+
+        cmd = self._buildCommand(input_options, video_file_p)
+        logger.info('FFmpeg command: %s', ' '.join(cmd))
+
+
+        # output is collected in a file so a full pipe cannot block ffmpeg
+        self._stream_output_f = tempfile.TemporaryFile()
+
+        try:
+            self._stream_subproc = subprocess.Popen(
+                cmd,
+                env=self._ffmpegEnv(),
+                stdin=subprocess.PIPE,
+                stdout=self._stream_output_f,
+                stderr=subprocess.STDOUT,
+                preexec_fn=lambda: os.nice(19),
+            )
+        except OSError as e:
+            self._stream_output_f.close()
+            self._stream_output_f = None
+            raise TimelapseException('Unable to start FFMPEG: {0:s}'.format(str(e))) from e
+
+
+        self._stream_video_file_p = video_file_p
+        self._stream_start = time.time()
+        self._stream_frame_count = 0
+
+
+    def writeFrame(self, image):
+        if not self.streaming:
+            raise TimelapseException('Timelapse stream is not open')
+
+        try:
+            self._stream_subproc.stdin.write(numpy.ascontiguousarray(image).data)
+        except BrokenPipeError as e:
+            self.abortStream()
+            raise TimelapseException('FFMPEG closed the timelapse stream') from e
+
+        self._stream_frame_count += 1
+
+
+    def closeStream(self):
+        if not self.streaming:
+            raise TimelapseException('Timelapse stream is not open')
+
+        video_file_p = self._stream_video_file_p
+
+        try:
+            self._stream_subproc.stdin.close()
+        except BrokenPipeError:
+            pass
+
+        returncode = self._stream_subproc.wait()
+        elapsed_s = time.time() - self._stream_start
+
+        ffmpeg_output = self._readStreamOutput()
+        self._stream_subproc = None
+
+
+        if returncode != 0:
+            logger.info('FFMPEG ran for %0.4f s', elapsed_s)
+            logger.error('FFMPEG failed to generate timelapse, return code: %d', returncode)
+
+            for line in ffmpeg_output.split('\n'):
+                logger.error('ffmpeg: %s', line)
+
+            ### Check if video file was created
+            if video_file_p.is_file():
+                logger.error('FFMPEG created broken video file, cleaning up')
+                video_file_p.unlink()
+
+            raise TimelapseException('FFMPEG return code %d', returncode)
+
+
+        logger.info('Timelapse streamed (%d frames) in %0.4f s', self._stream_frame_count, elapsed_s)
+
+        for line in ffmpeg_output.split('\n'):
+            logger.info('ffmpeg: %s', line)
+
+
+        # set default permissions
+        video_file_p.chmod(0o644)
+
+
+    def abortStream(self):
+        if not self.streaming:
+            return
+
+        logger.warning('Aborting timelapse stream')
+
+        self._stream_subproc.kill()
+
+        try:
+            self._stream_subproc.stdin.close()
+        except BrokenPipeError:
+            pass
+
+        self._stream_subproc.wait()
+        self._readStreamOutput()
+        self._stream_subproc = None
+
+        if self._stream_video_file_p.is_file():
+            self._stream_video_file_p.unlink()
+
+
+    def _readStreamOutput(self):
+        self._stream_output_f.seek(0)
+        ffmpeg_output = self._stream_output_f.read().decode(errors='replace')
+
+        self._stream_output_f.close()
+        self._stream_output_f = None
+
+        return ffmpeg_output
+
+
+    def _buildCommand(self, input_options, video_file_p):
         cmd = [self.ffmpeg_bin]
 
 
@@ -129,11 +403,11 @@ class TimelapseGenerator(object):
         cmd.extend([
             '-y',
             '-loglevel', 'level+error',
-            '-r', '{0:0.2f}'.format(self.framerate),
-            '-f', 'image2',
-            #'-start_number', '0',
-            #'-pattern_type', 'glob',
-            '-i', '{0:s}/%05d.{1:s}'.format(str(seqfolder), self.config['IMAGE_FILE_TYPE']),
+        ])
+
+        cmd.extend(input_options)
+
+        cmd.extend([
             '-c:v', '{0:s}'.format(self.codec),
             '-b:v', '{0:s}'.format(self.bitrate),
             #'-filter:v', 'setpts=50*PTS',
@@ -157,47 +431,14 @@ class TimelapseGenerator(object):
         # finally add filename
         cmd.append('{0:s}'.format(str(video_file_p)))
 
-        logger.info('FFmpeg command: %s', ' '.join(cmd))
+        return cmd
 
 
+    def _ffmpegEnv(self):
         ffmpeg_env = dict()
         if self.config.get('TIMELAPSE', {}).get('FFMPEG_REPORT'):
             home_dir = Path(os.environ['HOME'])
             logger.warning('*** FFMPEG debug report will be generated in %s ***', home_dir)
             ffmpeg_env['FFREPORT'] = 'file={0:s}/ffmpeg-report-%t.log'.format(str(home_dir))
 
-
-        try:
-            ffmpeg_subproc = subprocess.run(
-                cmd,
-                env=ffmpeg_env,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                preexec_fn=lambda: os.nice(19),
-                check=True
-            )
-            elapsed_s = time.time() - start
-            logger.info('Timelapse generated in %0.4f s', elapsed_s)
-
-            for line in ffmpeg_subproc.stdout.decode().split('\n'):
-                logger.info('ffmpeg: %s', line)
-        except subprocess.CalledProcessError as e:
-            elapsed_s = time.time() - start
-
-            logger.info('FFMPEG ran for %0.4f s', elapsed_s)
-            logger.error('FFMPEG failed to generate timelapse, return code: %d', e.returncode)
-
-            for line in e.stdout.decode().split('\n'):
-                logger.error('ffmpeg: %s', line)
-
-            ### Check if video file was created
-            if video_file_p.is_file():
-                logger.error('FFMPEG created broken video file, cleaning up')
-                video_file_p.unlink()
-
-            raise TimelapseException('FFMPEG return code %d', e.returncode)
-
-
-        # set default permissions
-        video_file_p.chmod(0o644)
-
+        return ffmpeg_env
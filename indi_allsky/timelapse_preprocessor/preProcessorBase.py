@@ -52,3 +52,8 @@ class PreProcessorBase(object):
     def main(self, *args, **kwargs):
         raise Exception()
 
+
+    def frames(self, *args, **kwargs):
+        # generator of processed frames for the ffmpeg rawvideo pipe
+        raise Exception()
+
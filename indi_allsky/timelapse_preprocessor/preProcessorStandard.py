@@ -3,6 +3,7 @@ import tempfile
 import logging
 
 from .preProcessorBase import PreProcessorBase
+from ..imagePrefetch import IndiAllSkyImagePrefetch
 
 
 logger = logging.getLogger('indi_allsky')
@@ -26,3 +27,14 @@ class PreProcessorStandard(PreProcessorBase):
             p_symlink = self.seqfolder.joinpath('{0:05d}.{1:s}'.format(i, self.config['IMAGE_FILE_TYPE']))
             p_symlink.symlink_to(f)
 
+
+    def frames(self, file_list):
+        prefetch = IndiAllSkyImagePrefetch(
+            threads=self.config.get('IMAGE_PREFETCH', {}).get('THREADS', 3),
+            queue_depth=self.config.get('IMAGE_PREFETCH', {}).get('QUEUE_DEPTH', 8),
+        )
+
+        for _, _, image, _ in prefetch.iterate(enumerate(file_list)):
+            yield image
+
+        prefetch.logStats('Timelapse')
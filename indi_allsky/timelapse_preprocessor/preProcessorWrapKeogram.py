@@ -5,11 +5,11 @@ import tempfile
 import numpy
 import cv2
 import simplejpeg
-import PIL
 from PIL import Image
 import logging
 
 from .preProcessorBase import PreProcessorBase
+from ..imagePrefetch import IndiAllSkyImagePrefetch
 
 
 logger = logging.getLogger('indi_allsky')
@@ -51,6 +51,66 @@ class PreProcessorWrapKeogram(PreProcessorBase):
 
 
     def main(self, file_list):
+        scaled_image_circle, scaled_x_offset, scaled_y_offset = self._setup(file_list)
+
+
+        process_start = time.time()
+
+        for i, f in enumerate(file_list):
+            # the symlink files must start at index 0 or ffmpeg will fail
+
+            if i % 25 == 0:
+                process_elapsed_s = time.time() - process_start
+                logger.info('Pre-processed %d of %d images (%0.2f images/s)', i, self.file_list_len, (i + 1) / process_elapsed_s)
+
+            self.wrap(
+                i,
+                f,
+                self.seqfolder,
+                scaled_image_circle,
+                scaled_x_offset,
+                scaled_y_offset,
+            )
+
+
+        process_elapsed_s = time.time() - process_start
+        logger.info('Pre-processing in %0.4f s (%0.2f images/s)', process_elapsed_s, len(file_list) / process_elapsed_s)
+
+
+    def frames(self, file_list):
+        scaled_image_circle, scaled_x_offset, scaled_y_offset = self._setup(file_list)
+
+
+        prefetch = IndiAllSkyImagePrefetch(
+            threads=self.config.get('IMAGE_PREFETCH', {}).get('THREADS', 3),
+            queue_depth=self.config.get('IMAGE_PREFETCH', {}).get('QUEUE_DEPTH', 8),
+        )
+
+
+        process_start = time.time()
+
+        for i, _, image, _ in prefetch.iterate(enumerate(file_list)):
+            if i % 25 == 0:
+                process_elapsed_s = time.time() - process_start
+                logger.info('Pre-processed %d of %d images (%0.2f images/s)', i, self.file_list_len, (i + 1) / process_elapsed_s)
+
+            yield self.wrapImage(
+                i,
+                image,
+                scaled_image_circle,
+                scaled_x_offset,
+                scaled_y_offset,
+            )
+
+            self.image_count += 1
+
+
+        process_elapsed_s = time.time() - process_start
+        logger.info('Pre-processing in %0.4f s (%0.2f images/s)', process_elapsed_s, len(file_list) / process_elapsed_s)
+        prefetch.logStats('Timelapse')
+
+
+    def _setup(self, file_list):
         # scale settings
         scaled_image_circle = int(self.image_circle * (self.pre_scale / 100))
         scaled_x_offset = int(self.x_offset * (self.pre_scale / 100))
@@ -91,74 +151,73 @@ class PreProcessorWrapKeogram(PreProcessorBase):
         self.file_list_len = len(file_list)
 
 
-        process_start = time.time()
+        return scaled_image_circle, scaled_x_offset, scaled_y_offset
 
-        for i, f in enumerate(file_list):
-            # the symlink files must start at index 0 or ffmpeg will fail
 
-            if i % 25 == 0:
-                process_elapsed_s = time.time() - process_start
-                logger.info('Pre-processed %d of %d images (%0.2f images/s)', i, self.file_list_len, (i + 1) / process_elapsed_s)
+    def wrap(self, i, f, seqfolder_p, image_circle, x_offset, y_offset):
+        #wrap_start = time.time()
 
-            self.wrap(
-                i,
-                f,
-                self.seqfolder,
-                scaled_image_circle,
-                scaled_x_offset,
-                scaled_y_offset,
-            )
+        #start_open = time.time()
 
+        image, _ = IndiAllSkyImagePrefetch.decodeImage(f)
 
-        process_elapsed_s = time.time() - process_start
-        logger.info('Pre-processing in %0.4f s (%0.2f images/s)', process_elapsed_s, len(file_list) / process_elapsed_s)
+        if isinstance(image, type(None)):
+            return
 
+        #elapsed_open_s = time.time() - start_open
+        #logger.info('Image opened in %0.4f s', elapsed_open_s)
 
-    def wrap(self, i, f, seqfolder_p, image_circle, x_offset, y_offset):
-        #wrap_start = time.time()
 
-        keogram = self._keogram_image.copy()
-        keogram_height, keogram_width = keogram.shape[:2]
+        image_with_keogram = self.wrapImage(i, image, image_circle, x_offset, y_offset)
 
-        current_percent = i / self.file_list_len
 
-        #keogram_line = int(keogram_width * current_percent)
-        keogram_line = int(keogram_width * (1 - current_percent))  # backwards
-        #logger.info('Line: %d', keogram_line)
+        #start_compress = time.time()
 
-        line = numpy.full([keogram_height, 1, 3], 255, dtype=numpy.uint8)
-        keogram[0:keogram_height, keogram_line:keogram_line + 1] = line
+        outfile_p = seqfolder_p.joinpath('{0:05d}.{1:s}'.format(self.image_count, self.config['IMAGE_FILE_TYPE']))
+        if self.config['IMAGE_FILE_TYPE'] in ('jpg', 'jpeg'):
+            #img_rgb = Image.fromarray(cv2.cvtColor(image_with_keogram, cv2.COLOR_BGR2RGB))
+            #img_rgb.save(str(outfile_p), quality=self.config['IMAGE_FILE_COMPRESSION']['jpg'])
 
+            ### opencv is faster
+            cv2.imwrite(str(outfile_p), image_with_keogram, [cv2.IMWRITE_JPEG_QUALITY, self.config['IMAGE_FILE_COMPRESSION']['jpg']])
+        elif self.config['IMAGE_FILE_TYPE'] in ('png',):
+            #img_rgb = Image.fromarray(cv2.cvtColor(self.trail_image, cv2.COLOR_BGR2RGB))
+            #img_rgb.save(str(f_tmp_frame_p), compress_level=self.config['IMAGE_FILE_COMPRESSION']['png'])
 
-        #start_open = time.time()
+            # opencv is faster than Pillow with PNG
+            cv2.imwrite(str(outfile_p), image_with_keogram, [cv2.IMWRITE_PNG_COMPRESSION, self.config['IMAGE_FILE_COMPRESSION']['png']])
+        elif self.config['IMAGE_FILE_TYPE'] in ('webp',):
+            img_rgb = Image.fromarray(cv2.cvtColor(image_with_keogram, cv2.COLOR_BGR2RGB))
+            img_rgb.save(str(outfile_p), quality=90, lossless=False)
+        elif self.config['IMAGE_FILE_TYPE'] in ('tif', 'tiff'):
+            img_rgb = Image.fromarray(cv2.cvtColor(image_with_keogram, cv2.COLOR_BGR2RGB))
+            img_rgb.save(str(outfile_p), compression='tiff_lzw')
+        else:
+            raise Exception('Unknown file type: %s', self.config['IMAGE_FILE_TYPE'])
 
+        #elapsed_compress_s = time.time() - start_compress
+        #logger.info('Image compress in %0.4f s', elapsed_compress_s)
 
-        if f.suffix in ('.jpg', '.jpeg'):
-            try:
-                with io.open(str(f), 'rb') as f_img:
-                    image = simplejpeg.decode_jpeg(f_img.read(), colorspace='BGR')
-            except ValueError as e:
-                logger.error('Unable to read - %s: %s', str(e), f)
-                return
 
-        elif f.suffix in ('.png',):
-            image = cv2.imread(str(f), cv2.IMREAD_COLOR)
+        #wrap_elapsed_s = time.time() - wrap_start
+        #logger.info('Wrapped image in %0.4f s', wrap_elapsed_s)
 
-            if isinstance(image, type(None)):
-                logger.error('Unable to read %s', f)
-                return
-        else:
-            # Pillow supports remaining image types
-            try:
-                with Image.open(str(f)) as img_pil:
-                    image = cv2.cvtColor(numpy.array(img_pil), cv2.COLOR_RGB2BGR)
-            except PIL.UnidentifiedImageError:
-                logger.error('Unable to read %s', f)
-                return
 
+        self.image_count += 1
 
-        #elapsed_open_s = time.time() - start_open
-        #logger.info('Image opened in %0.4f s', elapsed_open_s)
+
+    def wrapImage(self, i, image, image_circle, x_offset, y_offset):
+        keogram = self._keogram_image.copy()
+        keogram_height, keogram_width = keogram.shape[:2]
+
+        current_percent = i / self.file_list_len
+
+        #keogram_line = int(keogram_width * current_percent)
+        keogram_line = int(keogram_width * (1 - current_percent))  # backwards
+        #logger.info('Line: %d', keogram_line)
+
+        line = numpy.full([keogram_height, 1, 3], 255, dtype=numpy.uint8)
+        keogram[0:keogram_height, keogram_line:keogram_line + 1] = line
 
 
         image_height, image_width = image.shape[:2]
@@ -283,37 +342,4 @@ class PreProcessorWrapKeogram(PreProcessorBase):
             ]
 
 
-        #start_compress = time.time()
-
-        outfile_p = seqfolder_p.joinpath('{0:05d}.{1:s}'.format(self.image_count, self.config['IMAGE_FILE_TYPE']))
-        if self.config['IMAGE_FILE_TYPE'] in ('jpg', 'jpeg'):
-            #img_rgb = Image.fromarray(cv2.cvtColor(image_with_keogram, cv2.COLOR_BGR2RGB))
-            #img_rgb.save(str(outfile_p), quality=self.config['IMAGE_FILE_COMPRESSION']['jpg'])
-
-            ### opencv is faster
-            cv2.imwrite(str(outfile_p), image_with_keogram, [cv2.IMWRITE_JPEG_QUALITY, self.config['IMAGE_FILE_COMPRESSION']['jpg']])
-        elif self.config['IMAGE_FILE_TYPE'] in ('png',):
-            #img_rgb = Image.fromarray(cv2.cvtColor(self.trail_image, cv2.COLOR_BGR2RGB))
-            #img_rgb.save(str(f_tmp_frame_p), compress_level=self.config['IMAGE_FILE_COMPRESSION']['png'])
-
-            # opencv is faster than Pillow with PNG
-            cv2.imwrite(str(outfile_p), image_with_keogram, [cv2.IMWRITE_PNG_COMPRESSION, self.config['IMAGE_FILE_COMPRESSION']['png']])
-        elif self.config['IMAGE_FILE_TYPE'] in ('webp',):
-            img_rgb = Image.fromarray(cv2.cvtColor(image_with_keogram, cv2.COLOR_BGR2RGB))
-            img_rgb.save(str(outfile_p), quality=90, lossless=False)
-        elif self.config['IMAGE_FILE_TYPE'] in ('tif', 'tiff'):
-            img_rgb = Image.fromarray(cv2.cvtColor(image_with_keogram, cv2.COLOR_BGR2RGB))
-            img_rgb.save(str(outfile_p), compression='tiff_lzw')
-        else:
-            raise Exception('Unknown file type: %s', self.config['IMAGE_FILE_TYPE'])
-
-        #elapsed_compress_s = time.time() - start_compress
-        #logger.info('Image compress in %0.4f s', elapsed_compress_s)
-
-
-        #wrap_elapsed_s = time.time() - wrap_start
-        #logger.info('Wrapped image in %0.4f s', wrap_elapsed_s)
-
-
-        self.image_count += 1
-
+        return image_with_keogram
@@ -0,0 +1,152 @@
+import time
+import json
+import logging
+
+from .filetransfer.exceptions import ConnectionFailure
+
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyUploadConnectionPool(object):
+    """Keeps file transfer clients connected between upload tasks
+
+    Clients are keyed by the transfer class and all of the connection
+    parameters, a pool is owned by a single uploader thread and clients are
+    never shared between threads.
+    """
+
+    def __init__(self, config):
+        self.config = config
+
+        # 0 disables connection reuse
+        self._idle_timeout = float(self.config.get('UPLOAD_CONNECTION_IDLE_TIMEOUT', 120))
+
+        self._client_dict = dict()  # key: {'client', 'last_used'}
+
+
+    @property
+    def idle_timeout(self):
+        return self._idle_timeout
+
+
+    def __len__(self):
+        return len(self._client_dict)
+
+
+    @staticmethod
+    def connectionKey(client_class, client_kwargs, client_attrs, connect_kwargs):
+        key_data = [client_kwargs, client_attrs, connect_kwargs]
+        return (client_class.__name__, json.dumps(key_data, sort_keys=True, default=str))
+
+
+    def transfer(self, client_class, connect_kwargs, put_kwargs, client_kwargs=None, client_attrs=None):
+        if isinstance(client_kwargs, type(None)):
+            client_kwargs = dict()
+
+        if isinstance(client_attrs, type(None)):
+            client_attrs = dict()
+
+
+        key = self.connectionKey(client_class, client_kwargs, client_attrs, connect_kwargs)
+
+
+        client = self._checkout(key)
+        if client:
+            try:
+                response = client.put(**put_kwargs)
+            except ConnectionFailure as e:
+                # the server may have dropped an idle session
+                logger.warning('Reconnecting %s after failure on existing connection: %s', client_class.__name__, str(e))
+                self._closeClient(client)
+            except Exception:
+                self._closeClient(client)
+                raise
+            else:
+                self._checkin(key, client)
+                return response
+
+
+        client = client_class(self.config, **client_kwargs)
+        for k, v in client_attrs.items():
+            setattr(client, k, v)
+
+
+        try:
+            client.connect(**connect_kwargs)
+            response = client.put(**put_kwargs)
+        except Exception:
+            self._closeClient(client)
+            raise
+
+
+        self._checkin(key, client)
+
+        return response
+
+
+    def expire(self):
+        now = time.time()
+
+        for key in list(self._client_dict.keys()):
+            if now - self._client_dict[key]['last_used'] < self._idle_timeout:
+                continue
+
+            client_entry = self._client_dict.pop(key)
+            logger.info('Closing idle %s connection', client_entry['client'].__class__.__name__)
+            self._closeClient(client_entry['client'])
+
+
+    def closeAll(self):
+        for client_entry in self._client_dict.values():
+            self._closeClient(client_entry['client'])
+
+        self._client_dict.clear()
+
+
+    def _checkout(self, key):
+        client_entry = self._client_dict.pop(key, None)
+        if not client_entry:
+            return None
+
+
+        client = client_entry['client']
+
+        if time.time() - client_entry['last_used'] >= self._idle_timeout:
+            self._closeClient(client)
+            return None
+
+
+        try:
+            connected = client.isConnected()
+        except Exception as e:
+            logger.warning('%s health check failed: %s', client.__class__.__name__, str(e))
+            connected = False
+
+
+        if not connected:
+            self._closeClient(client)
+            return None
+
+
+        return client
+
+
+    def _checkin(self, key, client):
+        if self._idle_timeout <= 0 or not client.reusable:
+            self._closeClient(client)
+            return
+
+
+        self._client_dict[key] = {
+            'client'    : client,
+            'last_used' : time.time(),
+        }
+
+
+    def _closeClient(self, client):
+        try:
+            client.close()
+        except Exception as e:
+            # connection is probably already gone
+            logger.warning('Error closing %s connection: %s', client.__class__.__name__, str(e))
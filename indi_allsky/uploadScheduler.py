@@ -0,0 +1,303 @@
+from pathlib import Path
+import heapq
+import itertools
+import threading
+import logging
+
+from . import constants
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyUploadScheduler(object):
+    """Thread safe upload queue with a concurrency limit per destination
+
+    A slow destination only occupies its own worker slots, tasks for other
+    destinations are handed to the remaining upload workers.  Lower priority
+    values run first, ties are run in the order they were queued.
+
+    Tasks for a fixed remote target (latest image, realtime keogram) are
+    coalesced, a newer task replaces the pending task for the same target.
+    """
+
+    destination_list = ('filetransfer', 's3', 'mqtt', 'syncapi', 'youtube')
+
+    destination_actions = {
+        'filetransfer' : (constants.TRANSFER_UPLOAD,),
+        's3'           : (constants.TRANSFER_S3, constants.DELETE_S3),
+        'mqtt'         : (constants.TRANSFER_MQTT,),
+        'syncapi'      : (constants.TRANSFER_SYNC_V1,),
+        'youtube'      : (constants.TRANSFER_YOUTUBE,),
+    }
+
+    default_destination = 'filetransfer'
+
+    # default priorities when the task does not define one
+    priority_camera = 0  # the remote server rejects entries for an unknown camera
+    priority_latest = 10
+    priority_default = 50
+    priority_bulk = 100
+
+    model_priority = {
+        'IndiAllSkyDbCameraTable'           : priority_camera,
+        'IndiAllSkyDbImageTable'            : priority_latest,
+        'IndiAllSkyDbThumbnailTable'        : priority_latest,
+        'IndiAllSkyDbPanoramaImageTable'    : priority_latest,
+        'IndiAllSkyDbKeogramTable'          : priority_default,
+        'IndiAllSkyDbStarTrailsTable'       : priority_default,
+        'IndiAllSkyDbVideoTable'            : priority_bulk,
+        'IndiAllSkyDbMiniVideoTable'        : priority_bulk,
+        'IndiAllSkyDbStarTrailsVideoTable'  : priority_bulk,
+        'IndiAllSkyDbPanoramaVideoTable'    : priority_bulk,
+        'IndiAllSkyDbRawImageTable'         : priority_bulk,
+        'IndiAllSkyDbFitsImageTable'        : priority_bulk,
+    }
+
+    action_priority = {
+        constants.TRANSFER_MQTT    : priority_latest,
+        constants.DELETE_S3        : priority_latest,
+        constants.TRANSFER_YOUTUBE : priority_bulk,
+    }
+
+    small_file_size = 5 * 1024 * 1024  # local files without a model, realtime keogram vs db backup
+
+    state_key = 'UPLOAD_DESTINATIONS'
+
+
+    def __init__(self, config):
+        self._cond = threading.Condition()
+        self._counter = itertools.count()
+
+        self._pending = {dest: [] for dest in self.destination_list}
+        self._in_flight = {dest: 0 for dest in self.destination_list}
+        self._limits = dict()
+
+        self._coalesce_tasks = dict()  # coalesce key: task id
+        self._task_coalesce = dict()  # task id: coalesce key
+
+        self.updateConfig(config)
+
+
+    def updateConfig(self, config):
+        upload_destinations = config.get('UPLOAD_DESTINATION_WORKERS', {})
+
+        with self._cond:
+            for dest in self.destination_list:
+                self._limits[dest] = max(int(upload_destinations.get(dest.upper(), 1)), 1)
+
+            self._cond.notify_all()
+
+
+    @classmethod
+    def destinationForAction(cls, action):
+        for dest, action_list in cls.destination_actions.items():
+            if action in action_list:
+                return dest
+
+        return cls.default_destination
+
+
+    @classmethod
+    def taskPriority(cls, task_data, priority=None):
+        if not isinstance(priority, type(None)):
+            return int(priority)
+
+
+        action = task_data.get('action')
+        if action in cls.action_priority:
+            return cls.action_priority[action]
+
+
+        if (task_data.get('metadata') or {}).get('type') == constants.CAMERA:
+            return cls.priority_camera
+
+
+        model = task_data.get('model')
+        if model:
+            return cls.model_priority.get(model, cls.priority_default)
+
+
+        local_file = task_data.get('local_file')
+        if local_file:
+            try:
+                if Path(local_file).stat().st_size <= cls.small_file_size:
+                    return cls.priority_latest
+            except OSError:
+                pass
+
+            return cls.priority_bulk
+
+
+        return cls.priority_default
+
+
+    @classmethod
+    def coalesceKey(cls, task_data):
+        if not task_data.get('coalesce'):
+            return None
+
+        remote_file = task_data.get('remote_file')
+        if not remote_file:
+            return None
+
+        return (task_data.get('action'), str(remote_file))
+
+
+    def addTask(self, task_id, action, priority, coalesce_key=None):
+        # returns (destination, superseded task id list)
+        dest = self.destinationForAction(action)
+        task_id = int(task_id)
+
+        superseded_list = list()
+
+        with self._cond:
+            entry = (int(priority), next(self._counter), task_id)
+
+            if not isinstance(coalesce_key, type(None)):
+                old_task_id = self._coalesce_tasks.get(coalesce_key)
+
+                if not isinstance(old_task_id, type(None)):
+                    old_entry = self._removePending(dest, old_task_id)
+
+                    if old_entry:
+                        superseded_list.append(old_task_id)
+
+                        # the new task takes the place of the old task in the queue
+                        entry = (min(entry[0], old_entry[0]), old_entry[1], task_id)
+
+
+                self._coalesce_tasks[coalesce_key] = task_id
+                self._task_coalesce[task_id] = coalesce_key
+
+
+            heapq.heappush(self._pending[dest], entry)
+            self._cond.notify()
+
+
+        return dest, superseded_list
+
+
+    def _removePending(self, dest, task_id):
+        dest_pending = self._pending[dest]
+
+        for i, entry in enumerate(dest_pending):
+            if entry[2] != task_id:
+                continue
+
+            dest_pending.pop(i)
+            heapq.heapify(dest_pending)
+
+            self._task_coalesce.pop(task_id, None)
+
+            return entry
+
+
+        return None
+
+
+    def acquire(self, timeout=None):
+        # returns (destination, task_id), or None after the timeout
+        with self._cond:
+            result = self._next()
+            if result:
+                return result
+
+            self._cond.wait(timeout=timeout)
+
+            return self._next()
+
+
+    def _next(self):
+        # next task for a destination that has a free slot
+        best_dest = None
+        for dest in self.destination_list:
+            if self._in_flight[dest] >= self._limits[dest]:
+                continue
+
+            if not self._pending[dest]:
+                continue
+
+            if isinstance(best_dest, type(None)) or self._pending[dest][0] < self._pending[best_dest][0]:
+                best_dest = dest
+
+
+        if isinstance(best_dest, type(None)):
+            return None
+
+
+        priority, seq, task_id = heapq.heappop(self._pending[best_dest])
+        self._in_flight[best_dest] += 1
+
+
+        coalesce_key = self._task_coalesce.pop(task_id, None)
+        if not isinstance(coalesce_key, type(None)):
+            # newer tasks for the target are queued normally while this one runs
+            self._coalesce_tasks.pop(coalesce_key, None)
+
+        return best_dest, task_id
+
+
+    def acquireMore(self, dest, count):
+        # additional pending tasks for a destination slot that is already held
+        task_id_list = list()
+
+        with self._cond:
+            dest_pending = self._pending[dest]
+
+            while dest_pending and len(task_id_list) < count:
+                priority, seq, task_id = heapq.heappop(dest_pending)
+
+                coalesce_key = self._task_coalesce.pop(task_id, None)
+                if not isinstance(coalesce_key, type(None)):
+                    self._coalesce_tasks.pop(coalesce_key, None)
+
+                task_id_list.append(task_id)
+
+
+        return task_id_list
+
+
+    def release(self, dest):
+        with self._cond:
+            self._in_flight[dest] = max(self._in_flight[dest] - 1, 0)
+            self._cond.notify_all()
+
+
+    def waitPending(self, count, timeout=None):
+        # wait until no more than count tasks are queued or running
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pendingCount() <= count, timeout=timeout)
+
+
+    def _pendingCount(self):
+        return sum(len(p) for p in self._pending.values()) + sum(self._in_flight.values())
+
+
+    def wakeAll(self):
+        # let idle workers check for a stop
+        with self._cond:
+            self._cond.notify_all()
+
+
+    def pendingTaskIds(self):
+        with self._cond:
+            task_list = list()
+            for dest_pending in self._pending.values():
+                task_list.extend(dest_pending)
+
+        return [task_id for priority, seq, task_id in sorted(task_list)]
+
+
+    def status(self):
+        status = dict()
+
+        with self._cond:
+            for dest in self.destination_list:
+                status[dest] = {
+                    'limit'     : self._limits[dest],
+                    'queued'    : len(self._pending[dest]),
+                    'in_flight' : self._in_flight[dest],
+                }
+
+
+        return status
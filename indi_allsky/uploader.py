@@ -1,4 +1,5 @@
 import time
+import json
 from datetime import timedelta
 from pathlib import Path
 #import signal
@@ -19,6 +20,8 @@ from .flask.miscDb import miscDb
 from .flask import models
 
 from . import filetransfer
+from .uploadPool import IndiAllSkyUploadConnectionPool
+from .uploadScheduler import IndiAllSkyUploadScheduler
 
 from sqlalchemy.orm.exc import NoResultFound
 
@@ -31,6 +34,169 @@ logger = logging.getLogger('indi_allsky')
 
 
 
+class UploadDispatcher(Thread):
+    """Moves tasks from the upload queue to the upload scheduler
+
+    Producers keep sending {'task_id': N} to the upload queue, the upload
+    workers take tasks from the scheduler by destination and priority.
+    """
+
+    status_interval = 5
+
+
+    def __init__(
+        self,
+        idx,
+        config,
+        error_q,
+        upload_q,
+        scheduler,
+    ):
+        super(UploadDispatcher, self).__init__()
+
+        self.name = 'UploadDispatch-{0:d}'.format(idx)
+
+        self.config = config
+
+        self._miscDb = miscDb(self.config)
+
+        self.error_q = error_q
+        self.upload_q = upload_q
+        self.scheduler = scheduler
+
+        self._status_last = None
+        self._status_time = 0
+
+        self._stopper = threading.Event()
+
+
+    def stop(self):
+        self._stopper.set()
+
+
+    def stopped(self):
+        return self._stopper.is_set()
+
+
+    def run(self):
+        ### use this as a method to log uncaught exceptions
+        try:
+            self.saferun()
+        except Exception as e:
+            tb = traceback.format_exc()
+            self.error_q.put((str(e), tb))
+            raise e
+
+
+    def saferun(self):
+        while True:
+            if self.stopped():
+                logger.warning('Goodbye')
+                return
+
+            try:
+                u_dict = self.upload_q.get(timeout=self.status_interval)
+            except queue.Empty:
+                u_dict = {}
+
+
+            with app.app_context():
+                if u_dict.get('task_id'):
+                    self.queueTask(u_dict['task_id'])
+
+                self.publishStatus()
+
+
+    def queueTask(self, task_id):
+        try:
+            task = models.IndiAllSkyDbTaskQueueTable.query\
+                .filter(models.IndiAllSkyDbTaskQueueTable.id == task_id)\
+                .filter(models.IndiAllSkyDbTaskQueueTable.state == models.TaskQueueState.QUEUED)\
+                .filter(models.IndiAllSkyDbTaskQueueTable.queue == models.TaskQueueQueue.UPLOAD)\
+                .one()
+        except NoResultFound:
+            logger.error('Task ID %d not found', task_id)
+            return
+
+
+        if task.data:
+            task_data = task.data
+        else:
+            task_data = {}
+
+
+        priority = IndiAllSkyUploadScheduler.taskPriority(task_data, task.priority)
+        coalesce_key = IndiAllSkyUploadScheduler.coalesceKey(task_data)
+
+        dest, superseded_list = self.scheduler.addTask(task.id, task_data.get('action'), priority, coalesce_key=coalesce_key)
+        logger.info('Queued upload task %d for %s (priority %d)', task.id, dest, priority)
+
+
+        for superseded_task_id in superseded_list:
+            self.expireSuperseded(superseded_task_id, task.id)
+
+
+    def expireSuperseded(self, superseded_task_id, task_id):
+        logger.info('Upload task %d superseded by task %d', superseded_task_id, task_id)
+
+        try:
+            superseded_task = models.IndiAllSkyDbTaskQueueTable.query\
+                .filter(models.IndiAllSkyDbTaskQueueTable.id == superseded_task_id)\
+                .one()
+        except NoResultFound:
+            logger.error('Task ID %d not found', superseded_task_id)
+            return
+
+
+        superseded_task.result = 'Superseded by task {0:d}'.format(task_id)
+        superseded_task.setExpired()
+
+
+        if superseded_task.data and superseded_task.data.get('remove_local'):
+            # temporary files are not needed
+            local_file = superseded_task.data.get('local_file')
+            if not local_file:
+                return
+
+            try:
+                Path(local_file).unlink()
+            except FileNotFoundError:
+                pass
+            except PermissionError as e:
+                logger.error('Cannot remove local file: %s', str(e))
+
+
+    def publishStatus(self):
+        # destination state for the web interface
+        now = time.time()
+
+        if now - self._status_time < self.status_interval:
+            return
+
+
+        # workers update the scheduler directly, compare with the last published state
+        dest_status = self.scheduler.status()
+
+        if dest_status == self._status_last and now - self._status_time < 60:
+            return
+
+
+        destination_state = {
+            'ts'           : int(now),
+            'destinations' : dest_status,
+        }
+
+        try:
+            self._miscDb.setState(IndiAllSkyUploadScheduler.state_key, json.dumps(destination_state))
+        except Exception:
+            logger.exception('Unable to store upload destination state')
+
+
+        self._status_last = dest_status
+        self._status_time = now
+
+
+
 class FileUploader(Thread):
     def __init__(
         self,
@@ -38,6 +204,7 @@ class FileUploader(Thread):
         config,
         error_q,
         upload_q,
+        scheduler=None,
     ):
         super(FileUploader, self).__init__()
 
@@ -47,9 +214,14 @@ class FileUploader(Thread):
 
         self._miscDb = miscDb(self.config)
 
+        self._pool = IndiAllSkyUploadConnectionPool(self.config)
+
         self.error_q = error_q
         self.upload_q = upload_q
 
+        # without a scheduler tasks are taken directly from the upload queue
+        self.scheduler = scheduler
+
 
         self._stopper = threading.Event()
         #self._shutdown = False
@@ -90,6 +262,9 @@ class FileUploader(Thread):
     def stop(self):
         self._stopper.set()
 
+        if self.scheduler:
+            self.scheduler.wakeAll()
+
 
     def stopped(self):
         return self._stopper.is_set()
@@ -117,14 +292,18 @@ class FileUploader(Thread):
 
         while True:
             if self.stopped():
+                self._pool.closeAll()
                 logger.warning('Goodbye')
                 return
 
-            try:
-                u_dict = self.upload_q.get(timeout=11)  # prime number
-            except queue.Empty:
+            next_task = self._nextTask()
+            if not next_task:
+                self._pool.expire()
                 continue
 
+
+            dest, u_dict = next_task
+
             #if u_dict.get('stop'):
             #    logger.warning('Goodbye')
             #    return
@@ -134,9 +313,38 @@ class FileUploader(Thread):
             #    return
 
 
-            # new context for every task, reduces the effects of caching
-            with app.app_context():
-                self.processUpload(u_dict)
+            try:
+                # new context for every task, reduces the effects of caching
+                with app.app_context():
+                    syncapi_batch_size = int(self.config.get('SYNCAPI', {}).get('BATCH_SIZE', 1))
+
+                    if dest == 'syncapi' and syncapi_batch_size > 1:
+                        task_id_list = [u_dict['task_id']] + self.scheduler.acquireMore(dest, syncapi_batch_size - 1)
+                        self.processSyncApiBatch(task_id_list)
+                    else:
+                        self.processUpload(u_dict)
+            finally:
+                if self.scheduler:
+                    self.scheduler.release(dest)
+
+
+    def _nextTask(self):
+        # returns (destination, u_dict) or None
+        if self.scheduler:
+            scheduled_task = self.scheduler.acquire(timeout=11)
+            if not scheduled_task:
+                return None
+
+            dest, task_id = scheduled_task
+            return dest, {'task_id' : task_id}
+
+
+        try:
+            u_dict = self.upload_q.get(timeout=11)  # prime number
+        except queue.Empty:
+            return None
+
+        return None, u_dict
 
 
     def processUpload(self, u_dict):
@@ -239,13 +447,15 @@ class FileUploader(Thread):
                 task.setFailed('Unknown filetransfer class: {0:s}'.format(self.config['FILETRANSFER']['CLASSNAME']))
                 return
 
-            client = client_class(self.config)
-            client.connect_timeout = self.config.get('FILETRANSFER', {}).get('CONNECT_TIMEOUT', 10)
-            client.timeout = self.config.get('FILETRANSFER', {}).get('TIMEOUT', 60)
-            client.atomic = self.config.get('FILETRANSFER', {}).get('ATOMIC_TRANSFERS', False)
+            client_kwargs = dict()
+            client_attrs = {
+                'connect_timeout' : self.config.get('FILETRANSFER', {}).get('CONNECT_TIMEOUT', 10),
+                'timeout'         : self.config.get('FILETRANSFER', {}).get('TIMEOUT', 60),
+                'atomic'          : self.config.get('FILETRANSFER', {}).get('ATOMIC_TRANSFERS', False),
+            }
 
             if self.config['FILETRANSFER']['PORT']:
-                client.port = self.config['FILETRANSFER']['PORT']
+                client_attrs['port'] = self.config['FILETRANSFER']['PORT']
 
         elif action == constants.TRANSFER_S3:
             s3_key = local_file_p.relative_to(self.image_dir).as_posix()
@@ -283,13 +493,15 @@ class FileUploader(Thread):
                 return
 
 
-            client = client_class(self.config)
-            client.connect_timeout = self.config.get('S3UPLOAD', {}).get('CONNECT_TIMEOUT', 10)
-            client.timeout = self.config.get('S3UPLOAD', {}).get('TIMEOUT', 60)
+            client_kwargs = dict()
+            client_attrs = {
+                'connect_timeout' : self.config.get('S3UPLOAD', {}).get('CONNECT_TIMEOUT', 10),
+                'timeout'         : self.config.get('S3UPLOAD', {}).get('TIMEOUT', 60),
+            }
 
 
             if self.config['S3UPLOAD']['PORT']:
-                client.port = self.config['S3UPLOAD']['PORT']
+                client_attrs['port'] = self.config['S3UPLOAD']['PORT']
 
 
         elif action == constants.DELETE_S3:
@@ -319,13 +531,15 @@ class FileUploader(Thread):
                 return
 
 
-            client = client_class(self.config, delete=True)
-            client.connect_timeout = self.config.get('S3UPLOAD', {}).get('CONNECT_TIMEOUT', 10)
-            client.timeout = self.config.get('S3UPLOAD', {}).get('TIMEOUT', 60)
+            client_kwargs = {'delete' : True}
+            client_attrs = {
+                'connect_timeout' : self.config.get('S3UPLOAD', {}).get('CONNECT_TIMEOUT', 10),
+                'timeout'         : self.config.get('S3UPLOAD', {}).get('TIMEOUT', 60),
+            }
 
 
             if self.config['S3UPLOAD']['PORT']:
-                client.port = self.config['S3UPLOAD']['PORT']
+                client_attrs['port'] = self.config['S3UPLOAD']['PORT']
 
 
         elif action == constants.TRANSFER_MQTT:
@@ -362,10 +576,11 @@ class FileUploader(Thread):
                 task.setFailed('Unknown filetransfer class: {0:s}'.format('paho_mqtt'))
                 return
 
-            client = client_class(self.config)
+            client_kwargs = dict()
+            client_attrs = dict()
 
             if self.config['MQTTPUBLISH']['PORT']:
-                client.port = self.config['MQTTPUBLISH']['PORT']
+                client_attrs['port'] = self.config['MQTTPUBLISH']['PORT']
 
         elif action == constants.TRANSFER_SYNC_V1:
             ENDPOINT_URI = constants.ENDPOINT_V1[metadata['type']]
@@ -390,9 +605,11 @@ class FileUploader(Thread):
                 task.setFailed('Unknown filetransfer class: {0:s}'.format('requests_syncapi_v1'))
                 return
 
-            client = client_class(self.config)
-            client.connect_timeout = self.config.get('SYNCAPI', {}).get('CONNECT_TIMEOUT', 10.0)
-            client.timeout = self.config.get('SYNCAPI', {}).get('TIMEOUT', 60.0)
+            client_kwargs = dict()
+            client_attrs = {
+                'connect_timeout' : self.config.get('SYNCAPI', {}).get('CONNECT_TIMEOUT', 10.0),
+                'timeout'         : self.config.get('SYNCAPI', {}).get('TIMEOUT', 60.0),
+            }
         elif action == constants.TRANSFER_YOUTUBE:
             try:
                 credentials_json = self._miscDb.getState('YOUTUBE_CREDENTIALS')
@@ -419,7 +636,8 @@ class FileUploader(Thread):
                 task.setFailed('Unknown filetransfer class: {0:s}'.format('youtube_oauth2'))
                 return
 
-            client = client_class(self.config)
+            client_kwargs = dict()
+            client_attrs = dict()
         else:
             task.setFailed('Invalid transfer action')
             raise Exception('Invalid transfer action')
@@ -427,60 +645,17 @@ class FileUploader(Thread):
 
         start = time.time()
 
+        # Upload file, the connection is reused when possible
         try:
-            client.connect(**connect_kwargs)
-        except filetransfer.exceptions.ConnectionFailure as e:
-            logger.error('Connection failure: %s', e)
-            client.close()
-            task.setFailed('Connection failure')
-
-            self._miscDb.addNotification(
-                models.NotificationCategory.UPLOAD,
-                'connection',
-                '{0:s} file transfer connection failure: {1:s}'.format(client_class.__name__, str(e)),
-                expire=timedelta(hours=1),
-            )
-
-            self.cleanup(local_file_p, remove_local=remove_local)
-
-            return
-        except filetransfer.exceptions.AuthenticationFailure as e:
-            logger.error('Authentication failure: %s', e)
-            client.close()
-            task.setFailed('Authentication failure')
-
-            self._miscDb.addNotification(
-                models.NotificationCategory.UPLOAD,
-                'authentication',
-                '{0:s} file transfer authentication failure: {1:s}'.format(client_class.__name__, str(e)),
-                expire=timedelta(hours=1),
-            )
-
-            self.cleanup(local_file_p, remove_local=remove_local)
-
-            return
-        except filetransfer.exceptions.CertificateValidationFailure as e:
-            logger.error('Certificate validation failure: %s', e)
-            client.close()
-            task.setFailed('Certificate validation failure')
-
-            self._miscDb.addNotification(
-                models.NotificationCategory.UPLOAD,
-                'certificate',
-                '{0:s} file transfer certificate validation failed: {1:s}'.format(client_class.__name__, str(e)),
-                expire=timedelta(hours=1),
+            response = self._pool.transfer(
+                client_class,
+                connect_kwargs,
+                put_kwargs,
+                client_kwargs=client_kwargs,
+                client_attrs=client_attrs,
             )
-
-            self.cleanup(local_file_p, remove_local=remove_local)
-
-            return
-
-        # Upload file
-        try:
-            response = client.put(**put_kwargs)
         except filetransfer.exceptions.ConnectionFailure as e:
             logger.error('Connection failure: %s', e)
-            client.close()
             task.setFailed('Connection failure')
 
             self._miscDb.addNotification(
@@ -495,7 +670,6 @@ class FileUploader(Thread):
             return
         except filetransfer.exceptions.AuthenticationFailure as e:
             logger.error('Authentication failure: %s', e)
-            client.close()
             task.setFailed('Authentication failure')
 
             self._miscDb.addNotification(
@@ -510,7 +684,6 @@ class FileUploader(Thread):
             return
         except filetransfer.exceptions.CertificateValidationFailure as e:
             logger.error('Certificate validation failure: %s', e)
-            client.close()
             task.setFailed('Certificate validation failure')
 
             self._miscDb.addNotification(
@@ -525,7 +698,6 @@ class FileUploader(Thread):
             return
         except filetransfer.exceptions.TransferFailure as e:
             logger.error('Tranfer failure: %s', e)
-            client.close()
             task.setFailed('Tranfer failure')
 
             self._miscDb.addNotification(
@@ -540,7 +712,6 @@ class FileUploader(Thread):
             return
         except filetransfer.exceptions.PermissionFailure as e:
             logger.error('Permission failure: %s', e)
-            client.close()
             task.setFailed('Permission failure')
 
             self._miscDb.addNotification(
@@ -553,9 +724,6 @@ class FileUploader(Thread):
             self.cleanup(local_file_p, remove_local=remove_local)
 
             return
-        finally:
-            # close file transfer client
-            client.close()
 
 
         upload_elapsed_s = time.time() - start
@@ -603,6 +771,135 @@ class FileUploader(Thread):
         #raise Exception('Testing uncaught exception')
 
 
+    def processSyncApiBatch(self, task_id_list):
+        if len(task_id_list) == 1:
+            self.processUpload({'task_id' : task_id_list[0]})
+            return
+
+
+        camera_batch_dict = dict()  # camera uuid: [(task, entry), ...]
+
+        for task_id in task_id_list:
+            try:
+                task = models.IndiAllSkyDbTaskQueueTable.query\
+                    .filter(models.IndiAllSkyDbTaskQueueTable.id == task_id)\
+                    .filter(models.IndiAllSkyDbTaskQueueTable.state == models.TaskQueueState.QUEUED)\
+                    .filter(models.IndiAllSkyDbTaskQueueTable.queue == models.TaskQueueQueue.UPLOAD)\
+                    .one()
+            except NoResultFound:
+                logger.error('Task ID %d not found', task_id)
+                continue
+
+
+            metadata = task.data.get('metadata', {})
+            entry_model = task.data.get('model')
+            entry_id = task.data.get('id')
+
+            if metadata.get('type') == constants.CAMERA or not entry_model or not entry_id:
+                # cameras are synced before the entries in the batch
+                self.processUpload({'task_id' : task.id})
+                continue
+
+
+            task.setRunning()
+
+
+            try:
+                _model = getattr(models, entry_model)
+            except AttributeError:
+                logger.error('Model not found: %s', entry_model)
+                task.setFailed('Model not found: {0:s}'.format(entry_model))
+                continue
+
+            try:
+                entry = _model.query\
+                    .filter(_model.id == entry_id)\
+                    .one()
+            except NoResultFound:
+                logger.error('ID %d not found in %s', entry_id, entry_model)
+                task.setFailed('ID {0:d} not found in {1:s}'.format(entry_id, entry_model))
+                continue
+
+
+            camera_batch_dict.setdefault(metadata['camera_uuid'], []).append((task, entry))
+
+
+        for camera_uuid, batch_list in camera_batch_dict.items():
+            self._syncApiBatch(camera_uuid, batch_list)
+
+
+    def _syncApiBatch(self, camera_uuid, batch_list):
+        connect_kwargs = {
+            'hostname'     : '{0:s}/{1:s}'.format(self.config['SYNCAPI']['BASEURL'], constants.ENDPOINT_V1_BATCH),
+            'username'     : self.config['SYNCAPI']['USERNAME'],
+            'apikey'       : self.config['SYNCAPI']['APIKEY'],
+            'cert_bypass'  : self.config['SYNCAPI']['CERT_BYPASS'],
+        }
+
+        put_kwargs = {
+            'batch'         : {
+                'camera_uuid' : camera_uuid,
+                'utc_offset'  : batch_list[0][0].data['metadata']['utc_offset'],
+                'items'       : [(task.data['metadata'], entry.getFilesystemPath()) for task, entry in batch_list],
+            },
+            'empty_file'    : self.config.get('SYNCAPI', {}).get('EMPTY_FILE'),
+        }
+
+        client_class = filetransfer.requests_syncapi_v1
+
+        client_attrs = {
+            'connect_timeout' : self.config.get('SYNCAPI', {}).get('CONNECT_TIMEOUT', 10.0),
+            'timeout'         : self.config.get('SYNCAPI', {}).get('TIMEOUT', 60.0),
+        }
+
+
+        start = time.time()
+
+        try:
+            response = self._pool.transfer(
+                client_class,
+                connect_kwargs,
+                put_kwargs,
+                client_attrs=client_attrs,
+            )
+        except (
+            filetransfer.exceptions.ConnectionFailure,
+            filetransfer.exceptions.AuthenticationFailure,
+            filetransfer.exceptions.CertificateValidationFailure,
+            filetransfer.exceptions.TransferFailure,
+            filetransfer.exceptions.PermissionFailure,
+        ) as e:
+            logger.error('Batch transfer failure: %s', e)
+
+            for task, entry in batch_list:
+                task.setFailed('Batch transfer failure')
+
+            self._miscDb.addNotification(
+                models.NotificationCategory.UPLOAD,
+                'filetransfer',
+                '{0:s} batch file transfer failed: {1:s}'.format(client_class.__name__, str(e)),
+                expire=timedelta(hours=1),
+            )
+
+            return
+
+
+        upload_elapsed_s = time.time() - start
+        logger.info('Batch upload transaction of %d entries completed in %0.4f s', len(batch_list), upload_elapsed_s)
+
+
+        for (task, entry), item_result in zip(batch_list, response['items']):
+            if item_result.get('error'):
+                task.setFailed('Sync error: {0:s}'.format(item_result['error']))
+                continue
+
+            entry.sync_id = item_result['id']
+            task.setSuccess('File uploaded')
+
+
+        db.session.commit()
+
+
     def cleanup(self, local_file_p, remove_local=False):
         if remove_local:
             try:
@@ -1,7 +1,7 @@
 import os
 import time
+import functools
 import math
-import io
 import json
 import cv2
 #import numpy
@@ -11,6 +11,7 @@ from datetime import timezone
 from pathlib import Path
 import psutil
 import tempfile
+import shutil
 import signal
 import threading
 import traceback
@@ -23,8 +24,8 @@ from . import asi676mc
 from . import asi676mc_calibration
 
 from .timelapse import TimelapseGenerator
-from .keogram import KeogramGenerator
-from .starTrails import StarTrailGenerator
+from .imagePrefetch import IndiAllSkyImagePrefetch
+from .nightAccumulator import IndiAllSkyNightAccumulator
 from .miscUpload import miscUpload
 from .aurora import IndiAllskyAuroraUpdate
 from .smoke import IndiAllskySmokeUpdate
@@ -35,6 +36,7 @@ from .backup import IndiAllskyDatabaseBackup
 from .flask import create_app
 from .flask import db
 from .flask.miscDb import miscDb
+from .flask.assetExpire import IndiAllSkyAssetExpire
 
 from .flask.models import TaskQueueState
 from .flask.models import TaskQueueQueue
@@ -94,11 +96,19 @@ class VideoWorker(Process):
         upload_q,
         night_av,
         binning_av,
+        slot=None,
+        dispatch_q=None,
     ):
         super(VideoWorker, self).__init__()
 
         self.name = 'Video-{0:d}'.format(idx)
 
+        self.idx = idx
+
+        # tasks are received from the dispatcher and reported back when finished
+        self.slot = slot
+        self.dispatch_q = dispatch_q
+
         os.nice(19)  # lower priority
 
         self.config = config
@@ -203,9 +213,29 @@ class VideoWorker(Process):
                 return
 
 
+            if v_dict.get('ping'):
+                # a new dispatcher does not know if this worker is busy
+                if self.dispatch_q:
+                    self.dispatch_q.put({
+                        'worker_idle' : self.slot,
+                        'worker_idx'  : self.idx,
+                    })
+
+                continue
+
+
             # new context for every task, reduces the effects of caching
-            with app.app_context():
-                self.processTask(v_dict)
+            try:
+                with app.app_context():
+                    self.processTask(v_dict)
+            finally:
+                if self.dispatch_q:
+                    self.dispatch_q.put({
+                        'done'       : True,
+                        'slot'       : self.slot,
+                        'worker_idx' : self.idx,
+                        'task_id'    : v_dict['task_id'],
+                    })
 
 
     def processTask(self, v_dict):
@@ -488,6 +518,28 @@ class VideoWorker(Process):
 
 
     def generateVideo(self, task, **kwargs):
+        task.setRunning()
+
+        try:
+            timelapse_job = self._setupTimelapse(**kwargs)
+        except TimelapseException as e:
+            logger.error(str(e))
+            task.setFailed(str(e))
+            return
+
+
+        try:
+            timelapse_job['generator'].generate(timelapse_job['video_file'], timelapse_job['timelapse_files'], sort=False)
+        except TimelapseException:
+            task.setFailed(self._timelapseFailed(timelapse_job))
+            return
+
+
+        task.setSuccess(self._timelapseFinished(timelapse_job))
+
+
+    def _setupTimelapse(self, **kwargs):
+        # creates the video entry and timelapse generator, raises TimelapseException if the timelapse cannot be generated
         timespec = kwargs['timespec']
         night = bool(kwargs['night'])
         camera_id = kwargs['camera_id']
@@ -497,16 +549,12 @@ class VideoWorker(Process):
             .one()
 
 
-        task.setRunning()
-
         now = datetime.now()
 
         try:
             d_dayDate = datetime.strptime(timespec, '%Y%m%d').date()
         except ValueError:
-            logger.error('Invalid time spec')
-            task.setFailed('Invalid time spec')
-            return
+            raise TimelapseException('Invalid time spec')
 
 
         if night:
@@ -520,9 +568,7 @@ class VideoWorker(Process):
         elif self.config['FFMPEG_CODEC'] in ['libvpx']:
             video_format = 'webm'
         else:
-            logger.error('Invalid codec in config, timelapse generation failed')
-            task.setFailed('Invalid codec in config, timelapse generation failed')
-            return
+            raise TimelapseException('Invalid codec in config, timelapse generation failed')
 
 
         vid_folder = self._getVideoFolder(d_dayDate, camera)
@@ -553,9 +599,7 @@ class VideoWorker(Process):
 
 
             if not self.config.get('TIMELAPSE_OVERWRITE'):
-                logger.error('Timelapse already exists, overwrite not permitted')
-                task.setFailed('Timelapse already exists, overwrite not permitted')
-                return
+                raise TimelapseException('Timelapse already exists, overwrite not permitted')
 
 
             logger.warning('Removing old video db entry')
@@ -573,17 +617,10 @@ class VideoWorker(Process):
             video_file.unlink()
 
 
-        # find all files
-        timelapse_files_entries = IndiAllSkyDbImageTable.query\
-            .join(IndiAllSkyDbImageTable.camera)\
-            .filter(IndiAllSkyDbCameraTable.id == camera.id)\
-            .filter(IndiAllSkyDbImageTable.dayDate == d_dayDate)\
-            .filter(IndiAllSkyDbImageTable.night == night)\
-            .filter(IndiAllSkyDbImageTable.exclude == sa_false())\
-            .order_by(IndiAllSkyDbImageTable.createDate.asc())
-
+        # find all files, the list is shared with the keogram pass
+        image_entries = self._nightImageEntries(camera.id, d_dayDate, night)
 
-        timelapse_files_entries_count = timelapse_files_entries.count()
+        timelapse_files_entries_count = len(image_entries)
         logger.info('Found %d images for timelapse', timelapse_files_entries_count)
 
 
@@ -633,9 +670,10 @@ class VideoWorker(Process):
         logger.info('Max kpindex: %0.2f, ovation: %d, smoke rating: %s', max_kpindex, max_ovation_max, constants.SMOKE_RATING_MAP_STR[max_smoke_rating])
 
 
+        # ordered by createDate, the same order the frames are streamed
         timelapse_files = list()
-        for entry in timelapse_files_entries:
-            p_entry = Path(entry.getFilesystemPath())
+        for entry in image_entries:
+            p_entry = entry['file_p']
 
             if not p_entry.exists():
                 logger.error('File not found: %s', p_entry)
@@ -678,24 +716,45 @@ class VideoWorker(Process):
         )
 
 
-        try:
-            # find existing keogram
-            keogram_entry = IndiAllSkyDbKeogramTable.query\
-                .join(IndiAllSkyDbKeogramTable.camera)\
-                .filter(
-                    and_(
-                        IndiAllSkyDbCameraTable.id == camera.id,
-                        IndiAllSkyDbKeogramTable.dayDate == d_dayDate,
-                        IndiAllSkyDbKeogramTable.night == night,
-                    )
-                )\
-                .one()
+        keogram_filename = self._findKeogram(camera.id, d_dayDate, night)
 
-            keogram_filename = keogram_entry.getFilesystemPath()
-        except NoResultFound:
-            keogram_filename = None
 
+        pre_processor_class, framerate, bitrate, vf_scale, ffmpeg_extra_options = self._timelapseSettings(night)
 
+
+        tg = TimelapseGenerator(
+            self.config,
+            skip_frames=timelapse_skip_frames,
+            pre_processor_class=pre_processor_class,
+        )
+
+        tg.codec = self.config['FFMPEG_CODEC']
+        tg.framerate = framerate
+        tg.bitrate = bitrate
+        tg.vf_scale = vf_scale
+        tg.ffmpeg_extra_options = ffmpeg_extra_options
+
+        tg.pre_processor.keogram = keogram_filename
+        tg.pre_processor.pre_scale = self.config.get('TIMELAPSE', {}).get('PRE_SCALE', 50)
+
+
+        timelapse_job = {
+            'camera_id'           : camera.id,
+            'dayDate'             : d_dayDate,
+            'night'               : night,
+            'image_entries'       : image_entries,
+            'video_file'          : video_file,
+            'video_entry'         : video_entry,
+            'video_metadata'      : video_metadata,
+            'timelapse_files'     : timelapse_files,
+            'pre_processor_class' : pre_processor_class,
+            'generator'           : tg,
+        }
+
+        return timelapse_job
+
+
+    def _timelapseSettings(self, night):
         if self.config.get('TIMELAPSE', {}).get('USE_NIGHT_CONFIG', True):
             pre_processor_class = self.config.get('TIMELAPSE', {}).get('PRE_PROCESSOR', 'standard')
             framerate = self.config.get('FFMPEG_FRAMERATE', 25)
@@ -716,58 +775,93 @@ class VideoWorker(Process):
                 vf_scale = self.config.get('FFMPEG_VFSCALE_DAY', '')
                 ffmpeg_extra_options = self.config.get('FFMPEG_EXTRA_OPTIONS_DAY', '')
 
+        return pre_processor_class, framerate, bitrate, vf_scale, ffmpeg_extra_options
+
+
+    def _timelapseFinished(self, timelapse_job):
+        # returns the task result
+        video_file = timelapse_job['video_file']
+        video_entry = timelapse_job['video_entry']
+        video_metadata = timelapse_job['video_metadata']
+
 
         try:
-            tg = TimelapseGenerator(
-                self.config,
-                skip_frames=timelapse_skip_frames,
-                pre_processor_class=pre_processor_class,
-            )
+            fileSize = video_file.stat().st_size
+        except FileNotFoundError:
+            fileSize = None
 
-            tg.codec = self.config['FFMPEG_CODEC']
-            tg.framerate = framerate
-            tg.bitrate = bitrate
-            tg.vf_scale = vf_scale
-            tg.ffmpeg_extra_options = ffmpeg_extra_options
 
-            tg.pre_processor.keogram = keogram_filename
-            tg.pre_processor.pre_scale = self.config.get('TIMELAPSE', {}).get('PRE_SCALE', 50)
+        video_entry.fileSize = fileSize
+        video_metadata['fileSize'] = fileSize
 
-            tg.generate(video_file, timelapse_files)
 
+        video_entry.success = True
+        db.session.commit()
 
-            try:
-                fileSize = video_file.stat().st_size
-            except FileNotFoundError:
-                fileSize = None
 
+        ### Upload ###
+        self._miscUpload.syncapi_video(video_entry, video_metadata)  # syncapi before s3
+        self._miscUpload.s3_upload_video(video_entry, video_metadata)
+        self._miscUpload.upload_video(video_entry)
+        self._miscUpload.youtube_upload_video(video_entry, video_metadata)
 
-            video_entry.fileSize = fileSize
-            video_metadata['fileSize'] = fileSize
 
+        return 'Generated timelapse: {0:s}'.format(str(video_file))
 
-            video_entry.success = True
-            db.session.commit()
-        except TimelapseException:
-            self._miscDb.addNotification(
-                NotificationCategory.MEDIA,
-                'timelapse_video',
-                'Timelapse video failed to generate',
-                expire=timedelta(hours=12),
-            )
 
-            task.setFailed('Failed to generate timelapse: {0:s}'.format(str(video_file)))
-            return
+    def _timelapseFailed(self, timelapse_job):
+        # returns the task result
+        self._miscDb.addNotification(
+            NotificationCategory.MEDIA,
+            'timelapse_video',
+            'Timelapse video failed to generate',
+            expire=timedelta(hours=12),
+        )
 
+        return 'Failed to generate timelapse: {0:s}'.format(str(timelapse_job['video_file']))
 
-        task.setSuccess('Generated timelapse: {0:s}'.format(str(video_file)))
 
+    def _findKeogram(self, camera_id, d_dayDate, night):
+        try:
+            keogram_entry = IndiAllSkyDbKeogramTable.query\
+                .join(IndiAllSkyDbKeogramTable.camera)\
+                .filter(
+                    and_(
+                        IndiAllSkyDbCameraTable.id == camera_id,
+                        IndiAllSkyDbKeogramTable.dayDate == d_dayDate,
+                        IndiAllSkyDbKeogramTable.night == night,
+                    )
+                )\
+                .one()
+        except NoResultFound:
+            return None
 
-        ### Upload ###
-        self._miscUpload.syncapi_video(video_entry, video_metadata)  # syncapi before s3
-        self._miscUpload.s3_upload_video(video_entry, video_metadata)
-        self._miscUpload.upload_video(video_entry)
-        self._miscUpload.youtube_upload_video(video_entry, video_metadata)
+        return keogram_entry.getFilesystemPath()
+
+
+    def _nightImageEntries(self, camera_id, d_dayDate, night):
+        # Plain values are returned, ORM entries would be expired (and reloaded
+        # one at a time) by the commits between the timelapse and keogram passes
+        image_query = IndiAllSkyDbImageTable.query\
+            .join(IndiAllSkyDbImageTable.camera)\
+            .filter(IndiAllSkyDbCameraTable.id == camera_id)\
+            .filter(IndiAllSkyDbImageTable.dayDate == d_dayDate)\
+            .filter(IndiAllSkyDbImageTable.night == night)\
+            .filter(IndiAllSkyDbImageTable.exclude == sa_false())\
+            .order_by(IndiAllSkyDbImageTable.createDate.asc())
+
+
+        image_entries = list()
+        for entry in image_query:
+            image_entries.append({
+                'createDate' : entry.createDate,
+                'adu'        : entry.adu,
+                'stars'      : entry.stars,
+                'binmode'    : entry.binmode,
+                'file_p'     : Path(entry.getFilesystemPath()),
+            })
+
+        return image_entries
 
 
     def generateMiniVideo(self, task, **kwargs):
@@ -1333,6 +1427,44 @@ class VideoWorker(Process):
 
 
     def generateKeogramStarTrails(self, task, **kwargs):
+        task.setRunning()
+
+        try:
+            message = self._keogramStarTrails(**kwargs)
+        except TimelapseException as e:
+            logger.error(str(e))
+            task.setFailed(str(e))
+            return
+
+
+        task.setSuccess(message)
+
+
+    def _keogramStarTrails(self, image_entries=None, frame_consumer=None, **kwargs):
+        # returns the task result, raises TimelapseException if the keogram and star trail cannot be generated
+
+        # Star Trails only generated at night
+        st_tg = TimelapseGenerator(
+            self.config,
+            skip_frames=0,
+        )
+
+        st_tg.codec = self.config['FFMPEG_CODEC']
+        st_tg.framerate = self.config.get('FFMPEG_FRAMERATE', 25)
+        st_tg.bitrate = self.config.get('FFMPEG_BITRATE', '5000k')
+        st_tg.vf_scale = self.config.get('FFMPEG_VFSCALE_STARTRAIL', '')
+        st_tg.ffmpeg_extra_options = self.config.get('FFMPEG_EXTRA_OPTIONS', '')
+
+
+        try:
+            return self._generateKeogramStarTrails(st_tg, image_entries=image_entries, frame_consumer=frame_consumer, **kwargs)
+        except Exception:
+            # do not leave ffmpeg running with a partial star trail timelapse
+            st_tg.abortStream()
+            raise
+
+
+    def _generateKeogramStarTrails(self, st_tg, image_entries=None, frame_consumer=None, **kwargs):
         timespec = kwargs['timespec']
         night = bool(kwargs['night'])
         camera_id = kwargs['camera_id']
@@ -1345,16 +1477,12 @@ class VideoWorker(Process):
         detection_mask_dict = self._load_detection_mask()
 
 
-        task.setRunning()
-
         now = datetime.now()
 
         try:
             d_dayDate = datetime.strptime(timespec, '%Y%m%d').date()
         except ValueError:
-            logger.error('Invalid time spec')
-            task.setFailed('Invalid time spec')
-            return
+            raise TimelapseException('Invalid time spec')
 
 
         if night:
@@ -1368,9 +1496,7 @@ class VideoWorker(Process):
         elif self.config['FFMPEG_CODEC'] in ['libvpx']:
             video_format = 'webm'
         else:
-            logger.error('Invalid codec in config, timelapse generation failed')
-            task.setFailed('Invalid codec in config, timelapse generation failed')
-            return
+            raise TimelapseException('Invalid codec in config, timelapse generation failed')
 
 
         vid_folder = self._getVideoFolder(d_dayDate, camera)
@@ -1421,9 +1547,7 @@ class VideoWorker(Process):
 
 
             if not self.config.get('TIMELAPSE_OVERWRITE'):
-                logger.error('Keogram already exists, overwrite not permitted')
-                task.setFailed('Keogram already exists, overwrite not permitted')
-                return
+                raise TimelapseException('Keogram already exists, overwrite not permitted')
 
 
             logger.warning('Removing old keogram db entry')
@@ -1451,9 +1575,7 @@ class VideoWorker(Process):
 
 
             if not self.config.get('TIMELAPSE_OVERWRITE'):
-                logger.error('Star trail already exists, overwrite not permitted')
-                task.setFailed('Star trail already exists, overwrite not permitted')
-                return
+                raise TimelapseException('Star trail already exists, overwrite not permitted')
 
 
             logger.warning('Removing old star trail db entry')
@@ -1481,9 +1603,7 @@ class VideoWorker(Process):
 
 
             if not self.config.get('TIMELAPSE_OVERWRITE'):
-                logger.error('Star trail timelapse already exists, overwrite not permitted')
-                task.setFailed('Star trail timelapse already exists, overwrite not permitted')
-                return
+                raise TimelapseException('Star trail timelapse already exists, overwrite not permitted')
 
 
             logger.warning('Removing old star trail video db entry')
@@ -1509,17 +1629,12 @@ class VideoWorker(Process):
             startrail_video_file.unlink()
 
 
-        # find all files
-        files_entries = IndiAllSkyDbImageTable.query\
-            .join(IndiAllSkyDbImageTable.camera)\
-            .filter(IndiAllSkyDbCameraTable.id == camera.id)\
-            .filter(IndiAllSkyDbImageTable.dayDate == d_dayDate)\
-            .filter(IndiAllSkyDbImageTable.night == night)\
-            .filter(IndiAllSkyDbImageTable.exclude == sa_false())\
-            .order_by(IndiAllSkyDbImageTable.createDate.asc())
+        if isinstance(image_entries, type(None)):
+            # find all files
+            image_entries = self._nightImageEntries(camera.id, d_dayDate, night)
 
 
-        image_count = files_entries.count()
+        image_count = len(image_entries)
         logger.info('Found %d images for keogram/star trails', image_count)
 
 
@@ -1570,21 +1685,9 @@ class VideoWorker(Process):
         logger.info('Max kpindex: %0.2f, ovation: %d, smoke rating: %s', max_kpindex, max_ovation_max, constants.SMOKE_RATING_MAP_STR[max_smoke_rating])
 
 
-        timelapse_skip_frames = self.config.get('TIMELAPSE_SKIP_FRAMES', 4)
-
-
         processing_start = time.time()
 
-        kg = KeogramGenerator(
-            self.config,
-            skip_frames=timelapse_skip_frames,
-        )
-        kg.angle = self.config.get('KEOGRAM_ANGLE', 0.0)
-        kg.h_scale_factor = self.config.get('KEOGRAM_H_SCALE', 100)
-        kg.v_scale_factor = self.config.get('KEOGRAM_V_SCALE', 33)
-        kg.crop_top = self.config.get('KEOGRAM_CROP_TOP', 0)
-        kg.crop_bottom = self.config.get('KEOGRAM_CROP_BOTTOM', 0)
-        kg.label = self.config.get('KEOGRAM_LABEL', True)
+        kg = IndiAllSkyNightAccumulator.keogramGenerator(self.config)
 
 
         keogram_metadata = {
@@ -1674,25 +1777,7 @@ class VideoWorker(Process):
             startrail_video_entry = None
 
 
-        stg = StarTrailGenerator(
-            self.config,
-            skip_frames=timelapse_skip_frames,
-            mask=detection_mask_dict,
-        )
-        stg.max_adu = self.config['STARTRAILS_MAX_ADU']
-        stg.mask_threshold = self.config['STARTRAILS_MASK_THOLD']
-        stg.pixel_cutoff_threshold = self.config['STARTRAILS_PIXEL_THOLD']
-        stg.min_stars = self.config.get('STARTRAILS_MIN_STARS', 0)
-        stg.latitude = camera.latitude
-        stg.longitude = camera.longitude
-        stg.sun_alt_threshold = self.config['STARTRAILS_SUN_ALT_THOLD']
-
-        if self.config['STARTRAILS_MOONMODE_THOLD']:
-            stg.moonmode_alt = self.config['NIGHT_MOONMODE_ALT_DEG']
-            stg.moonmode_phase = self.config['NIGHT_MOONMODE_PHASE']
-        else:
-            stg.moon_alt_threshold = self.config['STARTRAILS_MOON_ALT_THOLD']
-            stg.moon_phase_threshold = self.config['STARTRAILS_MOON_PHASE_THOLD']
+        stg = IndiAllSkyNightAccumulator.startrailGenerator(self.config, camera, detection_mask_dict)
 
         if self.config.get('STARTRAILS_USE_DB_DATA', True):
             logger.warning('Re-using image data for ADU and Star counts')
@@ -1700,56 +1785,53 @@ class VideoWorker(Process):
             logger.warning('Recalculating values for ADU and Star counts')
 
 
-        # Files are presorted from the DB
-        for i, entry in enumerate(files_entries):
-            if i % 50 == 0:
-                processing_elapsed_s = time.time() - processing_start
-                logger.info('Processed %d of %d images (%0.2f images/s)', i, image_count, (i + 1) / processing_elapsed_s)
+        # resume from the data accumulated while the images were captured
+        accumulator = self._loadNightAccumulator(camera, d_dayDate, night, image_entries, detection_mask_dict)
 
-            image_file_p = Path(entry.getFilesystemPath())
+        process_entries = image_entries
 
-            if not image_file_p.exists():
-                logger.error('File not found: %s', image_file_p)
-                continue
+        if accumulator:
+            checkpoint_date = datetime.fromtimestamp(accumulator.last_create_ts)
 
-            if image_file_p.stat().st_size == 0:
-                continue
+            kg = accumulator.keogram_generator
 
+            if night:
+                # includes the star trail timelapse frames stored before the checkpoint
+                stg = accumulator.startrail_generator
 
-            #logger.info('Reading file: %s', p_entry)
-            if image_file_p.suffix in ('.jpg', '.jpeg'):
-                import simplejpeg
 
-                try:
-                    with io.open(str(image_file_p), 'rb') as f_img:
-                        image_data = simplejpeg.decode_jpeg(f_img.read(), colorspace='BGR')
-                except ValueError as e:
-                    logger.error('Unable to read image - %s: %s', str(e), image_file_p)
-                    continue
-            elif image_file_p.suffix in ('.png',):
-                # opencv is faster than Pillow with PNG
-                image_data = cv2.imread(str(image_file_p), cv2.IMREAD_COLOR)
+            # only the images captured after the checkpoint need to be read,
+            # the timelapse is generated from the image files
+            frame_consumer = None
 
-                if isinstance(image_data, type(None)):
-                    logger.error('Unable to read %s', image_file_p)
-                    continue
+            process_entries = [entry for entry in image_entries if entry['createDate'] > checkpoint_date]
+            image_count = len(process_entries)
+            logger.info('Processing %d images after the checkpoint', image_count)
+        elif night and self.config.get('STARTRAILS_TIMELAPSE', True) and self.config.get('STARTRAILS_TIMELAPSE_PIPE', True):
+            # frames are streamed into ffmpeg while the star trail is built
+            stg.enableTimelapseStream(st_tg, startrail_video_file.name)
 
-            else:
-                # Pillow supports remaining image types
-                import numpy
-                import PIL
-                from PIL import Image
 
-                try:
-                    with Image.open(str(image_file_p)) as img_pil:
-                        image_data = cv2.cvtColor(numpy.array(img_pil), cv2.COLOR_RGB2BGR)
-                except PIL.UnidentifiedImageError:
-                    logger.error('Unable to read image: %s', image_file_p)
-                    continue
+        prefetch = IndiAllSkyImagePrefetch(
+            threads=self.config.get('IMAGE_PREFETCH', {}).get('THREADS', 3),
+            queue_depth=self.config.get('IMAGE_PREFETCH', {}).get('QUEUE_DEPTH', 8),
+        )
+
+        accumulate_elapsed_s = 0.0
+
+
+        # Files are presorted from the DB
+        prefetch_items = ((entry, entry['file_p']) for entry in process_entries)
+
+        for i, (entry, image_file_p, image_data, image_ts) in enumerate(prefetch.iterate(prefetch_items)):
+            if i % 50 == 0:
+                processing_elapsed_s = time.time() - processing_start
+                logger.info('Processed %d of %d images (%0.2f images/s)', i, image_count, (i + 1) / processing_elapsed_s)
 
 
+            accumulate_start = time.time()
+
             try:
-                image_ts = image_file_p.stat().st_mtime
                 kg.processImage(image_data, image_ts)
             except KeogramMismatchException as e:
                 logger.error('Error processing keogram image: %s', str(e))
@@ -1757,12 +1839,27 @@ class VideoWorker(Process):
 
             if night:
                 if self.config.get('STARTRAILS_USE_DB_DATA', True):
-                    adu = entry.adu
-                    star_count = entry.stars  # can be None
+                    adu = entry['adu']
+                    star_count = entry['stars']  # can be None
                 else:
                     adu, star_count = None, None
 
-                stg.processImage(image_file_p, image_data, entry.binmode, adu=adu, star_count=star_count)
+                stg.processImage(image_file_p, image_data, entry['binmode'], adu=adu, star_count=star_count)
+
+
+            if frame_consumer:
+                # decoded frames are shared with the timelapse
+                try:
+                    frame_consumer(image_data)
+                except TimelapseException as e:
+                    logger.error('Timelapse stream failed: %s', str(e))
+                    frame_consumer = None
+
+            accumulate_elapsed_s += time.time() - accumulate_start
+
+
+        prefetch.logStats('Keogram/star trails')
+        logger.info('Keogram/star trails - accumulated images in %0.1f s', accumulate_elapsed_s)
 
 
         kg.finalize(keogram_file, camera)
@@ -1881,26 +1978,12 @@ class VideoWorker(Process):
                 )
 
 
-                # Star Trails only generated at night
-                framerate = self.config.get('FFMPEG_FRAMERATE', 25)
-                bitrate = self.config.get('FFMPEG_BITRATE', '5000k')
-                vf_scale = self.config.get('FFMPEG_VFSCALE_STARTRAIL', '')
-                ffmpeg_extra_options = self.config.get('FFMPEG_EXTRA_OPTIONS', '')
-
-
                 try:
-                    st_tg = TimelapseGenerator(
-                        self.config,
-                        skip_frames=0,
-                    )
-
-                    st_tg.codec = self.config['FFMPEG_CODEC']
-                    st_tg.framerate = framerate
-                    st_tg.bitrate = bitrate
-                    st_tg.vf_scale = vf_scale
-                    st_tg.ffmpeg_extra_options = ffmpeg_extra_options
-
-                    st_tg.generate(startrail_video_file, stg.timelapse_frame_list)
+                    if st_tg.streaming:
+                        st_tg.closeStream()
+                        shutil.move(str(stg.timelapse_stream_file), str(startrail_video_file))
+                    else:
+                        st_tg.generate(startrail_video_file, stg.timelapse_frame_list)
 
 
                     try:
@@ -1926,6 +2009,7 @@ class VideoWorker(Process):
                     )
             else:
                 logger.error('Not enough frames to generate star trails timelapse: %d', st_frame_count)
+                st_tg.abortStream()
                 startrail_video_entry = None
 
 
@@ -1976,7 +2060,101 @@ class VideoWorker(Process):
                 pass
 
 
-        task.setSuccess('Generated keogram and/or star trail')
+        return 'Generated keogram and/or star trail'
+
+
+    def generateNightProducts(self, task, **kwargs):
+        # The keogram, star trails, star trail timelapse and timelapse are generated from a single
+        # pass over the images.  With the standard pre-processor the decoded frames are streamed
+        # directly to the timelapse encoder, other pre-processors need the finished keogram.
+        night = bool(kwargs['night'])
+
+        night_products_start = time.time()
+
+        task.setRunning()
+
+
+        pre_processor_class = self._timelapseSettings(night)[0]
+
+        single_pass = self.config.get('TIMELAPSE', {}).get('PIPE', True) and pre_processor_class == 'standard'
+        if not single_pass:
+            logger.warning('Timelapse pre-processor %s requires a second pass', pre_processor_class)
+
+
+        # the task state is set once all of the products are finished
+        result_list = list()
+        failed = False
+
+
+        try:
+            timelapse_job = self._setupTimelapse(**kwargs)
+        except TimelapseException as e:
+            logger.error(str(e))
+            result_list.append(str(e))
+            failed = True
+            timelapse_job = None
+
+
+        if timelapse_job:
+            # the image list is shared, the timelapse frames are in the same order as the stream
+            image_entries = timelapse_job['image_entries']
+        else:
+            image_entries = None
+
+        if timelapse_job and single_pass:
+            tg = timelapse_job['generator']
+            frame_consumer = functools.partial(tg.streamFrame, timelapse_job['video_file'])
+        else:
+            frame_consumer = None
+
+
+        try:
+            result_list.append(self._keogramStarTrails(image_entries=image_entries, frame_consumer=frame_consumer, **kwargs))
+        except TimelapseException as e:
+            logger.error(str(e))
+            result_list.append(str(e))
+            failed = True
+        except Exception:
+            if timelapse_job:
+                timelapse_job['generator'].abortStream()
+
+            raise
+
+
+        if timelapse_job:
+            tg = timelapse_job['generator']
+
+            try:
+                if tg.streaming:
+                    tg.closeStream()
+                else:
+                    if single_pass:
+                        # resumed from a checkpoint, the keogram pass did not complete, or the stream failed
+                        logger.warning('Timelapse frames were not streamed, generating from files')
+                    else:
+                        tg.pre_processor.keogram = self._findKeogram(
+                            timelapse_job['camera_id'],
+                            timelapse_job['dayDate'],
+                            timelapse_job['night'],
+                        )
+
+                    tg.generate(timelapse_job['video_file'], timelapse_job['timelapse_files'], sort=False)
+            except TimelapseException:
+                result_list.append(self._timelapseFailed(timelapse_job))
+                failed = True
+            else:
+                result_list.append(self._timelapseFinished(timelapse_job))
+
+
+        logger.warning('Total night products processing in %0.1f s', time.time() - night_products_start)
+
+
+        message = ', '.join(result_list)[:255]
+
+        if failed:
+            task.setFailed(message)
+        else:
+            task.setSuccess(message)
 
 
     def uploadAllskyEndOfNight(self, task, **kwargs):
@@ -2343,11 +2521,6 @@ class VideoWorker(Process):
             .order_by(IndiAllSkyDbPanoramaVideoTable.createDate.asc())
 
 
-        ### Getting IDs first then deleting each file is faster than deleting all files with
-        ### thumbnails with a single query.  Deleting associated thumbnails causes sqlalchemy
-        ### to recache after every delete which cause a 1-5 second lag for each delete
-
-
         asset_lists = [
             (old_images, IndiAllSkyDbImageTable),
             (old_panorama_images, IndiAllSkyDbPanoramaImageTable),
@@ -2362,31 +2535,19 @@ class VideoWorker(Process):
         ]
 
 
-        delete_count = 0
-        for asset_list, asset_table in asset_lists:
-            while True:
-                id_list = [entry.id for entry in asset_list.limit(500)]
+        asset_expire = IndiAllSkyAssetExpire(
+            chunk_size=self.config.get('ASSET_EXPIRE', {}).get('CHUNK_SIZE', 500),
+            unlink_threads=self.config.get('ASSET_EXPIRE', {}).get('UNLINK_THREADS', 4),
+        )
 
-                if not id_list:
-                    break
 
-                delete_count += self._deleteAssets(asset_table, id_list)
+        delete_count = 0
+        for asset_list, asset_table in asset_lists:
+            delete_count += asset_expire.deleteQuery(asset_table, asset_list)
 
 
         # Remove empty folders
-        dir_list = list()
-        self._getFolderFolders(self.image_dir, dir_list)
-
-        empty_dirs = filter(lambda p: not any(p.iterdir()), dir_list)
-        for d in empty_dirs:
-            logger.info('Removing empty directory: %s', d)
-
-            try:
-                d.rmdir()
-            except OSError as e:
-                logger.error('Cannot remove folder: %s', str(e))
-            except PermissionError as e:
-                logger.error('Cannot remove folder: %s', str(e))
+        asset_expire.removeEmptyFolders(self.image_dir)
 
 
         # Calibration uploads are private scratch data rather than registered
@@ -2417,29 +2578,6 @@ class VideoWorker(Process):
         )
 
 
-    def _deleteAssets(self, table, entry_id_list):
-        delete_count = 0
-        for entry_id in entry_id_list:
-            entry = table.query\
-                .filter(table.id == entry_id)\
-                .one()
-
-            logger.info('Removing old %s entry: %s', entry.__class__.__name__, entry.filename)
-
-            try:
-                entry.deleteAsset()
-            except OSError as e:
-                logger.error('Cannot remove file: %s', str(e))
-                continue
-
-            db.session.delete(entry)
-            db.session.commit()
-
-            delete_count += 1
-
-        return delete_count
-
-
     def _getVideoFolder(self, video_date, camera):
         day_ref = video_date
 
@@ -2471,11 +2609,41 @@ class VideoWorker(Process):
                 self._getFolderFilesByExt(item, file_list, extension_list=extension_list)  # recursion
 
 
-    def _getFolderFolders(self, folder, dir_list):
-        for item in Path(folder).iterdir():
-            if item.is_dir():
-                dir_list.append(item)
-                self._getFolderFolders(item, dir_list)  # recursion
+    def _loadNightAccumulator(self, camera, d_dayDate, night, image_entries, detection_mask_dict):
+        if not self.config.get('NIGHT_ACCUMULATOR', {}).get('ENABLE', True):
+            return None
+
+
+        accumulator = IndiAllSkyNightAccumulator.load(
+            self.config,
+            camera,
+            d_dayDate,
+            night,
+            mask=detection_mask_dict,
+        )
+
+        if not accumulator:
+            logger.warning('Night accumulator data not available, processing all images')
+            return None
+
+
+        # images added, excluded, or deleted after the checkpoint invalidate the data
+        checkpoint_date = datetime.fromtimestamp(accumulator.last_create_ts)
+
+        checkpoint_image_count = len([entry for entry in image_entries if entry['createDate'] <= checkpoint_date])
+
+        if checkpoint_image_count != accumulator.frame_count:
+            logger.warning(
+                'Night accumulator checkpoint does not match the database (%d/%d images), processing all images',
+                accumulator.frame_count,
+                checkpoint_image_count,
+            )
+            return None
+
+
+        logger.info('Resuming keogram/star trails from checkpoint with %d images', accumulator.frame_count)
+
+        return accumulator
 
 
     def _load_detection_mask(self):
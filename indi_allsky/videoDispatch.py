@@ -0,0 +1,226 @@
+import time
+import json
+import signal
+import traceback
+import logging
+
+from .videoLanes import IndiAllSkyVideoLaneScheduler
+from .videoLanes import IndiAllSkyVideoLanes
+
+from .flask import create_app
+from .flask.miscDb import miscDb
+
+from .flask.models import TaskQueueState
+from .flask.models import TaskQueueQueue
+from .flask.models import IndiAllSkyDbTaskQueueTable
+
+from sqlalchemy.orm.exc import NoResultFound
+
+from multiprocessing import Process
+import queue
+
+
+app = create_app()
+
+logger = logging.getLogger('indi_allsky')
+
+
+class VideoDispatcher(Process):
+    """Routes tasks from the video queue to the lane workers
+
+    Producers keep sending {'task_id': N} to the video queue.  The lane
+    workers report back on the same queue when a task is finished, a task is
+    only sent to a worker when it is idle so priorities are honored.  Queued
+    tasks are read from the database when the dispatcher starts, nothing is
+    lost when a dispatcher is restarted.
+    """
+
+    status_interval = 5
+
+
+    def __init__(
+        self,
+        idx,
+        config,
+        error_q,
+        video_q,
+        slot_q_dict,
+        slot_lane_dict,
+    ):
+        super(VideoDispatcher, self).__init__()
+
+        self.name = 'VideoDispatch-{0:d}'.format(idx)
+
+        self.config = config
+
+        self.error_q = error_q
+        self.video_q = video_q
+        self.slot_q_dict = slot_q_dict  # slot name: worker queue
+
+        self._scheduler = IndiAllSkyVideoLaneScheduler(slot_lane_dict)
+
+        self._miscDb = miscDb(self.config)
+
+        self._status_changed = True
+        self._status_time = 0
+
+        self._shutdown = False
+
+
+    def sighup_handler_worker(self, signum, frame):
+        logger.warning('Caught HUP signal')
+
+        # set flag for program to stop processes
+        self._shutdown = True
+
+
+    def sigterm_handler_worker(self, signum, frame):
+        logger.warning('Caught TERM signal')
+
+        # set flag for program to stop processes
+        self._shutdown = True
+
+
+    def sigint_handler_worker(self, signum, frame):
+        logger.warning('Caught INT signal')
+
+        # set flag for program to stop processes
+        self._shutdown = True
+
+
+    def run(self):
+        # setup signal handling after detaching from the main process
+        signal.signal(signal.SIGHUP, self.sighup_handler_worker)
+        signal.signal(signal.SIGTERM, self.sigterm_handler_worker)
+        signal.signal(signal.SIGINT, self.sigint_handler_worker)
+
+
+        ### use this as a method to log uncaught exceptions
+        try:
+            self.saferun()
+        except Exception as e:
+            tb = traceback.format_exc()
+            self.error_q.put((str(e), tb))
+            raise e
+
+
+    def saferun(self):
+        with app.app_context():
+            self.loadQueuedTasks()
+
+
+        # the workers report when they are idle
+        self._scheduler.waitForWorkers()
+
+        for slot_q in self.slot_q_dict.values():
+            slot_q.put({'ping' : True})
+
+
+        while True:
+            try:
+                v_dict = self.video_q.get(timeout=self.status_interval)
+            except queue.Empty:
+                v_dict = {}
+
+
+            if v_dict.get('stop') or self._shutdown:
+                logger.warning('Goodbye')
+                return
+
+
+            with app.app_context():
+                self.processMessage(v_dict)
+
+                for slot_name, task_id in self._scheduler.assign():
+                    logger.info('Dispatching video task %d to %s', task_id, slot_name)
+                    self.slot_q_dict[slot_name].put({'task_id' : task_id})
+                    self._status_changed = True
+
+                self.publishStatus()
+
+
+    def processMessage(self, v_dict):
+        if v_dict.get('worker_start'):
+            self._scheduler.workerStarted(v_dict['worker_start'], v_dict['worker_idx'])
+            self._status_changed = True
+            return
+
+        if v_dict.get('done'):
+            self._scheduler.taskDone(v_dict['slot'], v_dict['worker_idx'])
+            self._status_changed = True
+            return
+
+        if v_dict.get('worker_idle'):
+            self._scheduler.workerIdle(v_dict['worker_idle'], v_dict['worker_idx'])
+            self._status_changed = True
+            return
+
+
+        task_id = v_dict.get('task_id')
+        if not task_id:
+            return
+
+
+        try:
+            task = IndiAllSkyDbTaskQueueTable.query\
+                .filter(IndiAllSkyDbTaskQueueTable.id == task_id)\
+                .filter(IndiAllSkyDbTaskQueueTable.state == TaskQueueState.QUEUED)\
+                .filter(IndiAllSkyDbTaskQueueTable.queue == TaskQueueQueue.VIDEO)\
+                .one()
+        except NoResultFound:
+            logger.error('Task ID %d not found', task_id)
+            return
+
+
+        self.addTask(task)
+
+
+    def addTask(self, task):
+        if task.data:
+            action = task.data.get('action')
+        else:
+            action = None
+
+
+        lane = self._scheduler.addTask(task.id, action, task.priority)
+        logger.info('Queued video task %d (%s) in %s lane', task.id, action, lane)
+
+        self._status_changed = True
+
+
+    def loadQueuedTasks(self):
+        # tasks that were not started before the previous dispatcher stopped
+        # a task already sent to a worker is skipped by the worker once it is running
+        task_list = IndiAllSkyDbTaskQueueTable.query\
+            .filter(IndiAllSkyDbTaskQueueTable.state == TaskQueueState.QUEUED)\
+            .filter(IndiAllSkyDbTaskQueueTable.queue == TaskQueueQueue.VIDEO)\
+            .order_by(IndiAllSkyDbTaskQueueTable.id.asc())
+
+        for task in task_list:
+            self.addTask(task)
+
+
+    def publishStatus(self):
+        # lane state for the web interface
+        now = time.time()
+
+        if not self._status_changed and now - self._status_time < 60:
+            return
+
+        if now - self._status_time < self.status_interval:
+            return
+
+
+        lane_status = {
+            'ts'    : int(now),
+            'lanes' : self._scheduler.status(),
+        }
+
+        try:
+            self._miscDb.setState(IndiAllSkyVideoLanes.state_key, json.dumps(lane_status))
+        except Exception:
+            logger.exception('Unable to store video lane state')
+
+
+        self._status_changed = False
+        self._status_time = now
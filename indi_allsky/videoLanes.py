@@ -0,0 +1,216 @@
+import os
+import heapq
+import logging
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyVideoLanes(object):
+    """VIDEO queue tasks are split into worker lanes
+
+    The heavy lane runs encodes and keogram/star trail generation, the light
+    lane runs network updates and maintenance so short tasks are never stuck
+    behind a long timelapse.
+    """
+
+    lane_list = ('heavy', 'light')
+
+    lane_actions = {
+        'heavy' : (
+            'generateVideo',
+            'generateMiniVideo',
+            'generatePanoramaVideo',
+            'generateKeogramStarTrails',
+            'generateNightProducts',
+        ),
+        'light' : (
+            'systemHealthCheck',
+            'updateAuroraData',
+            'updateSmokeData',
+            'updateSatelliteTleData',
+            'sendAllskyMapPing',
+            'uploadAllskyEndOfNight',
+            'backupDatabase',
+            'expireData',
+            'generateAsi676mcCalibration',  # runs on a separate thread, one at a time with a single light worker
+        ),
+    }
+
+    default_lane = 'light'  # unknown actions fail quickly
+
+    max_heavy_workers = 3
+
+    state_key = 'VIDEO_WORKER_LANES'
+
+
+    @classmethod
+    def laneForAction(cls, action):
+        for lane, action_list in cls.lane_actions.items():
+            if action in action_list:
+                return lane
+
+        return cls.default_lane
+
+
+    @classmethod
+    def workerCount(cls, config, lane):
+        video_workers = config.get('VIDEO_WORKERS', {})
+
+        if lane == 'heavy':
+            heavy_workers = int(video_workers.get('HEAVY', 0))
+
+            if heavy_workers < 1:
+                # encoders are already multithreaded
+                heavy_workers = min(max(int((os.cpu_count() or 1) / 4), 1), cls.max_heavy_workers)
+
+            return heavy_workers
+
+
+        return max(int(video_workers.get('LIGHT', 1)), 1)
+
+
+
+class IndiAllSkyVideoLaneScheduler(object):
+    """Priority queue per lane, tasks are only handed to idle workers
+
+    Lower priority values run first, tasks without a priority are treated as
+    priority 0, ties are run in the order they were queued.
+    """
+
+    def __init__(self, slot_dict):
+        # slot_dict is {slot_name: lane}
+        self._pending = {lane: [] for lane in IndiAllSkyVideoLanes.lane_list}
+        self._pending_task_id_set = set()
+
+        self._slots = dict()
+        for slot_name, lane in slot_dict.items():
+            self._slots[slot_name] = {
+                'lane'       : lane,
+                'worker_idx' : None,
+                'task_id'    : None,
+                'ready'      : True,  # slot state is known
+            }
+
+
+    def addTask(self, task_id, action, priority):
+        lane = IndiAllSkyVideoLanes.laneForAction(action)
+
+        if isinstance(priority, type(None)):
+            priority = 0
+
+
+        task_id = int(task_id)
+
+        if task_id in self._pending_task_id_set:
+            # already queued from the database
+            return lane
+
+        if task_id in [slot['task_id'] for slot in self._slots.values()]:
+            return lane
+
+
+        heapq.heappush(self._pending[lane], (int(priority), task_id))
+        self._pending_task_id_set.add(task_id)
+
+        return lane
+
+
+    def waitForWorkers(self):
+        # workers may still be running tasks from a previous dispatcher, the
+        # slots are not used until the worker reports
+        for slot in self._slots.values():
+            slot['worker_idx'] = None
+            slot['task_id'] = None
+            slot['ready'] = False
+
+
+    def workerStarted(self, slot_name, worker_idx):
+        slot = self._slots.get(slot_name)
+        if not slot:
+            return
+
+        # a restarted worker does not finish the previous task
+        slot['worker_idx'] = worker_idx
+        slot['task_id'] = None
+        slot['ready'] = True
+
+
+    def workerIdle(self, slot_name, worker_idx):
+        slot = self._slots.get(slot_name)
+        if not slot:
+            return
+
+        if slot['ready']:
+            # the slot state is already known from a newer message
+            return
+
+        slot['worker_idx'] = worker_idx
+        slot['task_id'] = None
+        slot['ready'] = True
+
+
+    def taskDone(self, slot_name, worker_idx):
+        slot = self._slots.get(slot_name)
+        if not slot:
+            return
+
+        if not isinstance(slot['worker_idx'], type(None)) and slot['worker_idx'] != worker_idx:
+            # message from a worker that has been replaced
+            return
+
+        slot['worker_idx'] = worker_idx
+        slot['task_id'] = None
+        slot['ready'] = True
+
+
+    def assign(self):
+        # returns a list of (slot_name, task_id)
+        assigned_list = list()
+
+        for slot_name, slot in self._slots.items():
+            if not slot['ready']:
+                continue
+
+            if not isinstance(slot['task_id'], type(None)):
+                continue
+
+            lane_pending = self._pending[slot['lane']]
+            if not lane_pending:
+                continue
+
+            priority, task_id = heapq.heappop(lane_pending)
+            self._pending_task_id_set.discard(task_id)
+
+            slot['task_id'] = task_id
+            assigned_list.append((slot_name, task_id))
+
+
+        return assigned_list
+
+
+    def pendingTaskIds(self):
+        task_id_list = list()
+        for lane_pending in self._pending.values():
+            task_id_list.extend(task_id for priority, task_id in sorted(lane_pending))
+
+        return task_id_list
+
+
+    def status(self):
+        status = dict()
+        for lane in IndiAllSkyVideoLanes.lane_list:
+            status[lane] = {
+                'workers' : 0,
+                'running' : [],
+                'pending' : len(self._pending[lane]),
+            }
+
+        for slot in self._slots.values():
+            lane_status = status[slot['lane']]
+            lane_status['workers'] += 1
+
+            if not isinstance(slot['task_id'], type(None)):
+                lane_status['running'].append(slot['task_id'])
+
+
+        return status
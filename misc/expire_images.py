@@ -34,8 +34,8 @@ from indi_allsky.flask.models import IndiAllSkyDbRawImageTable
 
 from indi_allsky.config import IndiAllSkyConfig
 
-from indi_allsky.flask import db
 from indi_allsky.flask import create_app
+from indi_allsky.flask.assetExpire import IndiAllSkyAssetExpire
 
 
 logger = logging.getLogger('indi_allsky')
@@ -82,6 +82,11 @@ class ExpireImages(object):
             self.image_dir = Path(__file__).parent.parent.joinpath('html', 'images').absolute()
 
 
+        self._asset_expire = IndiAllSkyAssetExpire(
+            chunk_size=self.config.get('ASSET_EXPIRE', {}).get('CHUNK_SIZE', 500),
+            unlink_threads=self.config.get('ASSET_EXPIRE', {}).get('UNLINK_THREADS', 4),
+        )
+
         self._shutdown = False
 
 
@@ -127,6 +132,9 @@ class ExpireImages(object):
         # set flag for program to stop processes
         self._shutdown = True
 
+        # finish the current chunk
+        self._asset_expire.shutdown()
+
 
 
     def main(self):
@@ -209,11 +217,6 @@ class ExpireImages(object):
         time.sleep(10)
 
 
-        ### Getting IDs first then deleting each file is faster than deleting all files with
-        ### thumbnails with a single query.  Deleting associated thumbnails causes sqlalchemy
-        ### to recache after every delete which cause a 1-5 second lag for each delete
-
-
         # catch signals to perform cleaner shutdown
         signal.signal(signal.SIGINT, self.sigint_handler_main)
 
@@ -238,67 +241,20 @@ class ExpireImages(object):
 
         delete_count = 0
         for asset_list, asset_table in asset_lists:
-            while True:
-                id_list = [entry.id for entry in asset_list.limit(500)]
-
-                if not id_list:
-                    break
+            delete_count += self._asset_expire.deleteQuery(asset_table, asset_list)
 
-                delete_count += self._deleteAssets(asset_table, id_list)
+            if self._shutdown:
+                logger.warning('Deleted %d assets', delete_count)
+                sys.exit(1)
 
 
         # Remove empty folders
-        dir_list = list()
-        self._getFolderFolders(self.image_dir, dir_list)
-
-        empty_dirs = filter(lambda p: not any(p.iterdir()), dir_list)
-        for d in empty_dirs:
-            logger.info('Removing empty directory: %s', d)
-
-            try:
-                d.rmdir()
-            except OSError as e:
-                logger.error('Cannot remove folder: %s', str(e))
-            except PermissionError as e:
-                logger.error('Cannot remove folder: %s', str(e))
+        self._asset_expire.removeEmptyFolders(self.image_dir)
 
 
         logger.warning('Deleted %d assets', delete_count)
 
 
-    def _deleteAssets(self, table, entry_id_list):
-        delete_count = 0
-        for entry_id in entry_id_list:
-            entry = table.query\
-                .filter(table.id == entry_id)\
-                .one()
-
-            logger.info('Removing old %s entry: %s', entry.__class__.__name__, entry.filename)
-
-            try:
-                entry.deleteAsset()
-            except OSError as e:
-                logger.error('Cannot remove file: %s', str(e))
-                continue
-
-            db.session.delete(entry)
-            db.session.commit()
-
-            delete_count += 1
-
-            if self._shutdown:
-                sys.exit(1)
-
-        return delete_count
-
-
-    def _getFolderFolders(self, folder, dir_list):
-        for item in Path(folder).iterdir():
-            if item.is_dir():
-                dir_list.append(item)
-                self._getFolderFolders(item, dir_list)  # recursion
-
-
 
 if __name__ == "__main__":
     argparser = argparse.ArgumentParser()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+#######################################################################################
+# Migrate the long term keogram data from the database into the columnar store.       #
+# Each chunk of rows is removed from the database before it is written to the store,   #
+# the script may be interrupted and run again without duplicating data.                #
+#######################################################################################
+
+import sys
+from pathlib import Path
+import argparse
+import time
+import signal
+import logging
+
+import numpy
+
+from sqlalchemy.orm.exc import NoResultFound
+
+
+sys.path.insert(0, str(Path(__file__).parent.absolute().parent))
+
+
+from indi_allsky.flask.models import IndiAllSkyDbCameraTable
+from indi_allsky.flask.models import IndiAllSkyDbLongTermKeogramTable
+
+from indi_allsky.config import IndiAllSkyConfig
+
+from indi_allsky.flask import db
+from indi_allsky.flask import create_app
+from indi_allsky.longTermKeogramStore import LongTermKeogramStore
+
+
+logger = logging.getLogger('indi_allsky')
+logger.setLevel(logging.INFO)
+
+
+# setup flask context for db access
+app = create_app()
+app.app_context().push()
+
+
+LOG_FORMATTER_STREAM = logging.Formatter('[%(levelname)s]: %(message)s')
+
+LOG_HANDLER_STREAM = logging.StreamHandler()
+LOG_HANDLER_STREAM.setFormatter(LOG_FORMATTER_STREAM)
+
+logger.handlers.clear()  # remove syslog
+logger.addHandler(LOG_HANDLER_STREAM)
+
+
+
+class LongTermKeogramCompact(object):
+
+    def __init__(self):
+        try:
+            self._config_obj = IndiAllSkyConfig()
+            #logger.info('Loaded config id: %d', self._config_obj.config_id)
+        except NoResultFound:
+            logger.error('No config file found, please import a config')
+            sys.exit(1)
+
+        self.config = self._config_obj.config
+
+        self._chunk_size = 100000
+
+        self._store = LongTermKeogramStore(self.config)
+
+        self._shutdown = False
+
+
+    @property
+    def chunk_size(self):
+        return self._chunk_size
+
+    @chunk_size.setter
+    def chunk_size(self, new_chunk_size):
+        self._chunk_size = int(new_chunk_size)
+
+
+    def sigint_handler_main(self, signum, frame):
+        logger.warning('Caught INT signal, stopping after the current chunk')
+        self._shutdown = True
+
+
+    def main(self):
+        signal.signal(signal.SIGINT, self.sigint_handler_main)
+
+        logger.info('Store folder: %s', self._store.store_folder)
+
+
+        start = time.time()
+
+        total_count = 0
+        for camera in IndiAllSkyDbCameraTable.query.order_by(IndiAllSkyDbCameraTable.id.asc()):
+            total_count += self.compactCamera(camera.id)
+
+            if self._shutdown:
+                break
+
+
+        self._store.close()
+
+        logger.warning('Migrated %d rows in %0.1f s', total_count, time.time() - start)
+
+        if db.engine.dialect.name == 'sqlite':
+            logger.warning('Run VACUUM on the database to reclaim the space')
+
+
+    def compactCamera(self, camera_id):
+        ltk_columns = [
+            IndiAllSkyDbLongTermKeogramTable.id,
+            IndiAllSkyDbLongTermKeogramTable.ts,
+        ]
+
+        # store is BGR
+        for i in range(1, LongTermKeogramStore.pixels + 1):
+            ltk_columns.append(getattr(IndiAllSkyDbLongTermKeogramTable, 'b{0:d}'.format(i)))
+            ltk_columns.append(getattr(IndiAllSkyDbLongTermKeogramTable, 'g{0:d}'.format(i)))
+            ltk_columns.append(getattr(IndiAllSkyDbLongTermKeogramTable, 'r{0:d}'.format(i)))
+
+
+        camera_count = 0
+        last_id = 0
+
+        while not self._shutdown:
+            rows = db.session.query(*ltk_columns)\
+                .filter(IndiAllSkyDbLongTermKeogramTable.camera_id == camera_id)\
+                .filter(IndiAllSkyDbLongTermKeogramTable.id > last_id)\
+                .order_by(IndiAllSkyDbLongTermKeogramTable.id.asc())\
+                .limit(self._chunk_size)\
+                .all()
+
+            if not rows:
+                break
+
+
+            row_data = numpy.array(rows, dtype=numpy.int64)
+
+            id_array = row_data[:, 0]
+            ts_array = row_data[:, 1]
+            pixel_array = numpy.clip(row_data[:, 2:], 0, 255)
+
+            last_id = int(id_array[-1])
+
+
+            # the store is not transactional, rows are removed first so they are never added twice
+            IndiAllSkyDbLongTermKeogramTable.query\
+                .filter(IndiAllSkyDbLongTermKeogramTable.camera_id == camera_id)\
+                .filter(IndiAllSkyDbLongTermKeogramTable.id <= last_id)\
+                .delete(synchronize_session=False)
+            db.session.commit()
+
+
+            self._store.addMany(camera_id, ts_array, pixel_array)
+
+
+            camera_count += len(rows)
+            logger.info('Camera %d: migrated %d rows', camera_id, camera_count)
+
+
+        return camera_count
+
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument(
+        '--chunk_size',
+        '-c',
+        help='Rows per chunk',
+        type=int,
+        default=100000,
+    )
+
+
+    args = argparser.parse_args()
+
+
+    ltc = LongTermKeogramCompact()
+    ltc.chunk_size = args.chunk_size
+
+    ltc.main()
@@ -41,6 +41,9 @@ from indi_allsky.flask.models import IndiAllSkyDbPanoramaVideoTable
 from indi_allsky.flask.models import IndiAllSkyDbLongTermKeogramTable
 from indi_allsky.flask.models import IndiAllSkyDbThumbnailTable
 
+from indi_allsky.config import IndiAllSkyConfig
+from indi_allsky.longTermKeogramStore import LongTermKeogramStore
+
 
 
 
@@ -57,6 +60,15 @@ logger.addHandler(LOG_HANDLER_STREAM)
 class MergeCameras(object):
 
     def __init__(self):
+        try:
+            self._config_obj = IndiAllSkyConfig()
+            #logger.info('Loaded config id: %d', self._config_obj.config_id)
+        except NoResultFound:
+            logger.error('No config file found, please import a config')
+            sys.exit(1)
+
+        self.config = self._config_obj.config
+
         self._new_camera_id = 0
         self._orig_camera_id = 0
 
@@ -159,6 +171,12 @@ class MergeCameras(object):
             db.session.commit()
 
 
+        # long term keogram data is stored outside of the database
+        ltk_store = LongTermKeogramStore(self.config)
+        ltk_day_count = ltk_store.mergeCamera(new_camera_entry.id, orig_camera_entry.id)
+        logger.info('Merged %d days of long term keogram data', ltk_day_count)
+
+
 
         # merge cameras
         if not orig_camera_entry.name_alt1:
@@ -4,12 +4,16 @@
 # This script looks for failed file transfers (uploads, #
 # S3 transfers, and syncapi transfers) and attempts     #
 # the transfers again.                                  #
+#                                                       #
+# Progress is saved, an interrupted sync continues      #
+# where it left off unless --restart is given.          #
 #########################################################
 
 import sys
 from pathlib import Path
 import argparse
 import time
+import json
 from datetime import datetime
 from datetime import timedelta
 from prettytable import PrettyTable
@@ -43,12 +47,18 @@ from indi_allsky.flask.models import IndiAllSkyDbPanoramaImageTable
 from indi_allsky.flask.models import IndiAllSkyDbPanoramaVideoTable
 from indi_allsky.flask.models import IndiAllSkyDbThumbnailTable
 from indi_allsky.flask.models import IndiAllSkyDbLongTermKeogramTable
+from indi_allsky.flask.models import IndiAllSkyDbTaskQueueTable
+from indi_allsky.flask.models import TaskQueueState
+from indi_allsky.flask.models import TaskQueueQueue
 
 
 from indi_allsky import constants
 from indi_allsky.config import IndiAllSkyConfig
 from indi_allsky.flask import create_app
+from indi_allsky.flask.miscDb import miscDb
 from indi_allsky.miscUpload import miscUpload
+from indi_allsky.uploadScheduler import IndiAllSkyUploadScheduler
+from indi_allsky.longTermKeogramStore import LongTermKeogramStore
 
 
 logger = logging.getLogger('indi_allsky')
@@ -66,15 +76,21 @@ app = create_app()
 
 class UploadSync(object):
 
+    checkpoint_key = 'UPLOAD_SYNC_CHECKPOINT'
+
+
     def __init__(self, threads):
         self.threads = int(threads)
 
+        # entries are read in pages, a new page is queued when the workers are nearly idle
         self.batch_size  = self.threads * 11
+        self.low_water = self.threads * 2
 
         self._image_days = 30
         self._upload_images = False
         self._syncapi = True
         self._syncapi_images = True
+        self._restart = False
 
         with app.app_context():
             try:
@@ -87,11 +103,28 @@ class UploadSync(object):
             self.config = self._config_obj.config
 
 
-        self.upload_q = Queue()
+        self._miscDb = miscDb(self.config)
+
+        self._longterm_keogram_store = LongTermKeogramStore(self.config)
+
+
+        # all workers share the scheduler, each destination may use every worker
+        scheduler_config = {
+            'UPLOAD_DESTINATION_WORKERS' : {dest.upper(): self.threads for dest in IndiAllSkyUploadScheduler.destination_list},
+        }
+        self.upload_scheduler = IndiAllSkyUploadScheduler(scheduler_config)
+
+
+        self.upload_q = queue.Queue()  # miscUpload adds tasks here, they are moved to the scheduler
         self.upload_worker_list = []
         self.upload_worker_idx = 0
 
 
+        self._stream_list = list()
+        self._done_stream_set = set()  # stream keys, not scanned again when resuming
+        self._task_id_set = set()  # queued by this sync, not confirmed finished
+
+
         for x in range(self.threads):
             self.upload_worker_list.append({
                 'worker'  : None,
@@ -154,6 +187,15 @@ class UploadSync(object):
         self._syncapi_images = bool(new_syncapi_images)
 
 
+    @property
+    def restart(self):
+        return self._restart
+
+    @restart.setter
+    def restart(self, new_restart):
+        self._restart = bool(new_restart)
+
+
     def sigint_handler_main(self, signum, frame):
         logger.warning('Caught INT signal, shutting down')
         logger.warning('The program will exit when the current file transfers complete')
@@ -168,49 +210,65 @@ class UploadSync(object):
 
 
         with app.app_context():
+            # the queries are not run until they are counted
             status_dict = self._get_entry_status()
-            self._report(status_dict)
 
-            time.sleep(5)
+            if self.restart:
+                checkpoint = None
+            else:
+                checkpoint = self._readCheckpoint()
+
+
+            if isinstance(checkpoint, type(None)):
+                # counting every table is slow, the report is skipped when resuming
+                self._report(status_dict)
+
+                time.sleep(5)
 
 
-            # populate individual entries
-            upload_list = list()
+            # candidates are read from the database as needed
             for upload_type in status_dict.keys():
                 for table, data in status_dict[upload_type].items():
                     if not data:
                         continue
 
-                    for entry in data[1]:
-                        if upload_type == 'upload' and table.__name__ == 'IndiAllSkyDbImageTable':
-                            if not self.upload_images:
-                                continue
+                    if upload_type == 'upload' and table.__name__ == 'IndiAllSkyDbImageTable':
+                        if not self.upload_images:
+                            continue
 
-                        if upload_type == 'upload' and table.__name__ == 'IndiAllSkyDbPanoramaImageTable':
-                            if not self.upload_images:
-                                continue
+                    if upload_type == 'upload' and table.__name__ == 'IndiAllSkyDbPanoramaImageTable':
+                        if not self.upload_images:
+                            continue
 
-                        if upload_type == 'syncapi' and table.__name__ == 'IndiAllSkyDbImageTable':
-                            if not self.syncapi_images:
-                                continue
+                    if upload_type == 'syncapi' and table.__name__ == 'IndiAllSkyDbImageTable':
+                        if not self.syncapi_images:
+                            continue
 
-                        if upload_type == 'syncapi' and table.__name__ == 'IndiAllSkyDbPanoramaImageTable':
-                            if not self.syncapi_images:
-                                continue
+                    if upload_type == 'syncapi' and table.__name__ == 'IndiAllSkyDbPanoramaImageTable':
+                        if not self.syncapi_images:
+                            continue
 
-                        if upload_type == 'syncapi':  # needs to be last
-                            if not self.syncapi:
-                                continue
+                    if upload_type == 'syncapi':  # needs to be last
+                        if not self.syncapi:
+                            continue
 
 
-                        upload_list.append({
-                            'upload_type' : upload_type,
-                            'table'       : table,
-                            'entry_id'    : entry.id,  # cannot pass entries to different session
-                        })
+                    mod, upload_days = self._streamParams(upload_type, table)
+                    if not mod:
+                        continue
+
+
+                    self._stream_list.append({
+                        'upload_type' : upload_type,
+                        'table'       : table,
+                        'mod'         : mod,
+                        'upload_days' : upload_days,
+                        'cursor'      : None,  # last entry id, entries are read by descending id
+                    })
 
 
-            logger.info('Entries to upload: %d', len(upload_list))
+            if not isinstance(checkpoint, type(None)):
+                self._loadCheckpoint(checkpoint)
 
 
         while True:
@@ -220,16 +278,32 @@ class UploadSync(object):
             if self._shutdown:
                 logger.warning('Shutting down')
                 self._stopFileUploadWorkers(terminate=self._terminate)
+
+                if self._stream_list or self._outstandingTasks():
+                    with app.app_context():
+                        self._saveCheckpoint()
+
                 sys.exit()
 
 
-            if self.upload_q.qsize() == 0:
+            with app.app_context():
+                # workers add follow-up tasks, syncapi after S3
+                self._queueTasks()
+
+
+            if self._outstandingTasks() <= self.low_water:
                 with app.app_context():
                     try:
-                        self.addUploadEntries(upload_list)
+                        new_uploads = self._nextUploadEntries(self.batch_size)
+                        self.addUploadEntries(new_uploads)
+                        self._queueTasks()
+                        self._saveCheckpoint()
                     except NoUploadsAvailable:
-                        logger.warning('No uploads remaining to process')
-                        self._shutdown = True
+                        if self._outstandingTasks() == 0:
+                            logger.warning('No uploads remaining to process')
+                            self._removeCheckpoint()
+                            self._shutdown = True
+                            continue
 
 
             # do *NOT* start workers inside of a flask context
@@ -241,25 +315,193 @@ class UploadSync(object):
                 next_check_time = loop_start_time + 30
 
 
-            time.sleep(3)
+            if self._stream_list:
+                # returns as soon as the workers need more entries
+                self.upload_scheduler.waitPending(self.low_water, timeout=1)
+            else:
+                # wait for the remaining transfers
+                self.upload_scheduler.waitPending(0, timeout=1)
+
+
+    def _streamParams(self, upload_type, table):
+        # returns (id modulus, days)
+        if upload_type == 's3':
+            return 1, 99999
+
+        if upload_type == 'syncapi':
+            section = 'SYNCAPI'
+        else:
+            section = 'FILETRANSFER'
+
+
+        if table == IndiAllSkyDbImageTable:
+            return int(self.config.get(section, {}).get('UPLOAD_IMAGE', 1)), self.image_days
+        elif table == IndiAllSkyDbPanoramaImageTable:
+            return int(self.config.get(section, {}).get('UPLOAD_PANORAMA', 1)), self.image_days
+
+
+        return 1, 99999
+
+
+    def _candidateQuery(self, stream):
+        table = stream['table']
+
+        if stream['upload_type'] == 'syncapi':
+            query = self._get_syncapi(table, stream['mod'], state=False, upload_days=stream['upload_days'])
+        elif stream['upload_type'] == 's3':
+            query = self._get_s3(table, state=False, upload_days=stream['upload_days'])
+        else:
+            query = self._get_uploaded(table, stream['mod'], state=False, upload_days=stream['upload_days'])
+
+
+        # keyset pagination, the primary key is indexed
+        if not isinstance(stream['cursor'], type(None)):
+            query = query.filter(table.id < stream['cursor'])
+
+        return query\
+            .order_by(None)\
+            .order_by(table.id.desc())
+
+
+    def _nextUploadEntries(self, count):
+        new_uploads = list()
+
+        while self._stream_list and len(new_uploads) < count:
+            stream = self._stream_list[0]
+
+            entry_list = self._candidateQuery(stream)\
+                .limit(count - len(new_uploads))\
+                .all()
+
+
+            if not entry_list:
+                logger.info('Finished %s %s', stream['upload_type'], stream['table'].__name__)
+                self._done_stream_set.add(self._streamKey(stream))
+                self._stream_list.pop(0)
+                continue
+
+
+            for entry in entry_list:
+                new_uploads.append({
+                    'upload_type' : stream['upload_type'],
+                    'table'       : stream['table'],
+                    'entry'       : entry,
+                })
 
+            stream['cursor'] = entry_list[-1].id
 
 
-    def addUploadEntries(self, upload_list):
-        if len(upload_list) == 0:
+        if not new_uploads:
             raise NoUploadsAvailable
 
 
-        new_uploads = upload_list[:self.batch_size]
-        del upload_list[:self.batch_size]
+        return new_uploads
+
+
+    def _queueTasks(self):
+        # move new tasks from miscUpload to the scheduler
+        while True:
+            try:
+                u_dict = self.upload_q.get_nowait()
+            except queue.Empty:
+                break
+
+            self._queueTask(u_dict['task_id'])
+
+
+    def _queueTask(self, task_id):
+        try:
+            task = IndiAllSkyDbTaskQueueTable.query\
+                .filter(IndiAllSkyDbTaskQueueTable.id == task_id)\
+                .one()
+        except NoResultFound:
+            logger.error('Task ID %d not found', task_id)
+            return
+
+
+        priority = IndiAllSkyUploadScheduler.taskPriority(task.data, task.priority)
+        self.upload_scheduler.addTask(task.id, task.data.get('action'), priority)
+
+        self._task_id_set.add(task.id)
+
+
+    def _outstandingTasks(self):
+        # includes new tasks that are not in the scheduler yet
+        return self.upload_q.qsize() + sum(d['queued'] + d['in_flight'] for d in self.upload_scheduler.status().values())
+
+
+    def _readCheckpoint(self):
+        try:
+            return json.loads(self._miscDb.getState(self.checkpoint_key))
+        except NoResultFound:
+            return None
+
+
+    def _loadCheckpoint(self, checkpoint):
+        logger.warning('Resuming sync from checkpoint, use --restart to start over')
+
+        self._done_stream_set = set(checkpoint.get('done', []))
+
+        # finished streams are dropped
+        self._stream_list = [stream for stream in self._stream_list if self._streamKey(stream) not in self._done_stream_set]
+
+        cursor_dict = checkpoint.get('cursors', {})
+        for stream in self._stream_list:
+            stream['cursor'] = cursor_dict.get(self._streamKey(stream))
+
+
+        # tasks that were not completed before the sync was interrupted
+        task_list = IndiAllSkyDbTaskQueueTable.query\
+            .filter(IndiAllSkyDbTaskQueueTable.id.in_(checkpoint.get('tasks', [])))\
+            .filter(IndiAllSkyDbTaskQueueTable.queue == TaskQueueQueue.UPLOAD)\
+            .filter(IndiAllSkyDbTaskQueueTable.state.in_((TaskQueueState.QUEUED, TaskQueueState.RUNNING)))
 
-        logger.info('Adding %d upload entries (%d remaining)', len(new_uploads), len(upload_list))
+
+        for task in task_list:
+            task.setQueued()
+            self._queueTask(task.id)
+
+
+        logger.info('Requeued %d unfinished tasks', len(self._task_id_set))
+
+
+    def _saveCheckpoint(self):
+        if self._task_id_set:
+            # forget finished tasks
+            unfinished_task_list = IndiAllSkyDbTaskQueueTable.query\
+                .with_entities(IndiAllSkyDbTaskQueueTable.id)\
+                .filter(IndiAllSkyDbTaskQueueTable.id.in_(list(self._task_id_set)))\
+                .filter(IndiAllSkyDbTaskQueueTable.state.in_((TaskQueueState.QUEUED, TaskQueueState.RUNNING)))
+
+            self._task_id_set = set(t.id for t in unfinished_task_list)
+
+
+        checkpoint = {
+            'cursors' : {self._streamKey(stream): stream['cursor'] for stream in self._stream_list},
+            'done'    : sorted(self._done_stream_set),
+            'tasks'   : sorted(self._task_id_set),
+        }
+
+        self._miscDb.setState(self.checkpoint_key, json.dumps(checkpoint))
+
+
+    def _removeCheckpoint(self):
+        try:
+            self._miscDb.removeState(self.checkpoint_key)
+        except NoResultFound:
+            pass
+
+
+    def _streamKey(self, stream):
+        return '{0:s}:{1:s}'.format(stream['upload_type'], stream['table'].__name__)
+
+
+    def addUploadEntries(self, new_uploads):
+        logger.info('Adding %d upload entries', len(new_uploads))
 
 
         for x in new_uploads:
-            # cannot use entry from different session
-            entry = x['table'].query\
-                .filter(x['table'].id == x['entry_id']).one()
+            entry = x['entry']
 
 
             if not entry.validateFile():
@@ -921,6 +1163,15 @@ class UploadSync(object):
         camera_id = entry.camera_id
 
 
+        slot_data = self._longterm_keogram_store.read(camera_id, ts // LongTermKeogramStore.grid_seconds, 1)[0]
+
+        if slot_data[-1]:
+            # store is BGR
+            image_metadata['keogram_pixels'] = [[int(r), int(g), int(b)] for b, g, r in slot_data[:-1].reshape((-1, 3))]
+            return
+
+
+        # rows that have not been migrated to the store
         # it is possible to have multiple entries, we will only sync one
         keogram_data = IndiAllSkyDbLongTermKeogramTable.query\
             .join(IndiAllSkyDbLongTermKeogramTable.camera)\
@@ -1228,6 +1479,7 @@ class UploadSync(object):
             self.config,
             uw_dict['error_q'],
             self.upload_q,
+            scheduler=self.upload_scheduler,
         )
 
         uw_dict['worker'].start()
@@ -1339,6 +1591,13 @@ if __name__ == "__main__":
     )
     syncapi_images_group.set_defaults(syncapi_images=True)
 
+    argparser.add_argument(
+        '--restart',
+        help='ignore the saved progress and start over',
+        dest='restart',
+        action='store_true',
+    )
+
 
     args = argparser.parse_args()
 
@@ -1347,6 +1606,7 @@ if __name__ == "__main__":
     us.upload_images = args.upload_images
     us.syncapi = args.syncapi
     us.syncapi_images = args.syncapi_images
+    us.restart = args.restart
 
     action_func = getattr(us, args.action)
     action_func()
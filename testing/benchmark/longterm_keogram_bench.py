@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+#######################################################################################
+# Long term keogram generation benchmark                                              #
+#                                                                                     #
+# A separate database and store folder are seeded with synthetic data, then the       #
+# keogram is generated for 1 year and 5 year ranges from the database rows and again  #
+# after the rows are compacted into the columnar store.                               #
+#                                                                                     #
+# Never point this at the production database, rows are inserted and deleted.         #
+#######################################################################################
+
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+from datetime import datetime
+from datetime import timedelta
+import logging
+
+import numpy
+
+sys.path.append(str(Path(__file__).parent.absolute().parent.parent))
+
+from flask import Flask
+
+from sqlalchemy import insert
+
+from indi_allsky.flask import db
+
+from indi_allsky.flask.models import IndiAllSkyDbCameraTable
+from indi_allsky.flask.models import IndiAllSkyDbLongTermKeogramTable
+
+from indi_allsky.longTermKeogramStore import LongTermKeogramStore
+
+
+LOG_FORMATTER_STREAM = logging.Formatter('%(asctime)s [%(levelname)s] %(processName)s: %(message)s')
+LOG_HANDLER_STREAM = logging.StreamHandler()
+LOG_HANDLER_STREAM.setFormatter(LOG_FORMATTER_STREAM)
+
+
+logger = logging.getLogger('indi_allsky')
+logger.handlers.clear()
+logger.addHandler(LOG_HANDLER_STREAM)
+logger.setLevel(logging.INFO)
+
+
+class LongTermKeogramBench(object):
+
+    range_days = (365, 1825)
+
+    ltk_columns = ['r1', 'g1', 'b1', 'r2', 'g2', 'b2', 'r3', 'g3', 'b3', 'r4', 'g4', 'b4', 'r5', 'g5', 'b5']
+
+
+    def __init__(self, database_uri, varlib_folder):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+
+        db.init_app(self.app)
+
+        self.config = {
+            'VARLIB_FOLDER' : varlib_folder,
+        }
+
+        self._interval = 60
+        self._alignment_seconds = 60
+        self._period_pixels = 5
+
+        self._camera_id = None
+
+        tomorrow = datetime.now() + timedelta(hours=24)  # same as the web interface
+        self._end_date = datetime.strptime(tomorrow.strftime('%Y%m%d_120000'), '%Y%m%d_%H%M%S')
+
+
+    @property
+    def interval(self):
+        return self._interval
+
+    @interval.setter
+    def interval(self, new_interval):
+        self._interval = int(new_interval)
+
+
+    @property
+    def alignment_seconds(self):
+        return self._alignment_seconds
+
+    @alignment_seconds.setter
+    def alignment_seconds(self, new_alignment_seconds):
+        self._alignment_seconds = int(new_alignment_seconds)
+
+
+    @property
+    def period_pixels(self):
+        return self._period_pixels
+
+    @period_pixels.setter
+    def period_pixels(self, new_period_pixels):
+        self._period_pixels = int(new_period_pixels)
+
+
+    def main(self):
+        with self.app.app_context():
+            db.create_all()
+
+            self.seed()
+
+            db_results = self.run('database')
+
+            self.compact()
+
+            store_results = self.run('store')
+
+
+        logger.warning('Days    Database    Store')
+        for days in self.range_days:
+            logger.warning('%4d    %7.2fs    %4.2fs', days, db_results[days], store_results[days])
+
+
+    def seed(self):
+        camera = IndiAllSkyDbCameraTable(
+            name='longterm_keogram_bench',
+            uuid='longterm_keogram_bench',
+        )
+        db.session.add(camera)
+        db.session.commit()
+
+        self._camera_id = camera.id
+
+
+        end_ts = int(self._end_date.timestamp())
+        start_ts = end_ts - (max(self.range_days) * 86400)
+
+        rng = numpy.random.default_rng()
+
+        seed_start = time.time()
+
+        row_count = 0
+        for chunk_start_ts in range(start_ts, end_ts, 86400 * 30):
+            ts_array = numpy.arange(chunk_start_ts, min(chunk_start_ts + (86400 * 30), end_ts), self._interval)
+            pixel_array = rng.integers(0, 256, (len(ts_array), len(self.ltk_columns)))
+
+            rows = list()
+            for ts, pixels in zip(ts_array.tolist(), pixel_array.tolist()):
+                row = dict(zip(self.ltk_columns, pixels))
+                row['ts'] = ts
+                row['camera_id'] = self._camera_id
+                rows.append(row)
+
+            db.session.execute(insert(IndiAllSkyDbLongTermKeogramTable), rows)
+            db.session.commit()
+
+            row_count += len(rows)
+
+
+        logger.info('Seeded %d rows in %0.1fs', row_count, time.time() - seed_start)
+
+
+    def compact(self):
+        store = LongTermKeogramStore(self.config)
+
+        compact_start = time.time()
+
+        # store is BGR
+        bgr_columns = list()
+        for i in range(1, LongTermKeogramStore.pixels + 1):
+            bgr_columns.extend(['b{0:d}'.format(i), 'g{0:d}'.format(i), 'r{0:d}'.format(i)])
+
+        ltk_columns = [IndiAllSkyDbLongTermKeogramTable.ts] + [getattr(IndiAllSkyDbLongTermKeogramTable, c) for c in bgr_columns]
+
+        end_ts = int(self._end_date.timestamp())
+        start_ts = end_ts - (max(self.range_days) * 86400)
+
+        row_count = 0
+        for chunk_start_ts in range(start_ts, end_ts, 86400 * 30):
+            rows = db.session.query(*ltk_columns)\
+                .filter(IndiAllSkyDbLongTermKeogramTable.camera_id == self._camera_id)\
+                .filter(IndiAllSkyDbLongTermKeogramTable.ts >= chunk_start_ts)\
+                .filter(IndiAllSkyDbLongTermKeogramTable.ts < chunk_start_ts + (86400 * 30))\
+                .all()
+
+            if not rows:
+                continue
+
+            row_data = numpy.array(rows, dtype=numpy.int64)
+            store.addMany(self._camera_id, row_data[:, 0], row_data[:, 1:])
+
+            row_count += len(rows)
+
+        store.close()
+
+
+        IndiAllSkyDbLongTermKeogramTable.query\
+            .filter(IndiAllSkyDbLongTermKeogramTable.camera_id == self._camera_id)\
+            .delete(synchronize_session=False)
+        db.session.commit()
+
+        logger.info('Compacted %d rows in %0.1fs', row_count, time.time() - compact_start)
+
+
+    def run(self, label):
+        # imported late, module level create_app() requires the flask config
+        from indi_allsky.longTermKeogram import LongTermKeogramGenerator
+
+        results = dict()
+        for days in self.range_days:
+            ltg_gen = LongTermKeogramGenerator(self.config)
+            ltg_gen.camera_id = self._camera_id
+            ltg_gen.days = days
+            ltg_gen.alignment_seconds = self._alignment_seconds
+            ltg_gen.offset_seconds = 0
+            ltg_gen.period_pixels = self._period_pixels
+            ltg_gen.reverse = False
+            ltg_gen.label = False
+
+            query_start_date = self._end_date - timedelta(days=days)
+
+            generate_start = time.time()
+            keogram_data = ltg_gen.generate(query_start_date, self._end_date)
+            results[days] = time.time() - generate_start
+
+            logger.info('%s: %d days %s in %0.2fs', label, days, str(keogram_data.shape), results[days])
+
+
+        return results
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument(
+        '--database',
+        '-d',
+        help='database URI (default: temporary sqlite)',
+        type=str,
+    )
+    argparser.add_argument(
+        '--interval',
+        '-i',
+        help='seconds between entries [default: 60]',
+        type=int,
+        default=60,
+    )
+    argparser.add_argument(
+        '--alignment',
+        '-a',
+        help='alignment seconds [default: 60]',
+        type=int,
+        default=60,
+    )
+    argparser.add_argument(
+        '--pixels',
+        '-p',
+        help='period pixels [default: 5]',
+        type=int,
+        default=5,
+    )
+
+    args = argparser.parse_args()
+
+
+    tmp_folder = tempfile.TemporaryDirectory(prefix='ltk_bench_')
+
+    if args.database:
+        database_uri = args.database
+    else:
+        database_uri = 'sqlite:///{0:s}'.format(str(Path(tmp_folder.name).joinpath('ltk_bench.sqlite')))
+
+
+    ltb = LongTermKeogramBench(database_uri, tmp_folder.name)
+    ltb.interval = args.interval
+    ltb.alignment_seconds = args.alignment
+    ltb.period_pixels = args.pixels
+    ltb.main()
+
+    tmp_folder.cleanup()
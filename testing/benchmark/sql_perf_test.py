@@ -1,28 +1,44 @@
 #!/usr/bin/env python3
+#######################################################################################
+# Query plan regression harness for the hot image queries                             #
+#                                                                                     #
+# A separate database is seeded with a year of synthetic rows, then every hot query   #
+# is executed and checked with EXPLAIN QUERY PLAN (SQLite) or EXPLAIN (MySQL).  A     #
+# query fails if it scans the table without an index or exceeds the latency budget.   #
+#                                                                                     #
+# Never point this at the production database, rows are inserted.                     #
+#######################################################################################
 
 import sys
 import time
+import argparse
+import tempfile
 from pathlib import Path
-#from datetime import datetime
-#from datetime import timedelta
+from datetime import datetime
+from datetime import timedelta
 import logging
 
-sys.path.append(str(Path(__file__).parent.absolute().parent))
+sys.path.append(str(Path(__file__).parent.absolute().parent.parent))
 
-from indi_allsky.flask import create_app
+from flask import Flask
 
-# setup flask context for db access
-app = create_app()
-app.app_context().push()
+from sqlalchemy import event
+from sqlalchemy import insert
+from sqlalchemy import func
+from sqlalchemy import and_
+from sqlalchemy.sql.expression import true as sa_true
+from sqlalchemy.sql.expression import false as sa_false
+
+from indi_allsky.flask import db
 
 from indi_allsky.flask.models import IndiAllSkyDbCameraTable
 from indi_allsky.flask.models import IndiAllSkyDbImageTable
-#from indi_allsky.flask.models import IndiAllSkyDbThumbnailTable
-#from indi_allsky.flask.models import IndiAllSkyDbVideoTable
-
-from sqlalchemy import extract
-from sqlalchemy import and_
-from indi_allsky.flask import db
+from indi_allsky.flask.models import IndiAllSkyDbPanoramaImageTable
+from indi_allsky.flask.models import IndiAllSkyDbFitsImageTable
+from indi_allsky.flask.models import IndiAllSkyDbRawImageTable
+from indi_allsky.flask.models import IndiAllSkyDbVideoTable
+from indi_allsky.flask.models import IndiAllSkyDbKeogramTable
+from indi_allsky.flask.models import IndiAllSkyDbStarTrailsTable
 
 
 LOG_FORMATTER_STREAM = logging.Formatter('%(asctime)s [%(levelname)s] %(processName)s: %(message)s')
@@ -38,124 +54,242 @@ logger.setLevel(logging.INFO)
 
 class SqlTester(object):
 
-    def __init__(self):
-        pass
+    def __init__(self, database_uri):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+        self.app.config['INDI_ALLSKY_IMAGE_FOLDER'] = '/tmp'
+
+        db.init_app(self.app)
+
+        self._days = 365
+        self._images_per_day = 2880  # 30 second exposures
+        self._budget_s = 0.25
+        self._seed = True
+
+        self._camera_id = None
+        self._end_date = datetime.now().replace(hour=12, minute=0, second=0, microsecond=0)
+
+        self._last_statement = None
+        self._last_parameters = None
+
+
+    @property
+    def days(self):
+        return self._days
+
+    @days.setter
+    def days(self, new_days):
+        self._days = int(new_days)
+
+
+    @property
+    def images_per_day(self):
+        return self._images_per_day
+
+    @images_per_day.setter
+    def images_per_day(self, new_images_per_day):
+        self._images_per_day = int(new_images_per_day)
+
+
+    @property
+    def budget_s(self):
+        return self._budget_s
+
+    @budget_s.setter
+    def budget_s(self, new_budget_s):
+        self._budget_s = float(new_budget_s)
+
+
+    @property
+    def seed(self):
+        return self._seed
+
+    @seed.setter
+    def seed(self, new_seed):
+        self._seed = bool(new_seed)
 
 
     def main(self):
-        camera_id = 1
-        detections_count = 0
+        with self.app.app_context():
+            db.create_all()
 
-        year = 2024
-        month = 7
-        day = 28
-        hour = 4
+            event.listen(db.engine, 'before_cursor_execute', self._captureStatement)
 
+            if self.seed:
+                self.seedData()
 
-        createDate_Y = extract('year', IndiAllSkyDbImageTable.createDate).label('createDate_Y')
-        createDate_m = extract('month', IndiAllSkyDbImageTable.createDate).label('createDate_m')
-        createDate_d = extract('day', IndiAllSkyDbImageTable.createDate).label('createDate_d')
-        createDate_H = extract('hour', IndiAllSkyDbImageTable.createDate).label('createDate_H')
+            camera = IndiAllSkyDbCameraTable.query\
+                .order_by(IndiAllSkyDbCameraTable.id.asc())\
+                .first()
 
-        hours_query = db.session.query(
-            createDate_Y,
-            createDate_m,
-            createDate_d,
-            createDate_H,
-        )\
+            if not camera:
+                logger.error('No camera found, seed the database first')
+                return 1
+
+            self._camera_id = camera.id
+
+
+            failures = 0
+            for label, table, query in self.hotQueries():
+                if not self.checkQuery(label, table, query):
+                    failures += 1
+
+
+        if failures:
+            logger.error('%d queries failed', failures)
+            return 1
+
+        logger.info('All queries passed')
+        return 0
+
+
+    def seedData(self):
+        logger.warning('Seeding %d days with %d images per day', self.days, self.images_per_day)
+
+        camera = IndiAllSkyDbCameraTable(
+            name='sql_perf_test',
+            uuid='00000000-0000-0000-0000-000000000000',
+        )
+        db.session.add(camera)
+        db.session.commit()
+
+        start = time.time()
+
+        interval_s = 86400 / self.images_per_day
+        start_date = self._end_date - timedelta(days=self.days)
+
+        image_id = 0
+        for day in range(self.days):
+            day_start = start_date + timedelta(days=day)
+
+            image_list = list()
+            for i in range(self.images_per_day):
+                image_id += 1
+
+                createDate = day_start + timedelta(seconds=i * interval_s)
+                night = createDate.hour < 6 or createDate.hour >= 18
+
+                if night and createDate.hour < 12:
+                    dayDate = (createDate - timedelta(days=1)).date()
+                else:
+                    dayDate = createDate.date()
+
+                image_list.append({
+                    'camera_id'        : camera.id,
+                    'filename'         : 'ccd/exposures/{0:d}.jpg'.format(image_id),
+                    'createDate'       : createDate,
+                    'createDate_year'  : createDate.year,
+                    'createDate_month' : createDate.month,
+                    'createDate_day'   : createDate.day,
+                    'createDate_hour'  : createDate.hour,
+                    'dayDate'          : dayDate,
+                    'night'            : night,
+                    'exposure'         : 15.0,
+                    'gain'             : 100.0,
+                    'binmode'          : 1,
+                    'adu'              : 30.0,
+                    'sqm'              : 20000.0,
+                    'stars'            : image_id % 500,
+                    'detections'       : image_id % 3,
+                    'exclude'          : image_id % 100 == 0,
+                })
+
+            db.session.execute(insert(IndiAllSkyDbImageTable), image_list)
+
+
+            for table in (IndiAllSkyDbKeogramTable, IndiAllSkyDbStarTrailsTable, IndiAllSkyDbVideoTable):
+                db.session.execute(insert(table), [{
+                    'camera_id'  : camera.id,
+                    'filename'   : '{0:s}/{1:d}.jpg'.format(table.__tablename__, day),
+                    'createDate' : day_start,
+                    'dayDate'    : day_start.date(),
+                    'night'      : True,
+                }])
+
+
+            db.session.commit()
+
+
+        elapsed_s = time.time() - start
+        logger.info('Seeded %d images in %0.1f s', image_id, elapsed_s)
+
+
+    def hotQueries(self):
+        camera_id = self._camera_id
+
+        d_dayDate = (self._end_date - timedelta(days=2)).date()
+        ts_dt = self._end_date - timedelta(days=1)
+        cutoff_date = (self._end_date - timedelta(days=30)).date()
+
+
+        # end of night keogram, star trail, and timelapse file list
+        end_of_night_images = IndiAllSkyDbImageTable.query\
             .join(IndiAllSkyDbImageTable.camera)\
-            .filter(
-                and_(
-                    IndiAllSkyDbCameraTable.id == camera_id,
-                    IndiAllSkyDbImageTable.detections >= detections_count,
-                    createDate_Y == year,
-                    createDate_m == month,
-                    createDate_d == day,
-                )
-        )\
-            .distinct()\
-            .order_by(createDate_H.desc())
-
-
-        #    .join(IndiAllSkyDbThumbnailTable, IndiAllSkyDbImageTable.thumbnail_uuid == IndiAllSkyDbThumbnailTable.uuid)\
-
-
-        #hours_query_group = db.session.query(
-        #    createDate_Y,
-        #    createDate_m,
-        #    createDate_d,
-        #    createDate_H,
-        #)\
-        #    .join(IndiAllSkyDbImageTable.camera)\
-        #    .filter(
-        #        and_(
-        #            IndiAllSkyDbCameraTable.id == camera_id,
-        #            IndiAllSkyDbImageTable.detections >= detections_count,
-        #        )
-        #)\
-        #    .group_by(
-        #        createDate_Y,
-        #        createDate_m,
-        #        createDate_d,
-        #        createDate_H,
-        #)\
-        #    .distinct()\
-        #    .order_by(
-        #        createDate_Y.desc(),
-        #        createDate_m.desc(),
-        #        createDate_d.desc(),
-        #        createDate_H.desc(),
-        #)
-
-
-
-        years_query_new = db.session.query(
-            IndiAllSkyDbImageTable.createDate_year,
-        )\
+            .filter(IndiAllSkyDbCameraTable.id == camera_id)\
+            .filter(IndiAllSkyDbImageTable.dayDate == d_dayDate)\
+            .filter(IndiAllSkyDbImageTable.night == sa_true())\
+            .filter(IndiAllSkyDbImageTable.exclude == sa_false())\
+            .order_by(IndiAllSkyDbImageTable.createDate.asc())
+
+        end_of_night_stats = IndiAllSkyDbImageTable.query\
+            .add_columns(
+                func.max(IndiAllSkyDbImageTable.stars).label('image_max_stars'),
+                func.avg(IndiAllSkyDbImageTable.sqm).label('image_avg_sqm'),
+            )\
             .join(IndiAllSkyDbImageTable.camera)\
-            .filter(
-                and_(
-                    IndiAllSkyDbCameraTable.id == camera_id,
-                    IndiAllSkyDbImageTable.detections >= detections_count,
-                )
-        ).distinct()\
-            .order_by(IndiAllSkyDbImageTable.createDate_year.desc())
+            .filter(IndiAllSkyDbCameraTable.id == camera_id)\
+            .filter(IndiAllSkyDbImageTable.dayDate == d_dayDate)\
+            .filter(IndiAllSkyDbImageTable.night == sa_true())\
+            .filter(IndiAllSkyDbImageTable.exclude == sa_false())
 
 
-
-        months_query_new = db.session.query(
-            IndiAllSkyDbImageTable.createDate_year,
-            IndiAllSkyDbImageTable.createDate_month,
-        )\
+        # JsonImageLoopView.getLoopImages
+        loop_images = IndiAllSkyDbImageTable.query\
             .join(IndiAllSkyDbImageTable.camera)\
             .filter(
                 and_(
                     IndiAllSkyDbCameraTable.id == camera_id,
-                    IndiAllSkyDbImageTable.detections >= detections_count,
-                    IndiAllSkyDbImageTable.createDate_year == year,
+                    IndiAllSkyDbImageTable.exclude == sa_false(),
+                    IndiAllSkyDbImageTable.createDate > ts_dt - timedelta(seconds=900),
+                    IndiAllSkyDbImageTable.createDate < ts_dt,
                 )
-        ).distinct()\
-            .order_by(IndiAllSkyDbImageTable.createDate_month.desc())
-
-
-        days_query_new = db.session.query(
-            IndiAllSkyDbImageTable.createDate_year,
-            IndiAllSkyDbImageTable.createDate_month,
-            IndiAllSkyDbImageTable.createDate_day,
-        )\
-            .join(IndiAllSkyDbImageTable.camera)\
+            )\
+            .order_by(IndiAllSkyDbImageTable.createDate.desc())\
+            .limit(50)
+
+
+        # JsonChartView.getChartData
+        chart_data = IndiAllSkyDbImageTable.query\
+            .add_columns(
+                IndiAllSkyDbImageTable.createDate,
+                IndiAllSkyDbImageTable.sqm,
+                IndiAllSkyDbImageTable.stars,
+            )\
+            .join(IndiAllSkyDbCameraTable)\
             .filter(
                 and_(
                     IndiAllSkyDbCameraTable.id == camera_id,
-                    IndiAllSkyDbImageTable.detections >= detections_count,
-                    IndiAllSkyDbImageTable.createDate_year == year,
-                    IndiAllSkyDbImageTable.createDate_month == month,
+                    IndiAllSkyDbImageTable.createDate > ts_dt - timedelta(seconds=3600),
+                    IndiAllSkyDbImageTable.createDate < ts_dt,
                 )
-        ).distinct()\
-            .order_by(IndiAllSkyDbImageTable.createDate_day.desc())
+            )\
+            .order_by(IndiAllSkyDbImageTable.createDate.asc())
 
 
-        hours_query_new = db.session.query(
+        # ImageWorker.getSqmData
+        sqm_data = IndiAllSkyDbImageTable.query\
+            .add_columns(
+                func.max(IndiAllSkyDbImageTable.sqm).label('image_max_sqm'),
+                func.min(IndiAllSkyDbImageTable.sqm).label('image_min_sqm'),
+                func.avg(IndiAllSkyDbImageTable.sqm).label('image_avg_sqm'),
+            )\
+            .join(IndiAllSkyDbImageTable.camera)\
+            .filter(IndiAllSkyDbCameraTable.id == camera_id)\
+            .filter(IndiAllSkyDbImageTable.createDate > self._end_date - timedelta(minutes=30))
+
+
+        # image browser
+        browse_hours = db.session.query(
             IndiAllSkyDbImageTable.createDate_year,
             IndiAllSkyDbImageTable.createDate_month,
             IndiAllSkyDbImageTable.createDate_day,
@@ -165,114 +299,185 @@ class SqlTester(object):
             .filter(
                 and_(
                     IndiAllSkyDbCameraTable.id == camera_id,
-                    IndiAllSkyDbImageTable.detections >= detections_count,
-                    IndiAllSkyDbImageTable.createDate_year == year,
-                    IndiAllSkyDbImageTable.createDate_month == month,
-                    IndiAllSkyDbImageTable.createDate_day == day,
+                    IndiAllSkyDbImageTable.detections >= 0,
+                    IndiAllSkyDbImageTable.createDate_year == ts_dt.year,
+                    IndiAllSkyDbImageTable.createDate_month == ts_dt.month,
+                    IndiAllSkyDbImageTable.createDate_day == ts_dt.day,
                 )
-        )\
+            )\
             .distinct()\
             .order_by(IndiAllSkyDbImageTable.createDate_hour.desc())
 
 
-        images_query_new = db.session.query(
-            IndiAllSkyDbImageTable,
-        )\
+        # VideoWorker.expireData
+        expire_images = IndiAllSkyDbImageTable.query\
+            .with_entities(IndiAllSkyDbImageTable.id, IndiAllSkyDbImageTable.filename, IndiAllSkyDbImageTable.thumbnail_uuid)\
             .join(IndiAllSkyDbImageTable.camera)\
-            .filter(
-                and_(
-                    IndiAllSkyDbCameraTable.id == camera_id,
-                    IndiAllSkyDbImageTable.detections >= detections_count,
-                    IndiAllSkyDbImageTable.createDate_year == year,
-                    IndiAllSkyDbImageTable.createDate_month == month,
-                    IndiAllSkyDbImageTable.createDate_day == day,
-                    IndiAllSkyDbImageTable.createDate_hour == hour,
-                )
-        ).order_by(IndiAllSkyDbImageTable.createDate.desc())
+            .filter(IndiAllSkyDbCameraTable.id == camera_id)\
+            .filter(IndiAllSkyDbImageTable.dayDate < cutoff_date)\
+            .filter(IndiAllSkyDbImageTable.id > 0)\
+            .order_by(IndiAllSkyDbImageTable.id.asc())\
+            .limit(500)
+
+
+        query_list = [
+            ('End of night images', IndiAllSkyDbImageTable, end_of_night_images),
+            ('End of night stats', IndiAllSkyDbImageTable, end_of_night_stats),
+            ('Loop images', IndiAllSkyDbImageTable, loop_images),
+            ('Chart data', IndiAllSkyDbImageTable, chart_data),
+            ('SQM data', IndiAllSkyDbImageTable, sqm_data),
+            ('Browse hours', IndiAllSkyDbImageTable, browse_hours),
+            ('Expire images', IndiAllSkyDbImageTable, expire_images),
+        ]
+
+
+        # end of night lookups for the other asset tables
+        for table in (
+            IndiAllSkyDbPanoramaImageTable,
+            IndiAllSkyDbFitsImageTable,
+            IndiAllSkyDbRawImageTable,
+            IndiAllSkyDbVideoTable,
+            IndiAllSkyDbKeogramTable,
+            IndiAllSkyDbStarTrailsTable,
+        ):
+            asset_query = table.query\
+                .join(table.camera)\
+                .filter(IndiAllSkyDbCameraTable.id == camera_id)\
+                .filter(table.dayDate == d_dayDate)\
+                .filter(table.night == sa_true())\
+                .order_by(table.createDate.asc())
+
+            query_list.append(('{0:s} day/night'.format(table.__tablename__), table, asset_query))
+
+
+        return query_list
+
+
+    def checkQuery(self, label, table, query):
+        start = time.time()
+        row_count = len(query.all())
+        elapsed_s = time.time() - start
 
 
-        YmdH_query_group_new = db.session.query(
-            IndiAllSkyDbImageTable.createDate_year,
-            IndiAllSkyDbImageTable.createDate_month,
-            IndiAllSkyDbImageTable.createDate_day,
-            IndiAllSkyDbImageTable.createDate_hour,
-        )\
-            .join(IndiAllSkyDbImageTable.camera)\
-            .filter(
-                and_(
-                    IndiAllSkyDbCameraTable.id == camera_id,
-                    IndiAllSkyDbImageTable.detections >= detections_count,
-                )
-        )\
-            .group_by(
-                IndiAllSkyDbImageTable.createDate_year,
-                IndiAllSkyDbImageTable.createDate_month,
-                IndiAllSkyDbImageTable.createDate_day,
-                IndiAllSkyDbImageTable.createDate_hour,
-        )\
-            .distinct()\
-            .order_by(
-                IndiAllSkyDbImageTable.createDate_year.desc(),
-                IndiAllSkyDbImageTable.createDate_month.desc(),
-                IndiAllSkyDbImageTable.createDate_day.desc(),
-                IndiAllSkyDbImageTable.createDate_hour.desc(),
-        )
+        plan_index, plan_detail = self.explain(table, self._last_statement, self._last_parameters)
 
+        passed = True
 
+        if not plan_index:
+            logger.error('%-24s no index used on %s: %s', label, table.__tablename__, plan_detail)
+            passed = False
 
+        if elapsed_s > self.budget_s:
+            logger.error('%-24s %0.4f s exceeds budget of %0.4f s', label, elapsed_s, self.budget_s)
+            passed = False
 
-        logger.info('Starting queries')
 
-        start = time.time()
-        logger.warning('Entries: %d', hours_query.count())
-        elapsed_s = time.time() - start
-        logger.info('Original SQL executed in %0.4f s', elapsed_s)
+        if passed:
+            logger.info('%-24s %0.4f s, %d rows, index %s', label, elapsed_s, row_count, plan_index)
 
-        #start_group = time.time()
-        #logger.warning('Entries: %d', hours_query_group.count())
-        #elapsed_s = time.time() - start_group
-        #logger.info('Original group SQL executed in %0.4f s', elapsed_s)
+        return passed
 
 
+    def explain(self, table, statement, parameters):
+        # returns the index used on the table (or None) and the plan details
+        dialect = db.engine.dialect.name
 
-        start_new = time.time()
-        logger.warning('Entries: %d', years_query_new.count())
-        elapsed_new = time.time() - start_new
-        logger.info('New Years SQL executed in %0.4f s', elapsed_new)
+        with db.engine.connect() as conn:
+            if dialect == 'sqlite':
+                plan = conn.exec_driver_sql('EXPLAIN QUERY PLAN {0:s}'.format(statement), parameters).fetchall()
+                return self._sqlitePlan(table, [row[3] for row in plan])
+            elif dialect in ('mysql', 'mariadb'):
+                result = conn.exec_driver_sql('EXPLAIN {0:s}'.format(statement), parameters)
+                plan = [dict(zip(result.keys(), row)) for row in result.fetchall()]
+                return self._mysqlPlan(table, plan)
 
-        start_new = time.time()
-        logger.warning('Entries: %d', months_query_new.count())
-        elapsed_new = time.time() - start_new
-        logger.info('New Months SQL executed in %0.4f s', elapsed_new)
 
-        start_new = time.time()
-        logger.warning('Entries: %d', days_query_new.count())
-        elapsed_new = time.time() - start_new
-        logger.info('New Days SQL executed in %0.4f s', elapsed_new)
+        raise Exception('Unsupported database: {0:s}'.format(dialect))
 
-        start_new = time.time()
-        logger.warning('Entries: %d', hours_query_new.count())
-        elapsed_new = time.time() - start_new
-        logger.info('New Hours SQL executed in %0.4f s', elapsed_new)
 
-        start_new = time.time()
-        logger.warning('Entries: %d', images_query_new.count())
-        elapsed_new = time.time() - start_new
-        logger.info('New Images SQL executed in %0.4f s', elapsed_new)
+    def _sqlitePlan(self, table, detail_list):
+        # SEARCH image USING INDEX idx_image_cdnec_ix (camera_id=? AND dayDate=? ...)
+        for detail in detail_list:
+            words = detail.replace(' TABLE ', ' ').split()
+            if len(words) < 2 or words[1] != table.__tablename__:
+                continue
 
+            if 'INDEX' in words:
+                return words[words.index('INDEX') + 1], detail
 
-        start_new = time.time()
-        logger.warning('Entries: %d', YmdH_query_group_new.count())
-        elapsed_new = time.time() - start_new
-        logger.info('New group SQL executed in %0.4f s', elapsed_new)
+            if 'PRIMARY' in words:
+                return 'PRIMARY', detail
 
 
-        #for i in hours_query:
-        #    #logger.info('attrs: %s', i.keys())
-        #    logger.info('%d %d %d %d', i.createDate_Y, i.createDate_m, i.createDate_d, i.createDate_H)
+        return None, '; '.join(detail_list)
 
 
-if __name__ == "__main__":
-    st = SqlTester()
-    st.main()
+    def _mysqlPlan(self, table, plan):
+        for row in plan:
+            if row.get('table') != table.__tablename__:
+                continue
+
+            if row.get('key') and row.get('type') != 'ALL':
+                return row['key'], str(row)
+
+            return None, str(row)
+
 
+        return None, str(plan)
+
+
+    def _captureStatement(self, conn, cursor, statement, parameters, context, executemany):
+        self._last_statement = statement
+        self._last_parameters = parameters
+
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument(
+        '--database',
+        help='SQLAlchemy database URI (default: temporary sqlite database)',
+        type=str,
+    )
+    argparser.add_argument(
+        '--days',
+        help='Days of data to seed',
+        type=int,
+        default=365,
+    )
+    argparser.add_argument(
+        '--images_per_day',
+        help='Images per day to seed',
+        type=int,
+        default=2880,
+    )
+    argparser.add_argument(
+        '--budget',
+        help='Latency budget per query in seconds',
+        type=float,
+        default=0.25,
+    )
+    argparser.add_argument(
+        '--no-seed',
+        help='Use the existing rows in the database',
+        dest='seed',
+        action='store_false',
+    )
+
+    args = argparser.parse_args()
+
+
+    if args.database:
+        database_uri = args.database
+    else:
+        tmp_db_dir = tempfile.TemporaryDirectory(suffix='_sql_perf_test')
+        database_uri = 'sqlite:///{0:s}'.format(str(Path(tmp_db_dir.name).joinpath('sql_perf_test.sqlite')))
+
+
+    st = SqlTester(database_uri)
+    st.days = args.days
+    st.images_per_day = args.images_per_day
+    st.budget_s = args.budget
+    st.seed = args.seed
+
+    sys.exit(st.main())
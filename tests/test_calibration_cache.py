@@ -0,0 +1,82 @@
+import os
+from types import SimpleNamespace
+
+import numpy
+
+from indi_allsky.calibrationCache import IndiAllSkyCalibrationCache
+
+
+def _dark(value, size=100):
+    # uint8, so nbytes == size * size
+    return numpy.full((size, size), value, dtype=numpy.uint8)
+
+
+def test_hit_and_miss_counters():
+    cache = IndiAllSkyCalibrationCache(max_bytes=1024 * 1024)
+
+    assert cache.get('a') is None
+    cache.put('a', _dark(1))
+
+    assert cache.get('a')[0, 0] == 1
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+
+def test_cached_data_is_read_only():
+    cache = IndiAllSkyCalibrationCache(max_bytes=1024 * 1024)
+    cache.put('a', _dark(1))
+
+    assert not cache.get('a').flags.writeable
+
+
+def test_lru_eviction_by_bytes():
+    cache = IndiAllSkyCalibrationCache(max_bytes=25000)
+
+    cache.put('a', _dark(1))
+    cache.put('b', _dark(2))
+    cache.get('a')  # b is now least recently used
+    cache.put('c', _dark(3))
+
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+    assert cache.evictions == 1
+    assert cache.cache_bytes == 20000
+
+
+def test_oversize_entry_is_not_cached():
+    cache = IndiAllSkyCalibrationCache(max_bytes=5000)
+    cache.put('a', _dark(1))
+
+    assert cache.get('a') is None
+    assert cache.cache_bytes == 0
+
+
+def test_generation_change_clears_cache():
+    cache = IndiAllSkyCalibrationCache(max_bytes=1024 * 1024)
+    cache.generation = 'gen1'
+    cache.put('a', _dark(1))
+
+    cache.generation = 'gen1'
+    assert cache.get('a') is not None
+
+    cache.generation = 'gen2'
+    assert cache.get('a') is None
+    assert cache.cache_bytes == 0
+
+
+def test_key_tracks_file_mtime(tmp_path):
+    p_dark = tmp_path.joinpath('dark.fit')
+    p_dark.write_bytes(b'x')
+    dark_entry = SimpleNamespace(id=5)
+
+    key_1 = IndiAllSkyCalibrationCache.buildKey(1, 1, dark_entry, p_dark)
+
+    stat = p_dark.stat()
+    os.utime(p_dark, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+
+    key_2 = IndiAllSkyCalibrationCache.buildKey(1, 1, dark_entry, p_dark)
+    key_3 = IndiAllSkyCalibrationCache.buildKey(1, 2, dark_entry, p_dark)
+
+    assert key_1 != key_2
+    assert key_2 != key_3
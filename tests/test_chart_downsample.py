@@ -0,0 +1,52 @@
+import numpy
+
+from indi_allsky.chartDownsample import IndiAllSkyChartDownsample
+
+
+def test_minmax_keeps_extremes():
+    ts_array = numpy.arange(1000, dtype=numpy.int64)
+
+    rng = numpy.random.default_rng(11)
+    column = rng.random(1000)
+    column[333] = 50.0
+    column[777] = -50.0
+    column[500] = numpy.nan
+
+    new_ts_array, new_column_list = IndiAllSkyChartDownsample.minmax(ts_array, [column, numpy.zeros(1000)], 100)
+
+    assert new_ts_array.shape[0] == 100
+    assert len(new_column_list) == 2
+
+    assert new_column_list[0].max() == 50.0
+    assert new_column_list[0].min() == -50.0
+    assert not numpy.isnan(new_column_list[0]).any()
+    assert not new_column_list[1].any()
+
+    # first and last timestamp of every bucket
+    assert list(new_ts_array[:4]) == [0, 19, 20, 39]
+    assert new_ts_array[-1] == 999
+
+
+def test_minmax_short_series_unchanged():
+    ts_array = numpy.arange(10)
+
+    new_ts_array, new_column_list = IndiAllSkyChartDownsample.minmax(ts_array, [ts_array * 2.0], 100)
+
+    assert list(new_ts_array) == list(ts_array)
+    assert list(new_column_list[0]) == list(ts_array * 2.0)
+
+
+def test_lttb_indices():
+    ts_array = numpy.arange(1000)
+    y_array = numpy.zeros(1000)
+    y_array[421] = 100.0
+
+    index_list = IndiAllSkyChartDownsample.lttbIndices(ts_array, y_array, 50)
+
+    assert len(index_list) == 50
+    assert index_list[0] == 0
+    assert index_list[-1] == 999
+    assert (numpy.diff(index_list) > 0).all()
+    assert 421 in index_list
+
+    assert len(IndiAllSkyChartDownsample.lttbIndices(ts_array[:20], y_array[:20], 50)) == 20
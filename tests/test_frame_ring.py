@@ -0,0 +1,53 @@
+import numpy
+import pytest
+from astropy.io import fits
+
+from indi_allsky.frameRing import IndiAllSkyFrameRing
+
+
+@pytest.fixture
+def frame_ring():
+    ring = IndiAllSkyFrameRing(2, 1024 * 1024)
+    yield ring
+    ring.close(unlink=True)
+
+
+def _hdulist(data):
+    hdu = fits.PrimaryHDU(data)
+    hdu.header['GAIN'] = 100.0
+    return fits.HDUList([hdu])
+
+
+def test_frame_roundtrip_without_copy(frame_ring):
+    data = numpy.arange(200 * 300, dtype=numpy.uint16).reshape(200, 300)
+    hdulist = _hdulist(data)
+
+    frame_dict = frame_ring.putFrame(hdulist[0].data, hdulist[0].header)
+    assert frame_dict['slot'] == 0
+
+    new_hdulist = frame_ring.getHdulist(frame_dict)
+
+    numpy.testing.assert_array_equal(new_hdulist[0].data, data)
+    assert new_hdulist[0].header['BITPIX'] == 16
+    assert new_hdulist[0].header['GAIN'] == 100.0
+    assert numpy.may_share_memory(new_hdulist[0].data, frame_ring.getFrameData(frame_dict))
+
+
+def test_slots_are_exhausted_and_released(frame_ring):
+    hdulist = _hdulist(numpy.zeros((10, 10), dtype=numpy.uint8))
+
+    frame_1 = frame_ring.putFrame(hdulist[0].data, hdulist[0].header)
+    frame_2 = frame_ring.putFrame(hdulist[0].data, hdulist[0].header)
+    assert frame_ring.putFrame(hdulist[0].data, hdulist[0].header) is None
+
+    frame_ring.release(frame_1['slot'])
+    frame_3 = frame_ring.putFrame(hdulist[0].data, hdulist[0].header)
+
+    assert frame_3['slot'] == frame_1['slot']
+    assert frame_2['slot'] != frame_3['slot']
+
+
+def test_oversize_frame_is_rejected(frame_ring):
+    hdulist = _hdulist(numpy.zeros((1024, 1024), dtype=numpy.uint16))
+
+    assert frame_ring.putFrame(hdulist[0].data, hdulist[0].header) is None
@@ -0,0 +1,48 @@
+import numpy
+
+from indi_allsky.imageHistogram import IndiAllSkyImageHistogram
+
+
+def test_calculate_matches_roi_histogram():
+    config = {
+        'SQM_ROI' : [20, 10, 60, 50],
+    }
+
+    rng = numpy.random.default_rng(5)
+    image = rng.integers(0, 256, (80, 100, 3), dtype=numpy.uint8)
+
+    histogram_data, stats_data = IndiAllSkyImageHistogram(config).calculate(image, 1)
+
+    assert set(histogram_data) == {'blue', 'green', 'red'}
+
+    for i, col in enumerate(('blue', 'green', 'red')):
+        expected = numpy.histogram(image[10:50, 20:60, i], bins=256, range=(0, 256))[0]
+        assert histogram_data[col] == expected.tolist()
+        assert stats_data[col]['median'] == stats_data[col]['p50']
+
+
+def test_calculate_mono_fov():
+    image = numpy.zeros((40, 40), dtype=numpy.uint8)
+    image[10:30, 10:30] = 200
+
+    histogram_data, stats_data = IndiAllSkyImageHistogram({}).calculate(image, 1)
+
+    assert list(histogram_data) == ['gray']
+    assert histogram_data['gray'][200] == 400
+    assert sum(histogram_data['gray']) == 400
+    assert stats_data['gray']['mean'] == 200
+
+
+def test_histogram_stats():
+    hist = numpy.zeros(256, dtype=numpy.int64)
+    hist[10] = 50
+    hist[100] = 50
+
+    stats = IndiAllSkyImageHistogram.histogramStats(hist)
+
+    assert stats['mean'] == 55
+    assert stats['p5'] == 10
+    assert stats['p50'] == 10
+    assert stats['p95'] == 100
+
+    assert IndiAllSkyImageHistogram.histogramStats(numpy.zeros(256)) == {}
@@ -0,0 +1,52 @@
+import cv2
+import numpy
+
+from indi_allsky.imagePrefetch import IndiAllSkyImagePrefetch
+
+
+def _write_png(path, value):
+    cv2.imwrite(str(path), numpy.full((10, 12, 3), value, dtype=numpy.uint8))
+    return path
+
+
+def test_images_are_returned_in_order(tmp_path):
+    items = [(i, _write_png(tmp_path.joinpath('{0:d}.png'.format(i)), i)) for i in range(20)]
+
+    prefetch = IndiAllSkyImagePrefetch(threads=4, queue_depth=3)
+    results = list(prefetch.iterate(items))
+
+    assert [r[0] for r in results] == list(range(20))
+    assert [int(r[2][0, 0, 0]) for r in results] == list(range(20))
+    assert prefetch.decode_count == 20
+
+
+def test_unreadable_images_are_skipped(tmp_path):
+    good_p = _write_png(tmp_path.joinpath('good.png'), 1)
+
+    empty_p = tmp_path.joinpath('empty.png')
+    empty_p.touch()
+
+    bad_p = tmp_path.joinpath('bad.png')
+    bad_p.write_bytes(b'not a png')
+
+    missing_p = tmp_path.joinpath('missing.png')
+
+    items = [('empty', empty_p), ('bad', bad_p), ('missing', missing_p), ('good', good_p)]
+
+    prefetch = IndiAllSkyImagePrefetch(threads=2, queue_depth=2)
+    results = list(prefetch.iterate(items))
+
+    assert [r[0] for r in results] == ['good']
+    assert results[0][3] == good_p.stat().st_mtime
+
+
+def test_consumer_stops_early(tmp_path):
+    items = [(i, _write_png(tmp_path.joinpath('{0:d}.png'.format(i)), i)) for i in range(10)]
+
+    prefetch = IndiAllSkyImagePrefetch(threads=2, queue_depth=4)
+
+    for key, _, _, _ in prefetch.iterate(items):
+        if key == 2:
+            break
+
+    assert prefetch.decode_count == 3
@@ -0,0 +1,49 @@
+import numpy
+import pytest
+
+from indi_allsky.keogram import KeogramColumnBuffer
+
+
+def _column(value, height=8):
+    return numpy.full((height, 1, 3), value, dtype=numpy.uint8)
+
+
+def test_buffer_grows_and_keeps_order():
+    buf = KeogramColumnBuffer(8, 3, numpy.uint8, initial_columns=2)
+
+    for i in range(5):
+        buf.append(_column(i))
+
+    assert buf.capacity == 8
+    assert buf.shape == (8, 5, 3)
+    assert list(buf.data[0, :, 0]) == [0, 1, 2, 3, 4]
+
+
+def test_ring_evicts_oldest_columns():
+    buf = KeogramColumnBuffer(8, 3, numpy.uint8, capacity=3)
+
+    for i in range(7):
+        buf.append(_column(i))
+
+    assert buf.shape == (8, 3, 3)
+    assert list(buf.data[0, :, 0]) == [4, 5, 6]
+
+    segments = buf.segments()
+    assert len(segments) == 2
+    assert list(numpy.concatenate(segments, axis=1)[0, :, 0]) == [4, 5, 6]
+
+
+def test_extend_keeps_newest_columns():
+    buf = KeogramColumnBuffer(8, 3, numpy.uint8, capacity=4)
+
+    data = numpy.concatenate([_column(i) for i in range(6)], axis=1)
+    buf.extend(data)
+
+    assert list(buf.data[0, :, 0]) == [2, 3, 4, 5]
+
+
+def test_height_mismatch_raises():
+    buf = KeogramColumnBuffer(8, 3, numpy.uint8)
+
+    with pytest.raises(ValueError):
+        buf.append(_column(1, height=9))
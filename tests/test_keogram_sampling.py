@@ -0,0 +1,51 @@
+import cv2
+import numpy
+import pytest
+
+from indi_allsky.keogram import KeogramGenerator
+
+
+def _center_line_rotated(kg, image):
+    # reference implementation, recenter and rotate the full image
+    height, width = image.shape[:2]
+    recenter_width = width + (abs(kg.x_offset) * 2)
+    recenter_height = height + (abs(kg.y_offset) * 2)
+
+    recenter_image = numpy.zeros([recenter_height, recenter_width, 3], dtype=numpy.uint8)
+    recenter_image[
+        int((recenter_height / 2) - (height / 2) + kg.y_offset):int((recenter_height / 2) + (height / 2) + kg.y_offset),
+        int((recenter_width / 2) - (width / 2) - kg.x_offset):int((recenter_width / 2) + (width / 2) - kg.x_offset),
+    ] = image
+
+    rotated_image = kg.rotate(recenter_image)
+    return rotated_image[:, [int(rotated_image.shape[1] / 2)]]
+
+
+@pytest.mark.parametrize('angle', [0.0, 17.3, 90.0, -130.0])
+@pytest.mark.parametrize('offsets', [(0, 0), (13, -7)])
+def test_sampling_map_matches_rotation(angle, offsets):
+    rng = numpy.random.default_rng(0)
+    image = cv2.GaussianBlur(rng.integers(0, 255, (101, 150, 3), dtype=numpy.uint8), (0, 0), 2)
+
+    kg = KeogramGenerator({'KEOGRAM_ANGLE': angle})
+    kg.x_offset, kg.y_offset = offsets
+    kg.processImage(image, 0)
+
+    expected = _center_line_rotated(kg, image)
+
+    assert kg.keogram_data.shape == expected.shape
+    assert numpy.abs(kg.keogram_data.astype(numpy.int16) - expected.astype(numpy.int16)).max() <= 1
+
+
+def test_sampling_map_rebuilt_on_geometry_change():
+    image = numpy.zeros((50, 80, 3), dtype=numpy.uint8)
+
+    kg = KeogramGenerator({'KEOGRAM_ANGLE': 0.0})
+    kg.processImage(image, 0)
+    assert kg.rotated_height == 50
+
+    kg.angle = 90.0
+    kg.keogram_data = None
+    kg.processImage(image, 1)
+    assert kg.rotated_height == 80
+    assert kg.keogram_data.shape == (80, 1, 3)
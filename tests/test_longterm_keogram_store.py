@@ -0,0 +1,84 @@
+import numpy
+import pytest
+
+from indi_allsky.longTermKeogramStore import LongTermKeogramStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LongTermKeogramStore({'VARLIB_FOLDER': str(tmp_path)})
+
+
+def _pixels(value):
+    return [[value, value + 1, value + 2]] * LongTermKeogramStore.pixels
+
+
+def test_add_averages_slot(store):
+    ts = 1700000000  # multiple of the grid
+
+    store.add(1, ts, _pixels(10))
+    store.add(1, ts + 1, _pixels(20))
+    store.close()
+
+    data = store.read(1, ts // store.grid_seconds, 2)
+    assert list(data[0]) == [15, 16, 17] * store.pixels + [2]
+    assert not data[1].any()
+
+
+def test_read_spans_days(store):
+    day_start = 19000 * 86400
+
+    store.add(1, day_start - store.grid_seconds, _pixels(1))
+    store.add(1, day_start, _pixels(2))
+    store.close()
+
+    assert len(list(store.cameraFolder(1).iterdir())) == 2
+
+    data = store.read(1, (day_start // store.grid_seconds) - 1, 2)
+    assert data[0][0] == 1
+    assert data[1][0] == 2
+
+    assert store.firstTimestamp(1) == day_start - store.grid_seconds
+    assert store.firstTimestamp(2) is None
+
+
+def test_add_many_matches_add(store, tmp_path):
+    rng = numpy.random.default_rng(3)
+
+    ts_array = numpy.sort(rng.integers(1700000000, 1700000000 + 3 * 86400, 500))
+    pixel_array = rng.integers(0, 256, (500, store.pixels, 3))
+
+    store.addMany(1, ts_array, pixel_array)
+    store.close()
+
+    start_slot = 1700000000 // store.grid_seconds
+    data = store.read(1, start_slot, 4 * store.slots_per_day)
+
+    slots = (ts_array // store.grid_seconds) - start_slot
+    for slot in numpy.unique(slots):
+        expected = pixel_array[slots == slot].reshape((-1, store.pixels * 3)).sum(axis=0) // (slots == slot).sum()
+        assert list(data[slot][:-1]) == list(expected)
+        assert data[slot][-1] == (slots == slot).sum()
+
+    assert data[:, -1].sum() == 500
+
+
+def test_merge_camera(store):
+    day_start = 19000 * 86400
+
+    store.add(1, day_start, _pixels(10))
+    store.add(1, day_start + 86400, _pixels(30))
+    store.add(2, day_start, _pixels(20))
+    store.add(2, day_start + store.grid_seconds, _pixels(40))
+    store.close()
+
+    assert store.mergeCamera(1, 2) == 2
+    assert not store.cameraFolder(1).exists()
+    assert store.mergeCamera(1, 2) == 0
+
+    data = store.read(2, day_start // store.grid_seconds, 2)
+    assert list(data[0]) == [15, 16, 17] * store.pixels + [2]
+    assert list(data[1]) == [40, 41, 42] * store.pixels + [1]
+
+    data = store.read(2, (day_start + 86400) // store.grid_seconds, 1)
+    assert list(data[0]) == [30, 31, 32] * store.pixels + [1]
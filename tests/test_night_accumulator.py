@@ -0,0 +1,113 @@
+from datetime import date
+from types import SimpleNamespace
+
+import numpy
+import pytest
+
+from indi_allsky.nightAccumulator import IndiAllSkyNightAccumulator
+
+
+@pytest.fixture
+def config(tmp_path):
+    return {
+        'IMAGE_FOLDER'                : str(tmp_path.joinpath('images')),
+        'VARLIB_FOLDER'               : str(tmp_path),
+        'TIMELAPSE_SKIP_FRAMES'       : 2,
+        'KEOGRAM_ANGLE'               : 0.0,
+        'STARTRAILS_MAX_ADU'          : 255,
+        'STARTRAILS_MASK_THOLD'       : 255,
+        'STARTRAILS_PIXEL_THOLD'      : 100.0,
+        'STARTRAILS_SUN_ALT_THOLD'    : 90.0,
+        'STARTRAILS_MOONMODE_THOLD'   : False,
+        'STARTRAILS_MOON_ALT_THOLD'   : 91.0,
+        'STARTRAILS_MOON_PHASE_THOLD' : 101.0,
+        'IMAGE_FILE_TYPE'             : 'png',
+        'IMAGE_FILE_COMPRESSION'      : {'png': 1},
+    }
+
+
+CAMERA = SimpleNamespace(id=1, latitude=33.0, longitude=-84.0)
+DAY_DATE = date(2024, 1, 1)
+
+
+def _frames(tmp_path, count, seed=0):
+    rng = numpy.random.default_rng(seed)
+
+    image_file_p = tmp_path.joinpath('image.jpg')
+    image_file_p.write_bytes(b'x')
+
+    for i in range(count):
+        yield rng.integers(0, 100, (20, 30, 3), dtype=numpy.uint8), image_file_p
+
+
+def _add(accumulator, frames, start_ts):
+    for i, (image, image_file_p) in enumerate(frames):
+        accumulator.add(image, image_file_p, 1, start_ts + i, adu=10.0, star_count=0)
+
+
+def test_checkpoint_resume_matches_continuous(config, tmp_path):
+    frames = list(_frames(tmp_path, 12))
+
+    continuous = IndiAllSkyNightAccumulator(config, CAMERA, DAY_DATE, True, mask={1: None})
+    _add(continuous, frames, 1000)
+
+    partial = IndiAllSkyNightAccumulator(config, CAMERA, DAY_DATE, True, mask={1: None})
+    _add(partial, frames[:7], 1000)
+    partial.checkpoint()
+
+    resumed = IndiAllSkyNightAccumulator.load(config, CAMERA, DAY_DATE, True, mask={1: None})
+    assert resumed.frame_count == 7
+    assert resumed.last_create_ts == 1006
+
+    _add(resumed, frames[7:], 1007)
+
+    numpy.testing.assert_array_equal(
+        resumed.keogram_generator.keogram_data,
+        continuous.keogram_generator.keogram_data,
+    )
+    assert list(resumed.keogram_generator.timestamps) == list(continuous.keogram_generator.timestamps)
+
+    numpy.testing.assert_array_equal(
+        resumed.startrail_generator.trail_image,
+        continuous.startrail_generator.trail_image,
+    )
+    assert resumed.startrail_generator.trail_count == continuous.startrail_generator.trail_count
+    assert resumed.startrail_generator.excluded_images == continuous.startrail_generator.excluded_images
+
+    # star trail timelapse frames before the checkpoint are not regenerated
+    resumed_frame_list = resumed.startrail_generator.timelapse_frame_list
+    assert resumed.startrail_generator.timelapse_frame_count == continuous.startrail_generator.timelapse_frame_count
+    assert len(resumed_frame_list) == len(continuous.startrail_generator.timelapse_frame_list)
+    assert all(p.parent == resumed.startrail_generator.timelapse_frame_folder for p in resumed_frame_list)
+    assert resumed_frame_list[:5] == partial.startrail_generator.timelapse_frame_list
+
+
+def test_missing_timelapse_frame_invalidates_checkpoint(config, tmp_path):
+    accumulator = IndiAllSkyNightAccumulator(config, CAMERA, DAY_DATE, True, mask={1: None})
+    _add(accumulator, _frames(tmp_path, 5), 1000)
+    accumulator.checkpoint()
+
+    assert IndiAllSkyNightAccumulator.load(config, CAMERA, DAY_DATE, True, mask={1: None}) is not None
+
+    accumulator.startrail_generator.timelapse_frame_list[0].unlink()
+    assert IndiAllSkyNightAccumulator.load(config, CAMERA, DAY_DATE, True, mask={1: None}) is None
+
+
+def test_config_change_invalidates_checkpoint(config, tmp_path):
+    accumulator = IndiAllSkyNightAccumulator(config, CAMERA, DAY_DATE, False)
+    _add(accumulator, _frames(tmp_path, 5), 1000)
+    accumulator.checkpoint()
+
+    assert IndiAllSkyNightAccumulator.load(config, CAMERA, DAY_DATE, False) is not None
+
+    config['KEOGRAM_ANGLE'] = 45.0
+    assert IndiAllSkyNightAccumulator.load(config, CAMERA, DAY_DATE, False) is None
+
+
+def test_checkpoint_is_per_night(config, tmp_path):
+    accumulator = IndiAllSkyNightAccumulator(config, CAMERA, DAY_DATE, True, mask={1: None})
+    _add(accumulator, _frames(tmp_path, 5), 1000)
+    accumulator.checkpoint()
+
+    assert IndiAllSkyNightAccumulator.load(config, CAMERA, DAY_DATE, False) is None
+    assert IndiAllSkyNightAccumulator.load(config, CAMERA, date(2024, 1, 2), True, mask={1: None}) is None
@@ -0,0 +1,54 @@
+import random
+
+from indi_allsky.rollingWindow import IndiAllSkyRollingWindow
+from indi_allsky.rollingWindow import IndiAllSkyImageStats
+
+
+def test_rolling_window_matches_brute_force():
+    rng = random.Random(7)
+
+    window = IndiAllSkyRollingWindow(60)
+
+    history = list()
+    ts = 1000.0
+    for _ in range(500):
+        ts += rng.choice((0.0, 5.0, 15.0, 45.0))
+        value = rng.randint(0, 20)
+
+        window.add(ts, value)
+        history.append((ts, value))
+
+        in_window = [v for t, v in history if t > ts - 60]
+
+        summary = window.summary(ts)
+        assert summary['max'] == max(in_window)
+        assert summary['min'] == min(in_window)
+        assert abs(summary['avg'] - sum(in_window) / len(in_window)) < 1e-9
+        assert summary['last'] == value
+        assert window.count == len(in_window)
+
+
+def test_rolling_window_expires_to_empty():
+    window = IndiAllSkyRollingWindow(30)
+    window.add(100, 5.0)
+    window.add(110, None)  # ignored
+
+    assert window.count == 1
+
+    summary = window.summary(130)
+    assert summary['max'] is None
+    assert summary['avg'] is None
+    assert window.count == 0
+
+
+def test_image_stats_sensor_metrics():
+    image_stats = IndiAllSkyImageStats(1800)
+    image_stats.add(100, 20.5, 10, {'sensor_user_8': 19.0})
+    image_stats.add(160, 21.5, 30, {})
+
+    summary = image_stats.summary(200)
+    assert summary['window_s'] == 1800
+    assert summary['sqm'] == {'max': 21.5, 'min': 20.5, 'avg': 21.0, 'last': 21.5}
+    assert summary['stars']['avg'] == 20
+    assert summary['camera_sqm_mag']['max'] == 19.0
+    assert summary['camera_sqm_mag']['last'] == 0.0
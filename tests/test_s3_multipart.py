@@ -0,0 +1,154 @@
+import io
+import os
+
+import pytest
+
+from indi_allsky.filetransfer.multipart import MultipartState
+from indi_allsky.filetransfer.multipart import Boto3MultipartUpload
+
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def local_file(tmp_path):
+    local_file_p = tmp_path.joinpath('timelapse.mp4')
+
+    with io.open(str(local_file_p), 'wb') as f_local:
+        f_local.write(os.urandom(12 * MB))
+
+    return local_file_p
+
+
+def test_part_list(tmp_path, local_file):
+    state = MultipartState(tmp_path.joinpath('state'), local_file, 'bucket', 'key', 1)
+
+    # minimum part size is enforced
+    assert state.part_size == MultipartState.min_part_size
+
+    part_list = state.partList()
+    assert [p[0] for p in part_list] == [1, 2, 3]
+    assert part_list[-1] == (3, 10 * MB, 2 * MB)
+    assert sum(p[2] for p in part_list) == 12 * MB
+
+
+def test_state_persisted(tmp_path, local_file):
+    state_dir = tmp_path.joinpath('state')
+
+    state = MultipartState(state_dir, local_file, 'bucket', 'key', 5 * MB)
+    assert not state.load()
+
+    state.start('upload-1')
+    state.addPart(2, '"etag2"')
+
+
+    resumed_state = MultipartState(state_dir, local_file, 'bucket', 'key', 5 * MB)
+    assert resumed_state.load()
+    assert resumed_state.upload_id == 'upload-1'
+    assert [p[0] for p in resumed_state.pendingParts()] == [1, 3]
+
+    # different key does not share state
+    assert not MultipartState(state_dir, local_file, 'bucket', 'other', 5 * MB).load()
+
+    resumed_state.remove()
+    assert not state.load()
+
+
+def test_boto3_resume(tmp_path, local_file):
+    pytest.importorskip('moto')
+    import boto3
+    from moto import mock_aws
+
+
+    class flaky_client(object):
+        # fails a single part to simulate a dropped uplink
+        def __init__(self, client, fail_part):
+            self.client = client
+            self.fail_part = fail_part
+            self.uploaded_parts = list()
+
+        def __getattr__(self, name):
+            return getattr(self.client, name)
+
+        def upload_part(self, **kwargs):
+            if kwargs['PartNumber'] == self.fail_part:
+                raise ConnectionError('uplink dropped')
+
+            self.uploaded_parts.append(kwargs['PartNumber'])
+            return self.client.upload_part(**kwargs)
+
+
+    state_dir = tmp_path.joinpath('state')
+
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket='allsky')
+
+
+        client_1 = flaky_client(client, 2)
+        state = MultipartState(state_dir, local_file, 'allsky', 'videos/timelapse.mp4', 5 * MB)
+
+        with pytest.raises(ConnectionError):
+            Boto3MultipartUpload(client_1, state, concurrency=1).upload('allsky', 'videos/timelapse.mp4', {'ContentType' : 'video/mp4'})
+
+        assert state.state_file.exists()
+
+
+        # resumed upload only sends the missing parts
+        client_2 = flaky_client(client, None)
+        state = MultipartState(state_dir, local_file, 'allsky', 'videos/timelapse.mp4', 5 * MB)
+        Boto3MultipartUpload(client_2, state, concurrency=2).upload('allsky', 'videos/timelapse.mp4', {'ContentType' : 'video/mp4'})
+
+        assert 2 in client_2.uploaded_parts
+        assert 1 not in client_2.uploaded_parts
+        assert not state.state_file.exists()
+
+
+        r = client.get_object(Bucket='allsky', Key='videos/timelapse.mp4')
+        assert r['ContentType'] == 'video/mp4'
+        assert r['Body'].read() == local_file.read_bytes()
+
+
+def test_boto3_aborts_stale_upload(tmp_path, local_file):
+    pytest.importorskip('moto')
+    import boto3
+    from moto import mock_aws
+
+
+    state_dir = tmp_path.joinpath('state')
+
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket='allsky')
+
+
+        # interrupted upload, then the local file is modified
+        r = client.create_multipart_upload(Bucket='allsky', Key='videos/timelapse.mp4')
+        old_state = MultipartState(state_dir, local_file, 'allsky', 'videos/timelapse.mp4', 5 * MB)
+        old_state.start(r['UploadId'])
+
+        os.utime(local_file, times=(1000, 1000))
+
+
+        state = MultipartState(state_dir, local_file, 'allsky', 'videos/timelapse.mp4', 5 * MB)
+        assert state.state_file != old_state.state_file
+        assert [s[1]['upload_id'] for s in state.staleStates()] == [r['UploadId']]
+
+        Boto3MultipartUpload(client, state, concurrency=2).upload('allsky', 'videos/timelapse.mp4', {})
+
+        assert not old_state.state_file.exists()
+        assert client.list_multipart_uploads(Bucket='allsky').get('Uploads', []) == []
+
+
+def test_expired_state_is_aborted(tmp_path, local_file):
+    state_dir = tmp_path.joinpath('state')
+
+    state = MultipartState(state_dir, local_file, 'allsky', 'key', 5 * MB)
+    state.start('upload-1')
+    os.utime(state.state_file, times=(1000, 1000))
+
+    aborted = list()
+    MultipartState.expireStateFiles(state_dir, abort_upload=lambda *args: aborted.append(args))
+
+    assert aborted == [('allsky', 'key', 'upload-1')]
+    assert not state.state_file.exists()
@@ -0,0 +1,98 @@
+from datetime import datetime
+from datetime import timedelta
+from types import SimpleNamespace
+
+import numpy
+
+from indi_allsky.stack import IndiAllskyStacker
+
+
+def _frame(data, exp_date):
+    return SimpleNamespace(
+        opencv_data=data,
+        exp_date=exp_date,
+        registration_transform=None,
+        registration_reference_date=None,
+    )
+
+
+def _stacker():
+    return IndiAllskyStacker({}, mask={1: None})
+
+
+def test_average_running_matches_average():
+    stacker = _stacker()
+    rng = numpy.random.default_rng(0)
+    now = datetime(2024, 1, 1)
+
+    frames = [_frame(rng.integers(0, 65535, (20, 30), dtype=numpy.uint16), now + timedelta(seconds=i)) for i in range(8)]
+
+    stack_count = 3
+    image_list = list()
+    for f in frames:
+        image_list.insert(0, f)
+        del image_list[stack_count:]
+
+        expected = stacker.average([x.opencv_data for x in image_list], numpy.uint16)
+        result = stacker.average_running(image_list, numpy.uint16)
+
+        numpy.testing.assert_array_equal(result, expected)
+
+
+def test_average_running_reset_on_shape_change():
+    stacker = _stacker()
+    now = datetime(2024, 1, 1)
+
+    a = _frame(numpy.full((10, 10), 10, dtype=numpy.uint8), now)
+    b = _frame(numpy.full((10, 10), 20, dtype=numpy.uint8), now)
+    stacker.average_running([b, a], numpy.uint8)
+
+    c = _frame(numpy.full((5, 5), 30, dtype=numpy.uint8), now)
+    d = _frame(numpy.full((5, 5), 50, dtype=numpy.uint8), now)
+    result = stacker.average_running([d, c], numpy.uint8)
+
+    assert result.shape == (5, 5)
+    assert result[0, 0] == 40
+
+
+def test_register_incremental_composes_cached_transforms():
+    stacker = _stacker()
+    now = datetime(2024, 1, 1)
+
+    base = numpy.zeros((40, 40), dtype=numpy.uint16)
+    base[20, 10] = 1000
+
+    # each newer frame is shifted one pixel to the right
+    frames = list()
+    for i in range(3):
+        data = numpy.roll(base, i, axis=1)
+        frames.insert(0, _frame(data, now + timedelta(seconds=i)))
+
+    shift = numpy.identity(3)
+    shift[0, 2] = 1.0  # previous -> newer
+
+    for newer, older in zip(frames[:-1], frames[1:]):
+        newer.registration_transform = shift
+        newer.registration_reference_date = older.exp_date
+
+    # newest frame is already registered, so no alignment is performed
+    reg_data_list = stacker.register_incremental(frames, 1)
+
+    assert len(reg_data_list) == 3
+    for reg_data in reg_data_list:
+        assert reg_data[20, 12] == 1000
+
+
+def test_register_incremental_stops_at_broken_chain():
+    stacker = _stacker()
+    now = datetime(2024, 1, 1)
+
+    frames = [_frame(numpy.zeros((10, 10), dtype=numpy.uint8), now + timedelta(seconds=2 - i)) for i in range(3)]
+
+    frames[0].registration_transform = numpy.identity(3)
+    frames[0].registration_reference_date = frames[1].exp_date
+    # frames[1] was never registered against frames[2]
+
+    reg_data_list = stacker.register_incremental(frames, 1)
+
+    assert len(reg_data_list) == 2
@@ -0,0 +1,77 @@
+import json
+import hmac
+import hashlib
+import math
+import time
+
+from indi_allsky import constants
+from indi_allsky.filetransfer import requests_syncapi_v1
+
+
+class fake_response(object):
+    status_code = 200
+
+    def __init__(self, text):
+        self.text = text
+
+
+class fake_session(object):
+    def __init__(self):
+        self.request_list = list()
+
+    def put(self, url, data=None, headers=None, **kwargs):
+        # files are closed after the request
+        json_metadata = data.fields['metadata'][1].getvalue()
+
+        self.request_list.append((url, data.fields, json_metadata, headers))
+
+        return fake_response(json.dumps({'items' : [{'id' : 1}, {'id' : 2}]}))
+
+    def close(self):
+        pass
+
+
+def test_batch_request(tmp_path):
+    file_list = list()
+    for i in range(2):
+        local_file_p = tmp_path.joinpath('image_{0:d}.jpg'.format(i))
+        local_file_p.write_bytes(b'x' * (100 + i))
+        file_list.append(local_file_p)
+
+
+    client = requests_syncapi_v1({})
+    client.connect(hostname='https://example.com/indi-allsky/sync/v1/batch', username='user', apikey='key')
+    client.client = fake_session()
+
+    batch = {
+        'camera_uuid' : 'uuid-1',
+        'utc_offset'  : 0,
+        'items'       : [({'type' : constants.IMAGE, 'createDate' : i}, f) for i, f in enumerate(file_list)],
+    }
+
+    response = client.put(batch=batch, empty_file=False)
+    assert response == {'items' : [{'id' : 1}, {'id' : 2}]}
+
+
+    # one request for the batch
+    assert len(client.client.request_list) == 1
+    url, fields, json_metadata, headers = client.client.request_list[0]
+
+    assert list(fields.keys()) == ['metadata', 'media_0', 'media_1']
+    assert fields['media_1'][0] == 'image_1.jpg'
+
+
+    batch_metadata = json.loads(json_metadata)
+    assert batch_metadata['camera_uuid'] == 'uuid-1'
+    assert [item['media'] for item in batch_metadata['items']] == ['media_0', 'media_1']
+    assert [item['file_size'] for item in batch_metadata['items']] == [100, 101]
+
+
+    # authentication covers the whole batch
+    message_hmac = hmac.new(
+        b'key',
+        msg=str(math.floor(time.time() / client.time_skew)).encode() + json_metadata.encode(),
+        digestmod=hashlib.sha3_512,
+    ).hexdigest()
+
+    assert headers['Authorization'] == 'Bearer user:{0:s}'.format(message_hmac)
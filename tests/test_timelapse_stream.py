@@ -0,0 +1,138 @@
+import os
+import sys
+
+import cv2
+import numpy
+import pytest
+
+from indi_allsky.timelapse import TimelapseGenerator
+from indi_allsky.exceptions import TimelapseException
+
+
+FAKE_FFMPEG = '''#!{python}
+import sys
+data = sys.stdin.buffer.read()
+if {fail}:
+    sys.exit(1)
+with open(sys.argv[-1], 'w') as f_out:
+    f_out.write(' '.join(sys.argv[1:-1]) + '\\n')
+    f_out.write(str(len(data)))
+'''
+
+
+def _generator(tmp_path, fail=False):
+    ffmpeg_p = tmp_path.joinpath('ffmpeg')
+    ffmpeg_p.write_text(FAKE_FFMPEG.format(python=sys.executable, fail=fail))
+    ffmpeg_p.chmod(0o755)
+
+    tg = TimelapseGenerator({'IMAGE_FOLDER': str(tmp_path)})
+    tg.ffmpeg_bin = str(ffmpeg_p)
+    tg.framerate = 30
+    return tg
+
+
+def test_raw_frames_are_streamed(tmp_path):
+    tg = _generator(tmp_path)
+    video_p = tmp_path.joinpath('out.mp4')
+
+    tg.openStream(video_p, 40, 30)
+    for i in range(5):
+        tg.writeFrame(numpy.full((30, 40, 3), i, dtype=numpy.uint8))
+    tg.closeStream()
+
+    args, size = video_p.read_text().split('\n')
+    assert '-f rawvideo -pix_fmt bgr24 -s 40x30 -r 30.00 -i pipe:0' in args
+    assert int(size) == 5 * 30 * 40 * 3
+    assert tg.stream_frame_count == 5
+    assert not tg.streaming
+
+
+def test_failed_stream_raises(tmp_path):
+    tg = _generator(tmp_path, fail=True)
+
+    tg.openStream(tmp_path.joinpath('out.mp4'), 4, 4, channels=1)
+    tg.writeFrame(numpy.zeros((4, 4), dtype=numpy.uint8))
+
+    with pytest.raises(TimelapseException):
+        tg.closeStream()
+
+
+def test_abort_removes_video(tmp_path):
+    tg = _generator(tmp_path)
+    video_p = tmp_path.joinpath('out.mp4')
+
+    tg.openStream(video_p, 4, 4)
+    video_p.touch()
+    tg.abortStream()
+
+    assert not video_p.exists()
+    assert not tg.streaming
+
+
+def test_generate_pipes_preprocessed_frames(tmp_path):
+    tg = _generator(tmp_path)
+    tg.pipe = True
+
+    file_list = list()
+    for i in range(4):
+        if i == 2:
+            shape = (20, 20, 3)  # mismatched frame is skipped
+        else:
+            shape = (30, 40, 3)
+
+        image_p = tmp_path.joinpath('{0:d}.png'.format(i))
+        cv2.imwrite(str(image_p), numpy.full(shape, i, dtype=numpy.uint8))
+        os.utime(image_p, times=(1000 + i, 1000 + i))
+        file_list.append(image_p)
+
+    video_p = tmp_path.joinpath('out.mp4')
+    tg.generate(video_p, reversed(file_list))
+
+    args, size = video_p.read_text().split('\n')
+    assert '-s 40x30' in args
+    assert int(size) == 3 * 30 * 40 * 3
+
+
+def test_generate_without_frames_raises(tmp_path):
+    tg = _generator(tmp_path)
+    tg.pipe = True
+
+    bad_p = tmp_path.joinpath('bad.png')
+    bad_p.write_bytes(b'not a png')
+
+    with pytest.raises(TimelapseException):
+        tg.generate(tmp_path.joinpath('out.mp4'), [bad_p])
+
+
+def test_stream_frame_skips_leading_frames(tmp_path):
+    tg = _generator(tmp_path)
+    tg.skip_frames = 2
+    video_p = tmp_path.joinpath('out.mp4')
+
+    for i in range(5):
+        tg.streamFrame(video_p, numpy.full((4, 6, 3), i, dtype=numpy.uint8))
+    tg.closeStream()
+
+    _, size = video_p.read_text().split('\n')
+    assert int(size) == 3 * 4 * 6 * 3
+
+
+def test_generate_keeps_caller_order(tmp_path):
+    tg = _generator(tmp_path)
+    tg.pipe = True
+
+    file_list = list()
+    for i, shape in enumerate(((20, 20, 3), (30, 40, 3), (30, 40, 3))):
+        image_p = tmp_path.joinpath('{0:d}.png'.format(i))
+        cv2.imwrite(str(image_p), numpy.full(shape, i, dtype=numpy.uint8))
+        os.utime(image_p, times=(2000 - i, 2000 - i))  # newest first
+        file_list.append(image_p)
+
+    # the first frame sets the stream dimensions
+    video_p = tmp_path.joinpath('out.mp4')
+    tg.generate(video_p, file_list, sort=False)
+    assert '-s 20x20' in video_p.read_text().split('\n')[0]
+
+    video_p = tmp_path.joinpath('sorted.mp4')
+    tg.generate(video_p, file_list)
+    assert '-s 40x30' in video_p.read_text().split('\n')[0]
@@ -0,0 +1,128 @@
+import pytest
+
+from indi_allsky.uploadPool import IndiAllSkyUploadConnectionPool
+from indi_allsky.filetransfer.generic import GenericFileTransfer
+from indi_allsky.filetransfer.exceptions import ConnectionFailure
+from indi_allsky.filetransfer.exceptions import TransferFailure
+
+
+class fake_transfer(GenericFileTransfer):
+    instance_list = list()
+
+    def __init__(self, *args, **kwargs):
+        super(fake_transfer, self).__init__(*args, **kwargs)
+
+        self.connected = False
+        self.connect_count = 0
+        self.put_list = list()
+        self.fail_put = None
+
+        self.instance_list.append(self)
+
+
+    def connect(self, *args, **kwargs):
+        self.connected = True
+        self.connect_count += 1
+
+
+    def close(self):
+        self.connected = False
+
+
+    def isConnected(self):
+        return self.connected
+
+
+    def put(self, *args, **kwargs):
+        if self.fail_put:
+            e = self.fail_put
+            self.fail_put = None
+            raise e
+
+        self.put_list.append(kwargs['local_file'])
+
+        return {'id' : len(self.put_list)}
+
+
+
+@pytest.fixture
+def transfer_class():
+    fake_transfer.instance_list = list()
+    return fake_transfer
+
+
+def test_connection_reused(transfer_class):
+    pool = IndiAllSkyUploadConnectionPool({})
+
+    for i in range(3):
+        response = pool.transfer(transfer_class, {'hostname' : 'a'}, {'local_file' : i}, client_attrs={'port' : 22})
+
+    assert response == {'id' : 3}
+    assert len(transfer_class.instance_list) == 1
+    assert transfer_class.instance_list[0].connect_count == 1
+    assert transfer_class.instance_list[0].port == 22
+
+    # different parameters use a separate connection
+    pool.transfer(transfer_class, {'hostname' : 'b'}, {'local_file' : 4})
+    assert len(transfer_class.instance_list) == 2
+    assert len(pool) == 2
+
+    pool.closeAll()
+    assert len(pool) == 0
+    assert not any(c.connected for c in transfer_class.instance_list)
+
+
+def test_reconnect_after_failure(transfer_class):
+    pool = IndiAllSkyUploadConnectionPool({})
+
+    pool.transfer(transfer_class, {'hostname' : 'a'}, {'local_file' : 1})
+    first_client = transfer_class.instance_list[0]
+
+    # server dropped the connection
+    first_client.fail_put = ConnectionFailure('reset')
+    pool.transfer(transfer_class, {'hostname' : 'a'}, {'local_file' : 2})
+
+    assert not first_client.connected
+    assert len(transfer_class.instance_list) == 2
+    assert transfer_class.instance_list[1].put_list == [2]
+
+
+    # failed health check
+    transfer_class.instance_list[1].connected = False
+    pool.transfer(transfer_class, {'hostname' : 'a'}, {'local_file' : 3})
+    assert len(transfer_class.instance_list) == 3
+
+
+def test_failure_not_retried(transfer_class):
+    pool = IndiAllSkyUploadConnectionPool({})
+
+    pool.transfer(transfer_class, {'hostname' : 'a'}, {'local_file' : 1})
+    transfer_class.instance_list[0].fail_put = TransferFailure('denied')
+
+    with pytest.raises(TransferFailure):
+        pool.transfer(transfer_class, {'hostname' : 'a'}, {'local_file' : 2})
+
+    assert len(pool) == 0
+    assert not transfer_class.instance_list[0].connected
+
+
+def test_idle_timeout(transfer_class):
+    pool = IndiAllSkyUploadConnectionPool({'UPLOAD_CONNECTION_IDLE_TIMEOUT' : 0})
+
+    pool.transfer(transfer_class, {'hostname' : 'a'}, {'local_file' : 1})
+    assert len(pool) == 0
+    assert not transfer_class.instance_list[0].connected
+
+
+    pool = IndiAllSkyUploadConnectionPool({'UPLOAD_CONNECTION_IDLE_TIMEOUT' : 60})
+    pool.transfer(transfer_class, {'hostname' : 'a'}, {'local_file' : 1})
+
+    pool.expire()
+    assert len(pool) == 1
+
+    for client_entry in pool._client_dict.values():
+        client_entry['last_used'] -= 61
+
+    pool.expire()
+    assert len(pool) == 0
+    assert not transfer_class.instance_list[1].connected
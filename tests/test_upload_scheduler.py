@@ -0,0 +1,127 @@
+import threading
+
+from indi_allsky import constants
+from indi_allsky.uploadScheduler import IndiAllSkyUploadScheduler
+
+
+def test_task_priority():
+    image_data = {'action' : constants.TRANSFER_UPLOAD, 'model' : 'IndiAllSkyDbImageTable', 'id' : 1}
+    video_data = {'action' : constants.TRANSFER_UPLOAD, 'model' : 'IndiAllSkyDbVideoTable', 'id' : 1}
+    youtube_data = {'action' : constants.TRANSFER_YOUTUBE, 'model' : 'IndiAllSkyDbVideoTable', 'id' : 1}
+    mqtt_data = {'action' : constants.TRANSFER_MQTT, 'local_file' : '/nonexistent'}
+
+    assert IndiAllSkyUploadScheduler.taskPriority(image_data) < IndiAllSkyUploadScheduler.taskPriority(video_data)
+    assert IndiAllSkyUploadScheduler.taskPriority(youtube_data) == IndiAllSkyUploadScheduler.priority_bulk
+    assert IndiAllSkyUploadScheduler.taskPriority(mqtt_data) == IndiAllSkyUploadScheduler.priority_latest
+
+    # task priority is used when defined
+    assert IndiAllSkyUploadScheduler.taskPriority(video_data, priority=1) == 1
+
+
+def test_camera_before_images():
+    scheduler = IndiAllSkyUploadScheduler({})
+
+    camera_data = {'action' : constants.TRANSFER_SYNC_V1, 'model' : 'IndiAllSkyDbCameraTable', 'id' : 1, 'metadata' : {'type' : constants.CAMERA}}
+    image_data = {'action' : constants.TRANSFER_SYNC_V1, 'model' : 'IndiAllSkyDbImageTable', 'id' : 1}
+
+    scheduler.addTask(1, constants.TRANSFER_SYNC_V1, IndiAllSkyUploadScheduler.taskPriority(camera_data))
+    for task_id in (2, 3, 4):
+        scheduler.addTask(task_id, constants.TRANSFER_SYNC_V1, IndiAllSkyUploadScheduler.taskPriority(image_data))
+
+    assert scheduler.pendingTaskIds() == [1, 2, 3, 4]
+    assert scheduler.acquire(timeout=0) == ('syncapi', 1)
+
+
+def test_latest_before_bulk():
+    scheduler = IndiAllSkyUploadScheduler({})
+
+    scheduler.addTask(1, constants.TRANSFER_UPLOAD, 100)
+    scheduler.addTask(2, constants.TRANSFER_UPLOAD, 100)
+    scheduler.addTask(3, constants.TRANSFER_UPLOAD, 10)
+
+    assert scheduler.pendingTaskIds() == [3, 1, 2]
+    assert scheduler.acquire(timeout=0) == ('filetransfer', 3)
+
+
+def test_destination_limit():
+    scheduler = IndiAllSkyUploadScheduler({'UPLOAD_DESTINATION_WORKERS' : {'FILETRANSFER' : 1, 'S3' : 2}})
+
+    scheduler.addTask(1, constants.TRANSFER_YOUTUBE, 100)
+    scheduler.addTask(2, constants.TRANSFER_YOUTUBE, 100)
+    scheduler.addTask(3, constants.TRANSFER_S3, 10)
+    scheduler.addTask(4, constants.TRANSFER_S3, 10)
+    scheduler.addTask(5, constants.TRANSFER_S3, 10)
+
+    assert scheduler.acquire(timeout=0) == ('s3', 3)
+    assert scheduler.acquire(timeout=0) == ('s3', 4)
+
+    # s3 is at the limit, the slow destination gets a single slot
+    assert scheduler.acquire(timeout=0) == ('youtube', 1)
+    assert scheduler.acquire(timeout=0) is None
+
+    status = scheduler.status()
+    assert status['s3'] == {'limit' : 2, 'queued' : 1, 'in_flight' : 2}
+    assert status['youtube'] == {'limit' : 1, 'queued' : 1, 'in_flight' : 1}
+
+    scheduler.release('s3')
+    assert scheduler.acquire(timeout=0) == ('s3', 5)
+
+    scheduler.release('youtube')
+    assert scheduler.acquire(timeout=0) == ('youtube', 2)
+
+
+def test_coalesce_latest():
+    scheduler = IndiAllSkyUploadScheduler({})
+
+    latest_data = {'action' : constants.TRANSFER_UPLOAD, 'remote_file' : '/allsky/latest.jpg', 'coalesce' : True}
+    archive_data = {'action' : constants.TRANSFER_UPLOAD, 'remote_file' : '/allsky/image_1.jpg'}
+
+    latest_key = IndiAllSkyUploadScheduler.coalesceKey(latest_data)
+    assert IndiAllSkyUploadScheduler.coalesceKey(archive_data) is None
+
+    assert scheduler.addTask(1, constants.TRANSFER_UPLOAD, 10, coalesce_key=latest_key) == ('filetransfer', [])
+    scheduler.addTask(2, constants.TRANSFER_UPLOAD, 10)
+    scheduler.addTask(3, constants.TRANSFER_UPLOAD, 10)
+
+    # newest task replaces the pending task and keeps its place
+    assert scheduler.addTask(4, constants.TRANSFER_UPLOAD, 10, coalesce_key=latest_key) == ('filetransfer', [1])
+    assert scheduler.pendingTaskIds() == [4, 2, 3]
+
+
+    # running tasks are not superseded
+    assert scheduler.acquire(timeout=0) == ('filetransfer', 4)
+    assert scheduler.addTask(5, constants.TRANSFER_UPLOAD, 10, coalesce_key=latest_key) == ('filetransfer', [])
+    assert scheduler.pendingTaskIds() == [2, 3, 5]
+
+
+def test_acquire_more():
+    scheduler = IndiAllSkyUploadScheduler({})
+
+    for task_id in range(1, 6):
+        scheduler.addTask(task_id, constants.TRANSFER_SYNC_V1, 10)
+
+    scheduler.addTask(6, constants.TRANSFER_UPLOAD, 10)
+
+    assert scheduler.acquire(timeout=0) == ('syncapi', 1)
+
+    # the held slot takes more tasks for the same destination
+    assert scheduler.acquireMore('syncapi', 3) == [2, 3, 4]
+    assert scheduler.status()['syncapi'] == {'limit' : 1, 'queued' : 1, 'in_flight' : 1}
+    assert scheduler.pendingTaskIds() == [5, 6]
+
+
+def test_wait_pending():
+    scheduler = IndiAllSkyUploadScheduler({})
+
+    scheduler.addTask(1, constants.TRANSFER_UPLOAD, 10)
+    scheduler.addTask(2, constants.TRANSFER_UPLOAD, 10)
+
+    assert not scheduler.waitPending(1, timeout=0)
+
+    # running tasks are pending until released
+    assert scheduler.acquire(timeout=0) == ('filetransfer', 1)
+    assert scheduler.waitPending(2, timeout=0)
+    assert not scheduler.waitPending(1, timeout=0)
+
+    threading.Timer(0.1, scheduler.release, args=('filetransfer',)).start()
+    assert scheduler.waitPending(1, timeout=5)
@@ -0,0 +1,107 @@
+from indi_allsky.videoLanes import IndiAllSkyVideoLanes
+from indi_allsky.videoLanes import IndiAllSkyVideoLaneScheduler
+
+
+def test_lane_for_action():
+    assert IndiAllSkyVideoLanes.laneForAction('generateVideo') == 'heavy'
+    assert IndiAllSkyVideoLanes.laneForAction('generateKeogramStarTrails') == 'heavy'
+    assert IndiAllSkyVideoLanes.laneForAction('updateAuroraData') == 'light'
+    assert IndiAllSkyVideoLanes.laneForAction('unknownAction') == 'light'
+
+
+def test_worker_count():
+    assert IndiAllSkyVideoLanes.workerCount({'VIDEO_WORKERS' : {'HEAVY' : 2, 'LIGHT' : 3}}, 'heavy') == 2
+    assert IndiAllSkyVideoLanes.workerCount({'VIDEO_WORKERS' : {'HEAVY' : 2, 'LIGHT' : 3}}, 'light') == 3
+
+    auto_workers = IndiAllSkyVideoLanes.workerCount({}, 'heavy')
+    assert 1 <= auto_workers <= IndiAllSkyVideoLanes.max_heavy_workers
+
+
+def test_light_tasks_not_blocked_by_heavy():
+    scheduler = IndiAllSkyVideoLaneScheduler({'heavy-0' : 'heavy', 'light-0' : 'light'})
+
+    scheduler.addTask(1, 'generateVideo', None)
+    scheduler.addTask(2, 'generateVideo', None)
+    scheduler.addTask(3, 'updateAuroraData', None)
+
+    assert sorted(scheduler.assign()) == [('heavy-0', 1), ('light-0', 3)]
+
+    # workers are busy
+    scheduler.addTask(4, 'updateSmokeData', None)
+    assert scheduler.assign() == []
+
+    scheduler.taskDone('light-0', 5)
+    assert scheduler.assign() == [('light-0', 4)]
+
+    status = scheduler.status()
+    assert status['heavy'] == {'workers' : 1, 'running' : [1], 'pending' : 1}
+    assert status['light'] == {'workers' : 1, 'running' : [4], 'pending' : 0}
+
+
+def test_priority_order():
+    scheduler = IndiAllSkyVideoLaneScheduler({'heavy-0' : 'heavy'})
+
+    scheduler.addTask(1, 'generateVideo', 100)
+    scheduler.addTask(2, 'generateVideo', 100)
+    scheduler.addTask(3, 'generateVideo', None)
+    scheduler.addTask(4, 'generateVideo', 50)
+
+    assert scheduler.pendingTaskIds() == [3, 4, 1, 2]
+
+    order = list()
+    for _ in range(4):
+        order.extend(task_id for slot, task_id in scheduler.assign())
+        scheduler.taskDone('heavy-0', 1)
+
+    assert order == [3, 4, 1, 2]
+
+
+def test_replaced_worker():
+    scheduler = IndiAllSkyVideoLaneScheduler({'heavy-0' : 'heavy'})
+    scheduler.workerStarted('heavy-0', 1)
+
+    scheduler.addTask(1, 'generateVideo', None)
+    scheduler.addTask(2, 'generateVideo', None)
+    assert scheduler.assign() == [('heavy-0', 1)]
+
+    # worker 1 crashed and was replaced
+    scheduler.workerStarted('heavy-0', 2)
+    scheduler.taskDone('heavy-0', 1)  # late message from the old worker is ignored
+    assert scheduler.assign() == [('heavy-0', 2)]
+
+    scheduler.taskDone('heavy-0', 1)
+    assert scheduler.assign() == []
+
+
+def test_duplicate_task_ignored():
+    scheduler = IndiAllSkyVideoLaneScheduler({'heavy-0' : 'heavy'})
+
+    scheduler.addTask(1, 'generateVideo', None)
+    scheduler.addTask(1, 'generateVideo', None)  # message and database
+    assert scheduler.pendingTaskIds() == [1]
+
+    assert scheduler.assign() == [('heavy-0', 1)]
+
+    scheduler.addTask(1, 'generateVideo', None)  # running
+    assert scheduler.pendingTaskIds() == []
+
+
+def test_wait_for_workers():
+    scheduler = IndiAllSkyVideoLaneScheduler({'heavy-0' : 'heavy', 'light-0' : 'light'})
+    scheduler.waitForWorkers()
+
+    scheduler.addTask(1, 'generateVideo', None)
+    scheduler.addTask(2, 'updateAuroraData', None)
+    assert scheduler.assign() == []
+
+    # heavy worker is still running a task from the previous dispatcher
+    scheduler.workerIdle('light-0', 3)
+    assert scheduler.assign() == [('light-0', 2)]
+
+    scheduler.taskDone('heavy-0', 4)
+    assert scheduler.assign() == [('heavy-0', 1)]
+
+    # reply to the ping after the task is done does not free the slot
+    scheduler.workerIdle('heavy-0', 4)
+    scheduler.addTask(5, 'generateVideo', None)
+    assert scheduler.assign() == []